@@ -16,6 +16,11 @@ class Command(BaseCommand):
         parser.add_argument(
             "--days", type=int, default=365, help="Days of history to consider"
         )
+        parser.add_argument(
+            "--snapshot",
+            default=None,
+            help="Count views from this interaction snapshot directory instead of the database",
+        )
 
     def handle(self, *args, **options):
         days = options["days"]
@@ -24,14 +29,22 @@ class Command(BaseCommand):
         # Simpler approach: pick most recent 200 posts and compute views from Interaction
         post_ct = ContentType.objects.get_for_model(Post)
         candidates = Post.objects.order_by("-created")[:200]
+        snapshot_views = (
+            self._snapshot_views(options["snapshot"], post_ct.id, days)
+            if options["snapshot"]
+            else None
+        )
         scored = []
         for p in candidates:
-            views = Interaction.objects.filter(
-                content_type=post_ct,
-                object_id=p.id,
-                action__iexact="view",
-                created_at__gte=since,
-            ).count()
+            if snapshot_views is not None:
+                views = snapshot_views.get(p.id, 0)
+            else:
+                views = Interaction.objects.filter(
+                    content_type=post_ct,
+                    object_id=p.id,
+                    action__iexact="view",
+                    created_at__gte=since,
+                ).count()
             scored.append(
                 {
                     "id": p.id,
@@ -70,3 +83,18 @@ class Command(BaseCommand):
         )
 
         self.stdout.write(self.style.SUCCESS(f"Wrote creator bot index to {out_path}"))
+
+    def _snapshot_views(self, path, post_ct_id, days):
+        """Post id -> view count from a columnar interaction snapshot."""
+        import numpy as np
+
+        from recommend.ml.snapshot import InteractionSnapshot
+
+        snapshot = InteractionSnapshot(path)
+        code = snapshot.action_code("view")
+        if code is None:
+            return {}
+        rows = snapshot.read(("content_type_id", "object_id", "action"), days=days)
+        mask = (rows["content_type_id"] == post_ct_id) & (rows["action"] == code)
+        ids, counts = np.unique(rows["object_id"][mask], return_counts=True)
+        return dict(zip(ids.tolist(), counts.tolist()))
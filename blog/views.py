@@ -525,18 +525,16 @@ def blog_posts_api(request):
         total = posts_qs.count()
         posts = posts_qs[offset:offset + limit]
     elif sort == 'trending':
-        # Trending: posts with high engagement recently
-        from django.db.models import Count, Q
+        # Trending: engaged posts from the last week by materialized hot score
         from django.utils import timezone
         from datetime import timedelta
+        from recommend.popularity import trending_ids
         week_ago = timezone.now() - timedelta(days=7)
-        posts_qs = Post.objects.filter(
-            Q(likes__isnull=False) | Q(comments__isnull=False)
-        ).annotate(
-            engagement=Count('likes') + Count('comments')
-        ).filter(created__gte=week_ago).order_by('-engagement', '-created')
-        total = posts_qs.count()
-        posts = posts_qs[offset:offset + limit]
+        total, post_ids = trending_ids(
+            'blog.post', since=week_ago, offset=offset, limit=limit, engaged_only=True
+        )
+        posts_by_id = Post.objects.in_bulk(post_ids)
+        posts = [posts_by_id[pk] for pk in post_ids if pk in posts_by_id]
     elif sort == 'bookmarks':
         # User's bookmarked posts
         posts_qs = request.user.bookmarked_posts.all().order_by('-created')
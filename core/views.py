@@ -165,24 +165,15 @@ def community_posts_api(request):
         total = qs.count()
         posts = qs[offset : offset + limit]
     elif sort == "trending":
-        # Consider posts from the last week and score them by likes / age_hours
-        now = timezone.now()
-        week_ago = now - timedelta(days=7)
-        recent_qs = qs.filter(created_at__gte=week_ago).annotate(
-            likes_count=Count("likes"), comments_count=Count("comments")
+        # Posts from the last week by their materialized, age-decayed hot score
+        from recommend.popularity import trending_ids
+
+        week_ago = timezone.now() - timedelta(days=7)
+        total, post_ids = trending_ids(
+            "communities.communitypost", since=week_ago, offset=offset, limit=limit
         )
-        # Materialize and score in Python to allow more flexible math without DB-specific functions
-        scored = []
-        for p in recent_qs:
-            likes = p.likes.count()
-            # age in hours (at least 1)
-            age_hours = max(1.0, (now - p.created_at).total_seconds() / 3600.0)
-            # score: likes weighted by recency, slight weight for comments
-            score = (likes + 0.5 * p.comments.count()) / (age_hours**0.8)
-            scored.append((p, score))
-        scored.sort(key=lambda x: x[1], reverse=True)
-        total = recent_qs.count()
-        posts = [s[0] for s in scored][offset : offset + limit]
+        posts_dict = {p.id: p for p in qs.filter(id__in=post_ids)}
+        posts = [posts_dict[pid] for pid in post_ids if pid in posts_dict]
         # If trending window is empty, fall back to most_liked overall
         if total == 0:
             qs = qs.annotate(likes_count=Count("likes")).order_by(
@@ -7,6 +7,7 @@ remaining convenient for local development.
 """
 
 import os
+import sys
 from pathlib import Path
 
 import dj_database_url
@@ -266,6 +267,55 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
+CELERY_BEAT_SCHEDULE = {
+    "recommend-fold-in-new-items": {
+        "task": "recommend.tasks.fold_in_new_items",
+        "schedule": 15 * 60,
+    },
+    "recommend-cleanup-generations": {
+        "task": "recommend.tasks.cleanup_recommendation_generations",
+        "schedule": 60 * 60,
+    },
+    "recommend-snapshot-interactions": {
+        "task": "recommend.tasks.snapshot_interactions",
+        "schedule": 60 * 60,
+    },
+    "recommend-update-content-embeddings": {
+        "task": "recommend.tasks.update_content_embeddings",
+        "schedule": 60 * 60,
+    },
+    "recommend-build-related-items": {
+        "task": "recommend.tasks.build_related_items",
+        "schedule": 6 * 60 * 60,
+    },
+    "recommend-refresh-content-popularity": {
+        "task": "recommend.tasks.refresh_content_popularity",
+        "schedule": 5 * 60,
+    },
+    "recommend-run-pipeline": {
+        "task": "recommend.tasks.run_recommendation_pipeline",
+        "schedule": 24 * 60 * 60,
+    },
+}
+
+# ---------------------------
+# CACHE
+# ---------------------------
+# Shared by every web and Celery process: the recommender keeps its circuit
+# breakers, layer telemetry and recently seen items here.  Defaults to the
+# Redis instance Celery already uses.  Test runs (and USE_LOCAL_CACHE=1 for
+# a development box without Redis) get a per-process cache instead.
+CACHE_URL = os.environ.get("CACHE_URL", CELERY_BROKER_URL)
+_TESTING = sys.argv[1:2] == ["test"] or "pytest" in sys.modules
+if _TESTING or _env_bool("USE_LOCAL_CACHE", default=False):
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
 
 # ---------------------------
 # DEFAULT PRIMARY KEY FIELD
@@ -1,6 +1,15 @@
 from django.contrib import admin
 
-from .models import Interaction, Recommendation, UserInterests
+from .models import (
+    ContentPopularity,
+    Interaction,
+    ItemRegistry,
+    JobLock,
+    PipelineRun,
+    Recommendation,
+    RecommendationGeneration,
+    UserInterests,
+)
 
 
 @admin.register(UserInterests)
@@ -28,6 +37,7 @@ class InteractionAdmin(admin.ModelAdmin):
         "content_type",
         "object_id",
         "value",
+        "engagement_score",
         "created_at",
     )
     list_filter = ("action", "content_type")
@@ -36,6 +46,45 @@ class InteractionAdmin(admin.ModelAdmin):
 
 @admin.register(Recommendation)
 class RecommendationAdmin(admin.ModelAdmin):
-    list_display = ("user", "content_type", "object_id", "score", "created_at")
+    list_display = ("user", "content_type", "object_id", "score", "generation", "created_at")
     list_filter = ("content_type",)
     search_fields = ("user__username",)
+    raw_id_fields = ("generation",)
+
+
+@admin.register(RecommendationGeneration)
+class RecommendationGenerationAdmin(admin.ModelAdmin):
+    list_display = ("id", "source", "status", "row_count", "created_at", "completed_at")
+    list_filter = ("status", "source")
+
+
+@admin.register(ItemRegistry)
+class ItemRegistryAdmin(admin.ModelAdmin):
+    list_display = ("id", "content_type", "object_id", "created_at")
+    list_filter = ("content_type",)
+
+
+@admin.register(ContentPopularity)
+class ContentPopularityAdmin(admin.ModelAdmin):
+    list_display = (
+        "content_type",
+        "object_id",
+        "likes",
+        "bookmarks",
+        "comments",
+        "recent_interactions",
+        "hot_score",
+        "refreshed_at",
+    )
+    list_filter = ("content_type",)
+
+
+@admin.register(JobLock)
+class JobLockAdmin(admin.ModelAdmin):
+    list_display = ("name", "owner", "acquired_at", "expires_at")
+
+
+@admin.register(PipelineRun)
+class PipelineRunAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "attempts", "started_at", "finished_at")
+    list_filter = ("status",)
@@ -5,3 +5,6 @@ class RecommendConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "recommend"
     verbose_name = "Recommendations"
+
+    def ready(self):
+        import recommend.signals  # noqa: F401
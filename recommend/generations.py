@@ -0,0 +1,219 @@
+"""
+Versioned generations of precomputed ``Recommendation`` rows.
+
+Batch jobs write a complete generation with ``GenerationWriter`` and publish
+it by updating the single ``CurrentRecommendationGeneration`` row; readers go
+through ``Recommendation.objects.current()`` and never see a half-rebuilt
+table.  Superseded generations are removed by ``cleanup_generations()`` in
+small primary-key batches instead of one long mass delete, as are builds
+abandoned by a writer that was killed before it could mark them failed.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .locks import LOCK_TIMEOUT
+from .models import (
+    CurrentRecommendationGeneration,
+    Recommendation,
+    RecommendationGeneration,
+)
+
+logger = logging.getLogger(__name__)
+
+CURRENT_GENERATION_KEY = "recommend:generation:current"
+CURRENT_GENERATION_TTL = 60
+POINTER_ID = 1
+CLEANUP_BATCH_SIZE = 5000
+# Superseded generations kept for readers still holding a cached pointer
+KEEP_PREVIOUS = 1
+# A build this old outlived the job lock: its writer died (SIGKILL, OOM)
+ABANDONED_BUILD_AGE = getattr(settings, "RECOMMEND_ABANDONED_BUILD_AGE", LOCK_TIMEOUT)
+
+
+def current_generation_id():
+    """Id of the published generation, or None before the first publish."""
+    cached = cache.get(CURRENT_GENERATION_KEY)
+    if cached is not None:
+        return cached or None
+    generation_id = (
+        CurrentRecommendationGeneration.objects.filter(pk=POINTER_ID)
+        .values_list("generation_id", flat=True)
+        .first()
+    )
+    # 0 caches "no generation yet" without a DB hit per request
+    cache.set(CURRENT_GENERATION_KEY, generation_id or 0, CURRENT_GENERATION_TTL)
+    return generation_id
+
+
+def current_generation():
+    generation_id = current_generation_id()
+    if generation_id is None:
+        return None
+    return RecommendationGeneration.objects.filter(pk=generation_id).first()
+
+
+def publish_generation(generation):
+    """Make ``generation`` the one readers see (a single-row pointer update)."""
+    with transaction.atomic():
+        previous = (
+            CurrentRecommendationGeneration.objects.select_for_update()
+            .filter(pk=POINTER_ID)
+            .values_list("generation_id", flat=True)
+            .first()
+        )
+        generation.status = RecommendationGeneration.STATUS_READY
+        generation.completed_at = timezone.now()
+        generation.save(update_fields=["status", "completed_at", "row_count"])
+        CurrentRecommendationGeneration.objects.update_or_create(
+            pk=POINTER_ID, defaults={"generation": generation}
+        )
+        if previous and previous != generation.pk:
+            RecommendationGeneration.objects.filter(pk=previous).update(
+                status=RecommendationGeneration.STATUS_RETIRED
+            )
+    cache.set(CURRENT_GENERATION_KEY, generation.pk, CURRENT_GENERATION_TTL)
+    return generation
+
+
+class GenerationWriter:
+    """
+    Bulk-write a new generation and publish it on success.
+
+    Used as a context manager: rows added with ``add()`` are flushed with
+    ``bulk_create`` every ``chunk_size`` rows; leaving the block normally
+    publishes the generation, an exception marks it failed (its rows are
+    removed by the next cleanup).  With ``publish=False`` the finished
+    generation stays ``building`` until ``publish_generation()`` is called.
+    """
+
+    def __init__(self, source, chunk_size=5000, publish=True):
+        self.source = source
+        self.chunk_size = max(1, int(chunk_size))
+        self.publish = publish
+        self.generation = None
+        self.pending = []
+        self.created = 0
+
+    def __enter__(self):
+        self.generation = RecommendationGeneration.objects.create(source=self.source)
+        return self
+
+    def add(self, user_id, content_type_id, object_id, score):
+        self.pending.append(
+            Recommendation(
+                user_id=user_id,
+                content_type_id=content_type_id,
+                object_id=object_id,
+                score=score,
+                generation=self.generation,
+            )
+        )
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            Recommendation.objects.bulk_create(self.pending, batch_size=self.chunk_size)
+            self.created += len(self.pending)
+            self.pending = []
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.pending = []
+            RecommendationGeneration.objects.filter(pk=self.generation.pk).update(
+                status=RecommendationGeneration.STATUS_FAILED
+            )
+            return False
+        self.flush()
+        self.generation.row_count = self.created
+        if self.publish:
+            publish_generation(self.generation)
+        else:
+            self.generation.save(update_fields=["row_count"])
+        return False
+
+
+def replace_user_recommendations(user, rows):
+    """Rewrite one user's rows inside the current generation.
+
+    ``rows`` is an iterable of ``(content_type_id, object_id, score)``.
+    """
+    generation_id = current_generation_id()
+    objs = [
+        Recommendation(
+            user=user,
+            content_type_id=ct_id,
+            object_id=object_id,
+            score=score,
+            generation_id=generation_id,
+        )
+        for ct_id, object_id, score in rows
+    ]
+    with transaction.atomic():
+        Recommendation.objects.filter(user=user, generation_id=generation_id).delete()
+        Recommendation.objects.bulk_create(objs)
+    return objs
+
+
+def cleanup_generations(
+    batch_size=CLEANUP_BATCH_SIZE, keep=KEEP_PREVIOUS, abandoned_after=ABANDONED_BUILD_AGE
+):
+    """
+    Delete superseded and failed generations in primary-key batches.
+
+    The current generation, the ``keep`` most recently retired ones and any
+    generation still being built are left alone, except builds started more
+    than ``abandoned_after`` seconds ago, which are marked failed first.
+    Returns the number of recommendation rows deleted.
+    """
+    current_id = (
+        CurrentRecommendationGeneration.objects.filter(pk=POINTER_ID)
+        .values_list("generation_id", flat=True)
+        .first()
+    )
+    abandoned = (
+        RecommendationGeneration.objects.filter(
+            status=RecommendationGeneration.STATUS_BUILDING,
+            created_at__lt=timezone.now() - timedelta(seconds=abandoned_after),
+        )
+        .exclude(pk=current_id)
+        .update(status=RecommendationGeneration.STATUS_FAILED)
+    )
+    if abandoned:
+        logger.warning(f"Marked {abandoned} abandoned recommendation builds as failed")
+    retired = RecommendationGeneration.objects.filter(
+        status=RecommendationGeneration.STATUS_RETIRED
+    ).exclude(pk=current_id)
+    kept = list(retired.order_by("-created_at").values_list("pk", flat=True)[:keep])
+    doomed = list(
+        RecommendationGeneration.objects.filter(
+            status__in=[
+                RecommendationGeneration.STATUS_RETIRED,
+                RecommendationGeneration.STATUS_FAILED,
+            ]
+        )
+        .exclude(pk__in=[pk for pk in kept + [current_id] if pk is not None])
+        .values_list("pk", flat=True)
+    )
+    # Legacy rows written before generations existed, once one is published
+    targets = doomed + ([None] if current_id is not None else [])
+
+    deleted = 0
+    for generation_id in targets:
+        rows = Recommendation.objects.filter(generation_id=generation_id)
+        while True:
+            batch = list(rows.order_by().values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                break
+            deleted += Recommendation.objects.filter(pk__in=batch).delete()[0]
+        if generation_id is not None:
+            RecommendationGeneration.objects.filter(pk=generation_id).delete()
+    if deleted:
+        logger.info(f"Removed {deleted} recommendation rows from {len(doomed)} old generations")
+    return deleted
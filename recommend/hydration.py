@@ -0,0 +1,209 @@
+"""
+Batched hydration of ranked recommendation keys into card payloads.
+
+Items are registry item ids (see ``registry``) or legacy "app.model:id"
+keys.  They are grouped by content type and each group is fetched with one
+query (plus one prefetch for blog images), with the related rows a
+card needs pulled in by ``select_related`` / ``prefetch_related``.  Payloads
+are then emitted in the original ranked order; keys whose object no longer
+exists are dropped.
+"""
+
+import uuid
+
+from django.db.models import Prefetch
+from django.utils.html import strip_tags
+
+
+def parse_item_key(rec_key):
+    """Split "app.model:id" into ``(app_label, model_name, object_id)``."""
+    parts = rec_key.split(":", 1)
+    if len(parts) != 2:
+        return None, None, None
+    app_model, object_id = parts
+    if "." not in app_model:
+        return None, None, None
+    return app_model.split(".", 1) + [object_id]
+
+
+def _int_id(object_id):
+    try:
+        return int(object_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _uuid_id(object_id):
+    try:
+        return uuid.UUID(str(object_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def serialize_blog_post(obj, score):
+    # ``images`` is prefetched ordered by pk, matching ``images.first()``
+    images = list(obj.images.all())[:1]
+    image = images[0].image.url if images and images[0].image else None
+    return {
+        "type": "blog",
+        "id": obj.id,
+        "title": obj.title,
+        "excerpt": strip_tags(obj.content)[:220] if obj.content else "",
+        "image": image,
+        "score": float(score),
+    }
+
+
+def serialize_community_post(obj, score):
+    return {
+        "type": "community",
+        "id": obj.id,
+        "title": obj.title or (obj.content[:80] if obj.content else "Community Post"),
+        "excerpt": strip_tags(obj.content)[:220] if obj.content else "",
+        "image": obj.image.url if obj.image else None,
+        "community_id": obj.community.id,
+        "community_name": obj.community.name,
+        "author_username": obj.author.username,
+        "score": float(score),
+    }
+
+
+def serialize_game(obj, score):
+    return {
+        "type": "game",
+        "id": str(obj.id),
+        "title": obj.title,
+        "description": getattr(obj, "description", ""),
+        "thumbnail": obj.thumbnail.url if obj.thumbnail else None,
+        "score": float(score),
+    }
+
+
+def serialize_project(obj, score):
+    return {
+        "type": "marketplace",
+        "id": str(obj.id),
+        "title": obj.title,
+        "short_description": getattr(obj, "short_description", ""),
+        "thumbnail": obj.thumbnail.url if obj.thumbnail else None,
+        "price": float(obj.price) if getattr(obj, "price", None) is not None else None,
+        "is_free": getattr(obj, "is_free", False),
+        "score": float(score),
+    }
+
+
+def blog_posts(ids):
+    from blog.models import Post, PostImage
+
+    return Post.objects.filter(id__in=ids).prefetch_related(
+        Prefetch("images", queryset=PostImage.objects.order_by("pk"))
+    )
+
+
+def community_posts(ids):
+    from communities.models import CommunityPost
+
+    return CommunityPost.objects.filter(id__in=ids).select_related("community", "author")
+
+
+def games(ids):
+    from games.models import Game
+
+    return Game.objects.filter(id__in=ids)
+
+
+def projects(ids):
+    from marketplace.models import Project
+
+    return Project.objects.filter(id__in=ids)
+
+
+# (app_label, model-name substring) -> (id parser, batch fetcher, serializer)
+HYDRATORS = (
+    ("blog", "post", _int_id, blog_posts, serialize_blog_post),
+    ("communities", "post", _int_id, community_posts, serialize_community_post),
+    ("games", "game", _uuid_id, games, serialize_game),
+    ("marketplace", "project", _uuid_id, projects, serialize_project),
+)
+
+
+def _hydrator_for(app_label, model_name):
+    for hydrator in HYDRATORS:
+        if app_label == hydrator[0] and hydrator[1] in model_name:
+            return hydrator
+    return None
+
+
+def _hydrator_for_content_type(content_type_id):
+    from django.contrib.contenttypes.models import ContentType
+
+    try:
+        ct = ContentType.objects.get_for_id(content_type_id)
+    except ContentType.DoesNotExist:
+        return None
+    return _hydrator_for(ct.app_label, ct.model)
+
+
+def hydrate_recommendations(raw_recs):
+    """
+    Card payloads for ranked ``(item, score)`` pairs, in the same order.
+
+    ``item`` is a registry item id or an "app.model:id" key.  Issues one
+    query per content type present (two for blog posts), plus one registry
+    lookup for ids not cached in this process yet.
+    """
+    if not raw_recs:
+        return []
+    ids = [item for item, _ in raw_recs if not isinstance(item, str)]
+    resolved = {}
+    if ids:
+        from .registry import resolve
+
+        ct_ids, object_ids = resolve(ids)
+        resolved = dict(zip(ids, zip(ct_ids.tolist(), object_ids.tolist())))
+
+    slots = []
+    wanted = {}
+    for item, score in raw_recs:
+        if isinstance(item, str):
+            app_label, model_name, object_id = parse_item_key(item)
+            hydrator = app_label and _hydrator_for(app_label, model_name)
+        else:
+            ct_id, object_id = resolved[item]
+            hydrator = ct_id >= 0 and _hydrator_for_content_type(ct_id)
+        if not hydrator:
+            continue
+        pk = hydrator[2](object_id)
+        if pk is None:
+            continue
+        wanted.setdefault(hydrator, set()).add(pk)
+        slots.append((hydrator, pk, score))
+
+    fetched = {}
+    for hydrator, ids in wanted.items():
+        try:
+            fetched[hydrator] = {obj.pk: obj for obj in hydrator[3](ids)}
+        except Exception:
+            fetched[hydrator] = {}
+
+    results = []
+    for hydrator, pk, score in slots:
+        obj = fetched[hydrator].get(pk)
+        if obj is None:
+            continue
+        try:
+            results.append(hydrator[4](obj, score))
+        except Exception:
+            continue
+    return results
+
+
+def recommendation_rows_to_items(recs):
+    """``(item_id, score)`` pairs for ``Recommendation`` rows."""
+    from .registry import item_ids
+
+    recs = list(recs)
+    if not recs:
+        return []
+    ids = item_ids([rec.content_type_id for rec in recs], [rec.object_id for rec in recs])
+    return list(zip(ids.tolist(), [rec.score for rec in recs]))
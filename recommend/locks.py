@@ -0,0 +1,65 @@
+"""
+Database leases that keep heavy background jobs from overlapping.
+
+A lock is a ``JobLock`` row keyed by name.  Taking it is a single INSERT
+(or, for a lease that has expired because its worker died, a conditional
+UPDATE), so it works across worker nodes with any cache backend.  Holders
+renew the lease with ``extend_lock()`` between long steps; ``expires_at``
+only matters when the holder disappears without releasing.
+"""
+
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import JobLock
+
+LOCK_TIMEOUT = getattr(settings, "RECOMMEND_LOCK_TIMEOUT", 6 * 60 * 60)
+
+
+class LockBusy(Exception):
+    """Raised by ``job_lock`` when another job holds the lease."""
+
+
+def acquire_lock(name, timeout=LOCK_TIMEOUT):
+    """Take the lease on ``name``; returns the owner token, or None if it is held."""
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    expires = now + timedelta(seconds=timeout)
+    # Take over a lease whose holder died without releasing it
+    if JobLock.objects.filter(name=name, expires_at__lte=now).update(
+        owner=token, acquired_at=now, expires_at=expires
+    ):
+        return token
+    try:
+        with transaction.atomic():
+            JobLock.objects.create(name=name, owner=token, acquired_at=now, expires_at=expires)
+    except IntegrityError:
+        return None
+    return token
+
+
+def extend_lock(name, token, timeout=LOCK_TIMEOUT):
+    """Renew a held lease; False if it was lost (expired and taken over)."""
+    expires = timezone.now() + timedelta(seconds=timeout)
+    return bool(JobLock.objects.filter(name=name, owner=token).update(expires_at=expires))
+
+
+def release_lock(name, token):
+    JobLock.objects.filter(name=name, owner=token).delete()
+
+
+@contextmanager
+def job_lock(name, timeout=LOCK_TIMEOUT):
+    """Hold the lease on ``name`` for the block (raises ``LockBusy`` if taken)."""
+    token = acquire_lock(name, timeout)
+    if token is None:
+        raise LockBusy(f"{name} is already running")
+    try:
+        yield token
+    finally:
+        release_lock(name, token)
@@ -0,0 +1,56 @@
+"""Fill ``Interaction.engagement_score`` for rows written before the column existed.
+
+Rows are walked in primary-key order in chunks (keyset pagination, so each
+chunk is an index range scan), their weights are computed with the same
+vectorized code the training loader uses and written back with one
+``bulk_update`` per chunk.  Safe to interrupt and re-run: without
+``--recompute`` only rows that still have no score are touched.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recommend.ml.dataset import WEIGHT_COLUMNS, row_weights
+from recommend.models import Interaction
+
+
+class Command(BaseCommand):
+    help = "Backfill the stored engagement score of interactions in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Rows read and updated per batch (default: 5000)",
+        )
+        parser.add_argument(
+            "--recompute",
+            action="store_true",
+            help="Recompute every row, not only those without a score",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options["chunk_size"])
+        qs = Interaction.objects.order_by("pk")
+        if not options["recompute"]:
+            qs = qs.filter(engagement_score__isnull=True)
+
+        last_pk = 0
+        updated = 0
+        while True:
+            rows = list(qs.filter(pk__gt=last_pk).values_list("pk", *WEIGHT_COLUMNS)[:chunk_size])
+            if not rows:
+                break
+            pks, weights = row_weights(rows)
+            objs = [
+                Interaction(pk=pk, engagement_score=float(weight))
+                for pk, weight in zip(pks, weights)
+            ]
+            with transaction.atomic():
+                Interaction.objects.bulk_update(objs, ["engagement_score"], batch_size=chunk_size)
+            updated += len(objs)
+            last_pk = pks[-1]
+            self.stdout.write(f"Updated {updated} interactions (through id {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled engagement scores for {updated} interactions."))
@@ -0,0 +1,135 @@
+"""
+Management command to benchmark the recommenders on synthetic data.
+
+Usage:
+    python manage.py benchmark_recommenders [--users N] [--items N] [--interactions N]
+        [--k K] [--methods popularity,interest,item_knn,mf,hybrid] [--output report.json]
+        [--baseline old.json [--max-regression 0.1]]
+"""
+
+import contextlib
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommend.ml.benchmark import METHODS, compare_reports, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Train every recommender on synthetic power-law data and report training "
+        "time, peak memory, inference latency and recall/NDCG on held-out items"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Synthetic users (default: 1000)")
+        parser.add_argument("--items", type=int, default=2000, help="Synthetic items (default: 2000)")
+        parser.add_argument(
+            "--interactions",
+            type=int,
+            default=50000,
+            help="Approximate number of interactions (default: 50000)",
+        )
+        parser.add_argument("--k", type=int, default=10, help="Cut-off for recall/NDCG (default: 10)")
+        parser.add_argument(
+            "--methods",
+            default=",".join(METHODS),
+            help=f"Comma-separated methods to run (default: {','.join(METHODS)})",
+        )
+        parser.add_argument(
+            "--eval-users",
+            type=int,
+            default=500,
+            help="Held-out users scored for latency and quality (default: 500)",
+        )
+        parser.add_argument("--epochs", type=int, default=3, help="Epochs for the torch models (default: 3)")
+        parser.add_argument("--emb-dim", type=int, default=32, help="Embedding dimension (default: 32)")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+        parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+        parser.add_argument(
+            "--baseline",
+            default=None,
+            help="Earlier JSON report to compare against",
+        )
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=None,
+            help="Fail if any metric is worse than the baseline by more than this fraction",
+        )
+        parser.add_argument(
+            "--show-training-output",
+            action="store_true",
+            help="Do not hide the trainers' progress output",
+        )
+
+    def handle(self, *args, **options):
+        methods = [m.strip() for m in options["methods"].split(",") if m.strip()]
+        unknown = sorted(set(methods) - set(METHODS))
+        if unknown:
+            raise CommandError(f"Unknown methods: {', '.join(unknown)}")
+
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {e}")
+
+        if options["show_training_output"]:
+            quiet = contextlib.nullcontext()
+        else:
+            quiet = contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            report = run_benchmark(
+                n_users=options["users"],
+                n_items=options["items"],
+                n_interactions=options["interactions"],
+                k=options["k"],
+                methods=methods,
+                eval_users=options["eval_users"],
+                epochs=options["epochs"],
+                emb_dim=options["emb_dim"],
+                seed=options["seed"],
+                log=lambda message: self.stderr.write(f"[INFO] {message}"),
+            )
+
+        k = options["k"]
+        for method, result in report["results"].items():
+            if "skipped" in result:
+                self.stdout.write(f"  {method:<11} skipped: {result['skipped']}")
+                continue
+            latency = result["latency_ms"]
+            self.stdout.write(
+                f"  {method:<11} train={result['train_seconds']:.2f}s "
+                f"rss={result['peak_rss_mb']}MB "
+                f"p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} ms "
+                f"recall@{k}={result['recall_at_k']} ndcg@{k}={result['ndcg_at_k']} "
+                f"coverage={result['coverage']}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if baseline is not None:
+            regressions = []
+            for method, changes in compare_reports(baseline, report).items():
+                self.stdout.write(
+                    f"  {method:<11} vs baseline: "
+                    + " ".join(f"{name}={change:+.1%}" for name, change in sorted(changes.items()))
+                )
+                limit = options["max_regression"]
+                if limit is not None:
+                    regressions.extend(
+                        f"{method}.{name} {change:+.1%}"
+                        for name, change in changes.items()
+                        if change < -limit
+                    )
+            if regressions:
+                raise CommandError("Regressions beyond tolerance: " + ", ".join(regressions))
+
+        self.stdout.write(self.style.SUCCESS("Benchmark complete"))
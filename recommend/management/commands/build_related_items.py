@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+
+from recommend.ml.related import DEFAULT_NEIGHBOURS, RELATED_DIR, RELATED_WEIGHTS, build_related
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute "more like this" neighbours per item from co-interactions and '
+        "content embeddings, for the related-items rail and session suggestions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            default=RELATED_DIR,
+            help=f"Neighbour table directory (default: {RELATED_DIR})",
+        )
+        parser.add_argument(
+            "--k",
+            type=int,
+            default=DEFAULT_NEIGHBOURS,
+            help=f"Neighbours kept per signal and item (default: {DEFAULT_NEIGHBOURS})",
+        )
+        parser.add_argument(
+            "--co-weight",
+            type=float,
+            default=RELATED_WEIGHTS[0],
+            help=f"Default weight of co-interaction similarity (default: {RELATED_WEIGHTS[0]})",
+        )
+        parser.add_argument(
+            "--content-weight",
+            type=float,
+            default=RELATED_WEIGHTS[1],
+            help=f"Default weight of content similarity (default: {RELATED_WEIGHTS[1]})",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Only use interactions from the last N days",
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=1024,
+            help="Items per similarity block (default: 1024)",
+        )
+
+    def handle(self, *args, **options):
+        stats = build_related(
+            path=options["path"],
+            k=max(1, options["k"]),
+            weights=(options["co_weight"], options["content_weight"]),
+            days=options["days"],
+            block_size=max(1, options["block_size"]),
+            log=lambda message: self.stdout.write(f"[INFO] {message}"),
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Related items built for {stats['items']} items "
+                f"({stats['co_pairs']} co-interaction and {stats['content_pairs']} content pairs)."
+            )
+        )
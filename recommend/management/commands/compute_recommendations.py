@@ -1,21 +1,29 @@
 """Management command to compute recommendations.
 
-This provides a simple, dependency-free baseline:
-- Build item co-occurrence from recent interactions
-- Score candidate items for each user by similarity to items they've played
-- Store top-N recommendations in `Recommendation` table
+This provides a simple item-based baseline:
+- Build a sparse user x item matrix from recent interactions
+- Compute top-K item-item neighbours (cosine or Jaccard) with blocked
+  sparse matrix products
+- Score unseen items per user with a sparse product against the neighbours
+  (popularity fallback for users without neighbours)
+- Store top-N recommendations in a new `Recommendation` generation and
+  publish it once complete (readers keep the previous one until then)
 
 For production, swap in ALS/Matrix Factorization (implicit) or an online model.
 """
 
-from collections import Counter, defaultdict
-from datetime import timedelta
-
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.utils import timezone
 
-from recommend.models import Interaction, Recommendation
+from recommend.generations import GenerationWriter
+from recommend.ml.dataset import load_training_data
+from recommend.ml.item_similarity import (
+    DEFAULT_BLOCK_SIZE,
+    DEFAULT_NEIGHBOURS,
+    METRICS,
+    interaction_matrix,
+    item_neighbours,
+    recommend_all,
+)
 
 
 class Command(BaseCommand):
@@ -31,93 +39,79 @@ class Command(BaseCommand):
             default=12,
             help="Top N recommendations to store per user",
         )
+        parser.add_argument(
+            "--neighbours",
+            type=int,
+            default=DEFAULT_NEIGHBOURS,
+            help=f"Neighbours kept per item (default: {DEFAULT_NEIGHBOURS})",
+        )
+        parser.add_argument(
+            "--metric",
+            choices=METRICS,
+            default="jaccard",
+            help="Item-item similarity (default: jaccard)",
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=DEFAULT_BLOCK_SIZE,
+            help=f"Items/users per sparse product block (default: {DEFAULT_BLOCK_SIZE})",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Score user ranges in this many processes (default: 1)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Rows per bulk_create batch (default: 5000)",
+        )
+        parser.add_argument(
+            "--snapshot",
+            default=None,
+            help="Read interactions from this snapshot directory instead of the database",
+        )
 
     def handle(self, *args, **options):
-        days = options["days"]
         topn = options["topn"]
-        cutoff = timezone.now() - timedelta(days=days)
+        block_size = max(1, options["block_size"])
+        chunk_size = max(1, options["chunk_size"])
 
         self.stdout.write("Loading interactions...")
-        qs = Interaction.objects.filter(created_at__gte=cutoff).select_related(
-            "user", "content_type"
+        data = load_training_data(days=options["days"], snapshot=options["snapshot"])
+        if data is None:
+            self.stdout.write(self.style.WARNING("No interactions found"))
+            return
+        self.stdout.write(f"Found {data.n_users} users and {data.n_items} items")
+
+        matrix = interaction_matrix(data)
+        self.stdout.write(f"Computing {options['metric']} item neighbours...")
+        neighbours = item_neighbours(
+            matrix,
+            k=options["neighbours"],
+            metric=options["metric"],
+            block_size=block_size,
         )
 
-        # Build item -> users and user -> items maps
-        item_users = defaultdict(set)
-        user_items = defaultdict(list)  # list of item keys (content_type_id, object_id)
-
-        for it in qs.iterator():
-            key = (it.content_type_id, it.object_id)
-            item_users[key].add(it.user_id)
-            user_items[it.user_id].append((key, it.value))
-
-        self.stdout.write(f"Found {len(user_items)} users and {len(item_users)} items")
-
-        # Compute simple item-item similarity (Jaccard)
-        self.stdout.write("Computing item similarities (approx)...")
-        items = list(item_users.keys())
-        sim = defaultdict(dict)
-        for i, a in enumerate(items):
-            users_a = item_users[a]
-            if not users_a:
-                continue
-            for b in items[
-                i + 1 : i + 200
-            ]:  # limit pairwise to first 200 to avoid explosion
-                users_b = item_users[b]
-                if not users_b:
-                    continue
-                inter = len(users_a & users_b)
-                union = len(users_a | users_b)
-                if union == 0:
-                    continue
-                score = inter / union
-                if score > 0:
-                    sim[a][b] = score
-                    sim[b][a] = score
-
         self.stdout.write("Scoring candidates for users...")
-        # For each user, score unseen items by similarity to items they've interacted with
-        user_recs = {}
-        for uid, items_list in user_items.items():
-            seen = set(k for k, _ in items_list)
-            scores = Counter()
-            for k, v in items_list:
-                neighbors = sim.get(k, {})
-                for cand, s in neighbors.items():
-                    if cand in seen:
-                        continue
-                    scores[cand] += s * v
-            # fallback: popularity boost (item user count)
-            for cand in list(scores)[:0]:
-                pass
-            if not scores:
-                # recommend by popularity
-                pop = Counter({k: len(u) for k, u in item_users.items()})
-                for k, sc in pop.most_common(topn):
-                    if k not in seen:
-                        scores[k] += sc * 0.01
-
-            top = scores.most_common(topn)
-            user_recs[uid] = top
+        item_ct = (data.item_codes >> 32).tolist()
+        item_oid = (data.item_codes & 0xFFFFFFFF).tolist()
+        user_ids = data.user_ids.tolist()
 
         self.stdout.write("Saving recommendations...")
-        # bulk save
-        created = 0
-        with transaction.atomic():
-            Recommendation.objects.all().delete()
-            for uid, recs in user_recs.items():
-                objs = []
-                for (ct_id, obj_id), score in recs:
-                    objs.append(
-                        Recommendation(
-                            user_id=uid,
-                            content_type_id=ct_id,
-                            object_id=obj_id,
-                            score=score,
-                        )
-                    )
-                Recommendation.objects.bulk_create(objs)
-                created += len(objs)
-
-        self.stdout.write(self.style.SUCCESS(f"Wrote {created} recommendation rows"))
+        with GenerationWriter("compute_recommendations", chunk_size) as writer:
+            for uidx, idxs, scores in recommend_all(
+                matrix, neighbours, topn, block_size, max(1, options["workers"])
+            ):
+                for idx, score in zip(idxs.tolist(), scores.tolist()):
+                    writer.add(user_ids[uidx], item_ct[idx], item_oid[idx], score)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {writer.created} recommendation rows "
+                f"(generation {writer.generation.pk})"
+            )
+        )
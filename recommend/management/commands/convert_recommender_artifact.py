@@ -0,0 +1,59 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommend.ml import torch_recommender, torch_recommender_hybrid
+from recommend.ml.artifact import DTYPES, Artifact, artifact_path, convert_model_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert torch.save recommender payloads (.pt) into memory-mapped "
+        "artifact directories served by all worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            help="Model files to convert (default: the hybrid and MF models)",
+        )
+        parser.add_argument(
+            "--dtype",
+            choices=DTYPES,
+            default="float32",
+            help="Storage type for embedding matrices (default: float32)",
+        )
+        parser.add_argument(
+            "--skip-verify",
+            action="store_true",
+            help="Do not re-read the written files against their checksums",
+        )
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or [
+            torch_recommender_hybrid.MODEL_PATH,
+            torch_recommender_hybrid.LEGACY_MODEL_PATH,
+            torch_recommender.MODEL_PATH,
+        ]
+        converted = 0
+        for path in paths:
+            if not os.path.exists(path):
+                if options["paths"]:
+                    raise CommandError(f"Model file not found: {path}")
+                continue
+            try:
+                link = convert_model_file(path, dtype=options["dtype"])
+            except (ValueError, KeyError) as e:
+                raise CommandError(f"Could not convert {path}: {e}")
+            artifact = Artifact(link, verify=not options["skip_verify"])
+            size = sum(
+                os.path.getsize(os.path.join(artifact.path, entry["file"]))
+                for entry in artifact.manifest["files"].values()
+            )
+            self.stdout.write(
+                f"{path} -> {artifact_path(path)} "
+                f"(version {artifact.version}, {size / 1e6:.1f} MB, {options['dtype']})"
+            )
+            converted += 1
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} model(s)."))
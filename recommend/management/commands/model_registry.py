@@ -0,0 +1,96 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommend.ml.model_registry import KEEP_VERSIONS, ModelRegistry
+from recommend.ml.torch_recommender_hybrid import LEGACY_MODEL_PATH
+from recommend.telemetry import reset_shadow_stats, shadow_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Inspect and manage the hybrid model registry: list versions, promote, "
+        "roll back, prune, import a .pt file, and set or report the shadow version."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action",
+            choices=["list", "promote", "rollback", "prune", "import", "shadow", "shadow-stats"],
+        )
+        parser.add_argument(
+            "target",
+            nargs="?",
+            help=(
+                "Version (promote, rollback, shadow) or model file "
+                "(import, default: the pre-registry model file)"
+            ),
+        )
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=KEEP_VERSIONS,
+            help=f"Versions kept by prune (default: {KEEP_VERSIONS})",
+        )
+        parser.add_argument(
+            "--clear", action="store_true", help="With shadow: stop shadow scoring"
+        )
+        parser.add_argument(
+            "--reset", action="store_true", help="With shadow-stats: zero the counters"
+        )
+
+    def handle(self, *args, **options):
+        registry = ModelRegistry()
+        action, target = options["action"], options["target"]
+        try:
+            if action == "list":
+                self._list(registry)
+            elif action == "promote":
+                if not target:
+                    raise CommandError("promote needs a version")
+                registry.promote(target)
+                self.stdout.write(self.style.SUCCESS(f"Version {target} is now current."))
+            elif action == "rollback":
+                version = registry.rollback(target)
+                self.stdout.write(self.style.SUCCESS(f"Rolled back to version {version}."))
+            elif action == "prune":
+                removed = registry.prune(max(1, options["keep"]))
+                self.stdout.write(self.style.SUCCESS(f"Removed {len(removed)} old versions."))
+            elif action == "import":
+                target = target or LEGACY_MODEL_PATH
+                metadata = registry.import_model(target)
+                self.stdout.write(
+                    self.style.SUCCESS(f"Imported {target} as current version {metadata['version']}.")
+                )
+            elif action == "shadow":
+                if options["clear"]:
+                    registry.clear_shadow()
+                    self.stdout.write(self.style.SUCCESS("Shadow scoring stopped."))
+                    return
+                if not target:
+                    raise CommandError("shadow needs a version (or --clear)")
+                registry.set_shadow(target)
+                self.stdout.write(self.style.SUCCESS(f"Shadow scoring version {target}."))
+            elif action == "shadow-stats":
+                version = target or registry.shadow
+                if not version:
+                    raise CommandError("No shadow version set")
+                self.stdout.write(json.dumps(shadow_stats(version), indent=2))
+                if options["reset"]:
+                    reset_shadow_stats(version)
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+
+    def _list(self, registry):
+        current, shadow = registry.current, registry.shadow
+        versions = registry.versions()
+        for metadata in versions:
+            version = metadata["version"]
+            marks = [name for name, value in (("current", current), ("shadow", shadow)) if value == version]
+            metrics = metadata.get("metrics", {})
+            latency = metrics.get("latency_ms") or {}
+            self.stdout.write(
+                f"{version}  {metadata['created_at']}  items={metrics.get('items')} "
+                f"p95={latency.get('p95')}ms {' '.join(marks)}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(versions)} versions."))
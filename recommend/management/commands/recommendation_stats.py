@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from recommend.telemetry import LAYERS, CircuitBreaker, layer_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Show per-layer latency, hit/fallback counters and circuit breaker "
+        "state of the recommendation service."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print the raw stats as JSON")
+        parser.add_argument("--reset", action="store_true", help="Reset the counters afterwards")
+        parser.add_argument(
+            "--close-breakers",
+            action="store_true",
+            help="Force every layer's circuit breaker closed",
+        )
+
+    def handle(self, *args, **options):
+        stats = layer_stats()
+        if options["json"]:
+            self.stdout.write(json.dumps(stats, indent=2))
+        else:
+            rate = stats["fallback_rate"]
+            self.stdout.write(
+                f"Requests: {stats['requests']}  "
+                f"mean {stats['mean_request_ms']} ms  "
+                f"fallback rate {'-' if rate is None else f'{rate:.1%}'}"
+            )
+            for layer, info in stats["layers"].items():
+                counts = " ".join(f"{name}={count}" for name, count in info["counts"].items())
+                latency = info["latency_ms"]
+                self.stdout.write(
+                    f"  {layer:<24} served={info['served']:<6} {counts}  "
+                    f"p50<={latency['p50']} p95<={latency['p95']} p99<={latency['p99']} ms  "
+                    f"budget={info['timeout']}s breaker={info['breaker']['state']}"
+                )
+
+        if options["close_breakers"]:
+            for layer in LAYERS:
+                CircuitBreaker(layer).record_success()
+            self.stdout.write("Circuit breakers closed.")
+        if options["reset"]:
+            reset_stats()
+            self.stdout.write("Counters reset.")
+        self.stdout.write(self.style.SUCCESS("Recommendation stats complete"))
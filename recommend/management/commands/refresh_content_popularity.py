@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from recommend.popularity import CHUNK_SIZE, refresh_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Update the materialized ContentPopularity rows of posts touched since the "
+        "last run (or all of them with --full)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Ignore the watermarks and recompute every item",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help=f"Items recomputed per batch of grouped queries (default: {CHUNK_SIZE})",
+        )
+
+    def handle(self, *args, **options):
+        stats = refresh_popularity(full=options["full"], chunk_size=max(1, options["chunk_size"]))
+        mode = "full" if stats["full"] else "incremental"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Refreshed popularity of {stats['updated']} items "
+                f"({stats['removed']} removed, {mode} run)."
+            )
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recommend.locks import LockBusy
+from recommend.pipeline import run_pipeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the recommendation pipeline (snapshot, train, score, publish, warm), "
+        "resuming an unfinished run and skipping stages whose input is unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rerun every stage even if no new interactions arrived",
+        )
+        parser.add_argument("--epochs", type=int, default=None)
+        parser.add_argument("--workers", type=int, default=None)
+
+    def handle(self, *args, **options):
+        overrides = {
+            name: options[name] for name in ("epochs", "workers") if options[name] is not None
+        }
+        try:
+            run = run_pipeline(force=options["force"], log=self.stdout.write, **overrides)
+        except LockBusy as e:
+            raise CommandError(f"{e}; try again once it has finished.")
+        ran = [name for name, checkpoint in run.checkpoints.items() if not checkpoint["skipped"]]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Pipeline run {run.pk} completed (ran: {', '.join(ran) or 'nothing'})."
+            )
+        )
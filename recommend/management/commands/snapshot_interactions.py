@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+
+from recommend.ml.snapshot import (
+    COMMIT_LAG,
+    PARTITION_ROWS,
+    SNAPSHOT_DIR,
+    InteractionSnapshot,
+    write_snapshot,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Export new interactions (above the last id watermark) into compressed "
+        "columnar partitions for offline training and analytics."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            default=SNAPSHOT_DIR,
+            help=f"Snapshot directory (default: {SNAPSHOT_DIR})",
+        )
+        parser.add_argument(
+            "--partition-rows",
+            type=int,
+            default=PARTITION_ROWS,
+            help=f"Maximum rows per partition file (default: {PARTITION_ROWS})",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Rows fetched per database round trip (default: 5000)",
+        )
+        parser.add_argument(
+            "--lag",
+            type=int,
+            default=COMMIT_LAG,
+            help=f"Leave rows newer than this many seconds for the next run (default: {COMMIT_LAG})",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Drop the existing snapshot and export the whole table again",
+        )
+
+    def handle(self, *args, **options):
+        rows, partitions = write_snapshot(
+            path=options["path"],
+            partition_rows=max(1, options["partition_rows"]),
+            chunk_size=max(1, options["chunk_size"]),
+            full=options["full"],
+            lag=max(0, options["lag"]),
+        )
+        snapshot = InteractionSnapshot(options["path"])
+        self.stdout.write(
+            f"Snapshot holds {len(snapshot)} interactions in "
+            f"{len(snapshot.partitions())} partition(s), watermark {snapshot.watermark}"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Exported {rows} interactions in {partitions} new partition(s).")
+        )
@@ -3,6 +3,8 @@ Management command to train the hybrid recommendation model.
 
 Usage:
     python manage.py train_recommender [--days DAYS] [--epochs EPOCHS] [--emb-dim EMB_DIM]
+        [--profile {default,cpu,cpu-bf16}] [--threads N] [--epoch-time-budget SECONDS]
+        [--processes N]
 """
 
 from django.core.management.base import BaseCommand, CommandError
@@ -49,6 +51,52 @@ class Command(BaseCommand):
             default=1024,
             help="Batch size (default: 1024)",
         )
+        parser.add_argument(
+            "--num-workers",
+            type=int,
+            default=0,
+            help="DataLoader worker processes for batch assembly (default: 0)",
+        )
+        parser.add_argument(
+            "--profile",
+            default=None,
+            help="Training profile: default, cpu or cpu-bf16 (default: RECOMMEND_TRAINING_PROFILE)",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=None,
+            help="Intra-op torch threads (overrides the profile)",
+        )
+        parser.add_argument(
+            "--interop-threads",
+            type=int,
+            default=None,
+            help="Inter-op torch threads (overrides the profile)",
+        )
+        parser.add_argument(
+            "--bf16",
+            action="store_true",
+            default=None,
+            help="Run the forward pass under bfloat16 autocast",
+        )
+        parser.add_argument(
+            "--epoch-time-budget",
+            type=float,
+            default=None,
+            help="End each epoch after this many seconds",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Train data-parallel in this many local processes (gloo backend)",
+        )
+        parser.add_argument(
+            "--snapshot",
+            default=None,
+            help="Read interactions from this snapshot directory instead of the database",
+        )
 
     def handle(self, *args, **options):
         try:
@@ -70,6 +118,14 @@ class Command(BaseCommand):
                 lr=options["lr"],
                 batch_size=options["batch_size"],
                 use_content=True,
+                num_workers=options["num_workers"],
+                snapshot=options["snapshot"],
+                profile=options["profile"],
+                threads=options["threads"],
+                interop_threads=options["interop_threads"],
+                bf16=options["bf16"],
+                epoch_time_budget=options["epoch_time_budget"],
+                processes=options["processes"],
             )
 
             if model_path:
@@ -84,5 +140,7 @@ class Command(BaseCommand):
                     )
                 )
 
+        except ValueError as e:
+            raise CommandError(str(e))
         except Exception as e:
             raise CommandError(f"Model training failed: {e}")
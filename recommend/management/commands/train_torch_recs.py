@@ -1,13 +1,8 @@
-from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from recommend.ml.torch_recommender_hybrid import (
-    load_model_hybrid,
-    recommend_for_user_hybrid,
-    train_and_save_hybrid,
-)
-from recommend.models import Recommendation
+from recommend.locks import LockBusy, job_lock
+from recommend.ml.torch_recommender_hybrid import train_and_save_hybrid
+from recommend.pipeline import GENERATION_LOCK, TRAIN_LOCK, score_generation
 
 
 class Command(BaseCommand):
@@ -20,6 +15,29 @@ class Command(BaseCommand):
         parser.add_argument("--content_emb_dim", type=int, default=32)
         parser.add_argument("--topn", type=int, default=50)
         parser.add_argument("--use_content", action="store_true", default=True)
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=512,
+            help="Users scored per matrix product (default: 512)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Rows per bulk_create batch (default: 5000)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Shard user ranges across this many processes (default: 1)",
+        )
+        parser.add_argument(
+            "--snapshot",
+            default=None,
+            help="Read interactions from this snapshot directory instead of the database",
+        )
 
     def handle(self, *args, **options):
         days = options["days"]
@@ -28,48 +46,49 @@ class Command(BaseCommand):
         content_emb_dim = options["content_emb_dim"]
         topn = options["topn"]
         use_content = options["use_content"]
-        
+        block_size = max(1, options["block_size"])
+        chunk_size = max(1, options["chunk_size"])
+        workers = max(1, options["workers"])
+
         self.stdout.write("Training PyTorch hybrid recommender...")
-        path = train_and_save_hybrid(
-            days=days,
-            emb_dim=emb_dim,
-            content_emb_dim=content_emb_dim,
-            epochs=epochs,
-            use_content=use_content,
-        )
+        try:
+            with job_lock(TRAIN_LOCK):
+                path = train_and_save_hybrid(
+                    days=days,
+                    emb_dim=emb_dim,
+                    content_emb_dim=content_emb_dim,
+                    epochs=epochs,
+                    use_content=use_content,
+                    snapshot=options["snapshot"],
+                )
+        except LockBusy as e:
+            raise CommandError(f"{e}; not starting a second retrain.")
         if not path:
             self.stdout.write(
                 self.style.WARNING("No interactions or nothing to train on.")
             )
             return
         self.stdout.write(self.style.SUCCESS(f"Model saved to {path}"))
-        
-        model = load_model_hybrid(path)
-        if not model:
+
+        self.stdout.write(f"Generating top-{topn} recs...")
+        try:
+            with job_lock(GENERATION_LOCK):
+                writer = score_generation(
+                    path,
+                    topn=topn,
+                    block_size=block_size,
+                    chunk_size=chunk_size,
+                    workers=workers,
+                )
+        except LockBusy as e:
+            raise CommandError(f"{e}; the model is saved but no recommendations were written.")
+        if writer is None:
             self.stdout.write(self.style.ERROR("Failed to load model."))
             return
-        
-        User = get_user_model()
-        users = User.objects.all()
-        self.stdout.write(f"Generating top-{topn} recs for {users.count()} users...")
-        Recommendation.objects.all().delete()
-        
-        for user in users:
-            recs = recommend_for_user_hybrid(
-                user.id, model=model, topn=topn, exclude_seen=True, diversity_penalty=0.15
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored {writer.created} recommendations "
+                f"(generation {writer.generation.pk})."
             )
-            for rank, (item_key, score) in enumerate(recs, start=1):
-                try:
-                    app_model, oid = item_key.split(":", 1)
-                    app_label, model_name = app_model.split(".", 1)
-                    ct = ContentType.objects.get(app_label=app_label, model=model_name)
-                    Recommendation.objects.create(
-                        user=user,
-                        content_type=ct,
-                        object_id=int(oid),
-                        score=score,
-                    )
-                except Exception as e:
-                    self.stderr.write(f"Skipping {item_key}: {e}")
-        
-        self.stdout.write(self.style.SUCCESS("Recommendations stored."))
+        )
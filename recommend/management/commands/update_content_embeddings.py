@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recommend.ml.embeddings import (
+    EMBEDDING_DIR,
+    EMBEDDING_MODEL,
+    ENCODE_BATCH_SIZE,
+    update_embeddings,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Encode new and changed posts, community posts, games and projects with a local "
+        "sentence-transformers model and publish the float16 content embedding store."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            default=EMBEDDING_DIR,
+            help=f"Embedding store directory (default: {EMBEDDING_DIR})",
+        )
+        parser.add_argument(
+            "--model",
+            default=EMBEDDING_MODEL,
+            help=f"Local sentence-transformers model directory (default: {EMBEDDING_MODEL})",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=ENCODE_BATCH_SIZE,
+            help=f"Texts per encoder forward pass (default: {ENCODE_BATCH_SIZE})",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows fetched per database round trip (default: 1000)",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Ignore the stored hashes and re-encode every item",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            stats = update_embeddings(
+                path=options["path"],
+                model_path=options["model"],
+                batch_size=max(1, options["batch_size"]),
+                chunk_size=max(1, options["chunk_size"]),
+                full=options["full"],
+                log=lambda message: self.stdout.write(f"[INFO] {message}"),
+            )
+        except (FileNotFoundError, ImportError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Embedded {stats['items']} items: {stats['encoded']} encoded, "
+                f"{stats['reused']} unchanged, {stats['removed']} removed."
+            )
+        )
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('recommend', '0007_recommendation_generations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interaction',
+            name='engagement_score',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='interaction',
+            index=models.Index(fields=['engagement_score'], name='recommend_i_engagem_00efe4_idx'),
+        ),
+    ]
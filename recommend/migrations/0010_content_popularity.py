@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('recommend', '0009_item_registry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('likes', models.PositiveIntegerField(default=0)),
+                ('bookmarks', models.PositiveIntegerField(default=0)),
+                ('comments', models.PositiveIntegerField(default=0)),
+                ('recent_interactions', models.PositiveIntegerField(default=0)),
+                ('popularity', models.FloatField(default=0.0)),
+                ('hot_score', models.FloatField(default=0.0)),
+                ('item_created_at', models.DateTimeField(blank=True, null=True)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'verbose_name_plural': 'Content popularity',
+                'indexes': [models.Index(fields=['content_type', '-popularity'], name='recommend_popularity_idx'), models.Index(fields=['content_type', '-hot_score'], name='recommend_hot_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_id'), name='recommend_popularity_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,195 @@
+"""
+Pure-NumPy approximate nearest-neighbour index for item embeddings.
+
+An inverted-file (IVF) index: item vectors are clustered with k-means and
+stored grouped by cluster.  A query only scores the items in the ``n_probe``
+clusters whose centroids have the highest inner product with it, so top-K
+retrieval costs roughly ``n_items * n_probe / n_lists`` dot products instead
+of a full scan of the catalogue.  Scores are exact inner products for the
+probed items; the candidates can be re-ranked by the caller.
+
+Indexes are persisted next to the model file they were built from
+(``<model>.ivf.npz``) and support incremental insertion of new items.
+"""
+
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+ASSIGN_CHUNK = 8192
+
+
+def ann_index_path(model_path):
+    """Location of the ANN index persisted alongside ``model_path``."""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}.ivf.npz"
+
+
+def _nearest_centroid(vectors, centroids):
+    """L2-nearest centroid per row, computed in chunks to bound memory."""
+    c_sq = (centroids * centroids).sum(axis=1)
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[start : start + ASSIGN_CHUNK]
+        # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+        out[start : start + ASSIGN_CHUNK] = np.argmax(block @ centroids.T - 0.5 * c_sq, axis=1)
+    return out
+
+
+def _kmeans(vectors, n_lists, n_iter, rng):
+    n = len(vectors)
+    centroids = vectors[rng.choice(n, size=n_lists, replace=False)].copy()
+    assign = _nearest_centroid(vectors, centroids)
+    for _ in range(n_iter):
+        counts = np.bincount(assign, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # Re-seed empty lists with random points so every list stays usable
+            centroids[empty] = vectors[rng.choice(n, size=int(empty.sum()), replace=False)]
+        new_assign = _nearest_centroid(vectors, centroids)
+        if np.array_equal(new_assign, assign):
+            break
+        assign = new_assign
+    return centroids, assign
+
+
+class IVFIndex:
+    """Inner-product IVF index over a dense ``[n_items, dim]`` matrix."""
+
+    def __init__(self, centroids, vectors, assignments, ids=None, version=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        if ids is None:
+            ids = np.arange(len(self.vectors), dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.version = version
+        self._rebuild_lists()
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_iter=12, seed=0, version=None):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n))
+        n_lists = max(1, min(int(n_lists), n))
+        rng = np.random.default_rng(seed)
+        centroids, assign = _kmeans(vectors, n_lists, n_iter, rng)
+        return cls(centroids, vectors, assign, version=version)
+
+    def _rebuild_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=len(self.centroids))
+        self._order = order
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def default_n_probe(self):
+        return max(1, min(self.n_lists, max(4, self.n_lists // 4)))
+
+    def candidate_rows(self, query, n_probe=None):
+        """Rows of ``self.vectors`` stored in the clusters closest to ``query``."""
+        n_probe = n_probe or self.default_n_probe()
+        n_probe = min(n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        if n_probe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probe = np.arange(self.n_lists)
+        parts = [self._order[self._offsets[c] : self._offsets[c + 1]] for c in probe]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def search(self, query, k, n_probe=None):
+        """Return ``(ids, scores)`` of the approximate top-``k`` items, best first."""
+        query = np.asarray(query, dtype=np.float32)
+        rows = self.candidate_rows(query, n_probe)
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.vectors[rows] @ query
+        if k < len(rows):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return self.ids[rows[top]], scores[top]
+
+    def add(self, vectors, ids=None):
+        """Insert new items; they are routed to their nearest existing cluster."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if ids is None:
+            start = int(self.ids.max()) + 1 if len(self.ids) else 0
+            ids = np.arange(start, start + len(vectors), dtype=np.int64)
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.assignments = np.concatenate(
+            [self.assignments, _nearest_centroid(vectors, self.centroids)]
+        )
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self._rebuild_lists()
+        return ids
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            vectors=self.vectors,
+            assignments=self.assignments,
+            ids=self.ids,
+            version=np.array(self.version or ""),
+        )
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            version = str(data["version"]) or None
+            return cls(
+                data["centroids"],
+                data["vectors"],
+                data["assignments"],
+                data["ids"],
+                version=version,
+            )
+
+
+_index_lock = threading.Lock()
+_index_cache = {}
+
+
+def load_index(path):
+    """Process-wide cached ``IVFIndex.load``; reloads when the file changes."""
+    if np is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _index_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with _index_lock:
+        cached = _index_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        try:
+            index = IVFIndex.load(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        _index_cache[path] = (signature, index)
+        return index
@@ -0,0 +1,516 @@
+"""
+Directory-based, memory-mappable model artifacts.
+
+A trained payload (``state_dict``, key maps, item metadata) is written as a
+directory of raw ``.npy`` files plus a ``manifest.json``:
+
+- embedding matrices (optionally stored as float16, or int8 with one float32
+  scale per row) and any derived serving matrices
+- registry item ids aligned with the item rows (see ``recommend.registry``)
+- key maps as sorted key arrays with an aligned row array, looked up by
+  binary search (``SortedKeyMap``) instead of unpickled Python dicts
+- item metadata as columns (``created_at``, ``views``, ``likes``)
+- per-user seen items as CSR arrays (see ``seen``)
+- the manifest records shapes, dtypes and a sha256 per file
+
+Arrays are opened with ``np.load(mmap_mode="r")`` so every worker process
+maps the same page-cache copy.  Each save goes to a fresh
+``<root>.artifact.<version>`` directory and is published by atomically
+replacing the ``<root>.artifact`` symlink.
+
+``ArrayStore`` is the lighter variant for derived item tables (content
+embeddings, related items): one directory whose versioned files are
+published by atomically replacing its manifest.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections.abc import Mapping
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+DTYPES = ("float32", "float16", "int8")
+MATMUL_CHUNK = 65536
+
+
+def artifact_path(model_path):
+    """The artifact published alongside ``model_path`` (a symlink)."""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}.artifact"
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class QuantizedMatrix:
+    """int8 rows with a float32 scale per row, dequantized on access."""
+
+    def __init__(self, values, scale):
+        self.values = values
+        self.scale = scale
+
+    @classmethod
+    def quantize(cls, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        scale = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0)
+        scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+        values = np.clip(np.rint(matrix / scale[:, None]), -127, 127).astype(np.int8)
+        return cls(values, scale)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def ndim(self):
+        return 2
+
+    dtype = np.dtype(np.float32) if np is not None else None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        values = self.values[idx].astype(np.float32)
+        scale = self.scale[idx]
+        return values * (scale[..., None] if np.ndim(scale) else scale)
+
+    def __matmul__(self, other):
+        other = np.asarray(other, dtype=np.float32)
+        out = np.empty((len(self),) + other.shape[1:], dtype=np.float32)
+        # Dequantize in chunks to bound the temporary float32 copy
+        for start in range(0, len(self), MATMUL_CHUNK):
+            stop = start + MATMUL_CHUNK
+            block = self.values[start:stop].astype(np.float32) @ other
+            scale = self.scale[start:stop]
+            out[start:stop] = block * (scale[:, None] if block.ndim == 2 else scale)
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+
+class SortedKeyMap(Mapping):
+    """Read-only key -> row mapping backed by a sorted key array."""
+
+    def __init__(self, keys, rows):
+        self.keys_array = keys
+        self.rows = rows
+
+    @classmethod
+    def from_dict(cls, mapping, dtype=None):
+        keys = np.array(list(mapping.keys()), dtype=dtype)
+        rows = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+        order = np.argsort(keys, kind="stable")
+        return cls(keys[order], rows[order])
+
+    def lookup(self, keys):
+        """Vectorized rows for an array of keys (-1 where missing)."""
+        keys = np.asarray(keys, dtype=self.keys_array.dtype)
+        if len(self.keys_array) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self.keys_array, keys).clip(max=len(self.keys_array) - 1)
+        found = self.keys_array[pos] == keys
+        return np.where(found, self.rows[pos], -1)
+
+    def _position(self, key):
+        try:
+            pos = int(np.searchsorted(self.keys_array, key))
+        except (TypeError, ValueError):
+            return None
+        if pos < len(self.keys_array) and self.keys_array[pos] == key:
+            return pos
+        return None
+
+    def __getitem__(self, key):
+        pos = self._position(key)
+        if pos is None:
+            raise KeyError(key)
+        return int(self.rows[pos])
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __len__(self):
+        return len(self.keys_array)
+
+    def __iter__(self):
+        return iter(self.keys_array.tolist())
+
+
+def _metadata_columns(item_metadata, n_items):
+    created = np.zeros(n_items, dtype=np.float64)
+    views = np.full(n_items, -1, dtype=np.int64)
+    likes = np.full(n_items, -1, dtype=np.int64)
+    for idx, meta in (item_metadata or {}).items():
+        if not 0 <= idx < n_items or not meta:
+            continue
+        created[idx] = meta.get("created_at", 0) or 0
+        if "views" in meta:
+            views[idx] = meta["views"] or 0
+        if "likes" in meta:
+            likes[idx] = meta["likes"] or 0
+    return {"created_at": created, "views": views, "likes": likes}
+
+
+def payload_arrays(payload, dtype="float32"):
+    """Split a torch payload into ``{name: array}`` for ``write_artifact``."""
+    arrays = {}
+    quantized = {}
+    for name, tensor in payload["state_dict"].items():
+        value = tensor.detach().cpu().float().numpy() if hasattr(tensor, "detach") else tensor
+        arrays[name] = np.asarray(value, dtype=np.float32)
+
+    if "content_emb.weight" in arrays:
+        from .torch_recommender_hybrid import hybrid_item_matrix
+
+        item_emb = arrays["item_emb.weight"]
+        arrays["item_matrix"] = hybrid_item_matrix(item_emb, arrays["content_emb.weight"])
+        norms = np.linalg.norm(item_emb, axis=1, keepdims=True)
+        arrays["item_unit"] = item_emb / np.maximum(norms, 1e-8)
+
+    if dtype != "float32":
+        for name in list(arrays):
+            if arrays[name].ndim == 2:
+                if dtype == "int8":
+                    quantized[name] = QuantizedMatrix.quantize(arrays.pop(name))
+                else:
+                    arrays[name] = arrays[name].astype(np.float16)
+    return arrays, quantized
+
+
+def write_artifact(
+    payload, model_path, dtype="float32", index=None, keep_previous=1
+):
+    """
+    Write ``payload`` as a new artifact version and publish it.
+
+    ``index`` (an ``IVFIndex`` over the serving item matrix) is stored with
+    the artifact so serving processes can map it too.  Returns the path of
+    the published artifact link.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported artifact dtype: {dtype}")
+    link = artifact_path(model_path)
+    version = payload.get("version") or uuid.uuid4().hex
+    target = f"{link}.{version}"
+    staging = f"{target}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    arrays, quantized = payload_arrays(payload, dtype)
+    for name, matrix in quantized.items():
+        arrays[f"{name}.q"] = matrix.values
+        arrays[f"{name}.scale"] = matrix.scale
+
+    user_map = SortedKeyMap.from_dict(payload["user_map"], dtype=np.int64)
+    item_map = SortedKeyMap.from_dict(payload["item_map"], dtype=str)
+    raw_keys = payload["item_keys"]
+    item_keys = np.array([raw_keys[i] for i in range(len(raw_keys))], dtype=str)
+    arrays.update(
+        {
+            "user_map.keys": user_map.keys_array,
+            "user_map.rows": user_map.rows,
+            "item_map.keys": item_map.keys_array,
+            "item_map.rows": item_map.rows,
+            "item_keys": item_keys,
+        }
+    )
+    for column, values in _metadata_columns(
+        payload.get("item_metadata"), len(item_keys)
+    ).items():
+        arrays[f"meta.{column}"] = values
+    if "item_ids" in payload:
+        ids = payload["item_ids"]
+        arrays["item_ids"] = np.asarray(ids.numpy() if hasattr(ids, "numpy") else ids, dtype=np.int64)
+    if "seen_indptr" in payload:
+        from .seen import SeenItems
+
+        seen = SeenItems.from_payload(payload)
+        arrays["seen.indptr"] = seen.indptr
+        arrays["seen.indices"] = seen.indices
+    if index is not None:
+        arrays["ivf.centroids"] = index.centroids
+        arrays["ivf.assignments"] = index.assignments
+        arrays["ivf.ids"] = index.ids
+
+    files = {}
+    for name, array in arrays.items():
+        filename = f"{name}.npy"
+        path = os.path.join(staging, filename)
+        np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+        files[name] = {
+            "file": filename,
+            "shape": list(array.shape),
+            "dtype": str(array.dtype),
+            "sha256": _sha256(path),
+        }
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "dtype": dtype,
+        "quantized": sorted(quantized),
+        "emb_dim": payload.get("emb_dim"),
+        "content_emb_dim": payload.get("content_emb_dim"),
+        "ann_version": getattr(index, "version", None),
+        "files": files,
+    }
+    with open(os.path.join(staging, MANIFEST_NAME), "w") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+    previous = os.path.realpath(link) if os.path.islink(link) else None
+    tmp_link = f"{link}.{uuid.uuid4().hex}.lnk"
+    os.symlink(os.path.basename(target), tmp_link)
+    os.replace(tmp_link, link)
+    _prune_versions(link, keep={target, previous} if keep_previous else {target})
+    return link
+
+
+def _prune_versions(link, keep):
+    """Remove superseded version directories (mapped files stay readable)."""
+    directory, base = os.path.split(link)
+    keep = {os.path.realpath(path) for path in keep if path}
+    for name in os.listdir(directory or "."):
+        if not name.startswith(f"{base}.") or name.endswith((".tmp", ".lnk")):
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and not os.path.islink(path) and os.path.realpath(path) not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class Artifact:
+    """A loaded artifact: memory-mapped arrays, key maps and metadata columns."""
+
+    def __init__(self, path, verify=False):
+        self.path = os.path.realpath(path)
+        with open(os.path.join(self.path, MANIFEST_NAME)) as fh:
+            self.manifest = json.load(fh)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported artifact format: {self.manifest.get('format')}")
+        if verify:
+            self.verify()
+        self.version = self.manifest["version"]
+        self.emb_dim = self.manifest.get("emb_dim")
+        self.content_emb_dim = self.manifest.get("content_emb_dim")
+        self.user_map = SortedKeyMap(self._load("user_map.keys"), self._load("user_map.rows"))
+        self.item_map = SortedKeyMap(self._load("item_map.keys"), self._load("item_map.rows"))
+        self.item_keys = self._load("item_keys")
+        self.columns = {
+            name[len("meta.") :]: self._load(name)
+            for name in self.manifest["files"]
+            if name.startswith("meta.")
+        }
+
+    def _load(self, name):
+        entry = self.manifest["files"][name]
+        return np.load(os.path.join(self.path, entry["file"]), mmap_mode="r")
+
+    def has(self, name):
+        files = self.manifest["files"]
+        return name in files or f"{name}.q" in files
+
+    def array(self, name):
+        """A named matrix; int8-quantized ones come back as ``QuantizedMatrix``."""
+        if name in self.manifest.get("quantized", []):
+            return QuantizedMatrix(self._load(f"{name}.q"), self._load(f"{name}.scale"))
+        return self._load(name)
+
+    def ann_index(self, vectors):
+        """IVF index stored with the artifact, over ``vectors`` (or None)."""
+        if "ivf.centroids" not in self.manifest["files"]:
+            return None
+        from .ann import IVFIndex
+
+        return IVFIndex(
+            self._load("ivf.centroids"),
+            vectors,
+            self._load("ivf.assignments"),
+            self._load("ivf.ids"),
+            version=self.manifest.get("ann_version"),
+        )
+
+    def verify(self):
+        """Check every file against the manifest checksums."""
+        for name, entry in self.manifest["files"].items():
+            if _sha256(os.path.join(self.path, entry["file"])) != entry["sha256"]:
+                raise ValueError(f"Checksum mismatch for {name} in {self.path}")
+        return True
+
+
+_artifact_lock = threading.Lock()
+_artifacts = {}
+
+
+def load_artifact(path, verify=False):
+    """Process-wide cached ``Artifact``; reloads when the published version changes."""
+    if np is None:
+        return None
+    try:
+        target = os.path.realpath(path)
+        stat = os.stat(os.path.join(target, MANIFEST_NAME))
+    except OSError:
+        return None
+    signature = (target, stat.st_mtime_ns, stat.st_size)
+    cached = _artifacts.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with _artifact_lock:
+        cached = _artifacts.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        try:
+            artifact = Artifact(target, verify=verify)
+        except (OSError, KeyError, ValueError):
+            return None
+        _artifacts[path] = (signature, artifact)
+        return artifact
+
+
+class ArrayStore:
+    """
+    A directory of versioned ``.npy`` files published by ``manifest.json``.
+
+    Used for the derived item tables (content embeddings, related items)
+    that are rebuilt wholesale.  Every store has a sorted ``keys`` array of
+    "app.model:pk" item keys; the other arrays are aligned with it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = read_store_manifest(path)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No {type(self).__name__} store at {path}")
+        self.version = self.manifest["version"]
+        self.keys = self._load("keys")
+        self.key_map = SortedKeyMap(self.keys, np.arange(len(self.keys), dtype=np.int64))
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, self.manifest["files"][name]), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rows(self, keys):
+        """Vectorized store rows for "app.model:pk" keys (-1 where missing)."""
+        keys = np.asarray([str(key) for key in keys])
+        rows = self.key_map.lookup(keys)
+        # lookup() casts to the store's key width; reject truncated matches
+        found = rows >= 0
+        rows[found] = np.where(self.keys[rows[found]] == keys[found], rows[found], -1)
+        return rows
+
+
+def read_store_manifest(path):
+    """The published manifest of an ``ArrayStore`` directory (None if absent)."""
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def write_store(path, arrays, **meta):
+    """
+    Publish ``arrays`` (``keys`` plus aligned columns) as a new store version.
+
+    Rows are sorted by key.  The files are written under fresh names and
+    the manifest is replaced atomically last; files of older versions are
+    removed afterwards (processes still mapping them keep their open
+    files).  Returns the new version.
+    """
+    os.makedirs(path, exist_ok=True)
+    version = uuid.uuid4().hex
+    order = np.argsort(arrays["keys"], kind="stable")
+    files = {}
+    for name, array in arrays.items():
+        filename = f"{name}-{version}.npy"
+        tmp = os.path.join(path, f".{filename}.tmp")
+        with open(tmp, "wb") as fh:
+            np.save(fh, np.ascontiguousarray(np.asarray(array)[order]), allow_pickle=False)
+        os.replace(tmp, os.path.join(path, filename))
+        files[name] = filename
+    manifest = dict(meta, format=FORMAT_VERSION, version=version, count=len(order), files=files)
+    tmp = os.path.join(path, f".{MANIFEST_NAME}.tmp")
+    with open(tmp, "w") as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(tmp, os.path.join(path, MANIFEST_NAME))
+    current = set(files.values())
+    for entry in os.listdir(path):
+        if entry.endswith(".npy") and entry not in current:
+            os.remove(os.path.join(path, entry))
+    return version
+
+
+_store_lock = threading.Lock()
+_stores = {}
+
+
+def load_store(cls, path):
+    """Process-wide cached ``cls`` store; reloads when a new version is published."""
+    if np is None:
+        return None
+    manifest = read_store_manifest(path)
+    if manifest is None:
+        return None
+    cached = _stores.get((cls, path))
+    if cached is not None and cached.version == manifest["version"]:
+        return cached
+    with _store_lock:
+        try:
+            store = cls(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        _stores[(cls, path)] = store
+        return store
+
+
+def convert_model_file(model_path, dtype="float32", load=None):
+    """
+    Write the artifact for an existing ``.pt`` payload.
+
+    Items of a payload without ``item_ids`` (trained before the item
+    registry) are registered and their ids stored in the artifact.
+    """
+    if load is None:
+        import torch
+
+        def load(path):
+            return torch.load(path, map_location="cpu")
+
+    payload = load(model_path)
+    if not payload:
+        raise ValueError(f"No model payload in {model_path}")
+    from .ann import ann_index_path, load_index
+
+    if "item_ids" not in payload:
+        # Pre-registry model: register its items now rather than while serving
+        from .serving import register_item_keys
+
+        raw_keys = payload["item_keys"]
+        payload["item_ids"] = register_item_keys([raw_keys[i] for i in range(len(raw_keys))])
+
+    index = load_index(ann_index_path(model_path))
+    if index is not None and index.version != payload.get("version"):
+        index = None
+    return write_artifact(payload, model_path, dtype=dtype, index=index)
@@ -0,0 +1,465 @@
+"""
+Offline benchmark and evaluation harness for the recommenders.
+
+``generate_interactions()`` builds a synthetic catalogue: item popularity
+follows a Zipf law, user activity a Pareto law, and every user prefers two
+of ``n_categories`` item categories (picked with probability ``affinity``),
+so there is structure for the models to find.  A fraction of every active
+user's distinct items is held out; the rest is written as a columnar
+interaction snapshot and each recommender is trained from it through its
+normal entry point:
+
+- ``popularity``: global distinct-user counts (the popularity layer)
+- ``interest``: popular items in the user's two most-used categories (the
+  interest layer, with categories standing in for tags)
+- ``item_knn``: the sparse item-item model behind ``compute_recommendations``
+- ``mf``: ``torch_recommender.train_and_save``
+- ``hybrid``: ``torch_recommender_hybrid.train_and_save_hybrid``
+
+For each method the report has the training time, the peak RSS while it
+trained and served, p50/p95/p99 single-user inference latency, and
+recall@K / NDCG@K against the held-out items.  Training items are removed
+from every method's ranking before scoring, so methods are compared on the
+same protocol.  ``compare_reports()`` diffs two JSON reports.
+"""
+
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+METHODS = ("popularity", "interest", "item_knn", "mf", "hybrid")
+# Synthetic items are keyed "benchmark.item:<n>" (n = item index + 1)
+ITEM_LABEL = "benchmark.item"
+ITEM_CONTENT_TYPE_ID = 1
+ACTIONS = ("view", "like", "complete")
+ACTION_WEIGHTS = (0.8, 1.5, 2.0)
+ACTION_PROBS = (0.7, 0.2, 0.1)
+
+
+def generate_interactions(
+    n_users=1000,
+    n_items=2000,
+    n_interactions=50000,
+    n_categories=20,
+    alpha=1.1,
+    affinity=0.8,
+    seed=0,
+):
+    """
+    Synthetic power-law interactions.
+
+    Returns ``{"user", "item", "action", "weight", "created_at",
+    "item_category"}`` arrays; users are 1-based ids, items 0-based indices.
+    """
+    rng = np.random.default_rng(seed)
+    item_category = rng.integers(0, n_categories, n_items)
+    popularity = 1.0 / (rng.permutation(n_items) + 1.0) ** alpha
+    popularity /= popularity.sum()
+
+    activity = rng.pareto(1.5, n_users) + 1.0
+    counts = np.maximum(3, np.round(activity / activity.sum() * n_interactions)).astype(np.int64)
+    users = np.repeat(np.arange(n_users), counts)
+    preferred = rng.integers(0, n_categories, (n_users, 2))
+
+    items = rng.choice(n_items, size=len(users), p=popularity)
+    targeted = rng.random(len(users)) < affinity
+    wanted = preferred[users, rng.integers(0, 2, len(users))]
+    for category in range(n_categories):
+        members = np.flatnonzero(item_category == category)
+        rows = np.flatnonzero(targeted & (wanted == category))
+        if len(members) == 0 or len(rows) == 0:
+            continue
+        p = popularity[members] / popularity[members].sum()
+        items[rows] = members[rng.choice(len(members), size=len(rows), p=p)]
+
+    action = rng.choice(len(ACTIONS), size=len(users), p=ACTION_PROBS)
+    now = time.time()
+    return {
+        "user": users + 1,
+        "item": items,
+        "action": action.astype(np.uint8),
+        "weight": np.asarray(ACTION_WEIGHTS, dtype=np.float32)[action],
+        "created_at": now - rng.uniform(0, 90 * 86400, len(users)),
+        "item_category": item_category,
+    }
+
+
+def split_holdout(users, items, test_fraction=0.2, min_items=5, seed=0):
+    """
+    Hold out ``test_fraction`` of the distinct items of users with at least
+    ``min_items`` of them.  Returns ``(train_mask, {user: set(items)})``.
+    """
+    rng = np.random.default_rng(seed + 1)
+    pairs, inverse = np.unique(np.stack([users, items], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    held = np.zeros(len(pairs), dtype=bool)
+    starts = np.flatnonzero(np.r_[True, pairs[1:, 0] != pairs[:-1, 0]])
+    ends = np.r_[starts[1:], len(pairs)]
+    for start, end in zip(starts, ends):
+        n = end - start
+        if n >= min_items:
+            take = max(1, int(round(n * test_fraction)))
+            held[start + rng.choice(n, size=take, replace=False)] = True
+    test = {}
+    for user, item in pairs[held]:
+        test.setdefault(int(user), set()).add(int(item))
+    return ~held[inverse], test
+
+
+def recall_ndcg(ranked, relevant, k):
+    """recall@k and NDCG@k of one ranked item list against a relevant set."""
+    ranked = list(ranked)[:k]
+    hits = [1.0 if item in relevant else 0.0 for item in ranked]
+    recall = sum(hits) / len(relevant) if relevant else 0.0
+    dcg = sum(hit / np.log2(pos + 2) for pos, hit in enumerate(hits))
+    ideal = sum(1.0 / np.log2(pos + 2) for pos in range(min(k, len(relevant))))
+    return recall, (dcg / ideal if ideal else 0.0)
+
+
+def _reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets the VmHWM high-water mark
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux (a process-lifetime peak)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    ms = np.asarray(latencies) * 1000.0
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3),
+    }
+
+
+def _item_index(key):
+    return int(str(key).rsplit(":", 1)[1]) - 1
+
+
+class _Catalogue:
+    """Train-split state shared by the method builders."""
+
+    def __init__(self, interactions, train_mask, snapshot_path, workdir, options):
+        self.users = interactions["user"][train_mask]
+        self.items = interactions["item"][train_mask]
+        self.item_category = interactions["item_category"]
+        self.n_items = len(self.item_category)
+        self.snapshot_path = snapshot_path
+        self.workdir = workdir
+        self.options = options
+        self.seen = {}
+        for user, item in zip(self.users.tolist(), self.items.tolist()):
+            self.seen.setdefault(user, set()).add(item)
+        pairs = np.unique(np.stack([self.users, self.items], axis=1), axis=0)
+        self.item_users = np.bincount(pairs[:, 1], minlength=self.n_items)
+
+
+def _popularity(cat):
+    order = np.argsort(-cat.item_users, kind="stable")
+    return lambda user, n: order[:n].tolist()
+
+
+def _interest(cat):
+    n_categories = int(cat.item_category.max()) + 1
+    per_category = {}
+    for category in range(n_categories):
+        members = np.flatnonzero(cat.item_category == category)
+        per_category[category] = members[np.argsort(-cat.item_users[members], kind="stable")]
+    user_top = {}
+    for user, items in cat.seen.items():
+        counts = np.bincount(cat.item_category[list(items)], minlength=n_categories)
+        user_top[user] = np.argsort(-counts, kind="stable")[:2]
+    fallback = np.argsort(-cat.item_users, kind="stable")
+
+    def recommend(user, n):
+        top = user_top.get(user)
+        if top is None:
+            return fallback[:n].tolist()
+        merged = np.concatenate([per_category[c][:n] for c in top])
+        return merged[np.argsort(-cat.item_users[merged], kind="stable")][:n].tolist()
+
+    return recommend
+
+
+def _item_knn(cat):
+    from .dataset import load_snapshot_data
+    from .item_similarity import (
+        interaction_matrix,
+        item_neighbours,
+        popularity_order,
+        recommend_all,
+        score_users,
+    )
+
+    data = load_snapshot_data(cat.snapshot_path)
+    matrix = interaction_matrix(data)
+    neighbours = item_neighbours(matrix, k=cat.options["neighbours"], metric="jaccard")
+    popular, counts = popularity_order(matrix)
+    # The batch pass compute_recommendations runs (without the database writes)
+    for _ in recommend_all(matrix, neighbours, cat.options["k"]):
+        pass
+    user_map = data.user_map()
+    item_ids = np.array([_item_index(key) for key in data.item_keys])
+
+    def recommend(user, n):
+        uidx = user_map.get(user)
+        if uidx is None:
+            return item_ids[popular[:n]].tolist()
+        (_, idxs, _), = score_users(matrix, neighbours, popular, counts, n, uidx, uidx + 1)
+        return item_ids[idxs].tolist()
+
+    return recommend
+
+
+def _mf(cat):
+    from . import torch_recommender
+
+    path = os.path.join(cat.workdir, "mf.pt")
+    torch_recommender.train_and_save(
+        emb_dim=cat.options["emb_dim"],
+        epochs=cat.options["epochs"],
+        model_path=path,
+        snapshot=cat.snapshot_path,
+        register_items=False,
+    )
+    payload = torch_recommender.load_model(path)
+
+    def recommend(user, n):
+        recs = torch_recommender.recommend_for_user(user, model=payload, topn=n)
+        return [_item_index(key) for key, _ in recs]
+
+    return recommend
+
+
+def _hybrid(cat):
+    from .serving import HybridServingModel
+    from .torch_recommender_hybrid import (
+        load_model_hybrid,
+        recommend_for_user_hybrid,
+        train_and_save_hybrid,
+    )
+
+    path = os.path.join(cat.workdir, "hybrid.pt")
+    train_and_save_hybrid(
+        emb_dim=cat.options["emb_dim"],
+        content_emb_dim=max(1, cat.options["emb_dim"] // 2),
+        epochs=cat.options["epochs"],
+        model_path=path,
+        snapshot=cat.snapshot_path,
+        register_items=False,
+    )
+    model = HybridServingModel(load_model_hybrid(path), path)
+
+    def recommend(user, n):
+        recs = recommend_for_user_hybrid(
+            user, model=model, topn=n, diversity_penalty=0.0, freshness_boost=False
+        )
+        return [_item_index(key) for key, _ in recs]
+
+    return recommend
+
+
+BUILDERS = {
+    "popularity": _popularity,
+    "interest": _interest,
+    "item_knn": _item_knn,
+    "mf": _mf,
+    "hybrid": _hybrid,
+}
+
+
+def _evaluate(cat, test, recommend, k, eval_users):
+    latencies = []
+    recalls, ndcgs = [], []
+    recommended = set()
+    for user in eval_users:
+        seen = cat.seen.get(user, set())
+        started = time.perf_counter()
+        ranked = recommend(user, k + len(seen))
+        latencies.append(time.perf_counter() - started)
+        ranked = [item for item in ranked if item not in seen][:k]
+        recommended.update(ranked)
+        recall, ndcg = recall_ndcg(ranked, test[user], k)
+        recalls.append(recall)
+        ndcgs.append(ndcg)
+    return {
+        "latency_ms": _percentiles(latencies),
+        "recall_at_k": round(float(np.mean(recalls)), 5) if recalls else None,
+        "ndcg_at_k": round(float(np.mean(ndcgs)), 5) if ndcgs else None,
+        "coverage": round(len(recommended) / cat.n_items, 5),
+    }
+
+
+def _environment():
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    try:
+        import torch
+
+        env["torch"] = torch.__version__
+        env["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        env["torch"] = None
+    return env
+
+
+def run_benchmark(
+    n_users=1000,
+    n_items=2000,
+    n_interactions=50000,
+    n_categories=20,
+    k=10,
+    methods=METHODS,
+    eval_users=500,
+    epochs=3,
+    emb_dim=32,
+    neighbours=50,
+    seed=0,
+    workdir=None,
+    log=None,
+):
+    """Generate data, train and evaluate ``methods``; returns the JSON-able report."""
+    from .snapshot import write_array_snapshot
+
+    log = log or (lambda message: None)
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="recommend-bench-")
+    try:
+        interactions = generate_interactions(
+            n_users, n_items, n_interactions, n_categories=n_categories, seed=seed
+        )
+        train_mask, test = split_holdout(interactions["user"], interactions["item"], seed=seed)
+        n_train = int(train_mask.sum())
+        snapshot_path = os.path.join(workdir, "snapshot")
+        write_array_snapshot(
+            snapshot_path,
+            {
+                "id": np.arange(1, n_train + 1),
+                "user_id": interactions["user"][train_mask],
+                "content_type_id": np.full(n_train, ITEM_CONTENT_TYPE_ID),
+                "object_id": interactions["item"][train_mask] + 1,
+                "action": interactions["action"][train_mask],
+                "weight": interactions["weight"][train_mask],
+                "created_at": interactions["created_at"][train_mask],
+            },
+            {ITEM_CONTENT_TYPE_ID: ITEM_LABEL},
+            actions=ACTIONS,
+        )
+        options = {"k": k, "epochs": epochs, "emb_dim": emb_dim, "neighbours": neighbours}
+        cat = _Catalogue(interactions, train_mask, snapshot_path, workdir, options)
+        rng = np.random.default_rng(seed + 2)
+        candidates = sorted(test)
+        sample = (
+            rng.choice(candidates, size=eval_users, replace=False).tolist()
+            if len(candidates) > eval_users
+            else candidates
+        )
+        log(
+            f"{n_users} users, {n_items} items, {n_train} train interactions, "
+            f"{len(sample)} evaluation users"
+        )
+
+        results = {}
+        for method in methods:
+            _reset_peak_rss()
+            started = time.perf_counter()
+            try:
+                recommend = BUILDERS[method](cat)
+            except ImportError as e:
+                results[method] = {"skipped": str(e)}
+                log(f"{method}: skipped ({e})")
+                continue
+            train_seconds = time.perf_counter() - started
+            result = {"train_seconds": round(train_seconds, 3)}
+            result.update(_evaluate(cat, test, recommend, k, sample))
+            result["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+            results[method] = result
+            log(
+                f"{method}: train {train_seconds:.2f}s, "
+                f"p95 {result['latency_ms']['p95']} ms, "
+                f"recall@{k} {result['recall_at_k']}, ndcg@{k} {result['ndcg_at_k']}"
+            )
+        return {
+            "config": {
+                "n_users": n_users,
+                "n_items": n_items,
+                "n_interactions": n_interactions,
+                "n_categories": n_categories,
+                "k": k,
+                "eval_users": len(sample),
+                "epochs": epochs,
+                "emb_dim": emb_dim,
+                "neighbours": neighbours,
+                "seed": seed,
+            },
+            "dataset": {"train_interactions": n_train, "test_users": len(test)},
+            "environment": _environment(),
+            "results": results,
+            "timestamp": time.time(),
+        }
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Metrics where larger is better; everything else is a cost
+_HIGHER_IS_BETTER = {"recall_at_k", "ndcg_at_k", "coverage"}
+
+
+def compare_reports(baseline, current):
+    """
+    Relative change per method and metric, ``{method: {metric: change}}``.
+
+    Positive changes are improvements (for latency, time and memory a
+    decrease counts as positive).
+    """
+    def metrics(result):
+        flat = {k: v for k, v in result.items() if isinstance(v, (int, float))}
+        for name, value in (result.get("latency_ms") or {}).items():
+            flat[f"latency_{name}_ms"] = value
+        return flat
+
+    out = {}
+    for method, result in current.get("results", {}).items():
+        base = baseline.get("results", {}).get(method)
+        if not base or "skipped" in base or "skipped" in result:
+            continue
+        before, after = metrics(base), metrics(result)
+        changes = {}
+        for name, value in after.items():
+            old = before.get(name)
+            if old in (None, 0) or value is None:
+                continue
+            change = (value - old) / abs(old)
+            changes[name] = round(change if name in _HIGHER_IS_BETTER else -change, 4)
+        out[method] = changes
+    return out
@@ -0,0 +1,353 @@
+"""
+Single-pass, streaming extraction of training data for the torch recommenders.
+
+The ``Interaction`` table is read once with ``values_list(...).iterator()``;
+no model instances or per-row ``ContentType`` lookups are created.  Content
+types are mapped through an integer code table, engagement weights come from
+the stored ``engagement_score`` column (rows not yet backfilled are computed
+over whole column arrays), and the result is a set of compact numpy arrays
+(user index, item index, weight) plus the id/key tables needed to build the
+model maps.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from recommend.models import ACTION_ENGAGEMENT_BASE_WEIGHTS
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Metadata fields read by Interaction.engagement_weight(), in fallback order
+_METADATA_FIELDS = (
+    "duration_seconds",
+    "duration",
+    "scroll_depth",
+    "scroll_fraction",
+    "bookmarked",
+    "saved",
+    "wishlisted",
+    "liked",
+)
+# The whole metadata object, not per-key transforms: SQLite decodes a JSON
+# string such as "0" into a number, which changes what ``or`` picks
+_COLUMNS = ("user_id", "content_type_id", "object_id", "action", "value", "metadata")
+# Columns ``row_weights()`` reads after the primary key
+WEIGHT_COLUMNS = _COLUMNS[3:]
+# Rows with a stored weight only need the key columns
+_SCORED_COLUMNS = ("user_id", "content_type_id", "object_id", "engagement_score")
+
+
+def item_code(content_type_ids, object_ids):
+    """Pack (content_type_id, object_id) pairs into one int64 per item."""
+    return (np.asarray(content_type_ids, dtype=np.int64) << 32) | np.asarray(
+        object_ids, dtype=np.int64
+    )
+
+
+def content_type_labels():
+    """Integer code table: ContentType id -> "app_label.model"."""
+    return {
+        ct_id: f"{app_label}.{model}"
+        for ct_id, app_label, model in ContentType.objects.values_list(
+            "id", "app_label", "model"
+        )
+    }
+
+
+def _object_column(column):
+    """1-D object array of raw JSON values (list values stay single elements)."""
+    out = np.empty(len(column), dtype=object)
+    for i, raw in enumerate(column):
+        out[i] = raw
+    return out
+
+
+def _coerce_floats(column):
+    """Float array from JSON values; None/invalid become NaN (like float() fallbacks)."""
+    column = _object_column(column)
+    try:
+        return column.astype(np.float64)
+    except (TypeError, ValueError):
+        out = np.full(len(column), np.nan)
+        for i, raw in enumerate(column):
+            try:
+                out[i] = float(raw)
+            except (TypeError, ValueError):
+                pass
+        return out
+
+
+def _first_truthy(primary, fallback):
+    """Vectorized ``float(primary or fallback or 0)`` over raw JSON columns (invalid -> 0)."""
+    primary, fallback = _object_column(primary), _object_column(fallback)
+    # ``or`` decides on the raw values: "abc" or "0" wins over the fallback
+    chosen = np.where(primary.astype(bool), primary, fallback)
+    return np.nan_to_num(_coerce_floats(chosen), nan=0.0)
+
+
+def _truthy(column):
+    return _object_column(column).astype(bool)
+
+
+def _metadata_fields(metadata):
+    """Column of raw values per ``_METADATA_FIELDS`` name from ``metadata`` objects."""
+    metadata = [meta if isinstance(meta, dict) else {} for meta in metadata]
+    return {field: [meta.get(field) for meta in metadata] for field in _METADATA_FIELDS}
+
+
+def engagement_weights(actions, values, metadata_columns):
+    """
+    Vectorized equivalent of ``Interaction.engagement_weight()``.
+
+    ``metadata_columns`` maps each name in ``_METADATA_FIELDS`` to the column
+    of raw JSON values for that key.
+    """
+    values = _coerce_floats(values)
+    weight = np.maximum(np.nan_to_num(values, nan=0.5), 0.5)
+    actions = np.asarray(actions, dtype=object)
+    uniq, inverse = np.unique(actions.astype(str), return_inverse=True)
+    action_weight = np.array(
+        [ACTION_ENGAGEMENT_BASE_WEIGHTS.get(a, 1.0) for a in uniq], dtype=np.float64
+    )
+    weight = weight * action_weight[inverse]
+
+    duration = _first_truthy(metadata_columns["duration_seconds"], metadata_columns["duration"])
+    scroll = _first_truthy(metadata_columns["scroll_depth"], metadata_columns["scroll_fraction"])
+    bonus = np.minimum(2.5, duration / 30.0) + np.minimum(1.0, scroll)
+    saved = (
+        _truthy(metadata_columns["bookmarked"])
+        | _truthy(metadata_columns["saved"])
+        | _truthy(metadata_columns["wishlisted"])
+    )
+    bonus = bonus + saved * 1.0 + _truthy(metadata_columns["liked"]) * 0.5
+    return np.maximum(0.1, weight + bonus).astype(np.float32)
+
+
+class InteractionData:
+    """Compact training arrays extracted from the interaction log."""
+
+    def __init__(self, user_ids, item_codes, item_keys, user_idx, item_idx, weight):
+        self.user_ids = user_ids  # raw user id per dense user index
+        self.item_codes = item_codes  # packed (ct_id, object_id) per item index
+        self.item_keys = item_keys  # "app.model:id" per item index
+        self.user_idx = user_idx
+        self.item_idx = item_idx
+        self.weight = weight
+
+    @property
+    def n_users(self):
+        return len(self.user_ids)
+
+    @property
+    def n_items(self):
+        return len(self.item_keys)
+
+    def __len__(self):
+        return len(self.user_idx)
+
+    def user_map(self):
+        return {int(uid): idx for idx, uid in enumerate(self.user_ids)}
+
+    def item_map(self):
+        return {key: idx for idx, key in enumerate(self.item_keys)}
+
+    def item_ids(self, create=True):
+        """Registry item id per item index (see ``recommend.registry``)."""
+        from recommend.registry import item_ids_for_codes
+
+        return item_ids_for_codes(self.item_codes, create=create)
+
+    def items_by_user(self):
+        """Dense user index -> set of dense item indices."""
+        out = {}
+        for u, i in zip(self.user_idx.tolist(), self.item_idx.tolist()):
+            out.setdefault(u, set()).add(i)
+        return out
+
+
+def load_interaction_data(days=None, chunk_size=DEFAULT_CHUNK_SIZE, queryset=None):
+    """
+    Stream ``Interaction`` rows into an ``InteractionData`` in a single pass.
+
+    Rows whose content type is unknown are dropped.  Returns ``None`` when no
+    usable rows exist.
+    """
+    from recommend.models import Interaction
+
+    qs = queryset if queryset is not None else Interaction.objects.all()
+    if days:
+        qs = qs.filter(created_at__gte=timezone.now() - timezone.timedelta(days=int(days)))
+
+    labels = content_type_labels()
+    chunks = []
+    passes = (
+        (qs.filter(engagement_score__isnull=False), _SCORED_COLUMNS, _scored_chunk_to_arrays),
+        # Not backfilled yet: compute from action/value/metadata
+        (qs.filter(engagement_score__isnull=True), _COLUMNS, _chunk_to_arrays),
+    )
+    for rows, columns, to_arrays in passes:
+        buffer = []
+        for row in rows.order_by().values_list(*columns).iterator(chunk_size=chunk_size):
+            buffer.append(row)
+            if len(buffer) >= chunk_size:
+                chunks.append(to_arrays(buffer))
+                buffer = []
+        if buffer:
+            chunks.append(to_arrays(buffer))
+    if not chunks:
+        return None
+
+    return _build_interaction_data(
+        np.concatenate([c[0] for c in chunks]),
+        np.concatenate([c[1] for c in chunks]),
+        np.concatenate([c[2] for c in chunks]),
+        np.concatenate([c[3] for c in chunks]),
+        labels,
+    )
+
+
+def load_snapshot_data(snapshot=None, days=None):
+    """
+    ``InteractionData`` from a columnar snapshot instead of the live table.
+
+    ``snapshot`` is an ``InteractionSnapshot`` or a snapshot directory
+    (default: ``RECOMMEND_SNAPSHOT_DIR``).
+    """
+    from .snapshot import SNAPSHOT_DIR, InteractionSnapshot
+
+    if not isinstance(snapshot, InteractionSnapshot):
+        snapshot = InteractionSnapshot(snapshot or SNAPSHOT_DIR)
+    columns = snapshot.read(("user_id", "content_type_id", "object_id", "weight"), days=days)
+    if len(columns["user_id"]) == 0:
+        return None
+    return _build_interaction_data(
+        columns["user_id"],
+        columns["content_type_id"],
+        columns["object_id"],
+        columns["weight"],
+        snapshot.content_types,
+    )
+
+
+def load_training_data(days=None, snapshot=None):
+    """
+    Training data for the offline jobs.
+
+    Reads the columnar snapshot when one is given (or configured with
+    ``RECOMMEND_TRAINING_SNAPSHOT``), the ``Interaction`` table otherwise.
+    """
+    from django.conf import settings
+
+    snapshot = snapshot or getattr(settings, "RECOMMEND_TRAINING_SNAPSHOT", None)
+    if snapshot:
+        data = load_snapshot_data(snapshot, days=days)
+        print(f"[INFO] Loaded interactions from snapshot {snapshot}")
+        return data
+    return load_interaction_data(days=days)
+
+
+def _build_interaction_data(users, ct_ids, obj_ids, weights, labels):
+    known = np.isin(ct_ids, np.fromiter(labels.keys(), dtype=np.int64, count=len(labels)))
+    users, ct_ids, obj_ids, weights = users[known], ct_ids[known], obj_ids[known], weights[known]
+    if len(users) == 0:
+        return None
+
+    user_ids, user_idx = np.unique(users, return_inverse=True)
+    item_codes, item_idx = np.unique(item_code(ct_ids, obj_ids), return_inverse=True)
+    item_keys = [
+        f"{labels[int(code >> 32)]}:{int(code & 0xFFFFFFFF)}" for code in item_codes
+    ]
+    return InteractionData(
+        user_ids=user_ids,
+        item_codes=item_codes,
+        item_keys=item_keys,
+        user_idx=user_idx.astype(np.int32),
+        item_idx=item_idx.astype(np.int32),
+        weight=weights,
+    )
+
+
+def _chunk_to_arrays(rows):
+    columns = list(zip(*rows))
+    users = np.array(columns[0], dtype=np.int64)
+    ct_ids = np.array(columns[1], dtype=np.int64)
+    obj_ids = np.array(columns[2], dtype=np.int64)
+    weights = engagement_weights(columns[3], columns[4], _metadata_fields(columns[5]))
+    return users, ct_ids, obj_ids, weights
+
+
+def _scored_chunk_to_arrays(rows):
+    columns = list(zip(*rows))
+    return (
+        np.array(columns[0], dtype=np.int64),
+        np.array(columns[1], dtype=np.int64),
+        np.array(columns[2], dtype=np.int64),
+        np.array(columns[3], dtype=np.float32),
+    )
+
+
+def row_weights(rows):
+    """``(pks, weights)`` for ``values_list("pk", *WEIGHT_COLUMNS)`` rows."""
+    columns = list(zip(*rows))
+    return columns[0], engagement_weights(columns[1], columns[2], _metadata_fields(columns[3]))
+
+
+def computed_weights(queryset):
+    """``{pk: weight}`` computed from the raw columns of ``queryset``'s rows."""
+    rows = list(queryset.order_by().values_list("pk", *WEIGHT_COLUMNS))
+    if not rows:
+        return {}
+    pks, weights = row_weights(rows)
+    return dict(zip(pks, weights.tolist()))
+
+
+def load_item_metadata(item_keys, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Creation timestamps and engagement counters for the trained items.
+
+    Returns ``{item_index: {...}}`` for blog posts and community posts, read
+    with one streamed query per content type.
+    """
+    from django.db.models import Count
+
+    wanted = {key: idx for idx, key in enumerate(item_keys)}
+    metadata = {}
+    try:
+        from blog.models import Post
+
+        for pk, created, views in (
+            Post.objects.order_by().values_list("id", "created", "views").iterator(chunk_size=chunk_size)
+        ):
+            idx = wanted.get(f"blog.post:{pk}")
+            if idx is not None:
+                metadata[idx] = {
+                    "tags": [],
+                    "views": views or 0,
+                    "created_at": created.timestamp() if created else 0,
+                }
+    except Exception:
+        pass
+    try:
+        from communities.models import CommunityPost
+
+        rows = (
+            CommunityPost.objects.order_by()
+            .annotate(n_likes=Count("likes"))
+            .values_list("id", "created_at", "n_likes")
+        )
+        for pk, created, likes in rows.iterator(chunk_size=chunk_size):
+            idx = wanted.get(f"communities.communitypost:{pk}")
+            if idx is not None:
+                metadata[idx] = {
+                    "tags": [],
+                    "likes": likes or 0,
+                    "created_at": created.timestamp() if created else 0,
+                }
+    except Exception:
+        pass
+    return metadata
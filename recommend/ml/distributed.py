@@ -0,0 +1,89 @@
+"""
+Single-machine data-parallel training with ``torch.distributed`` (gloo).
+
+``run_data_parallel()`` forks ``world_size`` worker processes after the
+parent has loaded the training arrays, so every worker shares them
+copy-on-write and only takes its own shard.  The workers rendezvous through
+a file in a temporary directory (no ports, no external services), wrap the
+model in ``DistributedDataParallel`` to all-reduce gradients over gloo, and
+rank 0 hands its result back to the parent through ``torch.save``.  The
+parent then writes the model, ANN index and artifact exactly as a
+single-process run would.
+
+Fork is required (Linux); workers never touch the database.
+"""
+
+import os
+import tempfile
+
+try:
+    import torch
+    import torch.distributed as dist
+    import torch.multiprocessing as mp
+except ImportError:  # pragma: no cover
+    torch = None
+    dist = None
+    mp = None
+
+BACKEND = "gloo"
+
+
+def available():
+    return torch is not None and dist.is_available() and dist.is_gloo_available()
+
+
+def _worker(rank, world_size, init_file, result_path, threads, fn, args, kwargs):
+    torch.set_num_threads(threads)
+    dist.init_process_group(
+        BACKEND, init_method=f"file://{init_file}", rank=rank, world_size=world_size
+    )
+    try:
+        result = fn(*args, rank=rank, world_size=world_size, **kwargs)
+        if rank == 0:
+            torch.save(result, result_path)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_data_parallel(fn, world_size, *args, threads=None, **kwargs):
+    """
+    Run ``fn(*args, rank=r, world_size=n, **kwargs)`` in ``world_size``
+    forked processes and return rank 0's result.
+
+    ``threads`` is the intra-op thread count per process (default: the
+    cores split evenly between the processes).
+    """
+    from django.db import connections
+
+    if not available():
+        raise RuntimeError("torch.distributed with the gloo backend is not available")
+    threads = threads or max(1, (os.cpu_count() or 1) // world_size)
+    # Forked children must not reuse the parent's database connections
+    connections.close_all()
+    with tempfile.TemporaryDirectory(prefix="recommend-ddp-") as tmp:
+        init_file = os.path.join(tmp, "rendezvous")
+        result_path = os.path.join(tmp, "rank0.pt")
+        mp.start_processes(
+            _worker,
+            args=(world_size, init_file, result_path, threads, fn, args, kwargs),
+            nprocs=world_size,
+            join=True,
+            start_method="fork",
+        )
+        return torch.load(result_path, map_location="cpu")
+
+
+def all_reduce_sum(values):
+    """Sum a list of floats across processes (identity without a process group)."""
+    tensor = torch.tensor(values, dtype=torch.float64)
+    if dist is not None and dist.is_initialized():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def any_rank(flag):
+    """True if ``flag`` is set on any process (so all ranks stop together)."""
+    tensor = torch.tensor([1.0 if flag else 0.0])
+    if dist is not None and dist.is_initialized():
+        dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return bool(tensor.item())
@@ -0,0 +1,322 @@
+"""
+Text embeddings of recommendable content (sentence-transformers).
+
+``update_embeddings()`` walks blog posts, community posts, games and
+marketplace projects in primary-key chunks, builds one text per item from
+its title, description and tags, and hashes it.  Only items that are new or
+whose text hash changed are encoded, in batches of ``batch_size`` through a
+``SentenceTransformer`` loaded from a local directory (no network access);
+everything else reuses the stored vector.  Items that no longer exist are
+dropped.
+
+A store version (an ``artifact.ArrayStore``) is four ``.npy`` files plus
+``manifest.json``:
+
+- ``keys`` ("app.model:pk", sorted, so the row of a key is its
+  ``searchsorted`` position) and ``item_ids`` (registry ids, -1 for items
+  with UUID keys)
+- ``vectors`` (float16, L2-normalized, one row per key)
+- ``hashes`` (uint64 text hash per key)
+
+Arrays are opened with ``mmap_mode="r"`` so serving processes share one
+page-cache copy; a new version is published by atomically replacing the
+manifest.
+"""
+
+import hashlib
+import os
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .artifact import ArrayStore, load_store, write_store
+
+EMBEDDING_DIR = getattr(
+    settings,
+    "RECOMMEND_EMBEDDING_DIR",
+    os.path.join(settings.BASE_DIR, "data", "recommend", "embeddings"),
+)
+# A local sentence-transformers model directory; never downloaded at runtime
+EMBEDDING_MODEL = getattr(
+    settings,
+    "RECOMMEND_EMBEDDING_MODEL",
+    os.path.join(settings.BASE_DIR, "data", "models", "all-MiniLM-L6-v2"),
+)
+ENCODE_BATCH_SIZE = getattr(settings, "RECOMMEND_EMBEDDING_BATCH_SIZE", 64)
+# Characters of each item's text passed to the encoder (it truncates to its
+# own token limit anyway)
+MAX_TEXT_CHARS = 2000
+# Pending texts encoded together; bounds the memory held per pass
+FLUSH_ROWS = 4096
+
+
+def _join(*parts):
+    text = " \n".join(str(part).strip() for part in parts if part and str(part).strip())
+    return text[:MAX_TEXT_CHARS]
+
+
+def _chunks(queryset, fields, chunk_size):
+    """Rows of ``fields`` (pk first) in primary-key order, one list per chunk."""
+    last = None
+    while True:
+        qs = queryset.order_by("pk")
+        if last is not None:
+            qs = qs.filter(pk__gt=last)
+        rows = list(qs.values_list("pk", *fields)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def _blog_posts(chunk_size):
+    from blog.models import Post
+
+    tags_through = Post.tags.through
+    for rows in _chunks(Post.objects.all(), ("title", "description", "category__name"), chunk_size):
+        tags = {}
+        for post_id, name in tags_through.objects.filter(
+            post_id__in=[row[0] for row in rows]
+        ).values_list("post_id", "tag__name"):
+            tags.setdefault(post_id, []).append(name)
+        for pk, title, description, category in rows:
+            yield pk, _join(title, description, category, ", ".join(sorted(tags.get(pk, []))))
+
+
+def _community_posts(chunk_size):
+    from communities.models import CommunityPost
+
+    fields = ("title", "content", "community__name", "community__category")
+    for rows in _chunks(CommunityPost.objects.all(), fields, chunk_size):
+        for pk, title, content, community, category in rows:
+            yield pk, _join(title, strip_tags(content or "")[:MAX_TEXT_CHARS], community, category)
+
+
+def _games(chunk_size):
+    from games.models import Game
+
+    for rows in _chunks(Game.objects.all(), ("title", "description"), chunk_size):
+        for pk, title, description in rows:
+            yield pk, _join(title, description)
+
+
+def _projects(chunk_size):
+    from marketplace.models import Project
+
+    fields = ("title", "short_description", "description", "category", "tags")
+    for rows in _chunks(Project.objects.all(), fields, chunk_size):
+        for pk, title, short, description, category, tags in rows:
+            tags = ", ".join(str(tag) for tag in tags) if isinstance(tags, list) else tags
+            yield pk, _join(title, short, description, category, tags)
+
+
+# (content label, row generator yielding (pk, text))
+SOURCES = (
+    ("blog.post", _blog_posts),
+    ("communities.communitypost", _community_posts),
+    ("games.game", _games),
+    ("marketplace.project", _projects),
+)
+
+
+def text_hash(text):
+    """Stable 64-bit hash of an item's text."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def load_encoder(model_path=EMBEDDING_MODEL):
+    """A CPU ``SentenceTransformer`` from a local model directory (offline)."""
+    if not os.path.isdir(model_path):
+        raise FileNotFoundError(
+            f"No sentence-transformers model at {model_path}; copy one there or set "
+            "RECOMMEND_EMBEDDING_MODEL"
+        )
+    # Never reach out to the model hub from a worker
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_path, device="cpu")
+
+
+def _encode(encoder, texts, batch_size):
+    vectors = encoder.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+    return np.asarray(vectors, dtype=np.float32)
+
+
+class ContentEmbeddings(ArrayStore):
+    """Read access to a published embedding store (memory-mapped)."""
+
+    def __init__(self, path=EMBEDDING_DIR):
+        super().__init__(path)
+        self.model = self.manifest["model"]
+        self.dim = self.manifest["dim"]
+        self.item_ids = self._load("item_ids")
+        self.vectors = self._load("vectors")
+        self.hashes = self._load("hashes")
+
+    def vectors_for(self, keys):
+        """``(float32 [len(keys), dim] vectors, found mask)``; missing rows are zero."""
+        rows = self.rows(keys)
+        found = rows >= 0
+        out = np.zeros((len(rows), self.dim), dtype=np.float32)
+        if found.any():
+            out[found] = self.vectors[rows[found]]
+        return out, found
+
+    def nearest(self, vector, k=10, chunk=65536):
+        """Top-``k`` ``(key, cosine)`` pairs for a query vector (exact scan)."""
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-8)
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), chunk):
+            scores[start : start + chunk] = self.vectors[start : start + chunk].astype(np.float32) @ vector
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(str(self.keys[i]), float(scores[i])) for i in top]
+
+
+def load_embeddings(path=EMBEDDING_DIR):
+    """Process-wide cached ``ContentEmbeddings``; reloads when a new version is published."""
+    return load_store(ContentEmbeddings, path)
+
+
+def update_embeddings(
+    path=EMBEDDING_DIR,
+    model_path=EMBEDDING_MODEL,
+    batch_size=ENCODE_BATCH_SIZE,
+    chunk_size=1000,
+    full=False,
+    encoder=None,
+    log=None,
+):
+    """
+    Encode new and changed items and publish a new store version.
+
+    ``encoder`` is anything with sentence-transformers' ``encode()``
+    signature (default: ``load_encoder(model_path)``, loaded only when
+    something needs encoding).  ``full`` re-encodes every item.  Returns
+    ``{"items", "encoded", "reused", "removed"}``.
+    """
+    from django.contrib.contenttypes.models import ContentType
+
+    from recommend.registry import item_ids
+
+    log = log or (lambda message: None)
+    os.makedirs(path, exist_ok=True)
+    model_name = getattr(encoder, "model_name", None) or os.path.basename(os.path.normpath(model_path))
+
+    previous = None if full else load_embeddings(path)
+    if previous is not None and previous.model != model_name:
+        log(f"Model changed ({previous.model} -> {model_name}); re-encoding everything")
+        previous = None
+
+    keys, hashes, ids, parts, reused_rows = [], [], [], [], []
+    pending_pos, pending_texts = [], []
+    state = {"encoder": encoder, "dim": previous.dim if previous is not None else None}
+
+    def flush():
+        if not pending_texts:
+            return
+        if state["encoder"] is None:
+            state["encoder"] = load_encoder(model_path)
+        vectors = _encode(state["encoder"], pending_texts, batch_size)
+        state["dim"] = vectors.shape[1]
+        parts.append((np.asarray(pending_pos, dtype=np.int64), vectors))
+        pending_pos.clear()
+        pending_texts.clear()
+
+    def add_chunk(label, ct_id, batch):
+        """Hash one chunk of (pk, text) rows and queue the changed ones."""
+        start = len(keys)
+        chunk_keys = [f"{label}:{pk}" for pk, _ in batch]
+        chunk_hashes = [text_hash(text) for _, text in batch]
+        keys.extend(chunk_keys)
+        hashes.extend(chunk_hashes)
+        pks = [pk for pk, _ in batch]
+        if isinstance(pks[0], int):
+            ids.extend(item_ids([ct_id] * len(pks), pks).tolist())
+        else:
+            ids.extend([-1] * len(pks))
+        if previous is not None:
+            old_rows = previous.rows(chunk_keys)
+            unchanged = old_rows >= 0
+            unchanged[unchanged] = (
+                np.asarray(previous.hashes[old_rows[unchanged]], dtype=np.uint64)
+                == np.asarray(chunk_hashes, dtype=np.uint64)[unchanged]
+            )
+        else:
+            old_rows = np.full(len(batch), -1, dtype=np.int64)
+            unchanged = np.zeros(len(batch), dtype=bool)
+        for offset, (_, text) in enumerate(batch):
+            if unchanged[offset]:
+                reused_rows.append((start + offset, int(old_rows[offset])))
+            else:
+                pending_pos.append(start + offset)
+                pending_texts.append(text or chunk_keys[offset])
+        if len(pending_texts) >= FLUSH_ROWS:
+            flush()
+
+    for label, rows in SOURCES:
+        app_label, model = label.split(".", 1)
+        try:
+            ct_id = ContentType.objects.get_by_natural_key(app_label, model).id
+        except ContentType.DoesNotExist:
+            continue
+        before, batch = len(keys), []
+        for row in rows(chunk_size):
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                add_chunk(label, ct_id, batch)
+                batch = []
+        if batch:
+            add_chunk(label, ct_id, batch)
+        log(f"{label}: {len(keys) - before} items")
+    flush()
+
+    n, dim = len(keys), state["dim"] or 0
+    vectors = np.zeros((n, dim), dtype=np.float32)
+    if reused_rows:
+        positions, rows = (np.asarray(column, dtype=np.int64) for column in zip(*reused_rows))
+        vectors[positions] = previous.vectors[rows]
+    for positions, block in parts:
+        vectors[positions] = block
+
+    removed = 0
+    if previous is not None:
+        removed = len(previous) - (int((previous.rows(keys) >= 0).sum()) if keys else 0)
+    stats = {
+        "items": n,
+        "encoded": n - len(reused_rows),
+        "reused": len(reused_rows),
+        "removed": removed,
+    }
+    write_store(
+        path,
+        {
+            "keys": np.asarray(keys, dtype=str),
+            "item_ids": np.asarray(ids, dtype=np.int64),
+            "vectors": vectors.astype(np.float16),
+            "hashes": np.asarray(hashes, dtype=np.uint64),
+        },
+        model=model_name,
+        dim=int(dim),
+        updated_at=timezone.now().isoformat(),
+        last_run=stats,
+    )
+    return stats
@@ -0,0 +1,273 @@
+"""
+Incremental ("fold-in") updates of the hybrid recommender between retrains.
+
+Users: the item side of the model is frozen, so a user vector can be solved
+in closed form.  The user's recent interactions are targets of 1 (weighted by
+engagement), a few sampled catalogue items are targets of 0, and the ridge
+system ``(E_p' W E_p + E_n' E_n + reg I) u = E_p' w + reg u0`` is solved
+against the hybrid item matrix ``E``.  ``u0`` is the trained vector for known
+users and zero for new ones.  Solved vectors are published in the Django
+cache (shared by all serving processes) and marked stale by the
+``Interaction`` post_save signal.
+
+Items: items created after the last retrain get content-derived initial
+vectors (the mean of trained items in the same category/community, falling
+back to the mean of their content type).  The delta is published in the
+cache and appended to each process's serving model; rows beyond the ANN
+index are scored exactly.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+FOLDIN_TTL = getattr(settings, "RECOMMEND_FOLDIN_TTL", 6 * 3600)
+# "Nothing to fold in" is cached briefly: new items may become known soon
+FOLDIN_EMPTY_TTL = getattr(settings, "RECOMMEND_FOLDIN_EMPTY_TTL", 300)
+FOLDIN_MAX_INTERACTIONS = getattr(settings, "RECOMMEND_FOLDIN_MAX_INTERACTIONS", 200)
+FOLDIN_NEGATIVES = 64
+FOLDIN_REG = 0.1
+ITEM_DELTA_KEY = "recommend:foldin:items"
+NEW_ITEM_DAYS = 30
+
+# Cache marker written by the Interaction signal: "recompute on next request"
+STALE = "stale"
+
+# (content label, model path, group field) for items that can be folded in
+_NEW_ITEM_SOURCES = (
+    ("blog.post", "blog.Post", "category_id", "created"),
+    ("communities.communitypost", "communities.CommunityPost", "community_id", "created_at"),
+)
+
+
+def user_vector_key(user_id):
+    return f"recommend:foldin:user:{user_id}"
+
+
+def mark_user_stale(user_id):
+    """Invalidate a user's published vector after a new interaction."""
+    cache.set(user_vector_key(user_id), STALE, FOLDIN_TTL)
+
+
+def solve_user_vector(
+    item_matrix,
+    item_idx,
+    weights,
+    prior=None,
+    reg=FOLDIN_REG,
+    n_negatives=FOLDIN_NEGATIVES,
+    rng=None,
+):
+    """Ridge least-squares user vector against frozen item vectors."""
+    item_idx = np.asarray(item_idx, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    dim = item_matrix.shape[1]
+    positives = item_matrix[item_idx].astype(np.float64)
+
+    a = (positives * weights[:, None]).T @ positives + reg * np.eye(dim)
+    b = positives.T @ weights
+    if prior is not None:
+        b = b + reg * np.asarray(prior, dtype=np.float64)
+
+    rng = rng or np.random.default_rng()
+    n_negatives = min(n_negatives, len(item_matrix) - len(item_idx))
+    if n_negatives > 0:
+        negatives = rng.choice(len(item_matrix), size=n_negatives, replace=False)
+        negatives = negatives[~np.isin(negatives, item_idx)]
+        neg = item_matrix[negatives].astype(np.float64)
+        a += neg.T @ neg
+    return np.linalg.solve(a, b).astype(np.float32)
+
+
+def recent_user_items(model, user_id, limit=FOLDIN_MAX_INTERACTIONS):
+    """
+    Model item indices and summed engagement weights of a user's recent
+    interactions (one query, at most ``limit`` rows; rows without a stored
+    ``engagement_score`` cost one more).
+    """
+    from recommend.models import Interaction
+    from recommend.registry import item_ids
+
+    from .dataset import computed_weights
+
+    rows = list(
+        Interaction.objects.filter(user_id=user_id)
+        .order_by("-created_at")
+        .values_list("pk", "content_type_id", "object_id", "engagement_score")[:limit]
+    )
+    if not rows:
+        return None, None
+    columns = list(zip(*rows))
+    weights = np.array(
+        [np.nan if score is None else score for score in columns[3]], dtype=np.float64
+    )
+    missing = np.isnan(weights)
+    if missing.any():
+        pks = [pk for pk, absent in zip(columns[0], missing) if absent]
+        fallback = computed_weights(Interaction.objects.filter(pk__in=pks))
+        weights[missing] = [fallback[pk] for pk in pks]
+    # Lookup only: items the registry lacks cannot be rows of the model either
+    idxs = model.rows_for_item_ids(item_ids(columns[1], columns[2], create=False))
+    known = idxs >= 0
+    if not known.any():
+        return None, None
+    items, inverse = np.unique(idxs[known], return_inverse=True)
+    return items, np.bincount(inverse, weights=weights[known])
+
+
+def _publish_user_vector(model, user_id, vector):
+    """Share ``vector`` (None: nothing to fold in) for ``model``'s version."""
+    cache.set(
+        user_vector_key(user_id),
+        {"version": model.version, "vector": vector},
+        FOLDIN_TTL if vector is not None else FOLDIN_EMPTY_TTL,
+    )
+
+
+def fold_in_user(model, user_id, publish=True):
+    """
+    Solve (and publish) a fresh vector for ``user_id``; None without data.
+
+    The empty result is published too, so users without interactions on
+    known items do not query them again on every request.
+    """
+    items, weights = recent_user_items(model, user_id)
+    if items is None:
+        if publish:
+            _publish_user_vector(model, user_id, None)
+        return None
+    uidx = model.user_map.get(user_id)
+    prior = model.user_vector(user_id) if uidx is not None else None
+    vector = solve_user_vector(
+        model.item_matrix, items, weights, prior=prior, rng=np.random.default_rng(user_id)
+    )
+    if publish:
+        _publish_user_vector(model, user_id, vector)
+    return vector
+
+
+def folded_user_vector(model, user_id, publish=True):
+    """
+    Serving-time user vector with fold-in applied.
+
+    Known users keep their trained row until they interact again; unknown
+    users and users marked stale are folded in on demand and the result is
+    published for every other process, as is finding nothing to fold in
+    (for ``FOLDIN_EMPTY_TTL``).  ``publish=False`` solves without touching
+    the shared key (for models that are not being served).
+    """
+    uidx = model.user_map.get(user_id)
+    cached = cache.get(user_vector_key(user_id))
+    if isinstance(cached, dict) and cached.get("version") == model.version:
+        if cached["vector"] is not None:
+            return np.asarray(cached["vector"], dtype=np.float32)
+        # Recently found nothing to fold in
+        return model.user_vector(user_id)
+    if uidx is not None and cached != STALE:
+        return model.user_vector(user_id)
+    try:
+        vector = fold_in_user(model, user_id, publish=publish)
+    except Exception:
+        vector = None
+        if publish:
+            # Clears STALE: retried after FOLDIN_EMPTY_TTL or the next interaction
+            _publish_user_vector(model, user_id, None)
+    if vector is None and uidx is not None:
+        return model.user_vector(user_id)
+    return vector
+
+
+def _group_vectors(model, label, ids_to_groups):
+    """Mean trained item/content rows per group, plus the type-wide mean."""
+    mask = model.type_masks.get(label)
+    if mask is None or not mask.any():
+        return None, {}
+    rows = np.flatnonzero(mask)
+    type_mean = (model.item_emb[rows].mean(axis=0), model.content_emb[rows].mean(axis=0))
+    groups = {}
+    for row in rows:
+        group = ids_to_groups.get(int(model.item_object_ids[row]))
+        if group is not None:
+            groups.setdefault(group, []).append(row)
+    means = {
+        group: (model.item_emb[members].mean(axis=0), model.content_emb[members].mean(axis=0))
+        for group, members in groups.items()
+    }
+    return type_mean, means
+
+
+def new_item_delta(model, days=NEW_ITEM_DAYS, chunk_size=5000):
+    """
+    Content-derived vectors for recent items the model has not seen.
+
+    Returns ``{"version", "keys", "item_ids", "item_emb", "content_emb",
+    "created_at"}`` relative to ``model`` (which must be an unextended base
+    model).
+    """
+    from django.apps import apps
+
+    from recommend.registry import content_type_ids_for_labels, item_ids
+
+    cutoff = timezone.now() - timezone.timedelta(days=days)
+    keys, ids, item_rows, content_rows, created = [], [], [], [], []
+    for label, model_name, group_field, created_field in _NEW_ITEM_SOURCES:
+        try:
+            content_model = apps.get_model(model_name)
+        except LookupError:
+            continue
+        groups = {}
+        fresh = []
+        for pk, group, made in (
+            content_model.objects.order_by()
+            .values_list("id", group_field, created_field)
+            .iterator(chunk_size=chunk_size)
+        ):
+            groups[pk] = group
+            if made and made >= cutoff and f"{label}:{pk}" not in model.item_map:
+                fresh.append((pk, group, made))
+        if not fresh:
+            continue
+        type_mean, means = _group_vectors(model, label, groups)
+        if type_mean is None:
+            continue
+        (ct_id,) = content_type_ids_for_labels([label])
+        if ct_id is not None:
+            ids.extend(item_ids([ct_id] * len(fresh), [pk for pk, _, _ in fresh]).tolist())
+        else:
+            ids.extend([-1] * len(fresh))
+        for pk, group, made in fresh:
+            item_vec, content_vec = means.get(group, type_mean)
+            keys.append(f"{label}:{pk}")
+            item_rows.append(item_vec)
+            content_rows.append(content_vec)
+            created.append(made.timestamp())
+    return {
+        "version": model.version,
+        "keys": keys,
+        "item_ids": np.asarray(ids, dtype=np.int64),
+        "item_emb": np.asarray(item_rows, dtype=np.float32).reshape(-1, model.item_emb.shape[1]),
+        "content_emb": np.asarray(content_rows, dtype=np.float32).reshape(
+            -1, model.content_emb.shape[1]
+        ),
+        "created_at": np.asarray(created, dtype=np.float64),
+    }
+
+
+def publish_new_items(model_path=None, days=NEW_ITEM_DAYS):
+    """Compute the new-item delta for the current model and publish it."""
+    from .serving import apply_item_delta, get_serving_model
+
+    model = get_serving_model(model_path) if model_path else get_serving_model()
+    if model is None:
+        return 0
+    base = model.base
+    delta = new_item_delta(base, days=days)
+    delta["revision"] = timezone.now().timestamp()
+    cache.set(ITEM_DELTA_KEY, delta, None)
+    apply_item_delta(base, delta)
+    return len(delta["keys"])
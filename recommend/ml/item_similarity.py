@@ -0,0 +1,168 @@
+"""
+Sparse item-item collaborative filtering.
+
+Interactions become a CSR user x item matrix ``X`` of engagement weights.
+Item-item similarities (cosine over ``X`` or Jaccard over its binary
+pattern) are computed with blocked sparse products ``X[:, block]' X`` and
+only the top-K neighbours per item are kept, as a sparse ``N``.  A user's
+scores are the sparse product ``X[u] N``; already-seen items are dropped and
+users without any neighbour signal fall back to global popularity, which is
+computed once.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+try:
+    from scipy import sparse
+except ImportError:  # pragma: no cover
+    sparse = None
+
+DEFAULT_NEIGHBOURS = 50
+DEFAULT_BLOCK_SIZE = 2048
+POPULARITY_WEIGHT = 0.01
+METRICS = ("cosine", "jaccard")
+
+
+def interaction_matrix(data):
+    """CSR ``[n_users, n_items]`` matrix of summed engagement weights."""
+    matrix = sparse.csr_matrix(
+        (data.weight.astype(np.float32), (data.user_idx, data.item_idx)),
+        shape=(data.n_users, data.n_items),
+    )
+    matrix.sum_duplicates()
+    return matrix
+
+
+def top_k_per_row(matrix, k):
+    """Keep the ``k`` largest entries of every row of a CSR matrix."""
+    matrix = matrix.tocsr()
+    counts = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), counts)
+    # Rows stay grouped (primary key), values descend within each row
+    order = np.lexsort((-matrix.data, rows))
+    rank = np.arange(len(order)) - np.repeat(matrix.indptr[:-1], counts)
+    keep = order[rank < k]
+    return sparse.csr_matrix(
+        (matrix.data[keep], (rows[keep], matrix.indices[keep])), shape=matrix.shape
+    )
+
+
+def item_neighbours(
+    matrix, k=DEFAULT_NEIGHBOURS, metric="cosine", block_size=DEFAULT_BLOCK_SIZE
+):
+    """
+    Sparse ``[n_items, n_items]`` top-``k`` item similarity matrix.
+
+    Similarities are computed for ``block_size`` items at a time, so peak
+    memory is bounded by one block of co-occurrence counts.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown similarity metric: {metric}")
+    n_items = matrix.shape[1]
+    if metric == "cosine":
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+        cols = (matrix @ sparse.diags(1.0 / np.maximum(norms, 1e-12))).tocsc()
+    else:
+        cols = (matrix > 0).astype(np.float32).tocsc()
+        degree = np.asarray(cols.sum(axis=0)).ravel()
+    full = cols.tocsr()
+
+    blocks = []
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        sims = (cols[:, start:stop].T @ full).tocoo()
+        data = sims.data
+        if metric == "jaccard":
+            data = data / (degree[sims.row + start] + degree[sims.col] - data)
+        # Drop self-similarity
+        other = sims.row + start != sims.col
+        sims = sparse.csr_matrix(
+            (data[other], (sims.row[other], sims.col[other])), shape=sims.shape
+        )
+        blocks.append(top_k_per_row(sims, k))
+    if not blocks:
+        return sparse.csr_matrix((n_items, n_items), dtype=np.float32)
+    return sparse.vstack(blocks).tocsr().astype(np.float32)
+
+
+def popularity_order(matrix):
+    """Item indices by number of distinct users, and those counts."""
+    counts = np.diff((matrix > 0).tocsc().indptr)
+    return np.argsort(-counts, kind="stable"), counts
+
+
+def score_users(matrix, neighbours, popular, counts, topn, start, stop):
+    """
+    Top-``topn`` unseen items for users ``start:stop``.
+
+    Returns ``[(user_idx, item_idx_array, score_array), ...]``.
+    """
+    block = matrix[start:stop]
+    scores = (block @ neighbours).tocsr()
+    # Zero out already-seen items
+    scores = scores - scores.multiply(block > 0)
+    scores.eliminate_zeros()
+    top = top_k_per_row(scores, topn)
+
+    out = []
+    for offset in range(stop - start):
+        row = slice(top.indptr[offset], top.indptr[offset + 1])
+        items = top.indices[row]
+        if len(items):
+            values = top.data[row]
+            order = np.argsort(-values, kind="stable")
+            out.append((start + offset, items[order], values[order]))
+            continue
+        seen = block.indices[block.indptr[offset] : block.indptr[offset + 1]]
+        fallback = popular[: topn + len(seen)]
+        fallback = fallback[~np.isin(fallback, seen)][:topn]
+        out.append((start + offset, fallback, counts[fallback] * POPULARITY_WEIGHT))
+    return out
+
+
+# Populated in the parent before forking scoring workers (shared copy-on-write)
+_shared = {}
+
+
+def _score_shard(start, stop, topn, block_size):
+    args = (_shared["matrix"], _shared["neighbours"], _shared["popular"], _shared["counts"])
+    rows = []
+    for block_start in range(start, stop, block_size):
+        rows.extend(score_users(*args, topn, block_start, min(block_start + block_size, stop)))
+    return rows
+
+
+def recommend_all(matrix, neighbours, topn, block_size=DEFAULT_BLOCK_SIZE, workers=1):
+    """
+    Yield ``(user_idx, item_idxs, scores)`` for every user.
+
+    With ``workers`` > 1 user ranges are scored in forked processes.
+    """
+    popular, counts = popularity_order(matrix)
+    n_users = matrix.shape[0]
+    if workers <= 1 or n_users <= block_size:
+        for start in range(0, n_users, block_size):
+            yield from score_users(
+                matrix, neighbours, popular, counts, topn, start, min(start + block_size, n_users)
+            )
+        return
+
+    _shared.update(matrix=matrix, neighbours=neighbours, popular=popular, counts=counts)
+    try:
+        shard = (n_users + workers - 1) // workers
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [
+                pool.submit(_score_shard, start, min(start + shard, n_users), topn, block_size)
+                for start in range(0, n_users, shard)
+            ]
+            for future in futures:
+                yield from future.result()
+    finally:
+        _shared.clear()
@@ -0,0 +1,289 @@
+"""
+Versioned registry of trained hybrid models.
+
+Every training run into the registry writes a complete version directory::
+
+    <root>/<version>/model.pt           torch payload
+    <root>/<version>/model.ivf.npz      ANN index (if built)
+    <root>/<version>/model.artifact     memory-mapped artifact (see ``artifact``)
+    <root>/<version>/metadata.json      metrics, sha256 of model.pt, timestamps
+
+The version is staged as ``<root>/.<version>.tmp`` and renamed into place
+once fully written.  ``current`` is a relative symlink to the served
+version and ``shadow`` (optional) to a candidate scored beside it (see
+``shadow``); both are replaced atomically, so ``<root>/current/model.pt``
+(``torch_recommender_hybrid.MODEL_PATH``) always names a complete model.
+Every promotion is appended to ``history.json``, which ``rollback()`` walks
+back.  ``prune()`` keeps the newest versions plus whatever a pointer or
+the rollback target still needs.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from itertools import islice
+
+from django.conf import settings
+from django.utils import timezone
+
+from .torch_recommender_hybrid import REGISTRY_DIR
+
+CURRENT = "current"
+SHADOW = "shadow"
+MODEL_FILE = "model.pt"
+METADATA_NAME = "metadata.json"
+HISTORY_NAME = "history.json"
+KEEP_VERSIONS = getattr(settings, "RECOMMEND_MODEL_KEEP_VERSIONS", 5)
+# Users scored to measure a new version's single-user latency
+LATENCY_SAMPLE_USERS = 50
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(data, fh, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _replace_symlink(link, target):
+    tmp = f"{link}.{uuid.uuid4().hex}.lnk"
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
+
+
+def _directory_bytes(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(directory, name))
+    return total
+
+
+def measure_latency(model_path, users=LATENCY_SAMPLE_USERS):
+    """p50/p95/max single-user scoring latency (ms) of a saved model, or None."""
+    from .artifact import Artifact, artifact_path
+    from .serving import HybridServingModel
+    from .torch_recommender_hybrid import load_model_hybrid, recommend_for_user_hybrid
+
+    try:
+        import numpy as np
+
+        # Built directly so the probe does not stay in the serving cache
+        if os.path.isdir(artifact_path(model_path)):
+            model = HybridServingModel.from_artifact(Artifact(artifact_path(model_path)), model_path)
+        else:
+            model = HybridServingModel(load_model_hybrid(model_path), model_path)
+        timings = []
+        for user_id in islice(iter(model.user_map), users):
+            started = time.perf_counter()
+            recommend_for_user_hybrid(
+                int(user_id), model=model, topn=20, as_item_ids=True, publish_foldin=False
+            )
+            timings.append((time.perf_counter() - started) * 1000.0)
+    except Exception as e:
+        print(f"[WARN] Latency not measured: {e}")
+        return None
+    if not timings:
+        return None
+    return {
+        "users": len(timings),
+        "p50": round(float(np.percentile(timings, 50)), 3),
+        "p95": round(float(np.percentile(timings, 95)), 3),
+        "max": round(max(timings), 3),
+    }
+
+
+class ModelRegistry:
+    """The version directories and pointers under one registry root."""
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def path(self, version):
+        return os.path.join(self.root, version)
+
+    def model_path(self, version=CURRENT):
+        """``model.pt`` of a version (or of the ``current``/``shadow`` pointer)."""
+        return os.path.join(self.root, version, MODEL_FILE)
+
+    def _pointer(self, name):
+        try:
+            return os.readlink(os.path.join(self.root, name))
+        except OSError:
+            return None
+
+    @property
+    def current(self):
+        return self._pointer(CURRENT)
+
+    @property
+    def shadow(self):
+        return self._pointer(SHADOW)
+
+    def metadata(self, version):
+        with open(os.path.join(self.path(version), METADATA_NAME)) as fh:
+            return json.load(fh)
+
+    def versions(self):
+        """Metadata of every committed version, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(".") or os.path.islink(path) or not os.path.isdir(path):
+                continue
+            try:
+                found.append(self.metadata(name))
+            except (OSError, ValueError):
+                continue
+        return sorted(found, key=lambda meta: meta["created_at"])
+
+    def history(self):
+        try:
+            with open(os.path.join(self.root, HISTORY_NAME)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return []
+
+    def stage(self, version):
+        """Empty staging directory for ``version``; returns its ``model.pt`` path."""
+        staging = os.path.join(self.root, f".{version}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        return os.path.join(staging, MODEL_FILE)
+
+    def commit(self, version, metrics=None, promote=True, keep=KEEP_VERSIONS):
+        """
+        Write the metadata of a staged version and move it into place.
+
+        The version's serving latency is measured and added to ``metrics``.
+        ``promote`` makes it current; older versions are then pruned down to
+        ``keep``.  Returns the metadata.
+        """
+        staging = os.path.join(self.root, f".{version}.tmp")
+        staged_model = os.path.join(staging, MODEL_FILE)
+        metrics = dict(metrics or {})
+        metrics["latency_ms"] = measure_latency(staged_model)
+        metrics["size_bytes"] = _directory_bytes(staging)
+        metadata = {
+            "version": version,
+            "created_at": timezone.now().isoformat(),
+            "sha256": _sha256(staged_model),
+            "metrics": metrics,
+        }
+        _write_json(os.path.join(staging, METADATA_NAME), metadata)
+        shutil.rmtree(self.path(version), ignore_errors=True)
+        os.replace(staging, self.path(version))
+        if promote:
+            self.promote(version, verify=False)
+            self.prune(keep)
+        return metadata
+
+    def verify(self, version):
+        """Check ``model.pt`` and the artifact files against their checksums."""
+        from .artifact import Artifact, artifact_path
+
+        metadata = self.metadata(version)
+        if _sha256(self.model_path(version)) != metadata["sha256"]:
+            raise ValueError(f"Checksum mismatch for model version {version}")
+        artifact = artifact_path(self.model_path(version))
+        if os.path.isdir(artifact):
+            Artifact(artifact, verify=True)
+        return True
+
+    def promote(self, version, verify=True):
+        """Atomically point ``current`` at ``version``."""
+        if not os.path.isfile(os.path.join(self.path(version), METADATA_NAME)):
+            raise ValueError(f"Unknown model version: {version}")
+        if verify:
+            self.verify(version)
+        _replace_symlink(os.path.join(self.root, CURRENT), version)
+        history = self.history()
+        history.append({"version": version, "promoted_at": timezone.now().isoformat()})
+        _write_json(os.path.join(self.root, HISTORY_NAME), history)
+        return version
+
+    def rollback(self, version=None):
+        """
+        Point ``current`` back at ``version``, by default the version that
+        was current before it.  Returns the version now current.
+        """
+        if version is None:
+            current = self.current
+            for entry in reversed(self.history()):
+                if entry["version"] != current and os.path.isdir(self.path(entry["version"])):
+                    version = entry["version"]
+                    break
+            if version is None:
+                raise ValueError("No earlier model version to roll back to")
+        return self.promote(version)
+
+    def set_shadow(self, version):
+        """Score ``version`` beside the current model (see ``shadow``)."""
+        if not os.path.isfile(os.path.join(self.path(version), METADATA_NAME)):
+            raise ValueError(f"Unknown model version: {version}")
+        _replace_symlink(os.path.join(self.root, SHADOW), version)
+
+    def clear_shadow(self):
+        try:
+            os.remove(os.path.join(self.root, SHADOW))
+        except FileNotFoundError:
+            pass
+
+    def _rollback_target(self):
+        current = self.current
+        for entry in reversed(self.history()):
+            if entry["version"] != current:
+                return entry["version"]
+        return None
+
+    def prune(self, keep=KEEP_VERSIONS):
+        """
+        Delete all but the ``keep`` newest versions, never the current or
+        shadow version nor the rollback target.  Returns the removed versions.
+        """
+        versions = [meta["version"] for meta in self.versions()]
+        protected = set(versions[-keep:] if keep > 0 else [])
+        protected.update(v for v in (self.current, self.shadow, self._rollback_target()) if v)
+        removed = [version for version in versions if version not in protected]
+        for version in removed:
+            # Processes that mapped these files keep reading them until they reload
+            shutil.rmtree(self.path(version), ignore_errors=True)
+        return removed
+
+    def import_model(self, model_path, promote=True):
+        """Register an existing ``.pt`` file (e.g. a pre-registry model) as a version."""
+        from .ann import ann_index_path
+        from .artifact import convert_model_file
+        from .torch_recommender_hybrid import load_model_hybrid
+
+        payload = load_model_hybrid(model_path)
+        if not payload:
+            raise ValueError(f"No model payload in {model_path}")
+        version = payload.get("version") or uuid.uuid4().hex
+        staged = self.stage(version)
+        shutil.copy2(model_path, staged)
+        if os.path.exists(ann_index_path(model_path)):
+            shutil.copy2(ann_index_path(model_path), ann_index_path(staged))
+        convert_model_file(staged)
+        return self.commit(version, {"imported_from": model_path}, promote=promote)
+
+
+def registry_for(model_path):
+    """The ``ModelRegistry`` whose ``current`` pointer ``model_path`` is, else None."""
+    pointer = os.path.dirname(model_path)
+    if os.path.basename(model_path) != MODEL_FILE or os.path.basename(pointer) != CURRENT:
+        return None
+    return ModelRegistry(os.path.dirname(pointer))
@@ -0,0 +1,282 @@
+"""
+Precomputed "more like this" neighbour tables.
+
+``build_related()`` finds, for every item, neighbours of the same content
+type from two signals:
+
+- co-interaction: item-item cosine over the engagement matrix
+  (``item_similarity.item_neighbours``) restricted to the type's columns
+- content: cosine between the items' text embeddings (``embeddings``),
+  computed block by block within the type
+
+The top candidates of both signals are merged into one fixed-width row per
+item that holds the neighbour rows and both component scores, ordered by
+the default blend.  A lookup is one keyed read of that row; blending
+weights passed by the caller only re-rank the stored candidates.  Session
+suggestions for anonymous visitors sum the rows of the items viewed in the
+session.
+
+The table is an ``artifact.ArrayStore`` with, aligned with the sorted
+``keys``: ``item_ids`` (registry ids, -1 for UUID keys), ``neighbours``
+(int32 ``[n, width]`` store rows, -1 padded) and ``co_scores`` /
+``content_scores`` (float16 ``[n, width]``).
+"""
+
+import os
+from functools import cached_property
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .artifact import ArrayStore, load_store, write_store
+
+RELATED_DIR = getattr(
+    settings,
+    "RECOMMEND_RELATED_DIR",
+    os.path.join(settings.BASE_DIR, "data", "recommend", "related"),
+)
+# Default (co-interaction, content) blending weights
+RELATED_WEIGHTS = tuple(getattr(settings, "RECOMMEND_RELATED_WEIGHTS", (0.6, 0.4)))
+DEFAULT_NEIGHBOURS = 20
+SESSION_KEY = "recommend_recent_items"
+SESSION_ITEMS = 20
+# Longest "app.model:pk" key accepted from a request
+MAX_KEY_LENGTH = 128
+# Weight of the n-th most recent session item is SESSION_DECAY ** n
+SESSION_DECAY = 0.8
+
+
+def _labels(keys):
+    return np.char.partition(np.asarray(keys, dtype=str), ":")[:, 0]
+
+
+def _co_candidates(data, k, block_size):
+    """``(rows, cols, scores)`` of the co-interaction top-``k`` per item."""
+    from .item_similarity import interaction_matrix, item_neighbours
+
+    matrix = interaction_matrix(data).tocsc()
+    content_types = np.asarray(data.item_codes, dtype=np.int64) >> 32
+    rows, cols, scores = [], [], []
+    for content_type in np.unique(content_types):
+        items = np.flatnonzero(content_types == content_type)
+        if len(items) < 2:
+            continue
+        sims = item_neighbours(matrix[:, items].tocsr(), k=k, metric="cosine", block_size=block_size)
+        sims = sims.tocoo()
+        rows.append(items[sims.row])
+        cols.append(items[sims.col])
+        scores.append(sims.data)
+    if not rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(scores)
+
+
+def _content_candidates(store, k, block_size):
+    """``(rows, cols, scores)`` of the positive content top-``k`` per item."""
+    labels = _labels(store.keys)
+    rows, cols, scores = [], [], []
+    for label in np.unique(labels):
+        items = np.flatnonzero(labels == label)
+        if len(items) < 2:
+            continue
+        vectors = np.asarray(store.vectors[items], dtype=np.float32)
+        top = min(k, len(items) - 1)
+        for start in range(0, len(items), block_size):
+            sims = vectors[start : start + block_size] @ vectors.T
+            local = np.arange(len(sims))
+            sims[local, local + start] = -np.inf
+            best = np.argpartition(-sims, top - 1, axis=1)[:, :top]
+            values = np.take_along_axis(sims, best, axis=1)
+            keep = values > 0
+            rows.append(items[np.repeat(local + start, top).reshape(-1, top)[keep]])
+            cols.append(items[best[keep]])
+            scores.append(values[keep])
+    if not rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(scores)
+
+
+def build_related(
+    path=RELATED_DIR,
+    k=DEFAULT_NEIGHBOURS,
+    weights=RELATED_WEIGHTS,
+    days=None,
+    block_size=1024,
+    data=None,
+    embeddings=None,
+    log=None,
+):
+    """
+    Compute and publish the neighbour table.
+
+    Each row keeps up to ``2 * k`` candidates (the union of both signals'
+    top ``k``) so callers can re-weight without losing neighbours.
+    ``data`` (``InteractionData``) and ``embeddings`` (``ContentEmbeddings``)
+    default to the training data and the published embedding store; either
+    signal may be missing.  Returns ``{"items", "co_pairs", "content_pairs"}``.
+    """
+    from .dataset import load_training_data
+    from .embeddings import load_embeddings
+
+    log = log or (lambda message: None)
+    data = data if data is not None else load_training_data(days=days)
+    embeddings = embeddings if embeddings is not None else load_embeddings()
+
+    parts = []
+    stats = {"co_pairs": 0, "content_pairs": 0}
+    if data is not None and data.n_items:
+        co_keys = np.asarray(data.item_keys, dtype=str)
+        parts.append((co_keys, data.item_ids(), _co_candidates(data, k, block_size), 0))
+        stats["co_pairs"] = len(parts[-1][2][0])
+        log(f"Co-interaction: {data.n_items} items")
+    if embeddings is not None and len(embeddings):
+        content_keys = np.asarray(embeddings.keys, dtype=str)
+        ids = np.asarray(embeddings.item_ids, dtype=np.int64)
+        parts.append((content_keys, ids, _content_candidates(embeddings, k, block_size), 1))
+        stats["content_pairs"] = len(parts[-1][2][0])
+        log(f"Content: {len(embeddings)} items")
+
+    keys = np.unique(np.concatenate([part[0] for part in parts])) if parts else np.zeros(0, str)
+    n = len(keys)
+    item_ids = np.full(n, -1, dtype=np.int64)
+    rows, cols, signal_scores = [], [], ([], [])
+    for part_keys, part_ids, (src, dst, values), signal in parts:
+        positions = np.searchsorted(keys, part_keys)
+        item_ids[positions] = np.maximum(item_ids[positions], part_ids)
+        rows.append(positions[src])
+        cols.append(positions[dst])
+        signal_scores[signal].append(values.astype(np.float32))
+        signal_scores[1 - signal].append(np.zeros(len(values), dtype=np.float32))
+
+    width = 2 * k
+    neighbours = np.full((n, width), -1, dtype=np.int32)
+    co_scores = np.zeros((n, width), dtype=np.float16)
+    content_scores = np.zeros((n, width), dtype=np.float16)
+    if rows and n:
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        codes, inverse = np.unique(rows * n + cols, return_inverse=True)
+        co = np.bincount(inverse, np.concatenate(signal_scores[0]), minlength=len(codes))
+        content = np.bincount(inverse, np.concatenate(signal_scores[1]), minlength=len(codes))
+        rows, cols = codes // n, codes % n
+        blended = weights[0] * co + weights[1] * content
+        # Rows stay grouped, best blended candidate first within each row
+        order = np.lexsort((-blended, rows))
+        counts = np.bincount(rows, minlength=n)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        rank = np.arange(len(order)) - np.repeat(starts, counts)
+        keep = order[rank < width]
+        slots = rank[rank < width]
+        neighbours[rows[keep], slots] = cols[keep]
+        co_scores[rows[keep], slots] = co[keep]
+        content_scores[rows[keep], slots] = content[keep]
+
+    write_store(
+        path,
+        {
+            "keys": keys,
+            "item_ids": item_ids,
+            "neighbours": neighbours,
+            "co_scores": co_scores,
+            "content_scores": content_scores,
+        },
+        weights=[float(w) for w in weights],
+        k=int(k),
+        updated_at=timezone.now().isoformat(),
+    )
+    return dict(stats, items=n)
+
+
+class RelatedItems(ArrayStore):
+    """A published neighbour table (memory-mapped)."""
+
+    def __init__(self, path=RELATED_DIR):
+        super().__init__(path)
+        self.weights = tuple(self.manifest["weights"])
+        self.k = self.manifest["k"]
+        self.item_ids = self._load("item_ids")
+        self.neighbours = self._load("neighbours")
+        self.co_scores = self._load("co_scores")
+        self.content_scores = self._load("content_scores")
+
+    @cached_property
+    def id_rows(self):
+        """Store row per registry item id (-1 where absent), for O(1) id lookups."""
+        ids = np.asarray(self.item_ids)
+        known = ids >= 0
+        out = np.full(int(ids.max()) + 1 if known.any() else 0, -1, dtype=np.int32)
+        out[ids[known]] = np.flatnonzero(known)
+        return out
+
+    def row_for(self, item):
+        """Store row of a registry item id or "app.model:pk" key (-1 if unknown)."""
+        if isinstance(item, str):
+            return int(self.rows([item])[0])
+        item = int(item)
+        return int(self.id_rows[item]) if 0 <= item < len(self.id_rows) else -1
+
+    def _blend(self, rows, weights):
+        weights = self.weights if weights is None else weights
+        return weights[0] * self.co_scores[rows].astype(np.float32) + weights[
+            1
+        ] * self.content_scores[rows].astype(np.float32)
+
+    def _ranked(self, candidates, scores, k, exclude=()):
+        valid = candidates >= 0
+        if len(exclude):
+            valid &= ~np.isin(candidates, exclude)
+        candidates, scores = candidates[valid], scores[valid]
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [(str(self.keys[c]), float(s)) for c, s in zip(candidates[order], scores[order]) if s > 0]
+
+    def related(self, item, k=10, weights=None):
+        """Top-``k`` ``(key, score)`` neighbours of one item."""
+        row = self.row_for(item)
+        if row < 0:
+            return []
+        return self._ranked(np.asarray(self.neighbours[row]), self._blend(row, weights), k)
+
+    def suggestions(self, items, k=10, weights=None, decay=SESSION_DECAY):
+        """
+        Top-``k`` ``(key, score)`` for a session: the neighbour rows of
+        ``items`` (most recent first) summed with recency decay, excluding
+        the items themselves.
+        """
+        rows = np.array([self.row_for(item) for item in items], dtype=np.int64)
+        recency = decay ** np.arange(len(rows), dtype=np.float32)
+        recency, rows = recency[rows >= 0], rows[rows >= 0]
+        if not len(rows):
+            return []
+        candidates = np.asarray(self.neighbours[rows]).ravel()
+        scores = (self._blend(rows, weights) * recency[:, None]).ravel()
+        valid = candidates >= 0
+        unique, inverse = np.unique(candidates[valid], return_inverse=True)
+        totals = np.bincount(inverse, scores[valid], minlength=len(unique)).astype(np.float32)
+        return self._ranked(unique, totals, k, exclude=rows)
+
+
+def load_related(path=RELATED_DIR):
+    """Process-wide cached ``RelatedItems``; reloads when a new table is published."""
+    return load_store(RelatedItems, path)
+
+
+def related_items(item, k=10, weights=None, path=RELATED_DIR):
+    """``(key, score)`` neighbours of ``item`` (empty until a table is built)."""
+    table = load_related(path)
+    return table.related(item, k=k, weights=weights) if table is not None else []
+
+
+def session_suggestions(items, k=10, weights=None, path=RELATED_DIR):
+    """``(key, score)`` suggestions for recently viewed ``items`` (most recent first)."""
+    table = load_related(path)
+    return table.suggestions(items, k=k, weights=weights) if table is not None else []
+
+
+def remember_session_item(session, key):
+    """Push ``key`` onto the session's recently viewed items (most recent first)."""
+    recent = [item for item in session.get(SESSION_KEY, []) if item != key]
+    session[SESSION_KEY] = [key] + recent[: SESSION_ITEMS - 1]
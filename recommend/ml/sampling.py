@@ -0,0 +1,185 @@
+"""
+Tensorized batch construction for recommender training.
+
+Batches are assembled entirely with tensor ops: positives are drawn with
+``torch.multinomial`` over the engagement weights, negatives with one
+``torch.randint`` per batch, and collisions with a user's own positives are
+rejected against a sorted per-user CSR structure with ``torch.searchsorted``.
+``InteractionBatchDataset`` wraps the same sampler as an ``IterableDataset``
+so batches can be produced by ``torch.utils.data`` worker processes.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+try:
+    import torch
+    from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+except ImportError:  # pragma: no cover
+    torch = None
+    DataLoader = None
+    IterableDataset = object
+    get_worker_info = None
+
+# torch.multinomial supports at most 2**24 categories
+MULTINOMIAL_MAX_CATEGORIES = 2 ** 24
+NEGATIVE_MAX_ROUNDS = 5
+
+
+class PositiveIndex:
+    """Sorted per-user positive items in CSR form (``indptr``, ``indices``)."""
+
+    def __init__(self, user_idx, item_idx, n_users, n_items):
+        self.n_users = int(n_users)
+        self.n_items = int(n_items)
+        flat = np.unique(
+            np.asarray(user_idx, dtype=np.int64) * self.n_items
+            + np.asarray(item_idx, dtype=np.int64)
+        )
+        users = flat // self.n_items
+        counts = np.bincount(users, minlength=self.n_users)
+        self.indptr = torch.from_numpy(np.concatenate(([0], np.cumsum(counts))))
+        self.indices = torch.from_numpy(flat % self.n_items)
+        # Flattened user * n_items + item keys, globally sorted
+        self._flat = torch.from_numpy(flat)
+        # item - rank within the user's segment; non-decreasing per segment
+        ranks = np.arange(len(flat)) - np.repeat(self.indptr[:-1].numpy(), counts)
+        self._gaps = torch.from_numpy(users * self.n_items + (flat % self.n_items) - ranks)
+        self.degree = torch.from_numpy(counts)
+
+    def items_for(self, user):
+        return self.indices[self.indptr[user] : self.indptr[user + 1]]
+
+    def contains(self, users, items):
+        """Vectorized membership test for ``(users[i], items[i])`` pairs."""
+        if len(self._flat) == 0:
+            return torch.zeros(users.shape, dtype=torch.bool)
+        query = users.to(torch.int64) * self.n_items + items.to(torch.int64)
+        pos = torch.searchsorted(self._flat, query).clamp(max=len(self._flat) - 1)
+        return self._flat[pos] == query
+
+    def sample_complement(self, users, generator=None):
+        """
+        Exact uniform draw from each user's non-positive items.
+
+        A rank ``r`` among the user's ``n_items - degree`` negatives maps to
+        item ``r + #{positives p_j : p_j - j <= r}``.  Users whose positives
+        cover the whole catalogue get an arbitrary item.
+        """
+        users = users.to(torch.int64)
+        free = (self.n_items - self.degree[users]).clamp(min=1)
+        ranks = (torch.rand(users.shape, generator=generator, dtype=torch.float64) * free).long()
+        below = torch.searchsorted(self._gaps, users * self.n_items + ranks, right=True)
+        return (ranks + (below - self.indptr[users])).clamp(max=self.n_items - 1)
+
+
+def sample_negatives(users, positives, generator=None, max_rounds=NEGATIVE_MAX_ROUNDS):
+    """Uniform negative items per user, re-drawing collisions with positives.
+
+    A few cheap rejection rounds settle almost every draw; whatever still
+    collides is resolved exactly with ``PositiveIndex.sample_complement``.
+    """
+    negatives = torch.randint(positives.n_items, users.shape, generator=generator)
+    for _ in range(max_rounds):
+        clash = positives.contains(users, negatives)
+        n_clash = int(clash.sum())
+        if n_clash == 0:
+            return negatives
+        negatives[clash] = torch.randint(positives.n_items, (n_clash,), generator=generator)
+    clash = positives.contains(users, negatives)
+    if clash.any():
+        negatives[clash] = positives.sample_complement(users[clash], generator)
+    return negatives
+
+
+def draw_weighted(weights, k, generator=None):
+    """Sample ``k`` indices with replacement proportionally to ``weights``."""
+    if len(weights) <= MULTINOMIAL_MAX_CATEGORIES:
+        return torch.multinomial(weights, k, replacement=True, generator=generator)
+    cdf = torch.cumsum(weights.to(torch.float64), 0)
+    draws = torch.rand(k, generator=generator, dtype=torch.float64) * cdf[-1]
+    return torch.searchsorted(cdf, draws).clamp(max=len(weights) - 1)
+
+
+class WeightedBatchSampler:
+    """
+    Draws ``(users, pos_items, neg_items, weights)`` batches as tensors.
+
+    Positives are sampled with replacement proportionally to their engagement
+    weight; ``steps`` batches make up one epoch.
+    """
+
+    def __init__(self, users, items, weights, positives, batch_size, steps, seed=None):
+        self.users = torch.as_tensor(users, dtype=torch.long)
+        self.items = torch.as_tensor(items, dtype=torch.long)
+        self.weights = torch.as_tensor(weights, dtype=torch.float32)
+        self.positives = positives
+        self.batch_size = int(batch_size)
+        self.steps = int(steps)
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        else:
+            self.generator.seed()
+
+    def batch(self):
+        picks = draw_weighted(self.weights, self.batch_size, self.generator)
+        users = self.users[picks]
+        negatives = sample_negatives(users, self.positives, self.generator)
+        return users, self.items[picks], negatives, self.weights[picks]
+
+    def __iter__(self):
+        for _ in range(self.steps):
+            yield self.batch()
+
+    def __len__(self):
+        return self.steps
+
+
+def epoch_batches(users, items, positives, batch_size, generator=None):
+    """One pass over every positive in random order, with sampled negatives."""
+    users = torch.as_tensor(users, dtype=torch.long)
+    items = torch.as_tensor(items, dtype=torch.long)
+    order = torch.randperm(len(users), generator=generator)
+    for start in range(0, len(order), batch_size):
+        picks = order[start : start + batch_size]
+        batch_users = users[picks]
+        yield batch_users, items[picks], sample_negatives(batch_users, positives, generator)
+
+
+class InteractionBatchDataset(IterableDataset):
+    """``IterableDataset`` yielding whole batches from a ``WeightedBatchSampler``.
+
+    Each worker process draws its share of the epoch's steps with its own
+    seed, so batches from different workers are independent.
+    """
+
+    def __init__(self, sampler):
+        super().__init__()
+        self.sampler = sampler
+
+    def __iter__(self):
+        info = get_worker_info()
+        steps = self.sampler.steps
+        if info is not None:
+            self.sampler.generator.manual_seed(info.seed % (2 ** 63))
+            steps = steps // info.num_workers + (1 if info.id < steps % info.num_workers else 0)
+        for _ in range(steps):
+            yield self.sampler.batch()
+
+    def __len__(self):
+        return self.sampler.steps
+
+
+def batch_loader(sampler, num_workers=0):
+    """Iterate a sampler directly, or through a ``DataLoader`` with workers."""
+    if not num_workers:
+        return sampler
+    return DataLoader(
+        InteractionBatchDataset(sampler),
+        batch_size=None,
+        num_workers=num_workers,
+        persistent_workers=False,
+    )
@@ -0,0 +1,157 @@
+"""
+Per-user seen-item sets for ``exclude_seen`` in the hybrid serving path.
+
+At training time every user's consumed items are stored as a CSR structure
+over the model's dense indices: ``indptr`` (``n_users + 1`` int64 offsets)
+and ``indices`` (int32 item indices, sorted within each user).  It is saved
+with the model payload and in the memory-mapped artifact, so every serving
+process shares one copy and a lookup is two array slices.
+
+Interactions recorded after the retrain are appended to a small per-user
+ring of registry item ids (see ``recommend.registry``) by the
+``Interaction`` post_save signal.  The ring lives in the default cache,
+which ``settings.CACHES`` points at Redis, so an interaction handled by one
+process is excluded by every other.  An atomic ``cache.incr`` claims the
+next slot and each slot is its own key, so concurrent appends for one user
+never overwrite each other.  At request time the trained row and the
+mapped delta are merged into one sorted index array, and candidates are
+filtered with a single ``searchsorted`` before top-K selection: no query
+over the interaction history per request.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# Deltas only need to live until the next retrain folds them into the CSR
+SEEN_DELTA_TTL = getattr(settings, "RECOMMEND_SEEN_DELTA_TTL", 7 * 86400)
+SEEN_DELTA_MAX = 500
+
+
+class SeenItems:
+    """Sorted item indices per dense user index (CSR)."""
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_pairs(cls, user_idx, item_idx, n_users, n_items):
+        """Build from aligned (user index, item index) arrays; duplicates collapse."""
+        codes = np.unique(
+            np.asarray(user_idx, dtype=np.int64) * max(1, n_items)
+            + np.asarray(item_idx, dtype=np.int64)
+        )
+        users = codes // max(1, n_items)
+        indptr = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(users, minlength=n_users), out=indptr[1:])
+        return cls(indptr, (codes % max(1, n_items)).astype(np.int32))
+
+    @classmethod
+    def from_payload(cls, payload):
+        """The set saved in a torch payload, or None for models trained without one."""
+        indptr = payload.get("seen_indptr")
+        indices = payload.get("seen_indices")
+        if indptr is None or indices is None:
+            return None
+        return cls(_to_numpy(indptr, np.int64), _to_numpy(indices, np.int32))
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        if not artifact.has("seen.indptr"):
+            return None
+        return cls(artifact.array("seen.indptr"), artifact.array("seen.indices"))
+
+    def payload(self):
+        """Tensors for the torch payload (``torch.load`` only restores tensors)."""
+        import torch
+
+        return {
+            "seen_indptr": torch.from_numpy(np.ascontiguousarray(self.indptr)),
+            "seen_indices": torch.from_numpy(np.ascontiguousarray(self.indices)),
+        }
+
+    @property
+    def n_users(self):
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes
+
+    def row(self, uidx):
+        """Sorted item indices of dense user ``uidx`` (empty when out of range)."""
+        if uidx is None or not 0 <= uidx < self.n_users:
+            return np.zeros(0, dtype=np.int32)
+        return self.indices[self.indptr[uidx] : self.indptr[uidx + 1]]
+
+
+def _to_numpy(value, dtype):
+    if hasattr(value, "numpy"):
+        value = value.numpy()
+    return np.ascontiguousarray(value, dtype=dtype)
+
+
+def seen_delta_key(user_id):
+    return f"recommend:seen:user:{user_id}"
+
+
+def _slot_key(user_id, n):
+    return f"{seen_delta_key(user_id)}:{n % SEEN_DELTA_MAX}"
+
+
+def record_seen(user_id, item_id):
+    """Append registry ``item_id`` to the user's seen delta (on new interactions)."""
+    counter = seen_delta_key(user_id)
+    cache.add(counter, 0, SEEN_DELTA_TTL)
+    try:
+        n = cache.incr(counter)
+    except ValueError:
+        # The counter expired between add() and incr(); start a new ring
+        cache.add(counter, 0, SEEN_DELTA_TTL)
+        n = cache.incr(counter)
+    cache.set(_slot_key(user_id, n), item_id, SEEN_DELTA_TTL)
+    cache.touch(counter, SEEN_DELTA_TTL)
+
+
+def seen_delta(user_id):
+    """Registry ids in the user's seen delta (the newest ``SEEN_DELTA_MAX`` appends)."""
+    count = cache.get(seen_delta_key(user_id)) or 0
+    first = max(1, count - SEEN_DELTA_MAX + 1)
+    if count < first:
+        return []
+    slots = [_slot_key(user_id, n) for n in range(first, count + 1)]
+    return list(cache.get_many(slots).values())
+
+
+def seen_item_indices(model, user_id):
+    """
+    Sorted, unique model item indices ``user_id`` has already consumed: the
+    trained row merged with interactions recorded since.
+    """
+    seen = getattr(model, "seen", None)
+    base = seen.row(model.user_map.get(user_id)) if seen is not None else None
+    try:
+        delta = seen_delta(user_id)
+    except Exception:
+        delta = []
+    extra = model.rows_for_item_ids(delta) if delta else np.zeros(0, dtype=np.int64)
+    extra = extra[extra >= 0]
+    if base is None or len(base) == 0:
+        return np.unique(extra)
+    if len(extra) == 0:
+        return np.asarray(base, dtype=np.int64)
+    return np.union1d(base, extra)
+
+
+def unseen_mask(seen, idxs):
+    """Boolean mask of ``idxs`` not in the sorted ``seen`` array."""
+    idxs = np.asarray(idxs)
+    if len(seen) == 0 or len(idxs) == 0:
+        return np.ones(len(idxs), dtype=bool)
+    pos = np.searchsorted(seen, idxs).clip(max=len(seen) - 1)
+    return seen[pos] != idxs
@@ -0,0 +1,600 @@
+"""
+Process-wide serving cache for the hybrid recommender.
+
+Loading ``torch_recommender_hybrid.pt`` means unpickling the whole payload and
+rebuilding an ``nn.Module``; doing that per request dominated the latency of
+the recommendation endpoints.  ``get_serving_model()`` loads the artifact once
+per process, keeps the eval-mode embedding matrices as contiguous numpy arrays
+together with the decoded item keys, and swaps in a fresh instance when the
+file on disk changes (mtime/size) or carries a different ``version``.
+
+When a memory-mapped artifact directory (see ``artifact``) has been written
+next to the ``.pt`` file it is served instead: the matrices are mapped
+read-only, so all worker processes share one page-cache copy and start-up
+no longer grows with the catalogue size.
+
+Items folded in between retrains (see ``foldin``) are picked up from the
+shared cache at most every ``ITEM_DELTA_POLL_SECONDS`` and appended to an
+extended copy of the base model, which then replaces it atomically.
+
+``hybrid_cards()`` turns a user's recommendations from the served model
+into hydrated cards; ``warm_for_you_cache()`` precomputes the cached "for
+you" cards of active users after a retrain.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import ChainMap
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .ann import ann_index_path, load_index
+from .artifact import MANIFEST_NAME, SortedKeyMap, artifact_path, load_artifact
+from .seen import SeenItems
+from .torch_recommender_hybrid import (
+    ANN_MIN_ITEMS,
+    LEGACY_MODEL_PATH,
+    MODEL_PATH,
+    hybrid_item_matrix,
+    load_model_hybrid,
+)
+
+
+def _to_numpy(tensor):
+    """Convert a state_dict tensor to a contiguous float32 numpy array."""
+    if hasattr(tensor, "detach"):
+        tensor = tensor.detach().cpu().float().numpy()
+    return np.ascontiguousarray(tensor, dtype=np.float32)
+
+
+def _to_ids(value):
+    if hasattr(value, "numpy"):
+        value = value.numpy()
+    return np.ascontiguousarray(value, dtype=np.int64)
+
+
+def _registry_ids(label_names, label_codes, object_ids, create=False):
+    """Registry ids for parsed item keys (-1 for unregistered items unless ``create``)."""
+    from recommend.registry import content_type_ids_for_labels, item_ids
+
+    label_ct = np.array(
+        [-1 if ct is None else ct for ct in content_type_ids_for_labels(label_names)],
+        dtype=np.int64,
+    )
+    ids = np.full(len(label_codes), -1, dtype=np.int64)
+    if len(label_codes) == 0:
+        return ids
+    ct_ids = label_ct[label_codes]
+    valid = (ct_ids >= 0) & (object_ids >= 0)
+    if valid.any():
+        ids[valid] = item_ids(ct_ids[valid], object_ids[valid], create=create)
+    return ids
+
+
+def register_item_keys(keys):
+    """Registry ids for "app.model:id" keys, registering unknown items (offline use)."""
+    return _registry_ids(*_parse_keys(keys), create=True)
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _parse_keys(keys):
+    """Split "app.model:id" keys into (label names, label codes, object ids)."""
+    keys = np.asarray(keys, dtype=str)
+    if len(keys) == 0:
+        return [], np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+    parts = np.char.partition(keys, ":")
+    names, codes = np.unique(parts[:, 0], return_inverse=True)
+    raw_ids = parts[:, 2]
+    numeric = np.char.isdigit(raw_ids)
+    object_ids = np.full(len(keys), -1, dtype=np.int64)
+    if numeric.any():
+        object_ids[numeric] = raw_ids[numeric].astype(np.int64)
+    return names.tolist(), codes.astype(np.int32), object_ids
+
+
+class StackedMatrix:
+    """
+    Row-wise ``[base; extra]`` without copying ``base``.
+
+    Lets items folded in between retrains extend a memory-mapped matrix
+    while every process keeps sharing the mapped base rows.
+    """
+
+    ndim = 2
+
+    def __init__(self, base, extra):
+        self.base = base
+        self.extra = np.ascontiguousarray(extra, dtype=np.float32)
+        self.n_base = len(base)
+
+    @property
+    def shape(self):
+        return (self.n_base + len(self.extra), self.base.shape[1])
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            idx = int(idx)
+            if idx < 0:
+                idx += len(self)
+            return self.base[idx] if idx < self.n_base else self.extra[idx - self.n_base]
+        idx = np.arange(len(self))[idx] if isinstance(idx, slice) else np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        out = np.empty((len(idx), self.shape[1]), dtype=np.float32)
+        in_base = idx < self.n_base
+        out[in_base] = self.base[idx[in_base]]
+        out[~in_base] = self.extra[idx[~in_base] - self.n_base]
+        return out
+
+    def __matmul__(self, other):
+        return np.concatenate([np.asarray(self.base @ other, dtype=np.float32), self.extra @ other])
+
+    def __array__(self, dtype=None, copy=None):
+        out = np.concatenate([np.asarray(self.base, dtype=np.float32), self.extra])
+        return out if dtype is None else out.astype(dtype)
+
+
+def _stack_rows(base, extra):
+    if isinstance(base, StackedMatrix):
+        return StackedMatrix(base.base, np.concatenate([base.extra, extra]))
+    return StackedMatrix(base, extra)
+
+
+class HybridServingModel:
+    """Read-only, numpy-backed view of a trained hybrid model payload."""
+
+    def __init__(self, payload, source_path=None, signature=None):
+        state = payload["state_dict"]
+        self.source_path = source_path
+        self.signature = signature
+        self.version = payload.get("version") or (signature and str(signature[-2]))
+        self.emb_dim = payload.get("emb_dim", 128)
+        self.content_emb_dim = payload.get("content_emb_dim", 64)
+
+        self.user_map = payload["user_map"]
+        self.item_map = payload["item_map"]
+        raw_keys = payload["item_keys"]
+        self.item_keys = [raw_keys[i] for i in range(len(raw_keys))]
+        self.item_metadata = payload.get("item_metadata", {})
+        self._parse_item_keys()
+
+        self.user_emb = _to_numpy(state["user_emb.weight"])
+        self.item_emb = _to_numpy(state["item_emb.weight"])
+        self.content_emb = _to_numpy(state["content_emb.weight"])
+        self.item_matrix = hybrid_item_matrix(self.item_emb, self.content_emb)
+        norms = np.linalg.norm(self.item_emb, axis=1, keepdims=True)
+        self.item_unit = self.item_emb / np.maximum(norms, 1e-8)
+        self.item_created = self._created_timestamps()
+        self.seen = SeenItems.from_payload(payload)
+        ids = payload.get("item_ids")
+        self._item_ids = None if ids is None else _to_ids(ids)
+        self._finish_setup(self._load_index())
+
+    @classmethod
+    def from_artifact(cls, artifact, source_path=None, signature=None):
+        """Serve straight from a memory-mapped ``Artifact`` (no unpickling)."""
+        model = cls.__new__(cls)
+        model.source_path = source_path
+        model.signature = signature
+        model.version = artifact.version
+        model.emb_dim = artifact.emb_dim or 128
+        model.content_emb_dim = artifact.content_emb_dim or 64
+        model.user_map = artifact.user_map
+        model.item_map = artifact.item_map
+        model.item_keys = artifact.item_keys
+        model.item_metadata = {}
+        model._parse_item_keys()
+
+        model.user_emb = artifact.array("user_emb.weight")
+        model.item_emb = artifact.array("item_emb.weight")
+        model.content_emb = artifact.array("content_emb.weight")
+        model.item_matrix = artifact.array("item_matrix")
+        model.item_unit = artifact.array("item_unit")
+        model.item_created = artifact.columns.get("created_at")
+        if model.item_created is None:
+            model.item_created = np.zeros(len(model.item_keys), dtype=np.float64)
+        model.seen = SeenItems.from_artifact(artifact)
+        model._item_ids = artifact.array("item_ids") if artifact.has("item_ids") else None
+        index = None
+        if model.n_items >= ANN_MIN_ITEMS:
+            index = artifact.ann_index(model.item_matrix)
+            if index is not None and (index.version != model.version or len(index) != model.n_items):
+                index = None
+        model._finish_setup(index)
+        return model
+
+    def _finish_setup(self, index):
+        self._build_type_masks()
+        self._item_rows = None
+        self.index = index
+        self.base = self
+        self.delta_revision = None
+        self.delta_checked = float("-inf")
+
+    def _load_index(self):
+        """ANN index saved with this model, if present and of the same version."""
+        if not self.source_path or self.n_items < ANN_MIN_ITEMS:
+            return None
+        index = load_index(ann_index_path(self.source_path))
+        if index is None or index.version != self.version or len(index) != self.n_items:
+            return None
+        return index
+
+    def _parse_item_keys(self):
+        """Split "app.model:id" keys once into per-item label codes and ids."""
+        names, codes, object_ids = _parse_keys(self.item_keys)
+        self.label_names = names
+        self.item_label_codes = codes
+        self.item_object_ids = object_ids
+
+    @property
+    def item_ids(self):
+        """
+        Registry item id per item row (-1 for items without one).
+
+        Models trained before the registry existed carry no ids; their items
+        are looked up but never registered here, on the request path.
+        ``register_items()`` (or ``convert_model_file``) registers them
+        offline.
+        """
+        if self._item_ids is None:
+            self._item_ids = _registry_ids(
+                self.label_names, self.item_label_codes, self.item_object_ids
+            )
+        return self._item_ids
+
+    def register_items(self):
+        """Register every item of this model and use the resulting ids."""
+        self._item_ids = register_item_keys(self.item_keys)
+        self._item_rows = None
+        return self._item_ids
+
+    def rows_for_item_ids(self, ids):
+        """Vectorized item rows for registry item ids (-1 where not in the model)."""
+        if self._item_rows is None:
+            item_ids = np.asarray(self.item_ids, dtype=np.int64)
+            known = np.flatnonzero(item_ids >= 0)
+            order = np.argsort(item_ids[known], kind="stable")
+            self._item_rows = SortedKeyMap(item_ids[known][order], known[order])
+        return self._item_rows.lookup(np.asarray(ids, dtype=np.int64))
+
+    @property
+    def item_labels(self):
+        """Per-item "app.model" label (built on demand from the label codes)."""
+        names = self.label_names
+        return [names[code] for code in self.item_label_codes.tolist()]
+
+    def _created_timestamps(self):
+        created = np.zeros(len(self.item_keys), dtype=np.float64)
+        for idx, meta in self.item_metadata.items():
+            if 0 <= idx < len(created):
+                created[idx] = (meta or {}).get("created_at", 0) or 0
+        return created
+
+    def _build_type_masks(self):
+        """Index masks per "app.model" label and per app label."""
+        self.type_masks = {}
+        for code, label in enumerate(self.label_names):
+            mask = self.item_label_codes == code
+            self.type_masks[label] = mask
+            app_label = label.split(".", 1)[0]
+            if app_label in self.type_masks:
+                self.type_masks[app_label] = self.type_masks[app_label] | mask
+            else:
+                self.type_masks[app_label] = mask.copy()
+        self._allowed_cache = {}
+
+    def allowed_mask(self, allowed_content):
+        """Boolean item mask for a set of "app" / "app.model" filters (None = all)."""
+        if not allowed_content:
+            return None
+        key = frozenset(allowed_content)
+        mask = self._allowed_cache.get(key)
+        if mask is None:
+            mask = np.zeros(self.n_items, dtype=bool)
+            for name in key:
+                if name in self.type_masks:
+                    mask |= self.type_masks[name]
+            self._allowed_cache[key] = mask
+        return mask
+
+    @property
+    def n_items(self):
+        return len(self.item_keys)
+
+    def user_vector(self, user_id):
+        """Return the user's embedding row, or None for unknown users."""
+        uidx = self.user_map.get(user_id)
+        if uidx is None:
+            return None
+        return np.asarray(self.user_emb[uidx], dtype=np.float32)
+
+    def score_vector(self, uvec):
+        """Hybrid score of every item for a user vector (70% collab, 30% content)."""
+        return self.item_matrix @ uvec
+
+    def score_matrix(self, uvecs):
+        """Hybrid scores for a block of user vectors: ``[n_users, n_items]``."""
+        return (self.item_matrix @ np.asarray(uvecs, dtype=np.float32).T).T
+
+    def candidates(self, uvec, pool, mask=None):
+        """
+        Item indices worth re-ranking for ``uvec`` and their hybrid scores.
+
+        Uses the ANN index for large catalogues, otherwise scores every item.
+        ``mask`` restricts the result to allowed items; if the index cannot
+        fill the pool from allowed items the allowed subset is scanned exactly.
+        """
+        if self.index is not None:
+            ids, scores = self.index.search(uvec, pool)
+            n_indexed = len(self.index)
+            if n_indexed < self.n_items:
+                # Items folded in after the index was built are scanned exactly
+                extra = np.arange(n_indexed, self.n_items)
+                ids = np.concatenate([ids, extra])
+                scores = np.concatenate([scores, self.item_matrix[extra] @ uvec])
+            if mask is None:
+                return ids, scores
+            keep = mask[ids]
+            if keep.sum() >= min(pool, int(mask.sum())):
+                return ids[keep], scores[keep]
+        if mask is None:
+            return np.arange(self.n_items), self.score_vector(uvec)
+        idxs = np.flatnonzero(mask)
+        return idxs, self.item_matrix[idxs] @ uvec
+
+    def with_items(
+        self, keys, item_emb, content_emb, created_at, revision=None, item_ids=None
+    ):
+        """
+        Copy of this model with extra items appended.
+
+        Base matrices are shared, not copied: the copy stacks the new rows on
+        top of them, and ``candidates`` scans rows beyond the ANN index
+        exactly.
+        """
+        keys = [str(key) for key in keys]
+        item_emb = np.asarray(item_emb, dtype=np.float32).reshape(-1, self.item_emb.shape[1])
+        content_emb = np.asarray(content_emb, dtype=np.float32).reshape(
+            -1, self.content_emb.shape[1]
+        )
+        extended = copy.copy(self)
+        if isinstance(self.item_keys, list):
+            extended.item_keys = self.item_keys + keys
+        else:
+            extended.item_keys = np.concatenate([self.item_keys, np.asarray(keys, dtype=str)])
+        extended.item_map = ChainMap(
+            {key: self.n_items + offset for offset, key in enumerate(keys)}, self.item_map
+        )
+
+        names, codes, object_ids = _parse_keys(keys)
+        label_names = list(self.label_names)
+        remap = []
+        for name in names:
+            if name not in label_names:
+                label_names.append(name)
+            remap.append(label_names.index(name))
+        extended.label_names = label_names
+        extended.item_label_codes = np.concatenate(
+            [self.item_label_codes, np.asarray(remap, dtype=np.int32)[codes]]
+        )
+        extended.item_object_ids = np.concatenate([self.item_object_ids, object_ids])
+        if item_ids is None:
+            item_ids = _registry_ids(names, codes, object_ids)
+        extended._item_ids = np.concatenate(
+            [np.asarray(self.item_ids, dtype=np.int64), np.asarray(item_ids, dtype=np.int64)]
+        )
+        extended._item_rows = None
+
+        norms = np.linalg.norm(item_emb, axis=1, keepdims=True)
+        extended.item_emb = _stack_rows(self.item_emb, item_emb)
+        extended.content_emb = _stack_rows(self.content_emb, content_emb)
+        extended.item_matrix = _stack_rows(
+            self.item_matrix, hybrid_item_matrix(item_emb, content_emb)
+        )
+        extended.item_unit = _stack_rows(self.item_unit, item_emb / np.maximum(norms, 1e-8))
+        extended.item_created = np.concatenate(
+            [self.item_created, np.asarray(created_at, dtype=np.float64)]
+        )
+        extended._build_type_masks()
+        extended.base = self.base
+        extended.delta_revision = revision
+        return extended
+
+    def freshness_multipliers(self, now_ts, idxs=None):
+        """Per-item freshness boost (1.5x for brand new items, fading over 30 days)."""
+        created = self.item_created if idxs is None else self.item_created[idxs]
+        age_days = (now_ts - created) / 86400.0
+        boost = np.ones(len(created), dtype=np.float32)
+        week = (created > 0) & (age_days < 7)
+        month = (created > 0) & ~week & (age_days < 30)
+        boost[week] = 1.0 + 0.5 * (1 - age_days[week] / 7)
+        boost[month] = 1.0 + 0.2 * (1 - age_days[month] / 30)
+        return boost
+
+
+_serving_lock = threading.Lock()
+_serving_models = {}
+
+ITEM_DELTA_POLL_SECONDS = 60
+
+
+def apply_item_delta(base, delta):
+    """Append a published new-item delta to ``base`` and serve the result."""
+    if not delta or delta.get("version") != base.version:
+        return base
+    extended = base.with_items(
+        delta["keys"],
+        delta["item_emb"],
+        delta["content_emb"],
+        delta["created_at"],
+        revision=delta.get("revision"),
+        item_ids=delta.get("item_ids"),
+    )
+    if base.source_path:
+        with _serving_lock:
+            current = _serving_models.get(base.source_path)
+            if current is not None and current.base is base:
+                extended.signature = current.signature
+                _serving_models[base.source_path] = extended
+    return extended
+
+
+def _refresh_item_delta(current):
+    """Pick up a newer new-item delta from the shared cache, if any."""
+    from django.core.cache import cache
+
+    from .foldin import ITEM_DELTA_KEY
+
+    now = time.monotonic()
+    if now - current.delta_checked < ITEM_DELTA_POLL_SECONDS:
+        return current
+    current.delta_checked = now
+    try:
+        delta = cache.get(ITEM_DELTA_KEY)
+    except Exception:
+        return current
+    if not delta or delta.get("revision") == current.delta_revision:
+        return current
+    try:
+        return apply_item_delta(current.base, delta)
+    except (KeyError, TypeError, ValueError):
+        return current
+
+
+def _source_signature(model_path):
+    """``(kind, path, signature)`` of the newest published form of the model.
+
+    The memory-mapped artifact directory is preferred; the ``.pt`` file is
+    used when no artifact has been written for it.
+    """
+    manifest = os.path.join(artifact_path(model_path), MANIFEST_NAME)
+    signature = _file_signature(manifest)
+    if signature is not None:
+        return "artifact", signature
+    return "pt", _file_signature(model_path)
+
+
+def _load_serving(kind, model_path, signature):
+    if kind == "artifact":
+        artifact = load_artifact(artifact_path(model_path))
+        if artifact is None:
+            return None
+        return HybridServingModel.from_artifact(artifact, model_path, signature)
+    payload = load_model_hybrid(model_path)
+    if not payload:
+        return None
+    return HybridServingModel(payload, model_path, signature)
+
+
+def get_serving_model(model_path=MODEL_PATH):
+    """
+    Return the process-wide ``HybridServingModel`` for ``model_path``.
+
+    The file signature is checked on every call (a single ``stat``); the
+    model is only loaded again when it changed.  Readers always see either
+    the previous or the new instance, never a half-built one.  The default
+    path is the model registry's current version; until one is registered
+    the pre-registry ``LEGACY_MODEL_PATH`` file is served.
+    """
+    if np is None:
+        return None
+    if model_path == MODEL_PATH and not os.path.exists(MODEL_PATH):
+        model_path = LEGACY_MODEL_PATH
+    kind, signature = _source_signature(model_path)
+    if signature is None:
+        return None
+    signature = (kind,) + signature
+
+    current = _serving_models.get(model_path)
+    if current is not None and current.signature == signature:
+        return _refresh_item_delta(current)
+
+    with _serving_lock:
+        current = _serving_models.get(model_path)
+        if current is not None and current.signature == signature:
+            return current
+        try:
+            serving = _load_serving(kind, model_path, signature)
+        except (KeyError, TypeError, AttributeError, ValueError, OSError):
+            return None
+        if serving is None:
+            return None
+        if current is not None and current.version == serving.version:
+            # Same model re-written (e.g. touched); keep the warm instance.
+            current.signature = signature
+            return current
+        _serving_models[model_path] = serving
+        return serving
+
+
+def clear_serving_cache():
+    """Drop all cached serving models (used by tests and after retrains)."""
+    with _serving_lock:
+        _serving_models.clear()
+
+
+FOR_YOU_CONTENT = {"blog", "communities", "games", "marketplace"}
+FOR_YOU_TOPN = 24
+FOR_YOU_CACHE_TTL = 300
+
+
+def for_you_cache_key(user_id):
+    return f"for_you_pytorch:{user_id}"
+
+
+def hybrid_cards(user_id, allowed_content, topn=12, exclude_seen=True):
+    """Hydrated cards of ``user_id``'s recommendations from the served model ([] if none)."""
+    from recommend.hydration import hydrate_recommendations
+
+    from .shadow import recommend_with_shadow
+
+    model = get_serving_model()
+    if not model:
+        return []
+    try:
+        recommendations = recommend_with_shadow(
+            user_id,
+            model=model,
+            topn=topn,
+            exclude_seen=exclude_seen,
+            diversity_penalty=0.15,
+            freshness_boost=True,
+            allowed_content=allowed_content,
+            as_item_ids=True,
+        )
+    except Exception:
+        return []
+    return hydrate_recommendations(recommendations)
+
+
+def warm_for_you_cache(user_ids):
+    """Precompute the cached "for you" results of ``user_ids``; returns how many were stored."""
+    from django.core.cache import cache
+
+    warmed = 0
+    for user_id in user_ids:
+        results = hybrid_cards(user_id, FOR_YOU_CONTENT, topn=FOR_YOU_TOPN)
+        if results:
+            cache.set(for_you_cache_key(user_id), results, FOR_YOU_CACHE_TTL)
+            warmed += 1
+    return warmed
@@ -0,0 +1,108 @@
+"""
+Shadow scoring of a candidate model version.
+
+While the model registry has a ``shadow`` pointer, ``recommend_with_shadow()``
+serves the current model as usual and, for a ``SHADOW_SAMPLE_RATE`` fraction
+of requests, hands the same request to a background thread that scores it
+with the candidate.  Both latencies and the overlap of the two top-N lists
+are recorded per candidate version (``telemetry.record_shadow``); the
+candidate's results are never served.  At most ``SHADOW_MAX_PENDING``
+shadow requests run at once per process; further samples are dropped
+rather than queued.
+
+The candidate is loaded through the serving cache like the current model,
+so a process scoring shadows maps both.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from .model_registry import SHADOW, ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+SHADOW_SAMPLE_RATE = getattr(settings, "RECOMMEND_SHADOW_SAMPLE_RATE", 0.05)
+SHADOW_MAX_PENDING = 2
+
+_pending = threading.BoundedSemaphore(SHADOW_MAX_PENDING)
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=SHADOW_MAX_PENDING, thread_name_prefix="recommend-shadow"
+        )
+    return _executor
+
+
+def overlap(primary, candidate):
+    """Shared fraction of two ``(item, score)`` top-N lists."""
+    a = {item for item, _ in primary}
+    b = {item for item, _ in candidate}
+    if not a and not b:
+        return 1.0
+    return len(a & b) / max(len(a), len(b))
+
+
+def _score_shadow(path, user_id, kwargs, primary, primary_duration, primary_version):
+    from recommend.telemetry import record_shadow
+
+    from .serving import get_serving_model
+    from .torch_recommender_hybrid import recommend_for_user_hybrid
+
+    try:
+        candidate = get_serving_model(path)
+        if candidate is None or candidate.version == primary_version:
+            return
+        started = time.perf_counter()
+        # Read-only fold-in: the shared per-user key belongs to the served model
+        recs = recommend_for_user_hybrid(
+            user_id, model=candidate, publish_foldin=False, **kwargs
+        )
+        duration = time.perf_counter() - started
+        record_shadow(candidate.version, primary_duration, duration, overlap(primary, recs))
+    except Exception as e:
+        logger.debug(f"Shadow scoring failed: {e}")
+    finally:
+        _pending.release()
+        connections.close_all()
+
+
+def recommend_with_shadow(user_id, model=None, registry=None, sample_rate=None, **kwargs):
+    """
+    ``recommend_for_user_hybrid(user_id, model=model, **kwargs)``, sampling
+    the request for shadow scoring when a shadow version is set.
+    """
+    from .serving import get_serving_model
+    from .torch_recommender_hybrid import recommend_for_user_hybrid
+
+    model = model if model is not None else get_serving_model()
+    started = time.perf_counter()
+    recs = recommend_for_user_hybrid(user_id, model=model, **kwargs)
+    duration = time.perf_counter() - started
+
+    sample_rate = SHADOW_SAMPLE_RATE if sample_rate is None else sample_rate
+    if model is None or sample_rate <= 0 or random.random() >= sample_rate:
+        return recs
+    path = (registry or ModelRegistry()).model_path(SHADOW)
+    if not os.path.exists(path):
+        return recs
+    # Shadow work must never pile up behind slow candidates
+    if not _pending.acquire(blocking=False):
+        return recs
+    try:
+        _get_executor().submit(
+            _score_shadow, path, user_id, kwargs, list(recs), duration, model.version
+        )
+    except Exception:
+        _pending.release()
+    return recs
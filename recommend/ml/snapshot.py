@@ -0,0 +1,317 @@
+"""
+Columnar snapshots of the ``Interaction`` log for offline jobs.
+
+``write_snapshot()`` streams rows with an id above the last exported
+watermark into compressed ``.npz`` partitions of at most ``partition_rows``
+rows each:
+
+- ``id``, ``user_id``, ``content_type_id``, ``object_id`` (int64)
+- ``action`` (uint8 code into the manifest's ``actions`` list)
+- ``weight`` (float32 stored ``engagement_score``, computed for rows
+  that have none)
+- ``created_at`` (float64 epoch seconds)
+
+``manifest.json`` lists the partitions with their id/time ranges, row counts
+and sha256, the content type label table and the watermark.  It is rewritten
+atomically after every partition, so an interrupted export resumes where it
+stopped.  Rows created in the last ``lag`` seconds are left for the next run
+so in-flight transactions with lower ids are not skipped.
+
+The log is append-only from the snapshot's point of view: updated or deleted
+rows are only picked up by a ``full`` rebuild.
+
+``InteractionSnapshot`` reads partitions back (optionally only those that
+overlap a time window) for trainers and analytics commands, so full scans
+stop hitting the primary database and a retrain is reproducible from a fixed
+watermark.
+"""
+
+import json
+import os
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .artifact import _sha256
+
+SNAPSHOT_DIR = getattr(
+    settings,
+    "RECOMMEND_SNAPSHOT_DIR",
+    os.path.join(settings.BASE_DIR, "data", "recommend", "interactions"),
+)
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+PARTITION_ROWS = 1_000_000
+COMMIT_LAG = 60
+
+COLUMNS = ("id", "user_id", "content_type_id", "object_id", "action", "weight", "created_at")
+_DTYPES = {
+    "id": "int64",
+    "user_id": "int64",
+    "content_type_id": "int64",
+    "object_id": "int64",
+    "action": "uint8",
+    "weight": "float32",
+    "created_at": "float64",
+}
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format_version") != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, f".{MANIFEST_NAME}.tmp")
+    with open(tmp, "w") as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(tmp, os.path.join(path, MANIFEST_NAME))
+
+
+def _new_manifest():
+    from recommend.models import Interaction
+
+    return {
+        "format_version": FORMAT_VERSION,
+        "watermark": 0,
+        "actions": [action for action, _ in Interaction.ACTION_CHOICES],
+        "content_types": {},
+        "partitions": [],
+    }
+
+
+def _upper_id(lag):
+    """Highest id created before ``now - lag`` (None when there is none)."""
+    from recommend.models import Interaction
+
+    cutoff = timezone.now() - timezone.timedelta(seconds=lag)
+    return (
+        Interaction.objects.filter(created_at__lte=cutoff)
+        .order_by("-created_at", "-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+
+
+def _write_partition(path, manifest, rows):
+    from recommend.models import Interaction
+
+    from .dataset import computed_weights
+
+    columns = list(zip(*rows))
+    codes = {action: i for i, action in enumerate(manifest["actions"])}
+    for action in set(columns[4]):
+        if action not in codes:
+            codes[action] = len(manifest["actions"])
+            manifest["actions"].append(action)
+
+    weights = np.array(
+        [np.nan if score is None else score for score in columns[5]], dtype=np.float64
+    )
+    missing = np.isnan(weights)
+    if missing.any():
+        pks = [pk for pk, absent in zip(columns[0], missing) if absent]
+        fallback = computed_weights(Interaction.objects.filter(pk__in=pks))
+        weights[missing] = [fallback[pk] for pk in pks]
+
+    arrays = {
+        "id": np.array(columns[0], dtype=np.int64),
+        "user_id": np.array(columns[1], dtype=np.int64),
+        "content_type_id": np.array(columns[2], dtype=np.int64),
+        "object_id": np.array(columns[3], dtype=np.int64),
+        "action": np.array([codes[a] for a in columns[4]], dtype=np.uint8),
+        "weight": weights.astype(np.float32),
+        "created_at": np.array([c.timestamp() for c in columns[6]], dtype=np.float64),
+    }
+    _append_partition(path, manifest, arrays)
+
+
+def _append_partition(path, manifest, arrays):
+    """Write one partition of ``COLUMNS`` arrays and record it in the manifest."""
+    first, last = int(arrays["id"][0]), int(arrays["id"][-1])
+    name = f"part-{first:012d}-{last:012d}.npz"
+    tmp = os.path.join(path, f".{name}.tmp")
+    with open(tmp, "wb") as fh:
+        np.savez_compressed(fh, **arrays)
+    os.replace(tmp, os.path.join(path, name))
+
+    manifest["partitions"].append(
+        {
+            "file": name,
+            "rows": len(arrays["id"]),
+            "min_id": first,
+            "max_id": last,
+            "min_created": float(arrays["created_at"].min()),
+            "max_created": float(arrays["created_at"].max()),
+            "sha256": _sha256(os.path.join(path, name)),
+        }
+    )
+    manifest["watermark"] = last
+    manifest["updated_at"] = timezone.now().isoformat()
+    _write_manifest(path, manifest)
+
+
+def write_snapshot(
+    path=SNAPSHOT_DIR,
+    partition_rows=PARTITION_ROWS,
+    chunk_size=5000,
+    full=False,
+    lag=COMMIT_LAG,
+):
+    """
+    Export interactions above the watermark; returns ``(rows, partitions)``.
+
+    ``full`` drops the existing snapshot first and re-exports everything.
+    """
+    from recommend.models import Interaction
+
+    from .dataset import content_type_labels
+
+    os.makedirs(path, exist_ok=True)
+    manifest = None if full else _read_manifest(path)
+    if manifest is None:
+        for entry in os.listdir(path):
+            if entry == MANIFEST_NAME or entry.startswith("part-"):
+                os.remove(os.path.join(path, entry))
+        manifest = _new_manifest()
+    manifest["content_types"] = {str(k): v for k, v in content_type_labels().items()}
+
+    upper = _upper_id(lag)
+    if upper is None or upper <= manifest["watermark"]:
+        _write_manifest(path, manifest)
+        return 0, 0
+
+    rows = (
+        Interaction.objects.filter(id__gt=manifest["watermark"], id__lte=upper)
+        .order_by("id")
+        .values_list(
+            "id",
+            "user_id",
+            "content_type_id",
+            "object_id",
+            "action",
+            "engagement_score",
+            "created_at",
+        )
+    )
+    exported = partitions = 0
+    buffer = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        buffer.append(row)
+        if len(buffer) >= partition_rows:
+            _write_partition(path, manifest, buffer)
+            exported += len(buffer)
+            partitions += 1
+            buffer = []
+    if buffer:
+        _write_partition(path, manifest, buffer)
+        exported += len(buffer)
+        partitions += 1
+    return exported, partitions
+
+
+def write_array_snapshot(path, arrays, content_types, actions=None, partition_rows=PARTITION_ROWS):
+    """
+    Write a fresh snapshot from in-memory ``COLUMNS`` arrays (sorted by id).
+
+    Used for synthetic data (benchmarks, tests) that never lives in the
+    database; ``content_types`` maps content type ids to "app.model" labels.
+    """
+    os.makedirs(path, exist_ok=True)
+    for entry in os.listdir(path):
+        if entry == MANIFEST_NAME or entry.startswith("part-"):
+            os.remove(os.path.join(path, entry))
+    manifest = _new_manifest()
+    if actions is not None:
+        manifest["actions"] = list(actions)
+    manifest["content_types"] = {str(k): v for k, v in content_types.items()}
+    n_rows = len(arrays["id"])
+    for start in range(0, n_rows, partition_rows):
+        part = {
+            column: np.asarray(arrays[column][start : start + partition_rows], dtype=_DTYPES[column])
+            for column in COLUMNS
+        }
+        _append_partition(path, manifest, part)
+    if not n_rows:
+        _write_manifest(path, manifest)
+    return InteractionSnapshot(path)
+
+
+class InteractionSnapshot:
+    """Read access to a snapshot directory written by ``write_snapshot()``."""
+
+    def __init__(self, path=SNAPSHOT_DIR, verify=False):
+        self.path = path
+        self.manifest = _read_manifest(path)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No interaction snapshot at {path}")
+        if verify:
+            self.verify()
+
+    @property
+    def watermark(self):
+        return self.manifest["watermark"]
+
+    @property
+    def actions(self):
+        return self.manifest["actions"]
+
+    @property
+    def content_types(self):
+        """ContentType id -> "app_label.model" as of the last export."""
+        return {int(k): v for k, v in self.manifest["content_types"].items()}
+
+    def __len__(self):
+        return sum(part["rows"] for part in self.manifest["partitions"])
+
+    def verify(self):
+        for part in self.manifest["partitions"]:
+            if _sha256(os.path.join(self.path, part["file"])) != part["sha256"]:
+                raise ValueError(f"Checksum mismatch for {part['file']}")
+
+    def partitions(self, since=None):
+        """Partition entries that may hold rows created at or after ``since``."""
+        since_ts = since.timestamp() if since is not None else None
+        return [
+            part
+            for part in self.manifest["partitions"]
+            if since_ts is None or part["max_created"] >= since_ts
+        ]
+
+    def iter_partitions(self, columns=COLUMNS, days=None):
+        """Yield one dict of column arrays per partition, filtered to ``days``."""
+        since = timezone.now() - timezone.timedelta(days=int(days)) if days else None
+        for part in self.partitions(since):
+            with np.load(os.path.join(self.path, part["file"])) as npz:
+                created = npz["created_at"] if since is not None else None
+                keep = created >= since.timestamp() if since is not None else None
+                out = {}
+                for column in columns:
+                    values = npz[column]
+                    out[column] = values[keep] if keep is not None else values
+            yield out
+
+    def read(self, columns=COLUMNS, days=None):
+        """All rows (of ``columns``) as one dict of concatenated arrays."""
+        parts = list(self.iter_partitions(columns, days=days))
+        if not parts:
+            return {column: np.zeros(0, dtype=_DTYPES[column]) for column in columns}
+        return {column: np.concatenate([p[column] for p in parts]) for column in columns}
+
+    def action_code(self, action):
+        """uint8 code of ``action`` in this snapshot (None if never exported)."""
+        try:
+            return self.actions.index(action)
+        except ValueError:
+            return None
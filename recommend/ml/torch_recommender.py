@@ -1,9 +1,13 @@
 import os
-import random
-from collections import defaultdict
+import uuid
 
 from django.conf import settings
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 try:
     import torch
     import torch.nn as nn
@@ -20,6 +24,8 @@ MODEL_DIR = getattr(
 )
 os.makedirs(MODEL_DIR, exist_ok=True)
 MODEL_PATH = os.path.join(MODEL_DIR, "torch_recommender.pt")
+ANN_MIN_ITEMS = getattr(settings, "RECOMMEND_ANN_MIN_ITEMS", 2000)
+ARTIFACT_DTYPE = getattr(settings, "RECOMMEND_ARTIFACT_DTYPE", "float32")
 
 
 if nn is not None:
@@ -41,26 +47,6 @@ else:
     MFModel = None
 
 
-def _build_maps(interactions_qs):
-    user_map = {}
-    item_map = {}
-    items_by_user = defaultdict(set)
-    for r in interactions_qs:
-        try:
-            uid = int(r.user_id)
-            key = (
-                f"{r.content_type.app_label}.{r.content_type.model}:{int(r.object_id)}"
-            )
-        except Exception:
-            continue
-        if uid not in user_map:
-            user_map[uid] = len(user_map)
-        if key not in item_map:
-            item_map[key] = len(item_map)
-        items_by_user[uid].add(item_map[key])
-    return user_map, item_map, items_by_user
-
-
 def _require_torch():
     if torch is None or nn is None or optim is None or MFModel is None:
         raise ImportError(
@@ -69,91 +55,48 @@ def _require_torch():
 
 
 def train_and_save(
-    days=None, emb_dim=64, epochs=6, lr=0.01, model_path=MODEL_PATH, batch_size=1024
+    days=None,
+    emb_dim=64,
+    epochs=6,
+    lr=0.01,
+    model_path=MODEL_PATH,
+    batch_size=1024,
+    snapshot=None,
+    register_items=True,
 ):
+    """
+    Train the matrix factorization model and save it to ``model_path``.
+
+    The registry item id of every item is saved with the model (new items
+    are registered); ``register_items=False`` saves -1 instead, for
+    synthetic data such as the benchmark's that must not reach the table.
+    """
     _require_torch()
 
     # lazy import to avoid requiring Django models at module import time
-    from recommend.models import Interaction
+    from .dataset import load_training_data
 
-    qs = Interaction.objects.all().select_related("content_type")
-    if days:
-        from django.utils import timezone
-
-        cutoff = timezone.now() - timezone.timedelta(days=int(days))
-        # Interaction model uses 'created_at' as the timestamp field
-        qs = qs.filter(created_at__gte=cutoff)
-
-    user_map, item_map, items_by_user = _build_maps(qs)
-    if not user_map or not item_map:
-        return None
-    n_users = len(user_map)
-    n_items = len(item_map)
-    # Prepare positive pairs
-    pos_pairs = []
-    for r in qs:
-        try:
-            u = user_map[int(r.user_id)]
-            k = f"{r.content_type.app_label}.{r.content_type.model}:{int(r.object_id)}"
-            i = item_map.get(k)
-            if i is None:
-                continue
-            pos_pairs.append((u, i))
-        except Exception:
-            continue
-
-    if not pos_pairs:
+    data = load_training_data(days=days, snapshot=snapshot)
+    if data is None or data.n_users == 0 or data.n_items == 0:
         return None
+    user_map = data.user_map()
+    item_map = data.item_map()
+    n_users = data.n_users
+    n_items = data.n_items
+    from .sampling import PositiveIndex, epoch_batches
+
+    positives = PositiveIndex(data.user_idx, data.item_idx, n_users, n_items)
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model = MFModel(n_users, n_items, emb_dim).to(device)
     opt = optim.Adam(model.parameters(), lr=lr, weight_decay=1e-5)
-    user_pos = defaultdict(list)
-    for u, i in pos_pairs:
-        user_pos[u].append(i)
-    users = list(user_pos.keys())
-    all_items = list(range(n_items))
     loss_fn = nn.MarginRankingLoss(margin=0.1)
     model.train()
     for epoch in range(epochs):
-        random.shuffle(users)
         epoch_loss = 0.0
         steps = 0
-        batch = []
-        for u in users:
-            pos_list = user_pos[u]
-            if not pos_list:
-                continue
-            for pos in pos_list:
-                neg = random.choice(all_items)
-                # simple negative sampling
-                while neg in pos_list:
-                    neg = random.choice(all_items)
-                batch.append((u, pos, neg))
-                if len(batch) >= batch_size:
-                    us = torch.tensor(
-                        [b[0] for b in batch], dtype=torch.long, device=device
-                    )
-                    ips = torch.tensor(
-                        [b[1] for b in batch], dtype=torch.long, device=device
-                    )
-                    ins = torch.tensor(
-                        [b[2] for b in batch], dtype=torch.long, device=device
-                    )
-                    pos_scores = model(us, ips)
-                    neg_scores = model(us, ins)
-                    target = torch.ones_like(pos_scores, device=device)
-                    loss = loss_fn(pos_scores, neg_scores, target)
-                    opt.zero_grad()
-                    loss.backward()
-                    opt.step()
-                    epoch_loss += loss.item()
-                    steps += 1
-                    batch = []
-        if batch:
-            us = torch.tensor([b[0] for b in batch], dtype=torch.long, device=device)
-            ips = torch.tensor([b[1] for b in batch], dtype=torch.long, device=device)
-            ins = torch.tensor([b[2] for b in batch], dtype=torch.long, device=device)
+        for us, ips, ins in epoch_batches(data.user_idx, data.item_idx, positives, batch_size):
+            us, ips, ins = us.to(device), ips.to(device), ins.to(device)
             pos_scores = model(us, ips)
             neg_scores = model(us, ins)
             target = torch.ones_like(pos_scores, device=device)
@@ -173,8 +116,29 @@ def train_and_save(
         "item_map": item_map,
         "item_keys": {v: k for k, v in item_map.items()},
         "emb_dim": emb_dim,
+        "version": uuid.uuid4().hex,
     }
-    torch.save(payload, model_path)
+    payload["item_ids"] = torch.from_numpy(
+        data.item_ids() if register_items else np.full(data.n_items, -1, dtype=np.int64)
+    )
+    tmp_path = f"{model_path}.tmp"
+    torch.save(payload, tmp_path)
+    os.replace(tmp_path, model_path)
+    index = None
+    try:
+        from .ann import IVFIndex, ann_index_path
+
+        item_vectors = model.item_emb.weight.detach().cpu().float().numpy()
+        index = IVFIndex.build(item_vectors, version=payload["version"])
+        index.save(ann_index_path(model_path))
+    except Exception as e:
+        print(f"[WARN] ANN index not built: {e}")
+    try:
+        from .artifact import write_artifact
+
+        write_artifact(payload, model_path, dtype=ARTIFACT_DTYPE, index=index)
+    except Exception as e:
+        print(f"[WARN] Memory-mapped artifact not written: {e}")
     return model_path
 
 
@@ -193,6 +157,12 @@ def recommend_for_user(user_id, model=None, topn=20, exclude_seen=True):
         return []
     
     if model is None:
+        from .artifact import artifact_path, load_artifact
+
+        # Prefer the memory-mapped artifact shared by all worker processes
+        artifact = load_artifact(artifact_path(MODEL_PATH))
+        if artifact is not None:
+            return _recommend_from_artifact(artifact, user_id, topn)
         model = load_model()
         if model is None:
             return []
@@ -210,24 +180,50 @@ def recommend_for_user(user_id, model=None, topn=20, exclude_seen=True):
         return [(item_keys[i], 0.5) for i in range(min(topn, n_items))]
     
     try:
-        emb_dim = model.get("emb_dim", 64)
-        m = MFModel(len(user_map), len(item_map), emb_dim)
-        m.load_state_dict(model["state_dict"])
-        m.eval()
-        
-        with torch.no_grad():
-            uidx = user_map[user_id]
-            uvec = m.user_emb(torch.tensor([uidx], dtype=torch.long)).squeeze(0)
-            item_embs = m.item_emb.weight
-            scores = torch.mv(item_embs, uvec).numpy()
-        
-        idxs = list(range(len(scores)))
-        idxs.sort(key=lambda i: -scores[i])
-        
-        out = []
-        for i in idxs[:topn]:
-            out.append((item_keys[i], float(scores[i])))
-        return out
+        state = model["state_dict"]
+        uvec = state["user_emb.weight"][user_map[user_id]].detach().cpu().float().numpy()
+        index = _load_item_index(model, n_items)
+        if index is not None:
+            idxs, scores = index.search(uvec, topn)
+        else:
+            scores = state["item_emb.weight"].detach().cpu().float().numpy() @ uvec
+            idxs = np.argsort(-scores)[:topn]
+            scores = scores[idxs]
+        return [(item_keys[int(i)], float(sc)) for i, sc in zip(idxs, scores)]
     except Exception as e:
         # Fallback on error
         return [(item_keys[i], 0.5) for i in range(min(topn, n_items))]
+
+
+def _recommend_from_artifact(artifact, user_id, topn):
+    """``recommend_for_user`` over a memory-mapped artifact."""
+    item_keys = artifact.item_keys
+    n_items = len(item_keys)
+    uidx = artifact.user_map.get(user_id)
+    if uidx is None:
+        return [(str(item_keys[i]), 0.5) for i in range(min(topn, n_items))]
+    try:
+        uvec = np.asarray(artifact.array("user_emb.weight")[uidx], dtype=np.float32)
+        item_emb = artifact.array("item_emb.weight")
+        index = artifact.ann_index(item_emb) if n_items >= ANN_MIN_ITEMS else None
+        if index is not None and len(index) == n_items:
+            idxs, scores = index.search(uvec, topn)
+        else:
+            scores = np.asarray(item_emb @ uvec, dtype=np.float32)
+            idxs = np.argsort(-scores)[:topn]
+            scores = scores[idxs]
+        return [(str(item_keys[int(i)]), float(sc)) for i, sc in zip(idxs, scores)]
+    except Exception:
+        return [(str(item_keys[i]), 0.5) for i in range(min(topn, n_items))]
+
+
+def _load_item_index(model, n_items, model_path=MODEL_PATH):
+    """ANN index saved with ``model`` when the catalogue is large enough."""
+    if n_items < ANN_MIN_ITEMS:
+        return None
+    from .ann import ann_index_path, load_index
+
+    index = load_index(ann_index_path(model_path))
+    if index is None or index.version != model.get("version") or len(index) != n_items:
+        return None
+    return index
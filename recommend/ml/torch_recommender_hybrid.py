@@ -8,8 +8,9 @@ Enhanced recommendation engine combining:
 """
 
 import os
-from collections import defaultdict
-import random
+import time
+import uuid
+from contextlib import nullcontext
 from datetime import timedelta
 
 from django.conf import settings
@@ -38,7 +39,35 @@ MODEL_DIR = getattr(
     os.path.join(settings.BASE_DIR, "data", "recommend"),
 )
 os.makedirs(MODEL_DIR, exist_ok=True)
-MODEL_PATH = os.path.join(MODEL_DIR, "torch_recommender_hybrid.pt")
+# Versioned model registry (see ``model_registry``); MODEL_PATH follows its
+# "current" pointer
+REGISTRY_DIR = getattr(
+    settings, "RECOMMEND_MODEL_REGISTRY_DIR", os.path.join(MODEL_DIR, "hybrid")
+)
+MODEL_PATH = os.path.join(REGISTRY_DIR, "current", "model.pt")
+# Single-file model written before the registry; served until one is registered
+LEGACY_MODEL_PATH = os.path.join(MODEL_DIR, "torch_recommender_hybrid.pt")
+# Catalogues at least this large are served from the ANN index
+ANN_MIN_ITEMS = getattr(settings, "RECOMMEND_ANN_MIN_ITEMS", 2000)
+# Storage of embedding matrices in the mmap artifact: float32, float16 or int8
+ARTIFACT_DTYPE = getattr(settings, "RECOMMEND_ARTIFACT_DTYPE", "float32")
+
+# Intra-op threads for the CPU profiles (default: half the cores, leaving
+# room for the other Celery workers on the box)
+TRAINING_THREADS = getattr(
+    settings, "RECOMMEND_TRAINING_THREADS", max(1, (os.cpu_count() or 2) // 2)
+)
+# "default" keeps dense embeddings and torch's thread defaults.  The CPU
+# profiles use sparse embedding gradients (SparseAdam only touches the rows
+# in the batch), pinned thread counts and, for "cpu-bf16", bfloat16 autocast.
+TRAINING_PROFILES = {
+    "default": {"sparse": False, "bf16": False, "threads": None, "interop_threads": None},
+    "cpu": {"sparse": True, "bf16": False, "threads": TRAINING_THREADS, "interop_threads": 1},
+    "cpu-bf16": {"sparse": True, "bf16": True, "threads": TRAINING_THREADS, "interop_threads": 1},
+}
+TRAINING_PROFILE = getattr(settings, "RECOMMEND_TRAINING_PROFILE", "default")
+# Data-parallel worker processes for training (1 = train in this process)
+TRAINING_PROCESSES = getattr(settings, "RECOMMEND_TRAINING_PROCESSES", 1)
 
 
 def _require_deps(strict=True):
@@ -56,12 +85,15 @@ if nn is not None:
     class HybridRecommenderModel(nn.Module):
         """Enhanced MF with optional content embeddings and regularization."""
 
-        def __init__(self, n_users, n_items, emb_dim=128, content_emb_dim=64, dropout=0.2):
+        def __init__(
+            self, n_users, n_items, emb_dim=128, content_emb_dim=64, dropout=0.2, sparse=False
+        ):
             super().__init__()
-            self.user_emb = nn.Embedding(n_users, emb_dim)
-            self.item_emb = nn.Embedding(n_items, emb_dim)
+            # sparse=True gives row-sparse gradients (train with SparseAdam)
+            self.user_emb = nn.Embedding(n_users, emb_dim, sparse=sparse)
+            self.item_emb = nn.Embedding(n_items, emb_dim, sparse=sparse)
             # Content-based embeddings (category/tag vectors)
-            self.content_emb = nn.Embedding(n_items, content_emb_dim)
+            self.content_emb = nn.Embedding(n_items, content_emb_dim, sparse=sparse)
             
             self.dropout = nn.Dropout(dropout)
             self.bn_user = nn.BatchNorm1d(emb_dim)
@@ -106,38 +138,211 @@ if nn is not None:
                 return 0.7 * collab_score + 0.3 * content_score
             return collab_score
 
+    class PairwiseScores(nn.Module):
+        """Positive and negative scores in one forward (one DDP forward per step)."""
+
+        def __init__(self, model, use_content=False):
+            super().__init__()
+            self.model = model
+            self.use_content = use_content
+
+        def forward(self, u_idx, pos_idx, neg_idx):
+            return (
+                self.model(u_idx, pos_idx, use_content=self.use_content),
+                self.model(u_idx, neg_idx, use_content=self.use_content),
+            )
+
 else:
     HybridRecommenderModel = None
+    PairwiseScores = None
 
 
-def _build_maps_enhanced(interactions_qs, content_features=None):
-    """Build user/item maps with optional content metadata."""
-    user_map = {}
-    item_map = {}
-    items_by_user = defaultdict(set)
-    item_metadata = {}  # Store tags, categories, etc.
-    
-    for r in interactions_qs:
+def hybrid_item_matrix(item_emb, content_emb, collab_weight=0.7, content_weight=0.3):
+    """
+    Fold collaborative and content item embeddings into one scoring matrix.
+
+    ``0.7 * item.u + 0.3 * content.u[:content_dim]`` equals ``E.u`` with
+    ``E = 0.7 * item + 0.3 * [content, 0]``, so the hybrid score is a single
+    inner product and can be served from one ANN index.
+    """
+    item_emb = np.asarray(item_emb, dtype=np.float32)
+    content_emb = np.asarray(content_emb, dtype=np.float32)
+    matrix = collab_weight * item_emb
+    matrix[:, : content_emb.shape[1]] += content_weight * content_emb
+    return np.ascontiguousarray(matrix, dtype=np.float32)
+
+
+def build_ann_index(payload, model_path):
+    """Build, persist and return the IVF index for a saved hybrid payload."""
+    from .ann import IVFIndex, ann_index_path
+
+    state = payload["state_dict"]
+    matrix = hybrid_item_matrix(
+        state["item_emb.weight"].detach().cpu().float().numpy(),
+        state["content_emb.weight"].detach().cpu().float().numpy(),
+    )
+    index = IVFIndex.build(matrix, version=payload.get("version"))
+    index.save(ann_index_path(model_path))
+    return index
+
+
+def resolve_training_profile(profile=None, **overrides):
+    """Options of a named training profile with explicit (non-None) overrides applied."""
+    name = profile or TRAINING_PROFILE
+    if name not in TRAINING_PROFILES:
+        raise ValueError(f"Unknown training profile: {name}")
+    options = dict(TRAINING_PROFILES[name])
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return options
+
+
+def _set_threads(threads, interop_threads):
+    """Pin torch thread pools; returns the previous intra-op thread count."""
+    previous = torch.get_num_threads()
+    if threads:
+        torch.set_num_threads(int(threads))
+    if interop_threads:
         try:
-            uid = int(r.user_id)
-            key = (
-                f"{r.content_type.app_label}.{r.content_type.model}:{int(r.object_id)}"
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work in a process
+            pass
+    return previous
+
+
+def _optimizers(model, lr, sparse):
+    """AdamW for everything, or SparseAdam for embeddings + AdamW for the rest."""
+    if not sparse:
+        return [optim.AdamW(model.parameters(), lr=lr, weight_decay=1e-4)]
+    embeddings = [module.weight for module in model.modules() if isinstance(module, nn.Embedding)]
+    embedding_ids = {id(p) for p in embeddings}
+    dense = [p for p in model.parameters() if id(p) not in embedding_ids]
+    return [
+        optim.SparseAdam(embeddings, lr=lr),
+        optim.AdamW(dense, lr=lr, weight_decay=1e-4),
+    ]
+
+
+def _fit_hybrid(
+    data,
+    pos_users,
+    pos_items,
+    pos_weights,
+    emb_dim,
+    content_emb_dim,
+    epochs,
+    lr,
+    batch_size,
+    use_content,
+    num_workers,
+    options,
+    epoch_time_budget,
+    rank=0,
+    world_size=1,
+    seed=0,
+):
+    """
+    Train and return a ``HybridRecommenderModel``.
+
+    With ``world_size`` > 1 this runs inside a ``torch.distributed`` process
+    group: the positives are sharded by rank, gradients are all-reduced by
+    ``DistributedDataParallel`` and every rank runs the same number of steps.
+    """
+    from .distributed import all_reduce_sum, any_rank
+    from .sampling import PositiveIndex, WeightedBatchSampler, batch_loader
+
+    n_users, n_items = data.n_users, data.n_items
+    n_samples = len(pos_users)
+    batch_sample_size = min(batch_size, max(1, n_samples // world_size))
+    steps_per_epoch = max(
+        1, (n_samples + batch_sample_size * world_size - 1) // (batch_sample_size * world_size)
+    )
+    sampler_seed = None
+    if world_size > 1:
+        # Same permutation everywhere, so the shards are disjoint
+        order = np.random.default_rng(seed).permutation(n_samples)[rank::world_size]
+        pos_users, pos_items, pos_weights = pos_users[order], pos_items[order], pos_weights[order]
+        torch.manual_seed(seed)
+        sampler_seed = seed * 1000 + rank
+
+    device = torch.device("cuda" if torch.cuda.is_available() and world_size == 1 else "cpu")
+    model = HybridRecommenderModel(
+        n_users, n_items, emb_dim, content_emb_dim, sparse=options["sparse"]
+    ).to(device)
+    scorer = PairwiseScores(model, use_content=use_content)
+    if world_size > 1:
+        from torch.nn.parallel import DistributedDataParallel
+
+        # content_emb gets no gradient without use_content
+        scorer = DistributedDataParallel(scorer, find_unused_parameters=not use_content)
+    optimizers = _optimizers(model, lr, options["sparse"])
+    loss_fn = nn.MarginRankingLoss(margin=0.2, reduction="none")
+    autocast = (
+        torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+        if options["bf16"]
+        else nullcontext()
+    )
+
+    sampler = WeightedBatchSampler(
+        pos_users,
+        pos_items,
+        pos_weights,
+        PositiveIndex(data.user_idx, data.item_idx, n_users, n_items),
+        batch_sample_size,
+        steps_per_epoch,
+        seed=sampler_seed,
+    )
+
+    model.train()
+    for epoch in range(epochs):
+        epoch_loss = 0.0
+        steps = 0
+        samples = 0
+        started = time.perf_counter()
+        out_of_time = False
+        for us, ips, ins, batch_weights in batch_loader(sampler, num_workers):
+            us, ips, ins = us.to(device), ips.to(device), ins.to(device)
+
+            with autocast:
+                pos_scores, neg_scores = scorer(us, ips, ins)
+            pos_scores, neg_scores = pos_scores.float(), neg_scores.float()
+            target = torch.ones_like(pos_scores, device=device)
+            sample_weights = batch_weights.to(device).clamp(0.2, 3.0)
+            loss_values = loss_fn(pos_scores, neg_scores, target)
+            loss = (loss_values * sample_weights).mean()
+            for opt in optimizers:
+                opt.zero_grad()
+            loss.backward()
+            for opt in optimizers:
+                opt.step()
+
+            epoch_loss += loss.item()
+            steps += 1
+            samples += len(us)
+            if epoch_time_budget is not None:
+                over = time.perf_counter() - started >= epoch_time_budget
+                if world_size > 1:
+                    over = any_rank(over)
+                if over:
+                    out_of_time = steps < steps_per_epoch
+                    break
+
+        elapsed = time.perf_counter() - started
+        avg_loss = epoch_loss / max(1, steps)
+        if world_size > 1:
+            avg_loss, samples = all_reduce_sum([avg_loss, samples])
+            avg_loss /= world_size
+        if rank == 0:
+            note = f" (time budget hit after {steps}/{steps_per_epoch} steps)" if out_of_time else ""
+            print(
+                f"Epoch {epoch+1}/{epochs} avg_loss={avg_loss:.4f} "
+                f"samples/s={samples / max(elapsed, 1e-9):.0f}{note}"
             )
-        except Exception:
-            continue
-        
-        if uid not in user_map:
-            user_map[uid] = len(user_map)
-        if key not in item_map:
-            item_map[key] = len(item_map)
-        
-        items_by_user[uid].add(item_map[key])
-        
-        # Optionally store metadata
-        if content_features and key in content_features:
-            item_metadata[item_map[key]] = content_features[key]
-    
-    return user_map, item_map, items_by_user, item_metadata
+    return model
+
+
+def _fit_hybrid_state(*args, **kwargs):
+    return _fit_hybrid(*args, **kwargs).state_dict()
 
 
 def train_and_save_hybrid(
@@ -149,142 +354,148 @@ def train_and_save_hybrid(
     model_path=MODEL_PATH,
     batch_size=1024,
     use_content=True,
+    num_workers=0,
+    snapshot=None,
+    profile=None,
+    sparse=None,
+    bf16=None,
+    threads=None,
+    interop_threads=None,
+    epoch_time_budget=None,
+    processes=None,
+    register_items=True,
+    promote=True,
 ):
-    """Train hybrid model with collaborative + content-based filtering."""
-    _require_deps()
+    """Train hybrid model with collaborative + content-based filtering.
 
-    from recommend.models import Interaction
-    from blog.models import Post
-    from communities.models import CommunityPost
+    ``num_workers`` > 0 assembles batches in ``torch.utils.data`` worker
+    processes instead of the training process.  ``snapshot`` reads the
+    interactions from a columnar snapshot directory instead of the database.
 
-    qs = Interaction.objects.all().select_related("content_type")
-    if days:
-        cutoff = timezone.now() - timezone.timedelta(days=int(days))
-        qs = qs.filter(created_at__gte=cutoff)
+    ``profile`` picks a ``TRAINING_PROFILES`` entry (``sparse``, ``bf16``,
+    ``threads`` and ``interop_threads`` override it).  ``epoch_time_budget``
+    ends an epoch early after that many seconds; throughput is printed per
+    epoch.
 
-    content_features = {}
-    try:
-        for post in Post.objects.all():
-            key = f"blog.post:{post.id}"
-            tags = getattr(post, 'tags', '')
-            content_features[key] = {
-                'tags': tags.split(',') if tags else [],
-                'views': post.views if hasattr(post, 'views') else 0,
-                'created_at': post.created.timestamp() if hasattr(post, 'created') else 0
-            }
-    except Exception:
-        pass
-    
-    try:
-        for post in CommunityPost.objects.all():
-            key = f"communities.communitypost:{post.id}"
-            tags = getattr(post, 'tags', '')
-            content_features[key] = {
-                'tags': tags.split(',') if tags else [],
-                'likes': post.likes.count() if hasattr(post, 'likes') else 0,
-                'created_at': post.created_at.timestamp() if hasattr(post, 'created_at') else 0
-            }
-    except Exception:
-        pass
+    ``processes`` > 1 trains data-parallel in that many forked processes
+    (``torch.distributed`` over gloo, see ``distributed.py``); the threads
+    setting then applies per process.
 
-    user_map, item_map, items_by_user, item_metadata = _build_maps_enhanced(
-        qs, content_features
+    The registry item id of every item is saved with the model (see
+    ``recommend.registry``); ``register_items=False`` saves -1 instead, for
+    synthetic data.
+
+    When ``model_path`` is a model registry's ``current`` pointer (the
+    default ``MODEL_PATH``) the model is written as a new registry version
+    with its metrics and made current, unless ``promote=False``; the path of
+    the version's model is then returned (see ``model_registry``).
+    """
+    _require_deps()
+    started = time.time()
+    options = resolve_training_profile(
+        profile, sparse=sparse, bf16=bf16, threads=threads, interop_threads=interop_threads
     )
-    
-    if not user_map or not item_map:
-        return None
-    
-    n_users = len(user_map)
-    n_items = len(item_map)
-    
-    pos_samples = []
-    weights = []
-    for r in qs:
-        try:
-            uid = int(r.user_id)
-            u_idx = user_map.get(uid)
-            if u_idx is None:
-                continue
-            key = f"{r.content_type.app_label}.{r.content_type.model}:{int(r.object_id)}"
-            i_idx = item_map.get(key)
-            if i_idx is None:
-                continue
-            weight = r.engagement_weight()
-            if weight <= 0:
-                continue
-            pos_samples.append((u_idx, i_idx, weight))
-            weights.append(weight)
-        except Exception:
-            continue
-
-    if not pos_samples:
+
+    from .dataset import load_item_metadata, load_training_data
+    from .seen import SeenItems
+
+    data = load_training_data(days=days, snapshot=snapshot)
+    if data is None or data.n_users == 0 or data.n_items == 0:
         return None
 
-    user_item_sets = defaultdict(set)
-    for raw_uid, item_set in items_by_user.items():
-        mapped_idx = user_map.get(raw_uid)
-        if mapped_idx is not None:
-            user_item_sets[mapped_idx] = set(item_set)
+    user_map = data.user_map()
+    item_map = data.item_map()
+    item_metadata = load_item_metadata(data.item_keys)
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = HybridRecommenderModel(n_users, n_items, emb_dim, content_emb_dim).to(device)
-    opt = optim.AdamW(model.parameters(), lr=lr, weight_decay=1e-4)
-    loss_fn = nn.MarginRankingLoss(margin=0.2, reduction="none")
-    
-    all_items = list(range(n_items))
-    batch_sample_size = min(batch_size, len(pos_samples))
-    steps_per_epoch = max(1, (len(pos_samples) + batch_sample_size - 1) // batch_sample_size)
+    positive = data.weight > 0
+    pos_users = data.user_idx[positive]
+    pos_items = data.item_idx[positive]
+    pos_weights = data.weight[positive]
+    if len(pos_users) == 0:
+        return None
 
-    model.train()
-    for epoch in range(epochs):
-        epoch_loss = 0.0
-        steps = 0
-        for _ in range(steps_per_epoch):
-            batch_indices = random.choices(range(len(pos_samples)), weights=weights, k=batch_sample_size)
-            batch = [pos_samples[idx] for idx in batch_indices]
-            us = torch.tensor([entry[0] for entry in batch], dtype=torch.long, device=device)
-            ips = torch.tensor([entry[1] for entry in batch], dtype=torch.long, device=device)
-            neg_items = []
-            for entry in batch:
-                user_idx = entry[0]
-                positives = user_item_sets.get(user_idx, set())
-                neg = random.choice(all_items)
-                attempts = 0
-                while neg in positives and attempts < 5:
-                    neg = random.choice(all_items)
-                    attempts += 1
-                neg_items.append(neg)
-            ins = torch.tensor(neg_items, dtype=torch.long, device=device)
-            
-            pos_scores = model(us, ips, use_content=use_content)
-            neg_scores = model(us, ins, use_content=use_content)
-            target = torch.ones_like(pos_scores, device=device)
-            sample_weights = torch.tensor(
-                [entry[2] for entry in batch], dtype=torch.float32, device=device
-            ).clamp(0.2, 3.0)
-            loss_values = loss_fn(pos_scores, neg_scores, target)
-            loss = (loss_values * sample_weights).mean()
-            opt.zero_grad()
-            loss.backward()
-            opt.step()
-            
-            epoch_loss += loss.item()
-            steps += 1
-        
-        avg_loss = epoch_loss / max(1, steps)
-        print(f"Epoch {epoch+1}/{epochs} avg_loss={avg_loss:.4f}")
+    fit_args = (
+        data,
+        pos_users,
+        pos_items,
+        pos_weights,
+        emb_dim,
+        content_emb_dim,
+        epochs,
+        lr,
+        batch_size,
+        use_content,
+        num_workers,
+        options,
+        epoch_time_budget,
+    )
+    processes = min(int(processes or TRAINING_PROCESSES), len(pos_users))
+    if processes > 1:
+        from .distributed import run_data_parallel
+
+        print(f"[INFO] Training data-parallel in {processes} processes (gloo)")
+        state_dict = run_data_parallel(
+            _fit_hybrid_state, processes, *fit_args, threads=options["threads"]
+        )
+    else:
+        previous_threads = _set_threads(options["threads"], options["interop_threads"])
+        try:
+            state_dict = _fit_hybrid_state(*fit_args)
+        finally:
+            torch.set_num_threads(previous_threads)
 
     payload = {
-        "state_dict": model.state_dict(),
+        "state_dict": state_dict,
         "user_map": user_map,
         "item_map": item_map,
         "item_keys": {v: k for k, v in item_map.items()},
         "item_metadata": item_metadata,
         "emb_dim": emb_dim,
         "content_emb_dim": content_emb_dim,
+        "version": uuid.uuid4().hex,
     }
-    torch.save(payload, model_path)
+    from .model_registry import registry_for
+
+    registry = registry_for(model_path)
+    if registry is not None:
+        model_path = registry.stage(payload["version"])
+    # Per-user consumed items for exclude_seen at serving time
+    payload.update(
+        SeenItems.from_pairs(data.user_idx, data.item_idx, data.n_users, data.n_items).payload()
+    )
+    payload["item_ids"] = torch.from_numpy(
+        data.item_ids() if register_items else np.full(data.n_items, -1, dtype=np.int64)
+    )
+    # Write to a temp file and rename so serving workers never read a partial file
+    tmp_path = f"{model_path}.tmp"
+    torch.save(payload, tmp_path)
+    os.replace(tmp_path, model_path)
+    index = None
+    try:
+        index = build_ann_index(payload, model_path)
+    except Exception as e:
+        print(f"[WARN] ANN index not built: {e}")
+    try:
+        from .artifact import write_artifact
+
+        write_artifact(payload, model_path, dtype=ARTIFACT_DTYPE, index=index)
+    except Exception as e:
+        print(f"[WARN] Memory-mapped artifact not written: {e}")
     print(f"[OK] Hybrid model saved with {len(item_metadata)} content-enhanced items")
+    if registry is not None:
+        metrics = {
+            "users": data.n_users,
+            "items": data.n_items,
+            "positives": int(len(pos_users)),
+            "epochs": epochs,
+            "emb_dim": emb_dim,
+            "content_emb_dim": content_emb_dim,
+            "train_seconds": round(time.time() - started, 3),
+        }
+        registry.commit(payload["version"], metrics, promote=promote)
+        model_path = registry.model_path(payload["version"])
+        state = "current" if promote else "not promoted"
+        print(f"[OK] Registered model version {payload['version']} ({state})")
     return model_path
 
 
@@ -305,155 +516,192 @@ def recommend_for_user_hybrid(
     diversity_penalty=0.15,
     freshness_boost=True,
     allowed_content=None,
+    as_item_ids=False,
+    publish_foldin=True,
 ):
     """
     Enhanced recommendations with:
-    - Diversity: penalize similar items in top-N
+    - Diversity: MMR re-ranking over normalized item embeddings
     - Freshness: boost recent items
-    - Cold-start: fallback to popular items for new users
+    - Content filtering: precomputed per-type index masks
+    - Seen items: ``exclude_seen`` drops items in the user's seen set (trained
+      CSR row plus interactions since the retrain) before top-K selection
+    - Cold-start: users missing from the model are folded in online;
+      without any interactions they fall back to popular items
+
+    Returns ``(key, score)`` pairs with "app.model:id" keys, or registry item
+    ids with ``as_item_ids`` (items without an id keep their key).
+    ``publish_foldin=False`` keeps fold-in read-only, for scoring with a
+    model that is not the one being served (shadow candidates, probes).
     """
     if not _require_deps(strict=False):
         return []
     
+    from .seen import seen_item_indices, unseen_mask
+    from .serving import HybridServingModel, get_serving_model
+
     if model is None:
-        model = load_model_hybrid()
+        model = get_serving_model()
         if model is None:
             # Model not trained yet, return empty to trigger fallback
             return []
-    
+    elif not isinstance(model, HybridServingModel):
+        try:
+            model = HybridServingModel(model)
+        except (KeyError, TypeError, AttributeError, ValueError):
+            return []
+
+    # Cold-start: new users are folded in from their recent interactions
+    from .foldin import folded_user_vector
+
     try:
-        user_map = model["user_map"]
-        item_map = model["item_map"]
-        item_keys = [model["item_keys"][i] for i in sorted(model["item_keys"].keys())]
-        allowed_content_set = set(allowed_content) if allowed_content else None
-
-        def _matches_allowed(app_label, model_name):
-            if not allowed_content_set:
-                return True
-            candidate = f"{app_label}.{model_name}"
-            if candidate in allowed_content_set:
-                return True
-            return app_label in allowed_content_set
-        item_metadata = model.get("item_metadata", {})
-        n_items = len(item_map)
-    except (KeyError, TypeError) as e:
-        # Model structure invalid, return empty
-        return []
-    
-    # Cold-start: new user
-    if user_id not in user_map:
+        uvec = folded_user_vector(model, user_id, publish=publish_foldin)
+    except Exception:
+        uvec = model.user_vector(user_id)
+    if uvec is None:
         # Return empty to trigger fallback to collaborative/content-based
         return []
-    
+
     try:
-        emb_dim = model.get("emb_dim", 128)
-        content_emb_dim = model.get("content_emb_dim", 64)
-        
-        m = HybridRecommenderModel(len(user_map), len(item_map), emb_dim, content_emb_dim)
-        m.load_state_dict(model["state_dict"])
-        m.eval()
-        
-        with torch.no_grad():
-            uidx = user_map[user_id]
-            uvec = m.user_emb(torch.tensor([uidx], dtype=torch.long)).squeeze(0)  # [emb_dim]
-            
-            # Collaborative score (full embedding)
-            collab_scores = torch.mv(m.item_emb.weight, uvec).numpy()
-            
-            # Content score (project user vec to content space)
-            u_content = uvec[:content_emb_dim]  # [content_emb_dim]
-            content_scores = torch.mv(m.content_emb.weight, u_content).numpy()
-            
-            # Hybrid: 70% collab + 30% content
-            scores = 0.7 * collab_scores + 0.3 * content_scores
+        mask = model.allowed_mask(allowed_content)
+        pool = max(topn * 10, 200)
+        seen = seen_item_indices(model, user_id) if exclude_seen else None
+        if seen is not None:
+            pool += len(seen)
+        cand, scores = model.candidates(uvec, pool, mask)
+        if seen is not None and len(seen):
+            keep = unseen_mask(seen, cand)
+            cand, scores = cand[keep], scores[keep]
+        if len(cand) == 0:
+            return []
+
+        # Apply freshness boost (prefer recent items)
+        if freshness_boost:
+            scores = scores * model.freshness_multipliers(timezone.now().timestamp(), cand)
+
+        # Keep a bounded pool for the diversity pass
+        pool = min(len(cand), max(topn * 5, 50))
+        if pool < len(cand):
+            top = np.argpartition(-scores, pool - 1)[:pool]
+            cand, scores = cand[top], scores[top]
+        picks = mmr_select(model.item_unit[cand], scores, topn, diversity_penalty)
     except Exception as e:
         # Model inference failed, return empty to trigger fallback
         return []
-    
-    # Apply freshness boost (prefer recent items)
-    if freshness_boost:
-        try:
-            now_ts = timezone.now().timestamp()
-            for i, key in enumerate(item_keys):
-                try:
-                    meta = item_metadata.get(i, {})
-                    created_at = meta.get('created_at', 0)
-                    if created_at > 0:
-                        age_days = (now_ts - created_at) / 86400.0
-                        if age_days < 7:
-                            # Boost items from last 7 days significantly
-                            scores[i] *= (1.0 + 0.5 * (1 - age_days / 7))
-                        elif age_days < 30:
-                            # Boost items from last 30 days slightly
-                            scores[i] *= (1.0 + 0.2 * (1 - age_days / 30))
-                except Exception:
-                    pass
-        except Exception:
-            pass
-    
-    # Apply diversity penalty (suppress similar items)
-    try:
-        idxs = list(range(len(scores)))
-        idxs.sort(key=lambda i: -scores[i])
-        
-        selected = []
-        selected_indices = set()
-        
-        for idx in idxs:
-            if len(selected) >= topn:
-                break
-            
-            key = item_keys[idx]
-            parts = key.split(":", 1)
-            if len(parts) != 2:
-                continue
-            app_model = parts[0]
-            if "." not in app_model:
-                continue
-            app_label, model_name = app_model.split(".", 1)
-            if not _matches_allowed(app_label, model_name):
-                continue
-            
-            # Diversity check: penalize items similar to already-selected
-            if selected and diversity_penalty > 0:
-                try:
-                    current_vec = m.item_emb.weight[idx].detach().numpy()
-                    similarity_penalty = 0.0
-                    
-                    for prev_idx in selected_indices:
-                        prev_vec = m.item_emb.weight[prev_idx].detach().numpy()
-                        sim = np.dot(current_vec, prev_vec) / (
-                            np.linalg.norm(current_vec) * np.linalg.norm(prev_vec) + 1e-8
-                        )
-                        similarity_penalty = max(similarity_penalty, sim * diversity_penalty)
-                    
-                    penalized_score = scores[idx] * (1 - similarity_penalty)
-                    if penalized_score < min(s for _, s in selected) * 0.5:
-                        continue
-                except Exception:
-                    pass
-            
-            selected.append((key, float(scores[idx])))
-            selected_indices.add(idx)
-        
-        return selected
-    except Exception as e:
-        # Fallback: return top-N by score without diversity penalty
-        try:
-            idxs = list(range(len(scores)))
-            idxs.sort(key=lambda i: -scores[i])
-            selected = []
-            for idx in idxs:
-                if len(selected) >= topn:
-                    break
-                key = item_keys[idx]
-                parts = key.split(":", 1)
-                if len(parts) == 2:
-                    app_model = parts[0]
-                    if "." in app_model:
-                        app_label, model_name = app_model.split(".", 1)
-                        if _matches_allowed(app_label, model_name):
-                            selected.append((key, float(scores[idx])))
-            return selected
-        except Exception:
-            return []
+
+    if as_item_ids:
+        ids = model.item_ids
+        return [
+            (int(ids[cand[p]]), float(scores[p]))
+            if ids[cand[p]] >= 0
+            else (str(model.item_keys[int(cand[p])]), float(scores[p]))
+            for p in picks
+        ]
+    return [(str(model.item_keys[int(cand[p])]), float(scores[p])) for p in picks]
+
+
+def mmr_select(unit_vectors, scores, topn, diversity_penalty=0.15):
+    """
+    Maximal Marginal Relevance over pre-normalized embedding rows.
+
+    Greedily picks ``argmax(lambda * relevance - (1 - lambda) * max_sim)`` with
+    ``lambda = 1 - diversity_penalty``, relevance being the min-max scaled
+    score and ``max_sim`` the cosine similarity to the closest item already
+    picked.  Returns positions into ``scores``, in pick order.
+    """
+    n = len(scores)
+    k = min(topn, n)
+    if k <= 0:
+        return []
+    if diversity_penalty <= 0:
+        order = np.argsort(-scores, kind="stable")
+        return order[:k].tolist()
+
+    lam = 1.0 - diversity_penalty
+    lo, hi = float(scores.min()), float(scores.max())
+    relevance = (scores - lo) / (hi - lo) if hi > lo else np.ones(n, dtype=np.float32)
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    picks = []
+    for _ in range(k):
+        if picks:
+            mmr = lam * relevance - (1.0 - lam) * max_sim
+        else:
+            mmr = relevance.astype(np.float32, copy=True)
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        picks.append(best)
+        available[best] = False
+        np.maximum(max_sim, unit_vectors @ unit_vectors[best], out=max_sim)
+    return picks
+
+
+def recommend_for_users_hybrid(
+    user_ids=None,
+    model=None,
+    topn=20,
+    block_size=512,
+    freshness_boost=True,
+    exclude_seen=False,
+):
+    """
+    Batch inference: score blocks of users against the item matrix.
+
+    Each block costs one matrix product plus an ``argpartition`` for the
+    top-N, instead of a full Python sort per user.  Yields
+    ``(user_id, item_indices, scores)`` with indices into ``model.item_keys``,
+    best first.  Users unknown to the model are skipped.  The per-request
+    diversity pass is not applied here.  ``exclude_seen`` masks each user's
+    trained seen set out of the block before selection (rows may then come
+    back shorter than ``topn``).
+    """
+    if not _require_deps(strict=False):
+        return
+    from .serving import get_serving_model
+
+    if model is None:
+        model = get_serving_model()
+        if model is None:
+            return
+
+    if user_ids is None:
+        user_ids = list(model.user_map.keys())
+    known = [(uid, model.user_map[uid]) for uid in user_ids if uid in model.user_map]
+    if not known or model.n_items == 0:
+        return
+
+    k = min(topn, model.n_items)
+    boost = (
+        model.freshness_multipliers(timezone.now().timestamp()) if freshness_boost else None
+    )
+    for start in range(0, len(known), block_size):
+        block = known[start : start + block_size]
+        rows = np.fromiter((uidx for _, uidx in block), dtype=np.int64, count=len(block))
+        scores = model.score_matrix(model.user_emb[rows])
+        if boost is not None:
+            scores *= boost
+        seen = getattr(model, "seen", None) if exclude_seen else None
+        if seen is not None:
+            lengths = np.diff(seen.indptr)[rows]
+            scores[np.repeat(np.arange(len(block)), lengths), _csr_rows(seen, rows)] = -np.inf
+        if k < model.n_items:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(model.n_items), (len(block), model.n_items))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for row, (uid, _) in enumerate(block):
+            if seen is not None:
+                valid = np.isfinite(top_scores[row])
+                yield uid, top[row][valid], top_scores[row][valid]
+            else:
+                yield uid, top[row], top_scores[row]
+
+
+def _csr_rows(seen, rows):
+    """Concatenated seen item indices of dense users ``rows``."""
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([seen.row(int(uidx)) for uidx in rows]).astype(np.int64)
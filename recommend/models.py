@@ -2,6 +2,7 @@ from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest
 
 # Game categories for user preferences
 GAME_CATEGORIES = [
@@ -104,6 +105,42 @@ class UserInterests(models.Model):
         self.completed_game_onboarding = value
 
 
+def engagement_weight_expression():
+    """
+    Database-side engagement weight of an ``Interaction`` row, for aggregates.
+
+    This is the stored ``engagement_score``; rows written before the column
+    existed and not yet backfilled fall back to ``max(value, 0.5)`` times the
+    action weight (the metadata bonus is not evaluated in SQL).
+    """
+    action_weight = models.Case(
+        *[
+            models.When(action=action, then=models.Value(weight))
+            for action, weight in ACTION_ENGAGEMENT_BASE_WEIGHTS.items()
+        ],
+        default=models.Value(1.0),
+        output_field=models.FloatField(),
+    )
+    base = Greatest(
+        Coalesce(models.F("value"), models.Value(0.5)), models.Value(0.5)
+    ) * action_weight
+    return Coalesce(models.F("engagement_score"), base, output_field=models.FloatField())
+
+
+class InteractionQuerySet(models.QuerySet):
+    def with_engagement(self):
+        """Annotate each row with its engagement weight as ``engagement``."""
+        return self.annotate(engagement=engagement_weight_expression())
+
+    def weighted_totals(self):
+        """Summed engagement per item: ``content_type_id, object_id, weight`` rows."""
+        return (
+            self.order_by()
+            .values("content_type_id", "object_id")
+            .annotate(weight=models.Sum(engagement_weight_expression()))
+        )
+
+
 class Interaction(models.Model):
     """Records that a user interacted with a game/content (play, like, view, complete)."""
 
@@ -125,18 +162,30 @@ class Interaction(models.Model):
     action = models.CharField(max_length=20, choices=ACTION_CHOICES, default="play")
     value = models.FloatField(default=1.0)
     metadata = models.JSONField(default=dict, blank=True)
+    # engagement_weight() computed at write time; NULL until backfilled
+    engagement_score = models.FloatField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = InteractionQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=["user"]),
             models.Index(fields=["content_type", "object_id"]),
             models.Index(fields=["created_at"]),
+            models.Index(fields=["engagement_score"]),
         ]
 
     def __str__(self):
         return f"{self.user_id} {self.action} {self.content_type_id}:{self.object_id}"
 
+    def save(self, *args, **kwargs):
+        self.engagement_score = self.engagement_weight()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "engagement_score" not in update_fields:
+            kwargs["update_fields"] = list(update_fields) + ["engagement_score"]
+        super().save(*args, **kwargs)
+
     def engagement_weight(self):
         weight = max(self.value or 0.5, 0.5)
         weight *= ACTION_ENGAGEMENT_BASE_WEIGHTS.get(self.action, 1.0)
@@ -159,6 +208,209 @@ class Interaction(models.Model):
         return max(0.1, weight + engagement_bonus)
 
 
+class RecommendationGeneration(models.Model):
+    """One complete batch of precomputed recommendations.
+
+    Batch jobs write into a new ``building`` generation and then flip
+    ``CurrentRecommendationGeneration`` to it, so readers never see a
+    partially written table.  Superseded generations are deleted in the
+    background.
+    """
+
+    STATUS_BUILDING = "building"
+    STATUS_READY = "ready"
+    STATUS_RETIRED = "retired"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_BUILDING, "Building"),
+        (STATUS_READY, "Ready"),
+        (STATUS_RETIRED, "Retired"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    source = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_BUILDING
+    )
+    row_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Generation {self.pk} ({self.source}, {self.status})"
+
+
+class CurrentRecommendationGeneration(models.Model):
+    """Single-row pointer to the generation readers should use."""
+
+    generation = models.ForeignKey(
+        RecommendationGeneration, null=True, on_delete=models.SET_NULL
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Current generation: {self.generation_id}"
+
+
+class ItemRegistry(models.Model):
+    """Stable dense integer id for every recommendable item.
+
+    The primary key is the item id used by the trainers, the serving model,
+    the seen-item store and hydration in place of "app.model:id" strings.
+    Rows are only ever added, so an id never changes meaning; see
+    ``recommend.registry`` for the cached lookups.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_type", "object_id"], name="recommend_item_registry_unique"
+            )
+        ]
+
+    def __str__(self):
+        return f"Item {self.pk} -> {self.content_type_id}:{self.object_id}"
+
+
+class ContentPopularity(models.Model):
+    """Materialized engagement counts and ranking scores per item.
+
+    Maintained incrementally by ``recommend.popularity.refresh_popularity``
+    so feeds and the popularity fallback rank with an indexed ORDER BY.
+    ``hot_score`` is ``ln(1 + engagement) + created / tau``: ordering by it
+    equals ordering by engagement decayed exponentially with age, without
+    rewriting rows as time passes.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    likes = models.PositiveIntegerField(default=0)
+    bookmarks = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+    # Interaction rows in the trailing window (POPULARITY_WINDOW_DAYS)
+    recent_interactions = models.PositiveIntegerField(default=0)
+    # likes + bookmarks, the all-time popularity used by the fallback layer
+    popularity = models.FloatField(default=0.0)
+    hot_score = models.FloatField(default=0.0)
+    item_created_at = models.DateTimeField(null=True, blank=True)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_type", "object_id"], name="recommend_popularity_unique"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["content_type", "-popularity"], name="recommend_popularity_idx"
+            ),
+            models.Index(fields=["content_type", "-hot_score"], name="recommend_hot_score_idx"),
+        ]
+        verbose_name_plural = "Content popularity"
+
+    def __str__(self):
+        return f"{self.content_type_id}:{self.object_id} hot={self.hot_score:.2f}"
+
+
+class PopularityDirtyItem(models.Model):
+    """An item whose likes, bookmarks or comments changed outside the
+    ``ContentPopularity`` watermarks.
+
+    Rows are only appended (duplicates are fine) and ``refresh_popularity``
+    deletes exactly the rows it processed, so concurrent marks are never
+    lost.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.content_type_id}:{self.object_id}"
+
+
+class PopularityWatermark(models.Model):
+    """Highest id ``refresh_popularity`` has processed for one source table.
+
+    ``name`` is "interaction", a comment model label or a content label (new
+    items).  Kept in the database so a cache eviction or restart does not
+    force a full recompute.
+    """
+
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+
+class JobLock(models.Model):
+    """A lease that lets one background job at a time run under ``name``.
+
+    Taken and released through ``recommend.locks``; a lease past
+    ``expires_at`` belongs to a crashed worker and may be taken over.
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    owner = models.CharField(max_length=64)
+    acquired_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} ({self.owner})"
+
+
+class PipelineRun(models.Model):
+    """One run of the scheduled recommendation pipeline (``recommend.pipeline``).
+
+    ``checkpoints`` maps each finished stage to its input watermark and the
+    artifacts it produced, so a run that crashed resumes after its last
+    completed stage and a later run can skip stages whose input is unchanged.
+    """
+
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING
+    )
+    checkpoints = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=1)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+
+    def __str__(self):
+        return f"Pipeline run {self.pk} ({self.status})"
+
+
+class RecommendationQuerySet(models.QuerySet):
+    def current(self):
+        """Rows of the published generation (legacy rows before the first one)."""
+        from .generations import current_generation_id
+
+        generation_id = current_generation_id()
+        if generation_id is None:
+            return self.filter(generation__isnull=True)
+        return self.filter(generation_id=generation_id)
+
+
 class Recommendation(models.Model):
     """Per-user precomputed recommendations."""
 
@@ -170,13 +422,23 @@ class Recommendation(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     score = models.FloatField()
+    generation = models.ForeignKey(
+        RecommendationGeneration,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="recommendations",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = RecommendationQuerySet.as_manager()
+
     class Meta:
         ordering = ["-score"]
         indexes = [
             models.Index(fields=["user"]),
             models.Index(fields=["content_type", "object_id"]),
+            models.Index(fields=["generation", "user", "-score"]),
         ]
 
     def __str__(self):
@@ -0,0 +1,389 @@
+"""
+The scheduled recommendation pipeline: snapshot -> train -> score ->
+publish -> warm.
+
+``run_pipeline()`` runs the stages in order under the ``PIPELINE_LOCK``
+lease (``recommend.locks``), so two pipelines never overlap; stages doing
+work that standalone tasks and commands also do take that work's own lock
+as well (``STAGE_LOCKS``), e.g. a manual ``train_torch_recs`` and the train
+stage exclude each other.
+
+Every finished stage is checkpointed on the ``PipelineRun`` row with its
+input watermark and output artifacts:
+
+- snapshot: input is the newest ``Interaction`` id; output the snapshot
+  directory and its watermark
+- train: input is the snapshot watermark; output the model path and version
+- score: input is the model version; output the (unpublished) generation
+- publish: input is the generation; makes it current
+- warm: input is the generation and model version; loads the serving model
+  and, if the trained version is the current one, fills the "for you"
+  cache of recently active users
+
+A stage whose input equals the one recorded by the last completed run is
+skipped and its artifacts reused, so a run without new interactions does
+no work.  A run that failed or whose worker died resumes after its last
+checkpoint on the next call (up to ``MAX_ATTEMPTS`` times).
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .generations import GenerationWriter, publish_generation
+from .locks import LOCK_TIMEOUT, LockBusy, extend_lock, job_lock
+from .models import Interaction, PipelineRun, RecommendationGeneration
+
+PIPELINE_LOCK = "recommend:pipeline"
+SNAPSHOT_LOCK = "recommend:snapshot"
+TRAIN_LOCK = "recommend:train"
+GENERATION_LOCK = "recommend:generation"
+STAGES = ("snapshot", "train", "score", "publish", "warm")
+STAGE_LOCKS = {
+    "snapshot": SNAPSHOT_LOCK,
+    "train": TRAIN_LOCK,
+    "score": GENERATION_LOCK,
+    "publish": GENERATION_LOCK,
+}
+# Times a failed run is resumed before the next call starts a fresh one
+MAX_ATTEMPTS = 3
+
+DEFAULT_OPTIONS = {
+    "snapshot_path": None,  # snapshot.SNAPSHOT_DIR
+    "model_path": None,  # torch_recommender_hybrid.MODEL_PATH
+    "lag": None,  # snapshot.COMMIT_LAG
+    "days": 365,
+    "epochs": 6,
+    "emb_dim": 64,
+    "content_emb_dim": 32,
+    "batch_size": 1024,
+    "topn": 50,
+    "block_size": 512,
+    "chunk_size": 5000,
+    "workers": 1,
+    # Most recently active users whose "for you" results are precomputed
+    "warm_users": 200,
+    "lock_timeout": LOCK_TIMEOUT,
+}
+
+
+def pipeline_options(**overrides):
+    """``DEFAULT_OPTIONS`` updated from ``RECOMMEND_PIPELINE`` and ``overrides``."""
+    from .ml.snapshot import COMMIT_LAG, SNAPSHOT_DIR
+    from .ml.torch_recommender_hybrid import MODEL_PATH
+
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, "RECOMMEND_PIPELINE", {}))
+    options.update(overrides)
+    if options["snapshot_path"] is None:
+        options["snapshot_path"] = SNAPSHOT_DIR
+    if options["model_path"] is None:
+        options["model_path"] = MODEL_PATH
+    if options["lag"] is None:
+        options["lag"] = COMMIT_LAG
+    return options
+
+
+def _score_user_shard(model_path, user_ids, topn, block_size):
+    """Score one shard of users in a worker process.
+
+    Workers are forked after the parent loaded the serving model, so the
+    embedding matrices are shared copy-on-write.  Only plain tuples are sent
+    back; all database writes happen in the parent.
+    """
+    from .ml.serving import get_serving_model
+    from .ml.torch_recommender_hybrid import recommend_for_users_hybrid
+
+    model = get_serving_model(model_path)
+    rows = []
+    for uid, idxs, scores in recommend_for_users_hybrid(
+        user_ids, model=model, topn=topn, block_size=block_size, exclude_seen=True
+    ):
+        rows.append((uid, idxs.tolist(), scores.tolist()))
+    return rows
+
+
+def score_generation(
+    model_path,
+    topn=50,
+    block_size=512,
+    chunk_size=5000,
+    workers=1,
+    source="train_torch_recs",
+    publish=True,
+):
+    """
+    Write the top-``topn`` of every user the model knows into a new generation.
+
+    Returns the ``GenerationWriter`` (``generation``, ``created``), or None
+    if the model cannot be loaded.  ``workers`` > 1 shards the users across
+    forked processes.
+    """
+    from .ml.serving import get_serving_model
+    from .ml.torch_recommender_hybrid import recommend_for_users_hybrid
+    from .registry import resolve
+
+    model = get_serving_model(model_path)
+    if not model:
+        return None
+
+    # (content type, object id) per item row straight from the registry ids
+    ids = model.item_ids
+    if (ids < 0).any():
+        # Pre-registry model: this is an offline job, so register its items
+        ids = model.register_items()
+    item_ct, item_oid = resolve(ids)
+    user_ids = sorted(model.user_map.keys())
+
+    with GenerationWriter(source, chunk_size, publish=publish) as writer:
+
+        def _add_rows(uid, idxs, scores):
+            for idx, score in zip(idxs, scores):
+                if item_ct[idx] < 0:
+                    continue
+                writer.add(uid, int(item_ct[idx]), int(item_oid[idx]), float(score))
+
+        if workers > 1 and len(user_ids) > block_size:
+            shard_size = (len(user_ids) + workers - 1) // workers
+            shards = [user_ids[i : i + shard_size] for i in range(0, len(user_ids), shard_size)]
+            ctx = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = [
+                    pool.submit(_score_user_shard, model_path, shard, topn, block_size)
+                    for shard in shards
+                ]
+                for future in futures:
+                    for uid, idxs, scores in future.result():
+                        _add_rows(uid, idxs, scores)
+        else:
+            for uid, idxs, scores in recommend_for_users_hybrid(
+                user_ids, model=model, topn=topn, block_size=block_size, exclude_seen=True
+            ):
+                _add_rows(uid, idxs, scores)
+    return writer
+
+
+# Stages: input(options, done) -> JSON watermark; run(options, done, log) ->
+# JSON artifacts, or None when there is nothing to do (ends the run early);
+# reusable(output) -> whether a skipped stage's recorded artifacts still exist.
+
+
+def _snapshot_input(options, done):
+    return {"interactions": Interaction.objects.aggregate(top=Max("id"))["top"] or 0}
+
+
+def _snapshot(options, done, log):
+    from .ml.snapshot import InteractionSnapshot, write_snapshot
+
+    path = options["snapshot_path"]
+    rows, partitions = write_snapshot(path, lag=options["lag"])
+    log(f"Exported {rows} interactions in {partitions} partitions")
+    return {"path": path, "watermark": InteractionSnapshot(path).watermark}
+
+
+def _train_input(options, done):
+    return {"watermark": done["snapshot"]["output"]["watermark"]}
+
+
+def _train(options, done, log):
+    from .ml.serving import get_serving_model
+    from .ml.torch_recommender_hybrid import train_and_save_hybrid
+
+    path = train_and_save_hybrid(
+        days=options["days"],
+        emb_dim=options["emb_dim"],
+        content_emb_dim=options["content_emb_dim"],
+        epochs=options["epochs"],
+        batch_size=options["batch_size"],
+        model_path=options["model_path"],
+        snapshot=done["snapshot"]["output"]["path"],
+    )
+    model = get_serving_model(path) if path else None
+    if model is None:
+        log("Nothing to train on")
+        return None
+    return {"model_path": path, "version": model.version}
+
+
+def _model_exists(output):
+    return os.path.exists(output["model_path"])
+
+
+def _score_input(options, done):
+    return {"version": done["train"]["output"]["version"]}
+
+
+def _score(options, done, log):
+    writer = score_generation(
+        done["train"]["output"]["model_path"],
+        topn=options["topn"],
+        block_size=max(1, options["block_size"]),
+        chunk_size=max(1, options["chunk_size"]),
+        workers=max(1, options["workers"]),
+        source="pipeline",
+        publish=False,
+    )
+    if writer is None:
+        raise RuntimeError("Failed to load the trained model")
+    log(f"Wrote {writer.created} recommendations (generation {writer.generation.pk})")
+    return {"generation": writer.generation.pk, "rows": writer.created}
+
+
+def _generation_exists(output):
+    return (
+        RecommendationGeneration.objects.filter(pk=output["generation"])
+        .exclude(status=RecommendationGeneration.STATUS_FAILED)
+        .exists()
+    )
+
+
+def _publish_input(options, done):
+    return {"generation": done["score"]["output"]["generation"]}
+
+
+def _publish(options, done, log):
+    generation = RecommendationGeneration.objects.get(pk=done["score"]["output"]["generation"])
+    publish_generation(generation)
+    log(f"Published generation {generation.pk}")
+    return {"generation": generation.pk}
+
+
+def _warm_input(options, done):
+    return {
+        "generation": done["publish"]["output"]["generation"],
+        "version": done["train"]["output"]["version"],
+    }
+
+
+def _warm(options, done, log):
+    from .ml.serving import get_serving_model, warm_for_you_cache
+
+    serving = get_serving_model()
+    users = []
+    # The views serve the current model only
+    if (
+        options["warm_users"]
+        and serving is not None
+        and serving.version == done["train"]["output"]["version"]
+    ):
+        users = list(
+            Interaction.objects.filter(created_at__gte=timezone.now() - timedelta(days=1))
+            .values("user_id")
+            .annotate(last=Max("created_at"))
+            .order_by("-last")
+            .values_list("user_id", flat=True)[: options["warm_users"]]
+        )
+    warmed = warm_for_you_cache(users)
+    log(f"Warmed the cache of {warmed} users")
+    return {"users": warmed}
+
+
+def _always(output):
+    return True
+
+
+STAGE_FUNCTIONS = {
+    "snapshot": (_snapshot_input, _snapshot, _always),
+    "train": (_train_input, _train, _model_exists),
+    "score": (_score_input, _score, _generation_exists),
+    "publish": (_publish_input, _publish, _generation_exists),
+    "warm": (_warm_input, _warm, _always),
+}
+
+
+def _run_stage(name, options, done, reference, log):
+    """Checkpoint dict of one stage, or None if the run should end here."""
+    get_input, run, reusable = STAGE_FUNCTIONS[name]
+    stage_input = get_input(options, done)
+    previous = reference.get(name)
+    if previous and previous["input"] == stage_input and reusable(previous["output"]):
+        log(f"{name}: input unchanged, skipped")
+        return dict(previous, skipped=True, finished_at=timezone.now().isoformat())
+
+    lock = STAGE_LOCKS.get(name)
+    with job_lock(lock, options["lock_timeout"]) if lock else nullcontext():
+        output = run(options, done, log)
+    if output is None:
+        return None
+    return {
+        "input": stage_input,
+        "output": output,
+        "skipped": False,
+        "finished_at": timezone.now().isoformat(),
+    }
+
+
+def _resumable_run():
+    """The latest run if it never completed and may be retried, else None."""
+    run = PipelineRun.objects.order_by("-pk").first()
+    if run is None or run.status == PipelineRun.STATUS_COMPLETED:
+        return None
+    if run.attempts >= MAX_ATTEMPTS:
+        if run.status == PipelineRun.STATUS_RUNNING:
+            # Its worker died; give up on it
+            run.status = PipelineRun.STATUS_FAILED
+            run.finished_at = timezone.now()
+            run.save(update_fields=["status", "finished_at"])
+        return None
+    run.attempts += 1
+    run.status = PipelineRun.STATUS_RUNNING
+    run.error = ""
+    run.save(update_fields=["attempts", "status", "error"])
+    return run
+
+
+def run_pipeline(force=False, log=None, **overrides):
+    """
+    Run the pipeline, resuming an unfinished run if there is one.
+
+    ``force`` reruns every stage even if its input is unchanged.  Returns the
+    ``PipelineRun``; raises ``LockBusy`` when another pipeline holds the lock
+    and re-raises a stage's exception after marking the run failed.
+    """
+    options = pipeline_options(**overrides)
+    log = log or (lambda message: None)
+    with job_lock(PIPELINE_LOCK, options["lock_timeout"]) as token:
+        run = _resumable_run()
+        if run is not None:
+            log(f"Resuming run {run.pk} after {', '.join(run.checkpoints) or 'no stages'}")
+        else:
+            run = PipelineRun.objects.create()
+        reference = {}
+        if not force:
+            last = (
+                PipelineRun.objects.filter(status=PipelineRun.STATUS_COMPLETED)
+                .order_by("-pk")
+                .first()
+            )
+            reference = last.checkpoints if last is not None else {}
+
+        done = run.checkpoints
+        name = None
+        try:
+            for name in STAGES:
+                if name in done:
+                    continue
+                if not extend_lock(PIPELINE_LOCK, token, options["lock_timeout"]):
+                    raise LockBusy(f"{PIPELINE_LOCK} lease was lost")
+                checkpoint = _run_stage(name, options, done, reference, log)
+                if checkpoint is None:
+                    break
+                done[name] = checkpoint
+                run.checkpoints = done
+                run.save(update_fields=["checkpoints"])
+        except Exception as e:
+            run.status = PipelineRun.STATUS_FAILED
+            run.error = f"{name}: {e}"
+            run.finished_at = timezone.now()
+            run.save(update_fields=["status", "error", "finished_at"])
+            raise
+        run.status = PipelineRun.STATUS_COMPLETED
+        run.finished_at = timezone.now()
+        run.save(update_fields=["status", "finished_at"])
+    return run
@@ -0,0 +1,316 @@
+"""
+Incremental maintenance of the ``ContentPopularity`` table.
+
+``refresh_popularity()`` recomputes the rows of items touched since the
+last run and leaves everything else alone.  An item counts as touched if:
+
+- it was created, or received an ``Interaction`` or a comment, above the
+  id watermarks stored in ``PopularityWatermark``
+- its likes/bookmarks changed (``m2m_changed`` and comment deletions append
+  a ``PopularityDirtyItem`` row; see ``signals``)
+- its trailing-window interaction count may have dropped (rows with recent
+  interactions that were last refreshed more than ``WINDOW_REFRESH`` ago)
+
+A touched item's counts are computed with one grouped query per signal for
+a whole chunk of items and upserted in bulk.  Without watermarks (first
+run or ``full=True``) every item is recomputed and rows of deleted items
+are dropped.  Processed dirty rows are deleted by primary key only after
+the run succeeded.
+
+Readers (``popular_items``, ``trending_ids``) are indexed ORDER BY queries
+on the table.
+"""
+
+import math
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import (
+    ContentPopularity,
+    Interaction,
+    PopularityDirtyItem,
+    PopularityWatermark,
+)
+
+# label -> (created field, comment model label)
+SOURCES = {
+    "blog.post": ("created", "blog.Comment"),
+    "communities.communitypost": ("created_at", "communities.CommunityPostComment"),
+}
+POPULARITY_WINDOW_DAYS = getattr(settings, "RECOMMEND_POPULARITY_WINDOW_DAYS", 7)
+# Time constant of the exponential age decay baked into hot_score
+HOT_DECAY_HOURS = getattr(settings, "RECOMMEND_HOT_DECAY_HOURS", 36)
+HOT_WEIGHTS = {"likes": 1.0, "comments": 0.5, "bookmarks": 0.5, "recent_interactions": 0.1}
+WINDOW_REFRESH = timedelta(hours=1)
+HOT_EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+CHUNK_SIZE = 500
+
+
+def hot_score(engagement, created_at):
+    """``ln(1 + engagement)`` plus the item's age credit (see ``ContentPopularity``)."""
+    age_credit = 0.0
+    if created_at is not None:
+        age_credit = (created_at - HOT_EPOCH).total_seconds() / (HOT_DECAY_HOURS * 3600.0)
+    return math.log1p(max(0.0, engagement)) + age_credit
+
+
+def mark_popularity_dirty(label, pks):
+    """Queue items whose likes, bookmarks or comments changed outside the watermarks."""
+    if label not in SOURCES or not pks:
+        return
+    ct_id = _content_type(label).id
+    PopularityDirtyItem.objects.bulk_create(
+        [PopularityDirtyItem(content_type_id=ct_id, object_id=int(pk)) for pk in pks]
+    )
+
+
+def _dirty_items():
+    """``(row pks, [(content type id, object id)])`` of the queued items."""
+    rows = list(PopularityDirtyItem.objects.values_list("pk", "content_type_id", "object_id"))
+    return [row[0] for row in rows], [row[1:] for row in rows]
+
+
+def _load_watermarks():
+    """``{name: id}`` of the last run, or None before the first one."""
+    return dict(PopularityWatermark.objects.values_list("name", "value")) or None
+
+
+def _save_watermarks(marks):
+    PopularityWatermark.objects.bulk_create(
+        [PopularityWatermark(name=name, value=value) for name, value in marks.items()],
+        update_conflicts=True,
+        unique_fields=["name"],
+        update_fields=["value"],
+    )
+
+
+def _model(label):
+    return apps.get_model(*label.split("."))
+
+
+def _comment_post_field(comment_model, model):
+    for field in comment_model._meta.get_fields():
+        if getattr(field, "related_model", None) is model and field.many_to_one:
+            return field.attname
+    raise LookupError(f"{comment_model.__name__} has no foreign key to {model.__name__}")
+
+
+def _grouped_counts(queryset, field):
+    return dict(queryset.values_list(field).annotate(n=Count("pk")).order_by())
+
+
+def _m2m_counts(model, name, pks):
+    descriptor = getattr(model, name)
+    through = descriptor.through
+    field = f"{descriptor.field.m2m_field_name()}_id"
+    return _grouped_counts(through.objects.filter(**{f"{field}__in": pks}), field)
+
+
+def _recompute(label, pks, now):
+    """Upsert the rows of ``pks``; returns ``(updated, removed)``."""
+    model = _model(label)
+    created_field, comment_label = SOURCES[label]
+    comment_model = _model(comment_label)
+    ct_id = ContentType.objects.get_for_model(model).id
+    window_start = now - timedelta(days=POPULARITY_WINDOW_DAYS)
+
+    created = dict(model.objects.filter(pk__in=pks).values_list("pk", created_field))
+    gone = [pk for pk in pks if pk not in created]
+    removed = 0
+    if gone:
+        removed, _ = ContentPopularity.objects.filter(content_type_id=ct_id, object_id__in=gone).delete()
+    pks = list(created)
+    if not pks:
+        return 0, removed
+
+    likes = _m2m_counts(model, "likes", pks)
+    bookmarks = _m2m_counts(model, "bookmarks", pks)
+    post_field = _comment_post_field(comment_model, model)
+    comments = _grouped_counts(comment_model.objects.filter(**{f"{post_field}__in": pks}), post_field)
+    recent = _grouped_counts(
+        Interaction.objects.filter(
+            content_type_id=ct_id, object_id__in=pks, created_at__gte=window_start
+        ),
+        "object_id",
+    )
+
+    rows = []
+    for pk in pks:
+        counts = {
+            "likes": likes.get(pk, 0),
+            "bookmarks": bookmarks.get(pk, 0),
+            "comments": comments.get(pk, 0),
+            "recent_interactions": recent.get(pk, 0),
+        }
+        engagement = sum(HOT_WEIGHTS[name] * value for name, value in counts.items())
+        rows.append(
+            ContentPopularity(
+                content_type_id=ct_id,
+                object_id=pk,
+                popularity=float(counts["likes"] + counts["bookmarks"]),
+                hot_score=hot_score(engagement, created[pk]),
+                item_created_at=created[pk],
+                **counts,
+            )
+        )
+    ContentPopularity.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["content_type", "object_id"],
+        update_fields=[
+            "likes",
+            "bookmarks",
+            "comments",
+            "recent_interactions",
+            "popularity",
+            "hot_score",
+            "item_created_at",
+            "refreshed_at",
+        ],
+    )
+    return len(rows), removed
+
+
+def _touched(watermarks, now):
+    """``({label: set(pk)}, new watermarks)`` for an incremental run."""
+    touched = {label: set() for label in SOURCES}
+    ct_labels = {
+        ContentType.objects.get_for_model(_model(label)).id: label for label in SOURCES
+    }
+    new_marks = dict(watermarks)
+
+    top = Interaction.objects.aggregate(top=Max("id"))["top"] or 0
+    rows = (
+        Interaction.objects.filter(
+            id__gt=watermarks.get("interaction", 0), id__lte=top, content_type_id__in=ct_labels
+        )
+        .values_list("content_type_id", "object_id")
+        .distinct()
+    )
+    for ct_id, pk in rows.iterator():
+        touched[ct_labels[ct_id]].add(pk)
+    new_marks["interaction"] = max(top, watermarks.get("interaction", 0))
+
+    for label, (_, comment_label) in SOURCES.items():
+        # New items, engaged with or not, need a row to show up in trending
+        model = _model(label)
+        mark = watermarks.get(label, 0)
+        top = model.objects.aggregate(top=Max("pk"))["top"] or 0
+        touched[label].update(
+            model.objects.filter(pk__gt=mark, pk__lte=top).values_list("pk", flat=True)
+        )
+        new_marks[label] = max(top, mark)
+
+        comment_model = _model(comment_label)
+        post_field = _comment_post_field(comment_model, model)
+        mark = watermarks.get(comment_label, 0)
+        top = comment_model.objects.aggregate(top=Max("id"))["top"] or 0
+        touched[label].update(
+            comment_model.objects.filter(id__gt=mark, id__lte=top)
+            .values_list(post_field, flat=True)
+            .distinct()
+        )
+        new_marks[comment_label] = max(top, mark)
+
+    # Trailing-window counts shrink as interactions age out
+    stale = ContentPopularity.objects.filter(
+        content_type_id__in=ct_labels,
+        recent_interactions__gt=0,
+        refreshed_at__lt=now - WINDOW_REFRESH,
+    ).values_list("content_type_id", "object_id")
+    for ct_id, pk in stale.iterator():
+        touched[ct_labels[ct_id]].add(pk)
+    return touched, new_marks
+
+
+def _all_items(now):
+    # Watermarks first: anything created while listing is picked up next run
+    marks = {"interaction": Interaction.objects.aggregate(top=Max("id"))["top"] or 0}
+    for label, (_, comment_label) in SOURCES.items():
+        marks[label] = _model(label).objects.aggregate(top=Max("pk"))["top"] or 0
+        marks[comment_label] = _model(comment_label).objects.aggregate(top=Max("id"))["top"] or 0
+
+    touched = {}
+    for label in SOURCES:
+        model = _model(label)
+        touched[label] = set(model.objects.values_list("pk", flat=True))
+        ct_id = ContentType.objects.get_for_model(model).id
+        # Rows of items deleted since (found through the live ids above)
+        touched[label].update(
+            ContentPopularity.objects.filter(content_type_id=ct_id)
+            .exclude(object_id__in=touched[label])
+            .values_list("object_id", flat=True)
+        )
+    return touched, marks
+
+
+def refresh_popularity(full=False, chunk_size=CHUNK_SIZE):
+    """
+    Bring ``ContentPopularity`` up to date.
+
+    Returns ``{"updated", "removed", "full"}``.
+    """
+    now = timezone.now()
+    watermarks = None if full else _load_watermarks()
+    # Read before the recompute: items marked later stay queued for the next run
+    dirty_pks, dirty = _dirty_items()
+    if watermarks is None:
+        touched, new_marks = _all_items(now)
+        full = True
+    else:
+        touched, new_marks = _touched(watermarks, now)
+        labels = {_content_type(label).id: label for label in SOURCES}
+        for ct_id, pk in dirty:
+            if ct_id in labels:
+                touched[labels[ct_id]].add(pk)
+
+    updated = removed = 0
+    for label, pks in touched.items():
+        pks = sorted(pks)
+        for start in range(0, len(pks), chunk_size):
+            done, gone = _recompute(label, pks[start : start + chunk_size], now)
+            updated += done
+            removed += gone
+    for start in range(0, len(dirty_pks), chunk_size):
+        PopularityDirtyItem.objects.filter(pk__in=dirty_pks[start : start + chunk_size]).delete()
+    _save_watermarks(new_marks)
+    return {"updated": updated, "removed": removed, "full": full}
+
+
+def popular_items(label, topn):
+    """``("app.model:id", popularity)`` pairs, most popular first (indexed read)."""
+    rows = (
+        ContentPopularity.objects.filter(content_type=_content_type(label))
+        .order_by("-popularity", "-item_created_at")
+        .values_list("object_id", "popularity")[:topn]
+    )
+    return [(f"{label}:{pk}", float(score or 1)) for pk, score in rows]
+
+
+def trending_ids(label, since=None, offset=0, limit=10, engaged_only=False):
+    """
+    ``(total, ids)``: items created after ``since`` by ``hot_score``, one page.
+    ``engaged_only`` skips items without likes or comments.
+    """
+    qs = ContentPopularity.objects.filter(content_type=_content_type(label))
+    if since is not None:
+        qs = qs.filter(item_created_at__gte=since)
+    if engaged_only:
+        qs = qs.filter(Q(likes__gt=0) | Q(comments__gt=0))
+    ids = list(
+        qs.order_by("-hot_score", "-item_created_at").values_list("object_id", flat=True)[
+            offset : offset + limit
+        ]
+    )
+    return qs.count(), ids
+
+
+def _content_type(label):
+    app_label, model_name = label.split(".", 1)
+    return ContentType.objects.get_by_natural_key(app_label, model_name)
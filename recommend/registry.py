@@ -0,0 +1,173 @@
+"""
+Dense integer ids for recommendable items (``ItemRegistry``).
+
+Items were passed between the trainers, the serving model, hydration and the
+``Recommendation`` writers as "app.model:id" strings and parsed again at
+every step.  The registry assigns each (content_type_id, object_id) pair a
+permanent integer id instead; the pair is packed into one int64 code
+(``content_type_id << 32 | object_id``, as in ``ml.dataset.item_code``) for
+the lookups.
+
+Both directions are cached per process.  A batch lookup costs one query per
+content type for the codes not cached yet, plus one ``bulk_create`` for
+pairs seen for the first time.  Strings are only built at the API boundary
+(``item_keys()``).
+"""
+
+import threading
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .models import ItemRegistry
+
+LOOKUP_BATCH_SIZE = 5000
+OBJECT_ID_MASK = 0xFFFFFFFF
+
+_lock = threading.Lock()
+# packed code -> item id, and item id -> packed code
+_ids = {}
+_codes = {}
+
+
+def pack(content_type_ids, object_ids):
+    """Pack (content_type_id, object_id) pairs into one int64 code per item."""
+    return (np.asarray(content_type_ids, dtype=np.int64) << 32) | np.asarray(
+        object_ids, dtype=np.int64
+    )
+
+
+def unpack(codes):
+    """``(content_type_ids, object_ids)`` arrays for packed codes."""
+    codes = np.asarray(codes, dtype=np.int64)
+    return codes >> 32, codes & OBJECT_ID_MASK
+
+
+def _remember(rows):
+    with _lock:
+        for item_id, ct_id, object_id in rows:
+            code = (ct_id << 32) | object_id
+            _ids[code] = item_id
+            _codes[item_id] = code
+
+
+def _fetch_codes(codes):
+    """Load registry rows for ``codes`` into the cache (one query per type)."""
+    ct_ids, object_ids = unpack(codes)
+    for ct_id in np.unique(ct_ids).tolist():
+        wanted = object_ids[ct_ids == ct_id].tolist()
+        for start in range(0, len(wanted), LOOKUP_BATCH_SIZE):
+            _remember(
+                ItemRegistry.objects.filter(
+                    content_type_id=ct_id, object_id__in=wanted[start : start + LOOKUP_BATCH_SIZE]
+                ).values_list("id", "content_type_id", "object_id")
+            )
+
+
+def item_ids_for_codes(codes, create=True):
+    """
+    Item ids (int64 array, aligned with ``codes``) for packed item codes.
+
+    Unregistered items are registered when ``create`` is set and come back
+    as -1 otherwise.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    out = np.fromiter((_ids.get(code, -1) for code in codes.tolist()), dtype=np.int64, count=len(codes))
+    missing = out < 0
+    if not missing.any():
+        return out
+    pending = np.unique(codes[missing])
+    _fetch_codes(pending)
+    if create:
+        new = [code for code in pending.tolist() if code not in _ids]
+        if new:
+            ct_ids, object_ids = unpack(new)
+            try:
+                ItemRegistry.objects.bulk_create(
+                    [
+                        ItemRegistry(content_type_id=ct_id, object_id=object_id)
+                        for ct_id, object_id in zip(ct_ids.tolist(), object_ids.tolist())
+                    ],
+                    batch_size=LOOKUP_BATCH_SIZE,
+                    ignore_conflicts=True,
+                )
+            except IntegrityError:
+                # A concurrent writer registered them first; re-read below
+                pass
+            _fetch_codes(np.asarray(new, dtype=np.int64))
+    out[missing] = [_ids.get(code, -1) for code in codes[missing].tolist()]
+    return out
+
+
+def item_ids(content_type_ids, object_ids, create=True):
+    """Item ids for aligned content type / object id arrays."""
+    return item_ids_for_codes(pack(content_type_ids, object_ids), create=create)
+
+
+def item_id(content_type_id, object_id, create=True):
+    """Item id of a single (content type, object) pair (None if unknown)."""
+    found = int(item_ids_for_codes([(int(content_type_id) << 32) | int(object_id)], create)[0])
+    return found if found >= 0 else None
+
+
+def codes_for_item_ids(ids):
+    """Packed codes (int64 array, -1 for unknown ids) for item ids."""
+    ids = np.asarray(ids, dtype=np.int64)
+    out = np.fromiter((_codes.get(i, -1) for i in ids.tolist()), dtype=np.int64, count=len(ids))
+    missing = out < 0
+    if missing.any():
+        wanted = np.unique(ids[missing]).tolist()
+        for start in range(0, len(wanted), LOOKUP_BATCH_SIZE):
+            _remember(
+                ItemRegistry.objects.filter(id__in=wanted[start : start + LOOKUP_BATCH_SIZE])
+                .values_list("id", "content_type_id", "object_id")
+            )
+        out[missing] = [_codes.get(i, -1) for i in ids[missing].tolist()]
+    return out
+
+
+def resolve(ids):
+    """``(content_type_ids, object_ids)`` arrays for item ids (-1 where unknown)."""
+    codes = codes_for_item_ids(ids)
+    ct_ids, object_ids = unpack(codes)
+    unknown = codes < 0
+    ct_ids[unknown] = -1
+    object_ids[unknown] = -1
+    return ct_ids, object_ids
+
+
+def content_type_ids_for_labels(labels):
+    """ContentType ids for "app.model" labels (None for unknown labels)."""
+    out = []
+    for label in labels:
+        try:
+            app_label, model_name = str(label).split(".", 1)
+            out.append(ContentType.objects.get_by_natural_key(app_label, model_name).id)
+        except (ValueError, ContentType.DoesNotExist):
+            out.append(None)
+    return out
+
+
+def item_keys(ids):
+    """Legacy "app.model:id" keys for item ids (None where unknown)."""
+    ct_ids, object_ids = resolve(ids)
+    keys = []
+    for ct_id, object_id in zip(ct_ids.tolist(), object_ids.tolist()):
+        if ct_id < 0:
+            keys.append(None)
+            continue
+        ct = ContentType.objects.get_for_id(ct_id)
+        keys.append(f"{ct.app_label}.{ct.model}:{object_id}")
+    return keys
+
+
+def clear_cache():
+    """Forget the cached mappings (tests, or after rows were deleted)."""
+    with _lock:
+        _ids.clear()
+        _codes.clear()
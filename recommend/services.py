@@ -17,8 +17,11 @@ from django.core.cache import cache
 from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
+from django.db.models import Count
 
 from .models import Interaction, Recommendation
+from .telemetry import (LAYER_TIMEOUTS, CircuitBreaker, LayerTimeout,
+                        record_layer, record_request, run_with_budget)
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +39,14 @@ class RecommendationService:
 
     def __init__(self):
         self._health_status = {}
-        self._circuit_breaker = {}
-        self._last_health_check = {}
+        # Shared through the cache, so one worker's failures protect all of them
+        self._breakers = {
+            layer: CircuitBreaker(
+                layer, threshold=MAX_RETRIES, reset_timeout=CIRCUIT_BREAKER_TIMEOUT
+            )
+            for layer, budget in LAYER_TIMEOUTS.items()
+            if budget
+        }
 
     def get_recommendations(
         self,
@@ -51,42 +60,35 @@ class RecommendationService:
         """
         Get infallible recommendations with multiple fallback layers.
 
+        Each layer runs under its circuit breaker and time budget
+        (``telemetry.LAYER_TIMEOUTS``); a layer that is open, fails, times
+        out or returns nothing hands over to the next one.
+
         Returns: List of (content_key, score) tuples
         """
         start_time = time.time()
 
         try:
-            # Layer 1: AI-powered recommendations
-            recommendations = self._get_ai_recommendations(
-                user_id, content_types, topn, exclude_seen,
-                diversity_penalty, freshness_boost
-            )
-
-            if recommendations:
-                self._log_performance('ai_recommendations', time.time() - start_time, len(recommendations))
-                return recommendations
-
-            # Layer 2: Collaborative filtering fallback
-            recommendations = self._get_collaborative_recommendations(
-                user_id, content_types, topn
-            )
-
-            if recommendations:
-                self._log_performance('collaborative_fallback', time.time() - start_time, len(recommendations))
-                return recommendations
-
-            # Layer 3: Content-based recommendations
-            recommendations = self._get_content_based_recommendations(
-                user_id, content_types, topn
+            layers = (
+                # Layer 1: AI-powered recommendations
+                ('ai_recommendations', self._get_ai_recommendations,
+                 (user_id, content_types, topn, exclude_seen, diversity_penalty, freshness_boost)),
+                # Layer 2: Collaborative filtering fallback
+                ('collaborative_fallback', self._get_collaborative_recommendations,
+                 (user_id, content_types, topn)),
+                # Layer 3: Content-based recommendations
+                ('content_based_fallback', self._get_content_based_recommendations,
+                 (user_id, content_types, topn)),
             )
-
-            if recommendations:
-                self._log_performance('content_based_fallback', time.time() - start_time, len(recommendations))
-                return recommendations
+            for layer, method, args in layers:
+                recommendations = self._run_layer(layer, method, *args)
+                if recommendations:
+                    self._log_performance(layer, time.time() - start_time, len(recommendations))
+                    return recommendations
 
             # Layer 4: Popularity-based recommendations (always works)
-            recommendations = self._get_popularity_recommendations(
-                content_types, topn
+            recommendations = self._run_layer(
+                'popularity_fallback', self._get_popularity_recommendations, content_types, topn
             )
 
             self._log_performance('popularity_fallback', time.time() - start_time, len(recommendations))
@@ -95,7 +97,37 @@ class RecommendationService:
         except Exception as e:
             logger.error(f"Critical error in recommendation service: {e}", exc_info=True)
             # Emergency fallback - return popular content
-            return self._get_emergency_fallback(content_types, topn)
+            recommendations = self._get_emergency_fallback(content_types, topn)
+            self._log_performance('emergency_fallback', time.time() - start_time, len(recommendations))
+            return recommendations
+
+    def _run_layer(self, layer: str, method, *args) -> List[Tuple[str, float]]:
+        """Run one layer under its breaker and time budget, recording telemetry."""
+        breaker = self._breakers.get(layer)
+        if breaker is not None and not breaker.allow():
+            record_layer(layer, 'open', 0.0)
+            return []
+
+        start_time = time.time()
+        try:
+            recommendations = run_with_budget(method, LAYER_TIMEOUTS.get(layer), *args)
+        except LayerTimeout as e:
+            logger.warning(f"Recommendation layer {layer} abandoned: {e}")
+            outcome, recommendations = 'timeout', []
+            self._update_health_status(layer, False, str(e))
+        except ImportError:
+            outcome, recommendations = 'error', []
+            self._update_health_status(layer, False, "Missing dependencies")
+        except Exception as e:
+            logger.warning(f"Recommendation layer {layer} failed: {e}")
+            outcome, recommendations = 'error', []
+            self._update_health_status(layer, False, str(e))
+        else:
+            outcome = 'hit' if recommendations else 'empty'
+            self._update_health_status(layer, True)
+
+        record_layer(layer, outcome, time.time() - start_time)
+        return recommendations
 
     def _get_ai_recommendations(
         self,
@@ -107,36 +139,23 @@ class RecommendationService:
         freshness_boost: bool
     ) -> List[Tuple[str, float]]:
         """Layer 1: AI-powered recommendations using PyTorch model."""
-        if not self._is_service_healthy('ai_recommendations'):
-            return []
-
-        try:
-            from .ml.torch_recommender import recommend_for_user
-
-            recommendations = recommend_for_user(
-                user_id=user_id,
-                topn=topn * 2,  # Get more for filtering
-                exclude_seen=exclude_seen
-            )
+        from .ml.torch_recommender import recommend_for_user
 
-            # Validate and filter recommendations
-            valid_recommendations = []
-            for rec_key, score in recommendations:
-                if self._validate_recommendation_key(rec_key, content_types):
-                    valid_recommendations.append((rec_key, float(score)))
-                    if len(valid_recommendations) >= topn:
-                        break
+        recommendations = recommend_for_user(
+            user_id=user_id,
+            topn=topn * 2,  # Get more for filtering
+            exclude_seen=exclude_seen
+        )
 
-            self._update_health_status('ai_recommendations', True)
-            return valid_recommendations
+        # Validate and filter recommendations
+        valid_recommendations = []
+        for rec_key, score in recommendations:
+            if self._validate_recommendation_key(rec_key, content_types):
+                valid_recommendations.append((rec_key, float(score)))
+                if len(valid_recommendations) >= topn:
+                    break
 
-        except ImportError:
-            self._update_health_status('ai_recommendations', False, "Missing dependencies")
-        except Exception as e:
-            logger.warning(f"AI recommendations failed: {e}")
-            self._update_health_status('ai_recommendations', False, str(e))
-
-        return []
+        return valid_recommendations
 
     def _get_collaborative_recommendations(
         self,
@@ -145,23 +164,18 @@ class RecommendationService:
         topn: int
     ) -> List[Tuple[str, float]]:
         """Layer 2: Collaborative filtering using stored recommendations."""
-        try:
-            # Get pre-computed recommendations for user
-            user_recommendations = Recommendation.objects.filter(
-                user_id=user_id
-            ).select_related('content_type')[:topn * 2]
-
-            recommendations = []
-            for rec in user_recommendations:
-                content_key = self._make_content_key(rec.content_type, rec.object_id)
-                if content_key and self._validate_recommendation_key(content_key, content_types):
-                    recommendations.append((content_key, float(rec.score)))
+        # Get pre-computed recommendations for user
+        user_recommendations = Recommendation.objects.current().filter(
+            user_id=user_id
+        ).select_related('content_type')[:topn * 2]
 
-            return recommendations[:topn]
+        recommendations = []
+        for rec in user_recommendations:
+            content_key = self._make_content_key(rec.content_type, rec.object_id)
+            if content_key and self._validate_recommendation_key(content_key, content_types):
+                recommendations.append((content_key, float(rec.score)))
 
-        except Exception as e:
-            logger.warning(f"Collaborative recommendations failed: {e}")
-            return []
+        return recommendations[:topn]
 
     def _get_content_based_recommendations(
         self,
@@ -170,31 +184,26 @@ class RecommendationService:
         topn: int
     ) -> List[Tuple[str, float]]:
         """Layer 3: Content-based recommendations using user interests."""
-        try:
-            from .models import UserInterests
+        from .models import UserInterests
 
-            user_interests = UserInterests.objects.filter(user_id=user_id).first()
-            if not user_interests:
-                return []
-
-            # Get user's interests
-            interests = self._extract_user_interests(user_interests, content_types)
-            if not interests:
-                return []
+        user_interests = UserInterests.objects.filter(user_id=user_id).first()
+        if not user_interests:
+            return []
 
-            # Find content matching interests
-            recommendations = []
-            for content_type in content_types:
-                matching_items = self._find_content_by_interests(content_type, interests, topn)
-                recommendations.extend(matching_items)
+        # Get user's interests
+        interests = self._extract_user_interests(user_interests, content_types)
+        if not interests:
+            return []
 
-            # Sort by relevance score and return top N
-            recommendations.sort(key=lambda x: x[1], reverse=True)
-            return recommendations[:topn]
+        # Find content matching interests
+        recommendations = []
+        for content_type in content_types:
+            matching_items = self._find_content_by_interests(content_type, interests, topn)
+            recommendations.extend(matching_items)
 
-        except Exception as e:
-            logger.warning(f"Content-based recommendations failed: {e}")
-            return []
+        # Sort by relevance score and return top N
+        recommendations.sort(key=lambda x: x[1], reverse=True)
+        return recommendations[:topn]
 
     def _get_popularity_recommendations(
         self,
@@ -234,35 +243,23 @@ class RecommendationService:
             logger.error(f"Emergency fallback failed: {e}")
             return []
 
-    def _is_service_healthy(self, service_name: str) -> bool:
-        """Check if a service is healthy (not in circuit breaker state)."""
-        if service_name in self._circuit_breaker:
-            breaker_time = self._circuit_breaker[service_name]
-            if time.time() - breaker_time < CIRCUIT_BREAKER_TIMEOUT:
-                return False
-            else:
-                # Circuit breaker expired, try again
-                del self._circuit_breaker[service_name]
-
-        return True
-
     def _update_health_status(self, service_name: str, healthy: bool, error: str = None):
-        """Update health status and manage circuit breaker."""
+        """Update health status and the layer's shared circuit breaker."""
         self._health_status[service_name] = {
             'healthy': healthy,
             'last_check': time.time(),
             'error': error
         }
 
-        if not healthy:
-            # Implement circuit breaker pattern
-            failure_count = self._health_status.get(service_name, {}).get('failure_count', 0) + 1
+        breaker = self._breakers.get(service_name)
+        if breaker is None:
+            return
+        if healthy:
+            breaker.record_success()
+        else:
+            failure_count = breaker.record_failure()
             self._health_status[service_name]['failure_count'] = failure_count
 
-            if failure_count >= MAX_RETRIES:
-                self._circuit_breaker[service_name] = time.time()
-                logger.warning(f"Circuit breaker activated for {service_name}")
-
     def _validate_recommendation_key(self, rec_key: str, allowed_types: List[str]) -> bool:
         """Validate that a recommendation key is for allowed content types."""
         try:
@@ -356,19 +353,14 @@ class RecommendationService:
     def _get_popular_content(self, content_type: str, topn: int) -> List[Tuple[str, float]]:
         """Get popular content for a content type."""
         try:
+            # Posts are ranked from the materialized ContentPopularity table
             if content_type == 'blog':
-                from blog.models import Post
-                posts = Post.objects.annotate(
-                    popularity=Count('likes') + Count('bookmarks')
-                ).order_by('-popularity', '-created')[:topn]
-                return [(f"blog.post:{p.id}", float(p.popularity or 1)) for p in posts]
+                from recommend.popularity import popular_items
+                return popular_items('blog.post', topn)
 
             elif content_type in ['communities', 'community']:
-                from communities.models import CommunityPost
-                posts = CommunityPost.objects.annotate(
-                    popularity=Count('likes') + Count('bookmarks')
-                ).order_by('-popularity', '-created_at')[:topn]
-                return [(f"communities.communitypost:{p.id}", float(p.popularity or 1)) for p in posts]
+                from recommend.popularity import popular_items
+                return popular_items('communities.communitypost', topn)
 
             elif content_type == 'games':
                 from games.models import Game
@@ -406,14 +398,20 @@ class RecommendationService:
         return []
 
     def _log_performance(self, method: str, duration: float, result_count: int):
-        """Log performance metrics."""
+        """Log performance metrics and count the request against the serving layer."""
+        record_request(method, duration)
         logger.info(f"Recommendation method '{method}' completed in {duration:.3f}s, returned {result_count} items")
 
     def get_health_status(self) -> Dict[str, Any]:
         """Get comprehensive health status of the recommendation system."""
+        breakers = {layer: breaker.status() for layer, breaker in self._breakers.items()}
         return {
             'services': self._health_status.copy(),
-            'circuit_breakers': list(self._circuit_breaker.keys()),
+            'circuit_breakers': [
+                layer for layer, status in breakers.items()
+                if status['state'] != CircuitBreaker.CLOSED
+            ],
+            'breakers': breakers,
             'timestamp': time.time()
         }
 
@@ -426,4 +424,11 @@ def get_recommendations(*args, **kwargs):
 
 def get_recommendation_health():
     """Get health status of the recommendation system."""
-    return recommendation_service.get_health_status()
\ No newline at end of file
+    return recommendation_service.get_health_status()
+
+
+def get_recommendation_stats():
+    """Layer latency histograms, hit/fallback counters and breaker states."""
+    from .telemetry import layer_stats
+
+    return layer_stats()
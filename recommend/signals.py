@@ -0,0 +1,92 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .ml.foldin import mark_user_stale
+from .ml.seen import record_seen
+from .models import Interaction, UserInterests
+from .popularity import SOURCES as POPULARITY_SOURCES
+from .popularity import mark_popularity_dirty
+from .registry import item_id
+from .utils import invalidate_user_profile
+
+
+@receiver(post_save, sender=Interaction)
+def _mark_folded_vector_stale(sender, instance, **kwargs):
+    if instance.user_id:
+        mark_user_stale(instance.user_id)
+
+
+def _record_seen(user_id, content_type_id, object_id):
+    # Registers the item on first sight, so its id exists before the next retrain
+    record_seen(user_id, item_id(content_type_id, object_id))
+
+
+@receiver(post_save, sender=Interaction)
+def _record_seen_item(sender, instance, created, **kwargs):
+    if created and instance.user_id and instance.content_type_id:
+        # After commit: a rolled-back registry row must not stay in the id cache
+        args = (instance.user_id, instance.content_type_id, instance.object_id)
+        transaction.on_commit(lambda: _record_seen(*args))
+
+
+@receiver(post_save, sender=Interaction)
+@receiver(post_save, sender=UserInterests)
+def _invalidate_user_profile(sender, instance, **kwargs):
+    if instance.user_id:
+        invalidate_user_profile(instance.user_id)
+
+
+def _connect_popularity_signals():
+    """Queue items whose likes/bookmarks change or lose a comment for the next refresh."""
+    for label, (_, comment_label) in POPULARITY_SOURCES.items():
+        model = apps.get_model(*label.split("."))
+
+        for name in ("likes", "bookmarks"):
+            field = getattr(model, name).field
+            item_column = f"{field.m2m_field_name()}_id"
+            user_column = f"{field.m2m_reverse_field_name()}_id"
+
+            def _m2m_changed(
+                sender, instance, action, reverse, pk_set, label=label,
+                item_column=item_column, user_column=user_column, **kwargs
+            ):
+                if action in ("post_add", "post_remove"):
+                    pks = pk_set if reverse else [instance.pk]
+                elif action == "pre_clear":
+                    # clear() passes no pk_set; read the rows about to go
+                    pks = [instance.pk] if not reverse else list(
+                        sender.objects.filter(**{user_column: instance.pk})
+                        .values_list(item_column, flat=True)
+                    )
+                else:
+                    return
+                mark_popularity_dirty(label, pks)
+
+            m2m_changed.connect(
+                _m2m_changed,
+                sender=field.remote_field.through,
+                weak=False,
+                dispatch_uid=f"recommend_popularity_{label}_{name}",
+            )
+
+        comment_model = apps.get_model(*comment_label.split("."))
+        post_column = next(
+            f.attname
+            for f in comment_model._meta.concrete_fields
+            if f.is_relation and f.related_model is model
+        )
+
+        def _comment_deleted(sender, instance, label=label, post_column=post_column, **kwargs):
+            mark_popularity_dirty(label, [getattr(instance, post_column)])
+
+        post_delete.connect(
+            _comment_deleted,
+            sender=comment_model,
+            weak=False,
+            dispatch_uid=f"recommend_popularity_{comment_label}_deleted",
+        )
+
+
+_connect_popularity_signals()
@@ -1,14 +1,101 @@
 from celery import shared_task
+from .generations import cleanup_generations
+from .locks import LockBusy, job_lock
+from .ml.embeddings import update_embeddings
+from .ml.foldin import publish_new_items
+from .ml.related import build_related
+from .ml.snapshot import write_snapshot
 from .ml.torch_recommender_hybrid import train_and_save_hybrid
+from .pipeline import SNAPSHOT_LOCK, TRAIN_LOCK, run_pipeline
+from .popularity import refresh_popularity
 
 @shared_task
 def retrain_recommender():
     """Retrain the hybrid recommender model nightly."""
     try:
-        train_and_save_hybrid(
-            epochs=10,
-            batch_size=1024
-        )
+        with job_lock(TRAIN_LOCK):
+            train_and_save_hybrid(
+                epochs=10,
+                batch_size=1024
+            )
         return "Recommender model retrained successfully"
+    except LockBusy as e:
+        return f"Skipped retrain: {e}"
     except Exception as e:
         return f"Failed to retrain recommender: {e}"
+
+
+@shared_task
+def fold_in_new_items():
+    """Give items created since the last retrain content-derived vectors."""
+    try:
+        added = publish_new_items()
+        return f"Folded in {added} new items"
+    except Exception as e:
+        return f"Failed to fold in new items: {e}"
+
+
+@shared_task
+def cleanup_recommendation_generations():
+    """Delete superseded Recommendation generations in small batches."""
+    try:
+        deleted = cleanup_generations()
+        return f"Removed {deleted} old recommendation rows"
+    except Exception as e:
+        return f"Failed to clean up recommendation generations: {e}"
+
+
+@shared_task
+def snapshot_interactions():
+    """Append new interactions to the columnar snapshot used by offline jobs."""
+    try:
+        with job_lock(SNAPSHOT_LOCK):
+            rows, partitions = write_snapshot()
+        return f"Exported {rows} interactions in {partitions} partitions"
+    except LockBusy as e:
+        return f"Skipped snapshot: {e}"
+    except Exception as e:
+        return f"Failed to snapshot interactions: {e}"
+
+
+@shared_task
+def update_content_embeddings():
+    """Encode new and changed items into the content embedding store."""
+    try:
+        stats = update_embeddings()
+        return f"Encoded {stats['encoded']} of {stats['items']} items ({stats['removed']} removed)"
+    except Exception as e:
+        return f"Failed to update content embeddings: {e}"
+
+
+@shared_task
+def build_related_items():
+    """Recompute the "more like this" neighbour table."""
+    try:
+        stats = build_related()
+        return f"Built related items for {stats['items']} items"
+    except Exception as e:
+        return f"Failed to build related items: {e}"
+
+
+@shared_task
+def refresh_content_popularity():
+    """Recompute popularity and hot scores of items touched since the last run."""
+    try:
+        stats = refresh_popularity()
+        return f"Refreshed popularity of {stats['updated']} items ({stats['removed']} removed)"
+    except Exception as e:
+        return f"Failed to refresh content popularity: {e}"
+
+
+@shared_task
+def run_recommendation_pipeline(force=False, **options):
+    """Snapshot, retrain, score, publish and warm; skips stages with unchanged input."""
+    try:
+        run = run_pipeline(force=force, **options)
+        ran = [name for name, checkpoint in run.checkpoints.items() if not checkpoint["skipped"]]
+        return f"Pipeline run {run.pk} completed (ran: {', '.join(ran) or 'nothing'})"
+    except LockBusy as e:
+        return f"Skipped recommendation pipeline: {e}"
+    except Exception as e:
+        return f"Recommendation pipeline failed: {e}"
@@ -0,0 +1,367 @@
+"""
+Cross-process circuit breakers and layer telemetry for the recommendation
+service.
+
+All state lives in the Django cache, which ``settings.CACHES`` points at
+the Redis instance shared with Celery, so every worker sees the same
+breaker and the same counters.  Counters are updated with atomic
+``cache.incr``; a breaker opens after ``threshold`` consecutive failures and
+stays open until ``open_until``.  After that a single process wins a
+``cache.add`` on the probe key and tries the layer (half-open); its success
+closes the breaker for everyone, its failure re-opens it.
+
+Latency is recorded per layer as a fixed-bucket histogram, next to outcome
+counters (hit / empty / error / timeout / open).  ``layer_stats()`` turns
+those into a JSON-friendly summary for the stats endpoint and the
+``recommendation_stats`` command.  Shadow scoring of a candidate model
+(see ``ml.shadow``) is recorded the same way per candidate version.
+
+``run_with_budget()`` runs a layer on a small shared thread pool and gives
+up waiting after its time budget; the abandoned call keeps running in the
+background but the request moves on to the next layer.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+STATS_PREFIX = "recommend:stats"
+SHADOW_PREFIX = f"{STATS_PREFIX}:shadow"
+BREAKER_PREFIX = "recommend:breaker"
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+OUTCOMES = ("hit", "empty", "error", "timeout", "open")
+
+# Layers in the order RecommendationService tries them
+LAYERS = (
+    "ai_recommendations",
+    "collaborative_fallback",
+    "content_based_fallback",
+    "popularity_fallback",
+    "emergency_fallback",
+)
+
+# Seconds a layer may run before the request moves on; None runs inline
+LAYER_TIMEOUTS = {
+    "ai_recommendations": 1.5,
+    "collaborative_fallback": 0.5,
+    "content_based_fallback": 0.5,
+    "popularity_fallback": None,
+    "emergency_fallback": None,
+}
+LAYER_TIMEOUTS.update(getattr(settings, "RECOMMEND_LAYER_TIMEOUTS", {}))
+LAYER_WORKERS = getattr(settings, "RECOMMEND_LAYER_WORKERS", 8)
+
+BREAKER_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 300  # 5 minutes
+# How long a half-open probe holds the probe slot before another may try
+BREAKER_PROBE_TIMEOUT = 30
+
+
+class LayerTimeout(Exception):
+    """A layer did not finish within its time budget."""
+
+
+def incr(key, delta=1, timeout=None, backend=None):
+    """Atomic counter increment that creates the key on first use."""
+    backend = backend or cache
+    if backend.add(key, delta, timeout):
+        return delta
+    try:
+        return backend.incr(key, delta)
+    except ValueError:
+        # Expired between add() and incr()
+        backend.set(key, delta, timeout)
+        return delta
+
+
+class CircuitBreaker:
+    """Circuit breaker whose state is shared through ``backend`` (default: the default cache)."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name,
+        threshold=BREAKER_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+        probe_timeout=BREAKER_PROBE_TIMEOUT,
+        backend=None,
+    ):
+        self.name = name
+        self.cache = backend or cache
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.failures_key = f"{BREAKER_PREFIX}:{name}:failures"
+        self.open_until_key = f"{BREAKER_PREFIX}:{name}:open_until"
+        self.probe_key = f"{BREAKER_PREFIX}:{name}:probe"
+
+    def state(self):
+        open_until = self.cache.get(self.open_until_key)
+        if not open_until:
+            return self.CLOSED
+        if time.time() < open_until:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """
+        True if the caller may run the layer.
+
+        While open nobody may; once the open period has passed exactly one
+        caller (the one that claims the probe key) is let through.
+        """
+        state = self.state()
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+        return self.cache.add(self.probe_key, 1, self.probe_timeout)
+
+    def record_success(self):
+        if self.cache.get(self.open_until_key):
+            logger.info(f"Circuit breaker closed for {self.name}")
+        self.cache.delete_many([self.failures_key, self.open_until_key, self.probe_key])
+
+    def record_failure(self):
+        failures = incr(self.failures_key, timeout=self.reset_timeout * 2, backend=self.cache)
+        # A failed half-open probe re-opens immediately
+        if failures >= self.threshold or self.cache.get(self.open_until_key):
+            self.trip()
+        return failures
+
+    def trip(self):
+        self.cache.set(
+            self.open_until_key,
+            time.time() + self.reset_timeout,
+            self.reset_timeout * 2,
+        )
+        self.cache.delete_many([self.failures_key, self.probe_key])
+        logger.warning(f"Circuit breaker activated for {self.name}")
+
+    def status(self):
+        return {
+            "state": self.state(),
+            "failures": self.cache.get(self.failures_key, 0),
+            "open_until": self.cache.get(self.open_until_key),
+        }
+
+
+def _bucket_label(bound):
+    return f"le_{bound}" if bound is not None else "le_inf"
+
+
+def _bucket_for(duration_ms):
+    for bound in LATENCY_BUCKETS_MS:
+        if duration_ms <= bound:
+            return bound
+    return None
+
+
+def record_layer(layer, outcome, duration):
+    """Count one ``outcome`` for ``layer`` and add its latency (seconds)."""
+    try:
+        incr(f"{STATS_PREFIX}:{layer}:{outcome}")
+        if outcome == "open":
+            return
+        duration_ms = duration * 1000.0
+        incr(f"{STATS_PREFIX}:{layer}:{_bucket_label(_bucket_for(duration_ms))}")
+        incr(f"{STATS_PREFIX}:{layer}:total_ms", int(round(duration_ms)))
+    except Exception as e:
+        # Telemetry must never break a request
+        logger.debug(f"Could not record telemetry for {layer}: {e}")
+
+
+def record_request(served_by, duration):
+    """Count a whole request and the layer that finally answered it."""
+    try:
+        incr(f"{STATS_PREFIX}:requests")
+        incr(f"{STATS_PREFIX}:served:{served_by}")
+        incr(f"{STATS_PREFIX}:request_ms", int(round(duration * 1000.0)))
+    except Exception as e:
+        logger.debug(f"Could not record request telemetry: {e}")
+
+
+def _bucket_keys(layer):
+    bounds = list(LATENCY_BUCKETS_MS) + [None]
+    return [(bound, f"{STATS_PREFIX}:{layer}:{_bucket_label(bound)}") for bound in bounds]
+
+
+def _percentile(buckets, total, fraction):
+    """Upper bucket bound (ms) containing the ``fraction`` quantile."""
+    if not total:
+        return None
+    target = fraction * total
+    seen = 0
+    for bound, count in buckets:
+        seen += count
+        if seen >= target:
+            return bound
+    return None
+
+
+def layer_stats():
+    """Counters, latency histograms and breaker state for every layer."""
+    keys = [f"{STATS_PREFIX}:requests", f"{STATS_PREFIX}:request_ms"]
+    for layer in LAYERS:
+        keys.append(f"{STATS_PREFIX}:served:{layer}")
+        keys.append(f"{STATS_PREFIX}:{layer}:total_ms")
+        keys.extend(f"{STATS_PREFIX}:{layer}:{outcome}" for outcome in OUTCOMES)
+        keys.extend(key for _, key in _bucket_keys(layer))
+    values = cache.get_many(keys)
+
+    requests = values.get(f"{STATS_PREFIX}:requests", 0)
+    layers = {}
+    for layer in LAYERS:
+        counts = {
+            outcome: values.get(f"{STATS_PREFIX}:{layer}:{outcome}", 0)
+            for outcome in OUTCOMES
+        }
+        buckets = [(bound, values.get(key, 0)) for bound, key in _bucket_keys(layer)]
+        timed = sum(count for _, count in buckets)
+        total_ms = values.get(f"{STATS_PREFIX}:{layer}:total_ms", 0)
+        layers[layer] = {
+            "counts": counts,
+            "served": values.get(f"{STATS_PREFIX}:served:{layer}", 0),
+            "latency_ms": {
+                "buckets": {_bucket_label(bound): count for bound, count in buckets},
+                "mean": round(total_ms / timed, 2) if timed else None,
+                "p50": _percentile(buckets, timed, 0.5),
+                "p95": _percentile(buckets, timed, 0.95),
+                "p99": _percentile(buckets, timed, 0.99),
+            },
+            "timeout": LAYER_TIMEOUTS.get(layer),
+            "breaker": CircuitBreaker(layer).status(),
+        }
+
+    served_first = layers[LAYERS[0]]["served"]
+    return {
+        "requests": requests,
+        "mean_request_ms": (
+            round(values.get(f"{STATS_PREFIX}:request_ms", 0) / requests, 2)
+            if requests
+            else None
+        ),
+        "fallback_rate": round((requests - served_first) / requests, 4) if requests else None,
+        "layers": layers,
+        "timestamp": time.time(),
+    }
+
+
+def reset_stats():
+    """Drop all telemetry counters (breaker state is left alone)."""
+    keys = [f"{STATS_PREFIX}:requests", f"{STATS_PREFIX}:request_ms"]
+    for layer in LAYERS:
+        keys.append(f"{STATS_PREFIX}:served:{layer}")
+        keys.append(f"{STATS_PREFIX}:{layer}:total_ms")
+        keys.extend(f"{STATS_PREFIX}:{layer}:{outcome}" for outcome in OUTCOMES)
+        keys.extend(key for _, key in _bucket_keys(layer))
+    cache.delete_many(keys)
+
+
+def record_shadow(version, primary, shadow, overlap):
+    """
+    Count one request scored by shadow candidate ``version``: both models'
+    latencies (seconds) and the overlap (0..1) of their top-N.
+    """
+    try:
+        prefix = f"{SHADOW_PREFIX}:{version}"
+        incr(f"{prefix}:samples")
+        incr(f"{prefix}:overlap_milli", int(round(overlap * 1000)))
+        for name, duration in (("primary", primary), ("shadow", shadow)):
+            duration_ms = duration * 1000.0
+            incr(f"{prefix}:{name}:{_bucket_label(_bucket_for(duration_ms))}")
+            incr(f"{prefix}:{name}:total_us", int(round(duration_ms * 1000)))
+    except Exception as e:
+        logger.debug(f"Could not record shadow telemetry for {version}: {e}")
+
+
+def _shadow_keys(version):
+    prefix = f"{SHADOW_PREFIX}:{version}"
+    keys = [f"{prefix}:samples", f"{prefix}:overlap_milli"]
+    for name in ("primary", "shadow"):
+        keys.append(f"{prefix}:{name}:total_us")
+        keys.extend(key for _, key in _bucket_keys(f"shadow:{version}:{name}"))
+    return keys
+
+
+def shadow_stats(version):
+    """Latency of the current model vs. candidate ``version`` and their overlap."""
+    values = cache.get_many(_shadow_keys(version))
+    prefix = f"{SHADOW_PREFIX}:{version}"
+    samples = values.get(f"{prefix}:samples", 0)
+    latency = {}
+    for name in ("primary", "shadow"):
+        buckets = [
+            (bound, values.get(key, 0)) for bound, key in _bucket_keys(f"shadow:{version}:{name}")
+        ]
+        timed = sum(count for _, count in buckets)
+        total_us = values.get(f"{prefix}:{name}:total_us", 0)
+        latency[name] = {
+            "mean": round(total_us / 1000.0 / timed, 3) if timed else None,
+            "p50": _percentile(buckets, timed, 0.5),
+            "p95": _percentile(buckets, timed, 0.95),
+            "p99": _percentile(buckets, timed, 0.99),
+        }
+    return {
+        "version": version,
+        "samples": samples,
+        "overlap": round(values.get(f"{prefix}:overlap_milli", 0) / 1000.0 / samples, 4)
+        if samples
+        else None,
+        "primary_ms": latency["primary"],
+        "shadow_ms": latency["shadow"],
+    }
+
+
+def reset_shadow_stats(version):
+    cache.delete_many(_shadow_keys(version))
+
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=LAYER_WORKERS, thread_name_prefix="recommend-layer"
+        )
+    return _executor
+
+
+def _call_and_close(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        # Pool threads open their own DB connections; don't leak them
+        connections.close_all()
+
+
+def run_with_budget(fn, budget, *args, **kwargs):
+    """
+    Run ``fn`` with a time budget in seconds.
+
+    Raises ``LayerTimeout`` when the budget is exceeded; the call is then
+    abandoned (left to finish on its pool thread, result discarded).  A
+    budget of None runs ``fn`` inline.
+    """
+    if not budget:
+        return fn(*args, **kwargs)
+    future = _get_executor().submit(_call_and_close, fn, args, kwargs)
+    try:
+        return future.result(timeout=budget)
+    except FutureTimeout:
+        future.cancel()
+        raise LayerTimeout(f"{getattr(fn, '__name__', fn)} exceeded {budget}s")
@@ -1,6 +1,8 @@
 """Tests for recommendation system and interests onboarding."""
 
+import io
 import json
+import os
 
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase
@@ -81,3 +83,1844 @@ class InteractionRecordingTest(TestCase):
         game2 = LetterSetGame.objects.create(user=self.user, letters="abcdefgh")
         category2 = categorize_game(game2)
         self.assertEqual(category2, "word")
+
+
+class UserScoringTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        from blog.models import Post, Tag
+        from communities.models import Community, CommunityPost
+
+        cache.clear()
+        self.user = User.objects.create_user(username="scoreuser", password="pw")
+        self.authors = [User.objects.create_user(username=f"author{i}", password="pw") for i in range(2)]
+        tag = Tag.objects.create(name="technology")
+        for i in range(5):
+            post = Post.objects.create(author=self.authors[i % 2], title=f"Tech {i}", content="x")
+            post.tags.add(tag)
+        community = Community.objects.create(name="Scoring", category="technology", creator=self.authors[0])
+        for i in range(8):
+            CommunityPost.objects.create(
+                community=community, author=self.authors[i % 2], title=f"C {i}", content="y"
+            )
+        UserInterests.objects.create(user=self.user, blog_tags=["tech"])
+
+    def test_profile_is_cached_and_invalidated(self):
+        from django.contrib.contenttypes.models import ContentType
+
+        from communities.models import CommunityPost
+        from recommend.models import Interaction
+        from recommend.utils import UserProfile
+
+        with self.assertNumQueries(3):
+            profile = UserProfile.for_user(self.user)
+        self.assertEqual(profile.recent_interactions, 0)
+        self.assertEqual(profile.blog_tags, ["tech"])
+        with self.assertNumQueries(0):
+            self.assertEqual(UserProfile.for_user(self.user).stats, profile.stats)
+
+        post = CommunityPost.objects.first()
+        Interaction.objects.create(
+            user=self.user,
+            content_type=ContentType.objects.get_for_model(CommunityPost),
+            object_id=post.id,
+            action="skip",
+            value=1.0,
+        )
+        profile = UserProfile.for_user(self.user)
+        self.assertEqual(profile.recent_interactions, 1)
+        self.assertEqual(profile.skip_rate, 1.0)
+
+    def test_vectorized_scores_match_single_candidate_scoring(self):
+        from recommend.utils import CandidateGenerator, ScoringEngine, UserProfile
+
+        profile = UserProfile.for_user(self.user)
+        candidates = CandidateGenerator.generate_candidates(self.user, profile=profile)
+        self.assertTrue(all(c["creator_id"] in {a.id for a in self.authors} for c in candidates))
+        # Exploration picks are deduplicated against the recent posts here
+        candidates.append(dict(candidates[0], object_id=-1, exploration=True))
+        scores = ScoringEngine.score_candidates(candidates, profile)
+        for candidate, score in zip(candidates, scores):
+            self.assertAlmostEqual(ScoringEngine.score_candidate(candidate, self.user, profile), score)
+        explored = [s for c, s in zip(candidates, scores) if c.get("exploration")]
+        regular = [s for c, s in zip(candidates, scores) if not c.get("exploration")]
+        self.assertGreater(min(explored), max(regular))
+
+    def test_recommendations_use_bounded_queries_without_random_ordering(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from recommend.models import Recommendation
+        from recommend.utils import _random_ids, compute_recommendations_for_user
+        from communities.models import CommunityPost
+
+        with CaptureQueriesContext(connection) as queries:
+            ranked = compute_recommendations_for_user(self.user, limit=6)
+        self.assertEqual(len(ranked), 6)
+        self.assertLessEqual(len(queries), 30)
+        self.assertFalse(any("RANDOM()" in q["sql"].upper() for q in queries.captured_queries))
+        self.assertEqual(Recommendation.objects.current().filter(user=self.user).count(), 6)
+        # Anti-fatigue: the two authors get at most three slots each
+        self.assertEqual(
+            sorted({c["creator_id"] for c in ranked}), sorted(a.id for a in self.authors)
+        )
+
+        ids = _random_ids(CommunityPost.objects.all(), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertTrue(CommunityPost.objects.filter(id__in=ids).count() == 5)
+        self.assertEqual(len(_random_ids(CommunityPost.objects.all(), 50)), 8)
+
+
+class ContentPopularityTest(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+
+        from django.core.cache import cache
+        from django.utils import timezone
+
+        from communities.models import Community, CommunityPost
+
+        cache.clear()
+        self.users = [User.objects.create_user(username=f"popuser{i}", password="pw") for i in range(3)]
+        community = Community.objects.create(name="Popular", category="technology", creator=self.users[0])
+        self.posts = [
+            CommunityPost.objects.create(
+                community=community, author=self.users[0], title=f"P {i}", content="z"
+            )
+            for i in range(4)
+        ]
+        # posts[3] is outside the trending window
+        CommunityPost.objects.filter(pk=self.posts[3].pk).update(
+            created_at=timezone.now() - timedelta(days=10)
+        )
+        self.posts[0].likes.add(self.users[0], self.users[1])
+        self.posts[1].likes.add(self.users[2])
+        self.posts[1].bookmarks.add(self.users[0], self.users[1], self.users[2])
+        self.posts[3].likes.add(*self.users)
+
+    def rows(self):
+        from recommend.models import ContentPopularity
+
+        return {
+            row.object_id: row
+            for row in ContentPopularity.objects.filter(object_id__in=[p.pk for p in self.posts])
+        }
+
+    def test_incremental_refresh_touches_only_changed_items(self):
+        from django.contrib.contenttypes.models import ContentType
+
+        from communities.models import CommunityPost, CommunityPostComment
+        from recommend.models import Interaction
+        from recommend.popularity import popular_items, refresh_popularity, trending_ids
+
+        self.assertTrue(refresh_popularity()["full"])
+        rows = self.rows()
+        self.assertEqual((rows[self.posts[0].pk].likes, rows[self.posts[1].pk].bookmarks), (2, 3))
+        self.assertEqual(
+            [key for key, _ in popular_items("communities.communitypost", 2)],
+            [f"communities.communitypost:{self.posts[1].pk}", f"communities.communitypost:{self.posts[3].pk}"],
+        )
+        self.assertEqual(refresh_popularity(), {"updated": 0, "removed": 0, "full": False})
+
+        CommunityPostComment.objects.create(post=self.posts[2], author=self.users[1], text="hi")
+        Interaction.objects.create(
+            user=self.users[1],
+            content_type=ContentType.objects.get_for_model(CommunityPost),
+            object_id=self.posts[2].pk,
+            action="view",
+        )
+        self.users[1].liked_community_posts.clear()
+        stats = refresh_popularity()
+        self.assertEqual(stats["updated"], 3)  # posts 0 and 3 lost a like, post 2 gained activity
+        rows = self.rows()
+        self.assertEqual(rows[self.posts[0].pk].likes, 1)
+        self.assertEqual(rows[self.posts[2].pk].comments, 1)
+        self.assertEqual(rows[self.posts[2].pk].recent_interactions, 1)
+
+        total, ids = trending_ids("communities.communitypost")
+        self.assertEqual(total, 4)
+        self.assertEqual(ids[:1], [self.posts[1].pk])
+        self.assertEqual(
+            ids, sorted(ids, key=lambda pk: rows[pk].hot_score, reverse=True)
+        )
+
+        self.posts[2].delete()
+        self.assertEqual(refresh_popularity()["removed"], 1)
+        self.assertNotIn(self.posts[2].pk, self.rows())
+
+    def test_new_items_get_rows_and_watermarks_survive_the_cache(self):
+        from django.core.cache import cache
+
+        from communities.models import CommunityPost
+        from recommend.models import PopularityWatermark
+        from recommend.popularity import refresh_popularity, trending_ids
+
+        self.assertTrue(refresh_popularity()["full"])
+        self.assertEqual(
+            PopularityWatermark.objects.get(name="communities.communitypost").value,
+            self.posts[-1].pk,
+        )
+        cache.clear()
+
+        # No likes, comments or interactions: still in trending after the next run
+        quiet = CommunityPost.objects.create(
+            community=self.posts[0].community, author=self.users[1], title="Quiet", content="q"
+        )
+        self.assertEqual(refresh_popularity(), {"updated": 1, "removed": 0, "full": False})
+        self.assertIn(quiet.pk, trending_ids("communities.communitypost", limit=10)[1])
+        self.assertEqual(refresh_popularity()["updated"], 0)
+
+    def test_likes_marked_during_a_refresh_are_kept_for_the_next(self):
+        from unittest.mock import patch
+
+        from recommend import popularity
+        from recommend.models import PopularityDirtyItem
+
+        popularity.refresh_popularity()
+        self.posts[2].likes.add(self.users[0])
+        self.assertEqual(PopularityDirtyItem.objects.count(), 1)
+
+        recompute = popularity._recompute
+        calls = []
+
+        def like_meanwhile(label, pks, now):
+            # An unlike committed while this run is recomputing
+            if not calls:
+                self.posts[3].likes.remove(self.users[0])
+            calls.append(pks)
+            return recompute(label, pks, now)
+
+        with patch.object(popularity, "_recompute", like_meanwhile):
+            self.assertEqual(popularity.refresh_popularity()["updated"], 1)
+        self.assertEqual(self.rows()[self.posts[2].pk].likes, 1)
+        self.assertEqual(
+            list(PopularityDirtyItem.objects.values_list("object_id", flat=True)), [self.posts[3].pk]
+        )
+        self.assertEqual(popularity.refresh_popularity()["updated"], 1)
+        self.assertEqual(self.rows()[self.posts[3].pk].likes, 2)
+        self.assertFalse(PopularityDirtyItem.objects.exists())
+
+    def test_feeds_read_trending_from_table(self):
+        from datetime import timedelta
+
+        from django.urls import reverse
+        from django.utils import timezone
+
+        from recommend.popularity import refresh_popularity, trending_ids
+
+        refresh_popularity()
+        response = self.client.get(reverse("community_posts_api"), {"sort": "trending", "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        _, expected = trending_ids(
+            "communities.communitypost", since=timezone.now() - timedelta(days=7), limit=2
+        )
+        self.assertEqual([post["id"] for post in response.json()["posts"]], expected)
+        self.assertNotIn(self.posts[3].pk, expected)
+
+
+class RecommenderFixtureMixin:
+    """Small interaction graph shared by the torch recommender tests."""
+
+    def setUp(self):
+        import tempfile
+
+        from django.contrib.contenttypes.models import ContentType
+
+        from communities.models import Community, CommunityPost
+        from recommend.models import Interaction
+        from recommend.registry import clear_cache
+
+        # Registry rows of earlier tests were rolled back
+        clear_cache()
+        self.users = [
+            User.objects.create_user(username=f"recuser{i}", password="pw")
+            for i in range(4)
+        ]
+        community = Community.objects.create(
+            name="Rec Community", category="technology", creator=self.users[0]
+        )
+        self.posts = [
+            CommunityPost.objects.create(
+                community=community,
+                author=self.users[0],
+                title=f"Post {i}",
+                content=f"Content {i}",
+            )
+            for i in range(6)
+        ]
+        ct = ContentType.objects.get_for_model(CommunityPost)
+        for u_pos, user in enumerate(self.users):
+            for post in self.posts[u_pos : u_pos + 3]:
+                Interaction.objects.create(
+                    user=user,
+                    content_type=ct,
+                    object_id=post.id,
+                    action="view",
+                    value=1.0,
+                )
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_path = os.path.join(self.temp_dir, "hybrid.pt")
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def train_hybrid(self, **kwargs):
+        from recommend.ml.torch_recommender_hybrid import train_and_save_hybrid
+
+        options = dict(model_path=self.model_path, epochs=1, emb_dim=8, content_emb_dim=4, batch_size=8)
+        options.update(kwargs)
+        return train_and_save_hybrid(**options)
+
+
+class HybridServingCacheTest(RecommenderFixtureMixin, TestCase):
+    def test_serving_model_is_reused_until_artifact_changes(self):
+        from recommend.ml.serving import get_serving_model
+
+        self.train_hybrid()
+        first = get_serving_model(self.model_path)
+        self.assertIsNotNone(first)
+        self.assertIs(get_serving_model(self.model_path), first)
+
+        self.train_hybrid()
+        second = get_serving_model(self.model_path)
+        self.assertIsNot(second, first)
+        self.assertNotEqual(second.version, first.version)
+
+    def test_recommendations_use_serving_model(self):
+        from recommend.ml.serving import get_serving_model
+        from recommend.ml.torch_recommender_hybrid import recommend_for_user_hybrid
+
+        self.train_hybrid()
+        serving = get_serving_model(self.model_path)
+        recs = recommend_for_user_hybrid(self.users[0].id, model=serving, topn=3)
+        self.assertTrue(recs)
+        self.assertTrue(all(key.startswith("communities.communitypost:") for key, _ in recs))
+        self.assertEqual(recommend_for_user_hybrid(-1, model=serving), [])
+
+
+class HybridBatchScoringTest(RecommenderFixtureMixin, TestCase):
+    def test_batch_top_n_matches_per_user_scores(self):
+        import numpy as np
+
+        from recommend.ml.serving import get_serving_model
+        from recommend.ml.torch_recommender_hybrid import recommend_for_users_hybrid
+
+        self.train_hybrid()
+        serving = get_serving_model(self.model_path)
+        user_ids = [u.id for u in self.users]
+        results = list(
+            recommend_for_users_hybrid(
+                user_ids, model=serving, topn=3, block_size=2, freshness_boost=False
+            )
+        )
+        self.assertEqual([uid for uid, _, _ in results], user_ids)
+        for uid, idxs, scores in results:
+            expected = np.argsort(-serving.score_vector(serving.user_vector(uid)))[:3]
+            self.assertEqual(list(idxs), list(expected))
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+
+
+class IVFIndexTest(TestCase):
+    def setUp(self):
+        import numpy as np
+
+        rng = np.random.default_rng(7)
+        self.vectors = rng.normal(size=(2000, 16)).astype("float32")
+        self.queries = rng.normal(size=(20, 16)).astype("float32")
+
+    def test_search_recall_against_brute_force(self):
+        import numpy as np
+
+        from recommend.ml.ann import IVFIndex
+
+        index = IVFIndex.build(self.vectors, n_lists=32)
+        hits = 0
+        for q in self.queries:
+            exact = set(np.argsort(-(self.vectors @ q))[:10])
+            ids, scores = index.search(q, 10, n_probe=16)
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            hits += len(exact & set(ids.tolist()))
+        self.assertGreaterEqual(hits / (10 * len(self.queries)), 0.8)
+
+    def test_add_and_persist(self):
+        import tempfile
+
+        import numpy as np
+
+        from recommend.ml.ann import IVFIndex
+
+        index = IVFIndex.build(self.vectors[:1000], n_lists=16, version="v1")
+        new_ids = index.add(self.vectors[1000:1001] * 100)
+        self.assertEqual(int(new_ids[0]), 1000)
+        ids, _ = index.search(self.vectors[1000], 1, n_probe=index.n_lists)
+        self.assertEqual(int(ids[0]), 1000)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = index.save(os.path.join(tmp, "items.ivf.npz"))
+            loaded = IVFIndex.load(path)
+        self.assertEqual(loaded.version, "v1")
+        self.assertEqual(len(loaded), 1001)
+        np.testing.assert_array_equal(loaded.assignments, index.assignments)
+
+
+class HybridAnnServingTest(RecommenderFixtureMixin, TestCase):
+    def test_serving_model_uses_index_saved_with_model(self):
+        from unittest.mock import patch
+
+        from recommend.ml import serving
+        from recommend.ml.torch_recommender_hybrid import recommend_for_user_hybrid
+
+        self.train_hybrid()
+        with patch.object(serving, "ANN_MIN_ITEMS", 1):
+            model = serving.HybridServingModel(
+                serving.load_model_hybrid(self.model_path), self.model_path
+            )
+        self.assertIsNotNone(model.index)
+        recs = recommend_for_user_hybrid(self.users[1].id, model=model, topn=3)
+        self.assertEqual(len(recs), 3)
+
+
+class InteractionSnapshotTest(RecommenderFixtureMixin, TestCase):
+    def test_incremental_snapshot_matches_live_table(self):
+        import numpy as np
+        from django.core.management import call_command
+
+        from recommend.ml.dataset import load_interaction_data, load_snapshot_data
+        from recommend.ml.snapshot import InteractionSnapshot, write_snapshot
+        from recommend.models import Interaction
+
+        path = os.path.join(self.temp_dir, "snapshot")
+        self.assertEqual(write_snapshot(path, partition_rows=5, lag=0), (12, 3))
+        snapshot = InteractionSnapshot(path, verify=True)
+        self.assertEqual(snapshot.watermark, Interaction.objects.order_by("-id").first().id)
+
+        live = load_interaction_data()
+        offline = load_snapshot_data(path)
+        self.assertEqual(offline.item_keys, live.item_keys)
+        np.testing.assert_array_equal(offline.user_ids, live.user_ids)
+        live_pairs = sorted(zip(live.user_idx, live.item_idx, live.weight.round(5)))
+        offline_pairs = sorted(zip(offline.user_idx, offline.item_idx, offline.weight.round(5)))
+        self.assertEqual(offline_pairs, live_pairs)
+
+        # Only rows above the watermark are exported on the next run
+        first = Interaction.objects.order_by("id").first()
+        Interaction.objects.create(
+            user=self.users[3], content_type=first.content_type, object_id=first.object_id,
+            action="like",
+        )
+        self.assertEqual(write_snapshot(path, partition_rows=5, lag=0), (1, 1))
+        self.assertEqual(write_snapshot(path, partition_rows=5, lag=0), (0, 0))
+        snapshot = InteractionSnapshot(path)
+        self.assertEqual(len(snapshot), 13)
+        rows = snapshot.read(("action",))
+        self.assertEqual(int((rows["action"] == snapshot.action_code("like")).sum()), 1)
+
+        out = io.StringIO()
+        call_command("compute_recommendations", snapshot=path, topn=2, stdout=out)
+        self.assertIn("Found 4 users and 6 items", out.getvalue())
+
+
+class HybridTrainingProfileTest(RecommenderFixtureMixin, TestCase):
+    def test_sparse_bf16_profile_trains_servable_model(self):
+        import contextlib
+
+        import torch
+
+        from recommend.ml import torch_recommender_hybrid as hybrid
+        from recommend.ml.serving import get_serving_model
+
+        self.assertEqual(hybrid.resolve_training_profile("cpu", threads=2)["threads"], 2)
+        with self.assertRaises(ValueError):
+            hybrid.resolve_training_profile("gpu")
+
+        model = hybrid.HybridRecommenderModel(4, 6, 8, 4, sparse=True)
+        optimizers = hybrid._optimizers(model, 0.01, sparse=True)
+        self.assertIsInstance(optimizers[0], torch.optim.SparseAdam)
+
+        threads = torch.get_num_threads()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            path = self.train_hybrid(
+                epochs=2, batch_size=2, profile="cpu-bf16", threads=1, epoch_time_budget=0
+            )
+        self.assertEqual(torch.get_num_threads(), threads)
+        self.assertIn("samples/s=", out.getvalue())
+        self.assertIn("time budget hit after 1/", out.getvalue())
+        self.assertTrue(
+            hybrid.recommend_for_user_hybrid(self.users[0].id, model=get_serving_model(path))
+        )
+
+
+class HybridDistributedTrainingTest(RecommenderFixtureMixin, TestCase):
+    def test_gloo_data_parallel_training_saves_model(self):
+        import contextlib
+
+        from recommend.ml import distributed
+        from recommend.ml.serving import get_serving_model
+        from recommend.ml.torch_recommender_hybrid import recommend_for_user_hybrid
+
+        if not distributed.available():
+            self.skipTest("torch.distributed/gloo not available")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            path = self.train_hybrid(epochs=2, batch_size=2, processes=2, profile="cpu")
+        self.assertEqual(path, self.model_path)
+        self.assertIn("data-parallel in 2 processes", out.getvalue())
+        model = get_serving_model(path)
+        self.assertEqual(model.n_items, len(self.posts))
+        self.assertTrue(recommend_for_user_hybrid(self.users[0].id, model=model, topn=3))
+
+
+class RecommenderBenchmarkTest(TestCase):
+    def test_synthetic_benchmark_reports_every_method(self):
+        import tempfile
+
+        import numpy as np
+        from django.core.management import call_command
+
+        from recommend.ml.benchmark import compare_reports, recall_ndcg, split_holdout
+
+        recall, ndcg = recall_ndcg([3, 1, 2], {1, 9}, k=2)
+        self.assertEqual(recall, 0.5)
+        self.assertAlmostEqual(ndcg, (1 / np.log2(3)) / (1 + 1 / np.log2(3)))
+        train, test = split_holdout(np.array([1] * 5 + [2] * 2), np.array([0, 1, 2, 3, 4, 0, 1]))
+        self.assertEqual(int((~train).sum()), 1)
+        self.assertEqual(list(test), [1])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "report.json")
+            call_command(
+                "benchmark_recommenders",
+                users=60, items=80, interactions=1500, eval_users=20, epochs=1, emb_dim=8,
+                methods="popularity,interest,item_knn,hybrid", output=output,
+                stdout=io.StringIO(), stderr=io.StringIO(),
+            )
+            with open(output) as fh:
+                report = json.load(fh)
+
+        self.assertEqual(
+            list(report["results"]), ["popularity", "interest", "item_knn", "hybrid"]
+        )
+        for result in report["results"].values():
+            if "skipped" in result:
+                continue
+            self.assertEqual(
+                set(result),
+                {"train_seconds", "peak_rss_mb", "latency_ms", "recall_at_k", "ndcg_at_k", "coverage"},
+            )
+            self.assertLessEqual(result["latency_ms"]["p50"], result["latency_ms"]["p99"])
+            for metric in ("recall_at_k", "ndcg_at_k", "coverage"):
+                self.assertGreaterEqual(result[metric], 0.0)
+                self.assertLessEqual(result[metric], 1.0)
+        # The preference structure is learnable: interest beats global popularity
+        self.assertGreater(
+            report["results"]["interest"]["recall_at_k"],
+            report["results"]["popularity"]["recall_at_k"],
+        )
+        self.assertEqual(compare_reports(report, report)["popularity"]["recall_at_k"], 0.0)
+
+
+class HybridRerankingTest(TestCase):
+    def test_mmr_without_penalty_is_score_order(self):
+        import numpy as np
+
+        from recommend.ml.torch_recommender_hybrid import mmr_select
+
+        unit = np.eye(4, dtype="float32")
+        scores = np.array([0.1, 0.9, 0.5, 0.7], dtype="float32")
+        self.assertEqual(mmr_select(unit, scores, 3, diversity_penalty=0), [1, 3, 2])
+
+    def test_mmr_skips_near_duplicates(self):
+        import numpy as np
+
+        from recommend.ml.torch_recommender_hybrid import mmr_select
+
+        unit = np.array([[1, 0], [1, 0], [0, 1]], dtype="float32")
+        scores = np.array([1.0, 0.99, 0.8], dtype="float32")
+        self.assertEqual(mmr_select(unit, scores, 2, diversity_penalty=0.5), [0, 2])
+
+
+class HybridServingFilterTest(RecommenderFixtureMixin, TestCase):
+    def test_allowed_content_masks_and_freshness(self):
+        from recommend.ml.serving import get_serving_model
+        from recommend.ml.torch_recommender_hybrid import recommend_for_user_hybrid
+
+        self.train_hybrid()
+        model = get_serving_model(self.model_path)
+        self.assertTrue(model.allowed_mask({"communities"}).all())
+        self.assertFalse(model.allowed_mask({"blog.post"}).any())
+        self.assertEqual(
+            recommend_for_user_hybrid(self.users[0].id, model=model, allowed_content={"blog"}),
+            [],
+        )
+        # Items were created just now, so all get the full 1.5x boost
+        self.assertTrue((model.freshness_multipliers(model.item_created.max()) > 1.49).all())
+
+
+class InteractionDataLoaderTest(RecommenderFixtureMixin, TestCase):
+    def test_vectorized_weights_match_model_method(self):
+        import numpy as np
+
+        from recommend.ml.dataset import (
+            computed_weights,
+            load_interaction_data,
+            row_weights,
+        )
+        from recommend.models import Interaction
+
+        samples = [
+            {"duration": "45", "bookmarked": False, "liked": True},
+            {"duration_seconds": 90, "scroll_depth": 0.4, "saved": True},
+            {"scroll_fraction": "bad", "wishlisted": 1},
+            {"duration": [1], "duration_seconds": 0},
+            # ``or`` picks the truthy raw string, which then fails float()
+            {"duration_seconds": "abc", "duration": 60},
+            {"duration_seconds": "0", "duration": 60, "scroll_depth": "x", "scroll_fraction": 1},
+            {"bookmarked": [], "saved": {}, "liked": [0]},
+            {"duration_seconds": None, "duration": True, "wishlisted": "no"},
+        ]
+        for interaction, meta in zip(Interaction.objects.order_by("id"), samples):
+            interaction.metadata = meta
+            interaction.action = "like"
+            interaction.value = 0.0
+            interaction.save()
+
+        data = load_interaction_data(chunk_size=5)
+        expected = {}
+        for it in Interaction.objects.all():
+            key = f"communities.communitypost:{it.object_id}"
+            expected[(it.user_id, key)] = it.engagement_weight()
+        got = {
+            (int(data.user_ids[u]), data.item_keys[i]): float(w)
+            for u, i, w in zip(data.user_idx, data.item_idx, data.weight)
+        }
+        self.assertEqual(set(got), set(expected))
+        for key, weight in expected.items():
+            self.assertAlmostEqual(got[key], weight, places=5)
+        self.assertEqual(data.n_users, len(self.users))
+        self.assertEqual(data.item_idx.dtype, np.int32)
+
+        # The raw-column path (rows without a stored score) agrees as well
+        computed = computed_weights(Interaction.objects.all())
+        for it in Interaction.objects.all():
+            self.assertAlmostEqual(computed[it.pk], it.engagement_weight(), places=5)
+
+        # Columns where every row holds a list stay one-dimensional
+        metas = [{"bookmarked": [], "duration": [1, 2]}, {"bookmarked": [], "duration": [3, 4]}]
+        pks, weights = row_weights([(pk, "view", 1.0, meta) for pk, meta in enumerate(metas)])
+        expected = [
+            Interaction(action="view", value=1.0, metadata=meta).engagement_weight()
+            for meta in metas
+        ]
+        self.assertEqual(list(pks), [0, 1])
+        np.testing.assert_allclose(weights, expected, rtol=1e-6)
+
+    def test_stored_scores_backfill_and_sql_expression(self):
+        from django.core.management import call_command
+        from django.db.models import Sum
+
+        from recommend.ml.dataset import load_interaction_data
+        from recommend.models import Interaction
+
+        first = Interaction.objects.order_by("id").first()
+        first.metadata = {"duration": 60, "liked": True}
+        first.save(update_fields=["metadata"])
+        first.refresh_from_db()
+        self.assertAlmostEqual(first.engagement_score, first.engagement_weight(), places=5)
+
+        expected = {it.pk: it.engagement_weight() for it in Interaction.objects.all()}
+        # Legacy rows: the loader falls back to computing from raw columns
+        Interaction.objects.update(engagement_score=None)
+        data = load_interaction_data(chunk_size=3)
+        self.assertAlmostEqual(float(data.weight.sum()), sum(expected.values()), places=3)
+
+        call_command("backfill_engagement_scores", chunk_size=2, stdout=io.StringIO())
+        self.assertFalse(Interaction.objects.filter(engagement_score__isnull=True).exists())
+        for pk, score in Interaction.objects.values_list("pk", "engagement_score"):
+            self.assertAlmostEqual(score, expected[pk], places=5)
+
+        total = Interaction.objects.with_engagement().aggregate(total=Sum("engagement"))["total"]
+        self.assertAlmostEqual(total, sum(expected.values()), places=3)
+        per_item = Interaction.objects.weighted_totals()
+        self.assertAlmostEqual(sum(row["weight"] for row in per_item), total, places=3)
+
+    def test_mf_trainer_uses_loader(self):
+        from recommend.ml.torch_recommender import recommend_for_user, train_and_save
+
+        path = os.path.join(self.temp_dir, "mf.pt")
+        self.assertEqual(train_and_save(epochs=1, emb_dim=4, model_path=path), path)
+        from recommend.ml.torch_recommender import load_model
+
+        recs = recommend_for_user(self.users[0].id, model=load_model(path), topn=2)
+        self.assertEqual(len(recs), 2)
+
+
+class TrainingSamplerTest(TestCase):
+    def test_negatives_avoid_positives(self):
+        import numpy as np
+        import torch
+
+        from recommend.ml.sampling import PositiveIndex, sample_negatives
+
+        users = np.array([0, 0, 0, 1, 1])
+        items = np.array([0, 1, 2, 2, 3])
+        positives = PositiveIndex(users, items, n_users=2, n_items=5)
+        self.assertEqual(positives.items_for(0).tolist(), [0, 1, 2])
+        self.assertEqual(
+            positives.contains(torch.tensor([0, 0, 1]), torch.tensor([2, 3, 2])).tolist(),
+            [True, False, True],
+        )
+        batch_users = torch.tensor([0, 1] * 500)
+        negatives = sample_negatives(batch_users, positives, torch.Generator().manual_seed(1))
+        self.assertFalse(positives.contains(batch_users, negatives).any())
+
+    def test_weighted_sampler_and_worker_pipeline(self):
+        import numpy as np
+
+        from recommend.ml.sampling import (
+            PositiveIndex,
+            WeightedBatchSampler,
+            batch_loader,
+        )
+
+        users = np.array([0, 1, 2])
+        items = np.array([0, 1, 2])
+        weights = np.array([0.0, 0.0, 1.0], dtype="float32")
+        sampler = WeightedBatchSampler(
+            users, items, weights, PositiveIndex(users, items, 3, 4), 8, 3, seed=0
+        )
+        batches = list(batch_loader(sampler, num_workers=2))
+        self.assertEqual(len(batches), 3)
+        for us, ips, ins, ws in batches:
+            self.assertEqual(us.tolist(), [2] * 8)
+            self.assertEqual(ips.tolist(), [2] * 8)
+            self.assertNotIn(2, ins.tolist())
+
+
+class HybridFoldInTest(RecommenderFixtureMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        super().setUp()
+        cache.clear()
+
+    def test_new_user_is_folded_in_and_published(self):
+        from django.contrib.contenttypes.models import ContentType
+        from django.core.cache import cache
+
+        from communities.models import CommunityPost
+        from recommend.ml.foldin import STALE, user_vector_key
+        from recommend.ml.serving import get_serving_model
+        from recommend.ml.torch_recommender_hybrid import recommend_for_user_hybrid
+        from recommend.models import Interaction
+
+        self.train_hybrid()
+        serving = get_serving_model(self.model_path)
+        newcomer = User.objects.create_user(username="newcomer", password="pw")
+        self.assertEqual(recommend_for_user_hybrid(newcomer.id, model=serving), [])
+
+        ct = ContentType.objects.get_for_model(CommunityPost)
+        for post in self.posts[:2]:
+            Interaction.objects.create(
+                user=newcomer, content_type=ct, object_id=post.id, action="like", value=1.0
+            )
+        self.assertEqual(cache.get(user_vector_key(newcomer.id)), STALE)
+
+        recs = recommend_for_user_hybrid(newcomer.id, model=serving, topn=3)
+        self.assertEqual(len(recs), 3)
+        published = cache.get(user_vector_key(newcomer.id))
+        self.assertEqual(published["version"], serving.version)
+        self.assertEqual(published["vector"].shape, (serving.emb_dim,))
+
+    def test_empty_fold_in_is_cached_and_clears_stale(self):
+        import numpy as np
+        from django.contrib.contenttypes.models import ContentType
+        from django.core.cache import cache
+
+        from communities.models import CommunityPost
+        from recommend.ml.foldin import STALE, folded_user_vector, user_vector_key
+        from recommend.ml.serving import get_serving_model
+        from recommend.models import Interaction
+
+        self.train_hybrid()
+        serving = get_serving_model(self.model_path)
+        newcomer = User.objects.create_user(username="quiet", password="pw")
+        self.assertIsNone(folded_user_vector(serving, newcomer.id))
+        with self.assertNumQueries(0):
+            self.assertIsNone(folded_user_vector(serving, newcomer.id))
+
+        # A known user's new interaction is with an item the model does not know
+        user = self.users[0]
+        fresh = CommunityPost.objects.create(
+            community=self.posts[0].community, author=user, title="New", content="New"
+        )
+        Interaction.objects.filter(user=user).delete()
+        Interaction.objects.create(
+            user=user,
+            content_type=ContentType.objects.get_for_model(CommunityPost),
+            object_id=fresh.id,
+            action="like",
+        )
+        self.assertEqual(cache.get(user_vector_key(user.id)), STALE)
+        trained = serving.user_vector(user.id)
+        np.testing.assert_array_equal(folded_user_vector(serving, user.id), trained)
+        self.assertNotEqual(cache.get(user_vector_key(user.id)), STALE)
+        with self.assertNumQueries(0):
+            np.testing.assert_array_equal(folded_user_vector(serving, user.id), trained)
+
+    def test_solved_vector_prefers_positive_items(self):
+        import numpy as np
+
+        from recommend.ml.foldin import solve_user_vector
+
+        rng = np.random.default_rng(0)
+        items = rng.normal(size=(50, 8)).astype("float32")
+        vector = solve_user_vector(items, [3, 7], [2.0, 1.0], rng=rng)
+        scores = items @ vector
+        self.assertGreater(scores[[3, 7]].min(), np.median(scores))
+
+    def test_new_items_are_appended_to_serving_model(self):
+        from communities.models import CommunityPost
+        from recommend.ml.foldin import publish_new_items
+        from recommend.ml.serving import get_serving_model
+
+        self.train_hybrid()
+        base = get_serving_model(self.model_path)
+        fresh = CommunityPost.objects.create(
+            community=self.posts[0].community,
+            author=self.users[1],
+            title="Fresh",
+            content="Fresh content",
+        )
+        self.assertEqual(publish_new_items(self.model_path), 1)
+
+        serving = get_serving_model(self.model_path)
+        key = f"communities.communitypost:{fresh.id}"
+        self.assertIs(serving.base, base)
+        self.assertEqual(serving.n_items, base.n_items + 1)
+        self.assertEqual(serving.item_keys[serving.item_map[key]], key)
+        self.assertEqual(serving.item_matrix.shape[0], serving.n_items)
+        self.assertEqual(len(base.item_keys), base.n_items)
+
+
+class HybridSeenItemsTest(RecommenderFixtureMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        super().setUp()
+        cache.clear()
+
+    def test_seen_items_are_excluded_before_top_k(self):
+        import numpy as np
+        from django.contrib.contenttypes.models import ContentType
+
+        from communities.models import CommunityPost
+        from recommend.ml.seen import SeenItems, seen_item_indices
+        from recommend.ml.serving import get_serving_model
+        from recommend.ml.torch_recommender_hybrid import (
+            recommend_for_user_hybrid,
+            recommend_for_users_hybrid,
+        )
+        from recommend.models import Interaction
+
+        seen = SeenItems.from_pairs([1, 0, 1, 1], [2, 1, 0, 2], n_users=3, n_items=4)
+        self.assertEqual(seen.indptr.tolist(), [0, 1, 3, 3])
+        self.assertEqual(seen.row(1).tolist(), [0, 2])
+        self.assertEqual(len(seen.row(5)), 0)
+
+        self.train_hybrid()
+        serving = get_serving_model(self.model_path)
+        self.assertIsNotNone(serving.seen)
+        user = self.users[0]
+        key = "communities.communitypost:{}".format
+        consumed = {key(post.id) for post in self.posts[:3]}
+
+        everything = recommend_for_user_hybrid(
+            user.id, model=serving, topn=6, exclude_seen=False, diversity_penalty=0.0
+        )
+        self.assertEqual(len(everything), 6)
+        recs = recommend_for_user_hybrid(user.id, model=serving, topn=6)
+        self.assertEqual({k for k, _ in recs}, {key(post.id) for post in self.posts[3:]})
+
+        # New interactions are excluded without a retrain
+        ct = ContentType.objects.get_for_model(CommunityPost)
+        with self.captureOnCommitCallbacks(execute=True):
+            Interaction.objects.create(
+                user=user, content_type=ct, object_id=self.posts[3].id, action="view"
+            )
+        self.assertEqual(len(seen_item_indices(serving, user.id)), 4)
+        recs = recommend_for_user_hybrid(user.id, model=serving, topn=6)
+        self.assertEqual({k for k, _ in recs}, {key(post.id) for post in self.posts[4:]})
+
+        (uid, idxs, scores), = recommend_for_users_hybrid(
+            [user.id], model=serving, topn=6, exclude_seen=True
+        )
+        self.assertEqual(len(idxs), 3)
+        self.assertFalse({serving.item_keys[i] for i in idxs} & consumed)
+        self.assertTrue(np.all(np.isfinite(scores)))
+
+    def test_seen_delta_is_visible_to_other_processes(self):
+        import shutil
+        import tempfile
+
+        from django.core.cache.backends.filebased import FileBasedCache
+        from django.test import override_settings
+
+        from recommend.ml import seen
+
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, True)
+        shared = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": location,
+            }
+        }
+        with override_settings(CACHES=shared):
+            seen.record_seen(7, 10)
+            seen.record_seen(7, 11)
+        # A second backend instance over the same store stands in for another worker
+        other = FileBasedCache(location, {})
+        count = other.get(seen.seen_delta_key(7))
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            sorted(other.get_many([seen._slot_key(7, n) for n in (1, 2)]).values()), [10, 11]
+        )
+
+    def test_seen_delta_keeps_every_append_up_to_the_ring_size(self):
+        from unittest.mock import patch
+
+        from recommend.ml import seen
+
+        self.assertEqual(seen.seen_delta(7), [])
+        with patch.object(seen, "SEEN_DELTA_MAX", 4):
+            for item_id in (10, 11, 12):
+                seen.record_seen(7, item_id)
+            seen.record_seen(8, 99)
+            self.assertEqual(sorted(seen.seen_delta(7)), [10, 11, 12])
+            for item_id in (13, 14, 15):
+                seen.record_seen(7, item_id)
+            self.assertEqual(sorted(seen.seen_delta(7)), [12, 13, 14, 15])
+            self.assertEqual(seen.seen_delta(8), [99])
+
+
+class ItemRegistryTest(RecommenderFixtureMixin, TestCase):
+    def test_models_and_hydration_use_registry_ids(self):
+        import numpy as np
+        from django.contrib.contenttypes.models import ContentType
+
+        from communities.models import CommunityPost
+        from recommend import registry
+        from recommend.hydration import hydrate_recommendations
+        from recommend.ml.serving import HybridServingModel, get_serving_model
+        from recommend.ml.torch_recommender_hybrid import (
+            load_model_hybrid,
+            recommend_for_user_hybrid,
+        )
+        from recommend.models import ItemRegistry
+
+        ct = ContentType.objects.get_for_model(CommunityPost)
+        pks = [post.id for post in self.posts]
+        ids = registry.item_ids([ct.id] * len(pks), pks)
+        self.assertEqual(ItemRegistry.objects.count(), len(pks))
+        with self.assertNumQueries(0):
+            np.testing.assert_array_equal(registry.item_ids([ct.id] * len(pks), pks), ids)
+            self.assertEqual(registry.item_id(ct.id, pks[2]), ids[2])
+        registry.clear_cache()
+        ct_ids, object_ids = registry.resolve(ids[::-1])
+        self.assertEqual(object_ids.tolist(), pks[::-1])
+        self.assertEqual(set(ct_ids.tolist()), {ct.id})
+        self.assertIsNone(registry.item_id(ct.id, 999999, create=False))
+
+        self.train_hybrid()
+        serving = get_serving_model(self.model_path)
+        for row, key in enumerate(serving.item_keys):
+            pk = int(str(key).split(":")[1])
+            self.assertEqual(serving.item_ids[row], ids[pks.index(pk)])
+        first_row = serving.item_map[f"communities.communitypost:{pks[0]}"]
+        np.testing.assert_array_equal(serving.rows_for_item_ids([ids[0], -5]), [first_row, -1])
+
+        recs = recommend_for_user_hybrid(
+            self.users[0].id, model=serving, topn=3, as_item_ids=True
+        )
+        self.assertTrue(recs)
+        self.assertTrue(all(isinstance(item, int) for item, _ in recs))
+        cards = hydrate_recommendations(recs)
+        self.assertEqual([card["id"] for card in cards], [pks[list(ids).index(i)] for i, _ in recs])
+
+        # Models saved before the registry look their items up while serving...
+        payload = load_model_hybrid(self.model_path)
+        del payload["item_ids"]
+        legacy = HybridServingModel(payload)
+        np.testing.assert_array_equal(legacy.item_ids, serving.item_ids)
+
+        # ...but never register them there: unknown items keep their keys
+        ItemRegistry.objects.all().delete()
+        registry.clear_cache()
+        legacy = HybridServingModel(payload)
+        recs = recommend_for_user_hybrid(
+            self.users[0].id, model=legacy, topn=3, as_item_ids=True
+        )
+        self.assertTrue(recs)
+        self.assertTrue(all(isinstance(item, str) for item, _ in recs))
+        self.assertEqual(ItemRegistry.objects.count(), 0)
+
+        legacy.register_items()
+        self.assertEqual(ItemRegistry.objects.count(), len(legacy.item_keys))
+        self.assertTrue((legacy.item_ids >= 0).all())
+
+
+class ContentEmbeddingStoreTest(RecommenderFixtureMixin, TestCase):
+    class FakeEncoder:
+        """Deterministic stand-in for a SentenceTransformer (bag of hashed words)."""
+
+        model_name = "fake-encoder"
+
+        def __init__(self):
+            self.calls = []
+
+        def encode(self, texts, batch_size=32, convert_to_numpy=True, normalize_embeddings=True, **kwargs):
+            import zlib
+
+            import numpy as np
+
+            self.calls.append((len(texts), batch_size))
+            out = np.zeros((len(texts), 16), dtype=np.float32)
+            for row, text in enumerate(texts):
+                for word in text.lower().split():
+                    out[row, zlib.crc32(word.encode()) % 16] += 1.0
+            return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-8)
+
+    def test_incremental_encoding_and_lookup(self):
+        import numpy as np
+        from django.contrib.contenttypes.models import ContentType
+
+        from communities.models import CommunityPost
+        from recommend import registry
+        from recommend.ml.embeddings import ContentEmbeddings, load_embeddings, update_embeddings
+
+        path = os.path.join(self.temp_dir, "embeddings")
+        encoder = self.FakeEncoder()
+        stats = update_embeddings(path, encoder=encoder, batch_size=4)
+        self.assertEqual(stats, {"items": 6, "encoded": 6, "reused": 0, "removed": 0})
+        self.assertEqual(encoder.calls, [(6, 4)])
+
+        store = load_embeddings(path)
+        self.assertEqual(len(store), 6)
+        self.assertEqual(store.vectors.dtype, np.float16)
+        self.assertIsInstance(store.vectors, np.memmap)
+        key = f"communities.communitypost:{self.posts[2].id}"
+        vectors, found = store.vectors_for([key, "communities.communitypost:999999"])
+        self.assertEqual(found.tolist(), [True, False])
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=2)
+        self.assertEqual(store.nearest(vectors[0], k=1)[0][0], key)
+        ct = ContentType.objects.get_for_model(CommunityPost)
+        self.assertEqual(
+            int(store.item_ids[store.rows([key])[0]]), registry.item_id(ct.id, self.posts[2].id)
+        )
+
+        # Unchanged rows are reused; only edited and new items are encoded
+        self.posts[0].title = "Rewritten title"
+        self.posts[0].save()
+        self.posts[5].delete()
+        CommunityPost.objects.create(
+            community=self.posts[1].community, author=self.users[1], title="Fresh", content="New"
+        )
+        encoder.calls.clear()
+        stats = update_embeddings(path, encoder=encoder, batch_size=4)
+        self.assertEqual(stats, {"items": 6, "encoded": 2, "reused": 4, "removed": 1})
+        self.assertEqual(encoder.calls, [(2, 4)])
+        reloaded = load_embeddings(path)
+        self.assertIsNot(reloaded, store)
+        np.testing.assert_array_equal(reloaded.vectors_for([key])[0], vectors[:1])
+        self.assertEqual(len([f for f in os.listdir(path) if f.endswith(".npy")]), 4)
+
+        # Nothing changed: no encoder call at all
+        encoder.calls.clear()
+        self.assertEqual(update_embeddings(path, encoder=encoder)["encoded"], 0)
+        self.assertEqual(encoder.calls, [])
+        self.assertEqual(len(ContentEmbeddings(path)), 6)
+
+
+class RelatedItemsTest(RecommenderFixtureMixin, TestCase):
+    def build_table(self):
+        from recommend.ml.embeddings import load_embeddings, update_embeddings
+        from recommend.ml.related import build_related, load_related
+
+        embeddings_path = os.path.join(self.temp_dir, "embeddings")
+        update_embeddings(embeddings_path, encoder=ContentEmbeddingStoreTest.FakeEncoder())
+        path = os.path.join(self.temp_dir, "related")
+        stats = build_related(path, k=3, embeddings=load_embeddings(embeddings_path))
+        return stats, load_related(path), load_embeddings(embeddings_path)
+
+    def test_neighbours_match_signals(self):
+        import numpy as np
+
+        from recommend.ml.dataset import load_interaction_data
+
+        stats, table, embeddings = self.build_table()
+        self.assertEqual(stats["items"], 6)
+        self.assertEqual(table.neighbours.shape, (6, 6))
+        self.assertEqual(table.co_scores.dtype, np.float16)
+
+        data = load_interaction_data()
+        binary = np.zeros((data.n_users, data.n_items))
+        binary[data.user_idx, data.item_idx] = data.weight
+        norms = np.linalg.norm(binary, axis=0)
+        cosine = binary.T @ binary / np.outer(norms, norms)
+        np.fill_diagonal(cosine, 0)
+        key = f"communities.communitypost:{self.posts[2].id}"
+        source = data.item_keys.index(key)
+        expected = np.argsort(-cosine[source], kind="stable")[:3]
+        co_only = table.related(key, k=3, weights=(1.0, 0.0))
+        self.assertEqual({k for k, _ in co_only}, {data.item_keys[i] for i in expected})
+        for neighbour, score in co_only:
+            self.assertAlmostEqual(score, cosine[source, data.item_keys.index(neighbour)], places=2)
+
+        vector = embeddings.vectors_for([key])[0][0]
+        cosines = embeddings.vectors_for(embeddings.keys)[0] @ vector
+        cosines[embeddings.rows([key])[0]] = 0
+        content_only = table.related(key, k=3, weights=(0.0, 1.0))
+        np.testing.assert_allclose(
+            [score for _, score in content_only], np.sort(cosines)[::-1][:3], atol=1e-2
+        )
+        for neighbour, score in content_only:
+            self.assertAlmostEqual(score, cosines[embeddings.rows([neighbour])[0]], places=2)
+
+        item_id = int(table.item_ids[table.rows([key])[0]])
+        self.assertEqual(table.related(item_id, k=3), table.related(key, k=3))
+        self.assertEqual(table.related("communities.communitypost:999999"), [])
+
+        suggestions = table.suggestions([key, f"communities.communitypost:{self.posts[3].id}"], k=4)
+        self.assertTrue(suggestions)
+        self.assertNotIn(key, [k for k, _ in suggestions])
+
+    def test_endpoints_use_session_for_anonymous_visitors(self):
+        from unittest.mock import patch
+
+        from django.urls import reverse
+
+        from recommend.ml import related
+
+        _, table, _ = self.build_table()
+        key = f"communities.communitypost:{self.posts[2].id}"
+        with patch.object(related, "load_related", lambda path=None: table):
+            response = self.client.get(reverse("get_related_items"), {"item": key, "k": 2})
+            self.assertEqual(response.status_code, 200)
+            results = response.json()["results"]
+            self.assertEqual(len(results), 2)
+            self.assertEqual(
+                [card["id"] for card in results],
+                [int(k.split(":")[1]) for k, _ in table.related(key, k=2)],
+            )
+            self.assertEqual(
+                self.client.get(reverse("get_related_items"), {"item": key, "k": "x"}).status_code,
+                400,
+            )
+
+            response = self.client.get(reverse("get_session_suggestions"), {"k": 3})
+            ids = [card["id"] for card in response.json()["results"]]
+            self.assertTrue(ids)
+            self.assertNotIn(self.posts[2].id, ids)
+
+        with patch.object(related, "load_related", lambda path=None: None):
+            response = self.client.get(reverse("get_related_items"), {"item": key})
+            self.assertEqual(response.json()["results"], [])
+
+    def test_session_only_remembers_items_in_the_table(self):
+        from unittest.mock import patch
+
+        from django.urls import reverse
+
+        from recommend.ml import related
+
+        _, table, _ = self.build_table()
+        key = f"communities.communitypost:{self.posts[2].id}"
+        with patch.object(related, "load_related", lambda path=None: table):
+            self.client.get(reverse("get_related_items"), {"item": "forged.model:1"})
+            response = self.client.get(
+                reverse("get_related_items"), {"item": "x:" + "9" * related.MAX_KEY_LENGTH}
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn(related.SESSION_KEY, self.client.session)
+
+            self.client.get(reverse("get_related_items"), {"item": key})
+            self.assertEqual(self.client.session[related.SESSION_KEY], [key])
+
+
+class RecommendationPipelineTest(RecommenderFixtureMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        super().setUp()
+        # Generation pointer cached by earlier tests
+        cache.clear()
+
+    def pipeline_options(self):
+        return dict(
+            snapshot_path=os.path.join(self.temp_dir, "snapshot"),
+            model_path=self.model_path,
+            lag=0,
+            epochs=1,
+            emb_dim=8,
+            content_emb_dim=4,
+            batch_size=8,
+            warm_users=0,
+        )
+
+    def test_stages_run_once_and_skip_without_new_interactions(self):
+        from django.contrib.contenttypes.models import ContentType
+
+        from communities.models import CommunityPost
+        from recommend.generations import current_generation_id
+        from recommend.models import Interaction, PipelineRun
+        from recommend.tasks import run_recommendation_pipeline
+
+        result = run_recommendation_pipeline.apply(kwargs=self.pipeline_options()).get()
+        self.assertIn("ran: snapshot, train, score, publish, warm", result)
+        run = PipelineRun.objects.get()
+        self.assertEqual(run.status, PipelineRun.STATUS_COMPLETED)
+        generation = run.checkpoints["publish"]["output"]["generation"]
+        self.assertEqual(current_generation_id(), generation)
+        self.assertGreater(run.checkpoints["score"]["output"]["rows"], 0)
+        self.assertEqual(
+            run.checkpoints["train"]["input"]["watermark"],
+            Interaction.objects.order_by("-id").first().id,
+        )
+
+        result = run_recommendation_pipeline.apply(kwargs=self.pipeline_options()).get()
+        self.assertIn("ran: nothing", result)
+        self.assertEqual(current_generation_id(), generation)
+
+        Interaction.objects.create(
+            user=self.users[3],
+            content_type=ContentType.objects.get_for_model(CommunityPost),
+            object_id=self.posts[0].id,
+            action="like",
+            value=1.0,
+        )
+        result = run_recommendation_pipeline.apply(kwargs=self.pipeline_options()).get()
+        self.assertIn("ran: snapshot, train, score, publish, warm", result)
+        self.assertNotEqual(current_generation_id(), generation)
+
+    def test_failed_run_resumes_after_last_checkpoint(self):
+        from unittest.mock import patch
+
+        from recommend import pipeline
+        from recommend.generations import current_generation_id
+        from recommend.models import PipelineRun, RecommendationGeneration
+
+        def crash(options, done, log):
+            raise RuntimeError("worker lost")
+
+        publish_input, _, reusable = pipeline.STAGE_FUNCTIONS["publish"]
+        with patch.dict(pipeline.STAGE_FUNCTIONS, {"publish": (publish_input, crash, reusable)}):
+            with self.assertRaises(RuntimeError):
+                pipeline.run_pipeline(**self.pipeline_options())
+        run = PipelineRun.objects.get()
+        self.assertEqual(run.status, PipelineRun.STATUS_FAILED)
+        self.assertEqual(list(run.checkpoints), ["snapshot", "train", "score"])
+        self.assertIn("publish: worker lost", run.error)
+        generation = run.checkpoints["score"]["output"]["generation"]
+        self.assertEqual(
+            RecommendationGeneration.objects.get(pk=generation).status,
+            RecommendationGeneration.STATUS_BUILDING,
+        )
+        self.assertIsNone(current_generation_id())
+
+        trained = run.checkpoints["train"]
+        with patch.object(pipeline, "_train", side_effect=AssertionError("retrained")):
+            resumed = pipeline.run_pipeline(**self.pipeline_options())
+        self.assertEqual(resumed.pk, run.pk)
+        self.assertEqual(resumed.attempts, 2)
+        self.assertEqual(resumed.status, PipelineRun.STATUS_COMPLETED)
+        self.assertEqual(resumed.checkpoints["train"], trained)
+        self.assertEqual(current_generation_id(), generation)
+
+    def test_locks_prevent_overlapping_runs(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from recommend.locks import acquire_lock, release_lock
+        from recommend.models import JobLock, PipelineRun
+        from recommend.pipeline import PIPELINE_LOCK, TRAIN_LOCK
+        from recommend.tasks import retrain_recommender, run_recommendation_pipeline
+
+        token = acquire_lock(PIPELINE_LOCK)
+        self.assertIsNotNone(token)
+        self.assertIsNone(acquire_lock(PIPELINE_LOCK))
+        result = run_recommendation_pipeline.apply(kwargs=self.pipeline_options()).get()
+        self.assertIn("Skipped recommendation pipeline", result)
+        self.assertFalse(PipelineRun.objects.exists())
+        release_lock(PIPELINE_LOCK, token)
+
+        train_token = acquire_lock(TRAIN_LOCK)
+        self.assertIn("Skipped retrain", retrain_recommender.apply().get())
+        # The pipeline's train stage takes the same lock; the run resumes later
+        result = run_recommendation_pipeline.apply(kwargs=self.pipeline_options()).get()
+        self.assertIn("recommend:train is already running", result)
+        run = PipelineRun.objects.get()
+        self.assertEqual(run.status, PipelineRun.STATUS_FAILED)
+        self.assertEqual(list(run.checkpoints), ["snapshot"])
+
+        # A lease whose holder died is taken over once it expires
+        JobLock.objects.filter(name=TRAIN_LOCK).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertNotIn(acquire_lock(TRAIN_LOCK), (None, train_token))
+        self.assertFalse(JobLock.objects.filter(owner=train_token).exists())
+
+
+class ModelRegistryTest(RecommenderFixtureMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        from recommend.ml.model_registry import ModelRegistry
+
+        super().setUp()
+        cache.clear()
+        self.registry = ModelRegistry(os.path.join(self.temp_dir, "registry"))
+
+    def train_version(self, **kwargs):
+        path = self.train_hybrid(model_path=self.registry.model_path(), **kwargs)
+        return os.path.basename(os.path.dirname(path))
+
+    def test_versions_promote_rollback_and_prune(self):
+        from recommend.ml.serving import get_serving_model
+
+        current = self.registry.model_path()
+        first = self.train_version()
+        self.assertEqual(self.registry.current, first)
+        metadata = self.registry.metadata(first)
+        self.assertEqual(metadata["metrics"]["users"], len(self.users))
+        self.assertEqual(metadata["metrics"]["latency_ms"]["users"], len(self.users))
+        self.assertTrue(self.registry.verify(first))
+        self.assertEqual(get_serving_model(current).version, first)
+
+        second = self.train_version()
+        third = self.train_version()
+        self.assertEqual(get_serving_model(current).version, third)
+        self.assertEqual([meta["version"] for meta in self.registry.versions()], [first, second, third])
+
+        # The newest version and the rollback target survive
+        self.assertEqual(self.registry.prune(keep=1), [first])
+        self.assertEqual(self.registry.rollback(), second)
+        self.assertEqual(get_serving_model(current).version, second)
+        self.assertEqual(self.registry.rollback(), third)
+
+        with open(self.registry.model_path(second), "ab") as fh:
+            fh.write(b"corrupt")
+        with self.assertRaises(ValueError):
+            self.registry.promote(second)
+        self.assertEqual(self.registry.current, third)
+
+        candidate = self.train_version(promote=False)
+        self.assertEqual(self.registry.current, third)
+        self.assertEqual(get_serving_model(current).version, third)
+        self.registry.set_shadow(candidate)
+        self.assertEqual(self.registry.prune(keep=1), [])
+        self.assertEqual(self.registry.shadow, candidate)
+
+    def test_candidate_scoring_leaves_served_foldin_alone(self):
+        from unittest.mock import patch
+
+        from django.core.cache import cache
+
+        from recommend.ml import shadow
+        from recommend.ml.foldin import STALE, user_vector_key
+        from recommend.ml.serving import get_serving_model
+        from recommend.telemetry import shadow_stats
+
+        class InlineExecutor:
+            def submit(self, fn, *args):
+                fn(*args)
+
+        served = self.train_version()
+        key = user_vector_key(self.users[0].id)
+        cache.set(key, STALE, 600)
+        # Staging and committing a version probes its latency on known users
+        candidate = self.train_version(promote=False)
+        self.assertEqual(cache.get(key), STALE)
+
+        self.registry.set_shadow(candidate)
+        model = get_serving_model(self.registry.model_path())
+        with patch.object(shadow, "_get_executor", InlineExecutor):
+            shadow.recommend_with_shadow(
+                self.users[0].id, model=model, registry=self.registry, sample_rate=1.0, topn=3
+            )
+        self.assertEqual(shadow_stats(candidate)["samples"], 1)
+        # Only the served model's own fold-in is published
+        self.assertEqual(cache.get(key)["version"], served)
+
+    def test_shadow_scoring_records_latency_and_overlap(self):
+        from unittest.mock import patch
+
+        from recommend.ml import shadow
+        from recommend.ml.serving import get_serving_model
+        from recommend.telemetry import shadow_stats
+
+        class InlineExecutor:
+            def submit(self, fn, *args):
+                fn(*args)
+
+        served = self.train_version()
+        candidate = self.train_version(promote=False)
+        model = get_serving_model(self.registry.model_path())
+        self.assertEqual(model.version, served)
+
+        def request(**kwargs):
+            # No freshness boost: it moves scores with the clock between calls
+            return shadow.recommend_with_shadow(
+                self.users[0].id,
+                model=model,
+                registry=self.registry,
+                topn=3,
+                as_item_ids=True,
+                freshness_boost=False,
+                **kwargs,
+            )
+
+        with patch.object(shadow, "_get_executor", InlineExecutor):
+            request(sample_rate=1.0)
+            self.assertEqual(shadow_stats(candidate)["samples"], 0)
+
+            self.registry.set_shadow(candidate)
+            recs = request(sample_rate=1.0)
+            self.assertEqual(recs, request(sample_rate=0.0))
+            stats = shadow_stats(candidate)
+            self.assertEqual(stats["samples"], 1)
+            self.assertGreaterEqual(stats["overlap"], 0.0)
+            self.assertLessEqual(stats["overlap"], 1.0)
+            self.assertIsNotNone(stats["primary_ms"]["mean"])
+            self.assertIsNotNone(stats["shadow_ms"]["p95"])
+
+            # A shadow pointing at the served version is not compared with itself
+            self.registry.set_shadow(served)
+            request(sample_rate=1.0)
+            self.assertEqual(shadow_stats(served)["samples"], 0)
+
+
+class ItemSimilarityTest(TestCase):
+    def setUp(self):
+        import numpy as np
+        from scipy import sparse
+
+        rng = np.random.default_rng(0)
+        dense = (rng.random((40, 30)) < 0.2) * rng.integers(1, 4, size=(40, 30))
+        dense[5] = 0
+        dense[5, 0] = 1
+        dense[6] = 0
+        self.dense = dense.astype("float32")
+        self.matrix = sparse.csr_matrix(self.dense)
+
+    def test_blocked_neighbours_match_dense_similarities(self):
+        import numpy as np
+
+        from recommend.ml.item_similarity import item_neighbours
+
+        binary = (self.dense > 0).astype(float)
+        co = binary.T @ binary
+        degree = binary.sum(axis=0)
+        jaccard = co / np.maximum(degree[:, None] + degree[None, :] - co, 1)
+        np.fill_diagonal(jaccard, 0)
+        neighbours = item_neighbours(self.matrix, k=30, metric="jaccard", block_size=7)
+        np.testing.assert_allclose(neighbours.toarray(), jaccard, rtol=1e-5)
+
+        norms = np.linalg.norm(self.dense, axis=0)
+        cosine = (self.dense.T @ self.dense) / np.maximum(np.outer(norms, norms), 1e-12)
+        np.fill_diagonal(cosine, 0)
+        top = item_neighbours(self.matrix, k=3, metric="cosine", block_size=4).toarray()
+        self.assertTrue(((top > 0).sum(axis=1) <= 3).all())
+        for row in range(30):
+            kept = np.flatnonzero(top[row])
+            np.testing.assert_allclose(top[row, kept], cosine[row, kept], rtol=1e-5)
+            if len(kept):
+                self.assertGreaterEqual(top[row, kept].min(), np.sort(cosine[row])[-3] - 1e-6)
+
+    def test_scoring_excludes_seen_and_falls_back_to_popularity(self):
+        import numpy as np
+
+        from recommend.ml.item_similarity import item_neighbours, recommend_all
+
+        neighbours = item_neighbours(self.matrix, k=10, metric="jaccard")
+        serial = {u: (i, s) for u, i, s in recommend_all(self.matrix, neighbours, 5, block_size=8)}
+        forked = {
+            u: (i, s)
+            for u, i, s in recommend_all(self.matrix, neighbours, 5, block_size=8, workers=2)
+        }
+        self.assertEqual(sorted(serial), list(range(40)))
+        expected = self.dense @ neighbours.toarray()
+        for user, (items, scores) in serial.items():
+            np.testing.assert_array_equal(items, forked[user][0])
+            self.assertFalse(np.isin(items, np.flatnonzero(self.dense[user])).any())
+            if user != 6:
+                np.testing.assert_allclose(scores, expected[user, items], rtol=1e-5)
+        popular = np.argsort(-(self.dense > 0).sum(axis=0), kind="stable")[:5]
+        np.testing.assert_array_equal(serial[6][0], popular)
+
+    def test_command_writes_recommendations(self):
+        from django.contrib.contenttypes.models import ContentType
+        from django.core.management import call_command
+
+        from recommend.models import Interaction, Recommendation
+
+        users = [User.objects.create_user(username=f"simuser{i}", password="pw") for i in range(3)]
+        ct = ContentType.objects.get_for_model(User)
+        for user, items in zip(users, ([1, 2], [2, 3], [1, 3, 4])):
+            for object_id in items:
+                Interaction.objects.create(
+                    user=user, content_type=ct, object_id=object_id, action="view", value=1.0
+                )
+        call_command("compute_recommendations", topn=2, stdout=io.StringIO())
+        recs = Recommendation.objects.filter(user=users[0]).order_by("-score")
+        self.assertTrue(recs.exists())
+        self.assertFalse(recs.filter(object_id__in=[1, 2]).exists())
+
+
+class RecommendationGenerationTest(TestCase):
+    def setUp(self):
+        from django.contrib.contenttypes.models import ContentType
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = User.objects.create_user(username="genuser", password="pw")
+        self.ct = ContentType.objects.get_for_model(User)
+
+    def _object_ids(self):
+        from recommend.models import Recommendation
+
+        return sorted(
+            Recommendation.objects.current()
+            .filter(user=self.user)
+            .values_list("object_id", flat=True)
+        )
+
+    def test_readers_see_previous_generation_until_publish(self):
+        from recommend.generations import GenerationWriter
+        from recommend.models import Recommendation, RecommendationGeneration
+
+        Recommendation.objects.create(
+            user=self.user, content_type=self.ct, object_id=1, score=1.0
+        )
+        self.assertEqual(self._object_ids(), [1])
+
+        with GenerationWriter("test", chunk_size=2) as writer:
+            for object_id in (2, 3, 4):
+                writer.add(self.user.id, self.ct.id, object_id, 1.0)
+            self.assertEqual(self._object_ids(), [1])
+        self.assertEqual(self._object_ids(), [2, 3, 4])
+        self.assertEqual(writer.generation.row_count, 3)
+
+        with self.assertRaises(RuntimeError):
+            with GenerationWriter("test") as failed:
+                failed.add(self.user.id, self.ct.id, 5, 1.0)
+                failed.flush()
+                raise RuntimeError("scoring crashed")
+        self.assertEqual(self._object_ids(), [2, 3, 4])
+        failed.generation.refresh_from_db()
+        self.assertEqual(failed.generation.status, RecommendationGeneration.STATUS_FAILED)
+
+    def test_cleanup_removes_old_generations_in_batches(self):
+        from recommend.generations import GenerationWriter, cleanup_generations
+        from recommend.models import Recommendation, RecommendationGeneration
+
+        Recommendation.objects.create(
+            user=self.user, content_type=self.ct, object_id=1, score=1.0
+        )
+        writers = []
+        for base in (10, 20, 30):
+            with GenerationWriter("test") as writer:
+                for object_id in range(base, base + 3):
+                    writer.add(self.user.id, self.ct.id, object_id, 1.0)
+            writers.append(writer)
+
+        self.assertEqual(cleanup_generations(batch_size=2), 4)
+        remaining = set(RecommendationGeneration.objects.values_list("pk", flat=True))
+        self.assertEqual(remaining, {writers[1].generation.pk, writers[2].generation.pk})
+        self.assertEqual(self._object_ids(), [30, 31, 32])
+        self.assertFalse(Recommendation.objects.filter(generation__isnull=True).exists())
+
+    def test_cleanup_reclaims_builds_abandoned_by_a_killed_writer(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from recommend.generations import ABANDONED_BUILD_AGE, cleanup_generations
+        from recommend.models import Recommendation, RecommendationGeneration
+
+        building = []
+        for base in (40, 50):
+            generation = RecommendationGeneration.objects.create(source="test")
+            for object_id in range(base, base + 3):
+                Recommendation.objects.create(
+                    user=self.user, content_type=self.ct, object_id=object_id,
+                    score=1.0, generation=generation,
+                )
+            building.append(generation)
+        # The first writer was killed long ago; the second is still running
+        RecommendationGeneration.objects.filter(pk=building[0].pk).update(
+            created_at=timezone.now() - timedelta(seconds=ABANDONED_BUILD_AGE + 60)
+        )
+
+        self.assertEqual(cleanup_generations(batch_size=2), 3)
+        self.assertEqual(
+            list(RecommendationGeneration.objects.values_list("pk", "status")),
+            [(building[1].pk, RecommendationGeneration.STATUS_BUILDING)],
+        )
+        self.assertEqual(
+            sorted(Recommendation.objects.values_list("object_id", flat=True)), [50, 51, 52]
+        )
+
+
+class RecommendationHydrationTest(TestCase):
+    def setUp(self):
+        from blog.models import Post, PostImage
+        from communities.models import Community, CommunityPost
+
+        author = User.objects.create_user(username="hydrauthor", password="pw")
+        self.blog_posts = []
+        for i in range(3):
+            post = Post.objects.create(author=author, title=f"Blog {i}", content=f"<b>Body {i}</b>")
+            post.images.add(PostImage.objects.create(image=f"post_images/{i}.png"))
+            self.blog_posts.append(post)
+        community = Community.objects.create(
+            name="Hydration Community", category="technology", creator=author
+        )
+        self.community_posts = [
+            CommunityPost.objects.create(
+                community=community, author=author, title="", content=f"Community {i}"
+            )
+            for i in range(3)
+        ]
+
+    def test_hydration_batches_queries_and_keeps_rank_order(self):
+        from recommend.hydration import hydrate_recommendations
+
+        raw = []
+        for blog, community in zip(self.blog_posts, self.community_posts):
+            raw.append((f"communities.communitypost:{community.id}", 2.0))
+            raw.append((f"blog.post:{blog.id}", 1.0))
+        raw.insert(3, ("blog.post:999999", 5.0))
+        raw.append(("unknown:1", 0.1))
+
+        with self.assertNumQueries(3):
+            results = hydrate_recommendations(raw)
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(
+            [(r["type"], r["id"]) for r in results],
+            [
+                ("community" if key.startswith("communities") else "blog", int(key.split(":")[1]))
+                for key, _ in raw
+                if key not in ("blog.post:999999", "unknown:1")
+            ],
+        )
+        blog = results[1]
+        self.assertEqual(blog["excerpt"], "Body 0")
+        self.assertTrue(blog["image"].endswith("post_images/0.png"))
+        community = results[0]
+        self.assertEqual(community["title"], "Community 0")
+        self.assertEqual(community["community_name"], "Hydration Community")
+        self.assertEqual(community["author_username"], "hydrauthor")
+
+
+class ModelArtifactTest(RecommenderFixtureMixin, TestCase):
+    def test_serving_prefers_memory_mapped_artifact(self):
+        from unittest.mock import patch
+
+        import numpy as np
+
+        from recommend.ml import serving
+        from recommend.ml.artifact import Artifact, artifact_path
+
+        self.train_hybrid()
+        link = artifact_path(self.model_path)
+        self.assertTrue(os.path.islink(link))
+        self.assertTrue(Artifact(link, verify=True).verify())
+
+        mapped = serving.get_serving_model(self.model_path)
+        self.assertIsInstance(mapped.item_matrix, np.memmap)
+        reference = serving.HybridServingModel(
+            serving.load_model_hybrid(self.model_path), self.model_path
+        )
+        self.assertEqual(mapped.version, reference.version)
+        self.assertEqual([str(k) for k in mapped.item_keys], reference.item_keys)
+        self.assertEqual(mapped.item_labels, reference.item_labels)
+        for uid in reference.user_map:
+            self.assertEqual(mapped.user_map[uid], reference.user_map[uid])
+            np.testing.assert_allclose(
+                mapped.score_vector(mapped.user_vector(uid)),
+                reference.score_vector(reference.user_vector(uid)),
+                rtol=1e-5,
+            )
+        np.testing.assert_allclose(mapped.item_created, reference.item_created)
+        self.assertIsNone(mapped.user_map.get(-1))
+        key = reference.item_keys[2]
+        self.assertEqual(mapped.item_map.lookup([key, "missing:1"]).tolist(), [2, -1])
+
+        with patch.object(serving, "ANN_MIN_ITEMS", 1):
+            indexed = serving.HybridServingModel.from_artifact(Artifact(link), self.model_path)
+        self.assertIsNotNone(indexed.index)
+        self.assertTrue(np.shares_memory(indexed.index.vectors, indexed.item_matrix))
+
+    def test_quantized_artifacts_and_converter(self):
+        import numpy as np
+        from django.core.management import call_command
+
+        from recommend.ml import serving
+        from recommend.ml.artifact import Artifact, artifact_path, write_artifact
+
+        self.train_hybrid()
+        payload = serving.load_model_hybrid(self.model_path)
+        reference = serving.HybridServingModel(payload)
+        uid = next(iter(reference.user_map))
+        expected = reference.score_vector(reference.user_vector(uid))
+        for dtype, tolerance in (("float16", 1e-2), ("int8", 5e-2)):
+            path = os.path.join(self.temp_dir, f"{dtype}.pt")
+            artifact = Artifact(write_artifact(payload, path, dtype=dtype))
+            model = serving.HybridServingModel.from_artifact(artifact)
+            scores = model.score_vector(model.user_vector(uid))
+            scale = np.abs(expected).max()
+            np.testing.assert_allclose(scores, expected, atol=tolerance * scale)
+
+        link = artifact_path(self.model_path)
+        out = io.StringIO()
+        call_command("convert_recommender_artifact", self.model_path, dtype="float16", stdout=out)
+        self.assertIn("Converted 1 model(s).", out.getvalue())
+        converted = Artifact(link, verify=True)
+        self.assertEqual(converted.manifest["dtype"], "float16")
+        self.assertEqual(converted.version, payload["version"])
+        self.assertEqual(converted.path, os.path.realpath(link))
+
+        with open(os.path.join(converted.path, "item_keys.npy"), "ab") as fh:
+            fh.write(b"x")
+        with self.assertRaises(ValueError):
+            converted.verify()
+
+
+class RecommendationTelemetryTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = User.objects.create_user(username="telemetry", password="pw")
+
+    def test_breaker_state_is_shared_and_probes_half_open(self):
+        import time
+        from unittest.mock import patch
+
+        from django.core.cache import cache
+
+        from recommend.services import MAX_RETRIES, RecommendationService
+
+        calls = []
+
+        def failing_ai(self, *args):
+            calls.append(1)
+            raise RuntimeError("model unavailable")
+
+        fallback = [("blog.post:1", 1.0)]
+        with patch.object(RecommendationService, "_get_ai_recommendations", failing_ai), \
+                patch.object(RecommendationService, "_get_collaborative_recommendations",
+                             lambda self, *args: fallback):
+            first = RecommendationService()
+            for _ in range(MAX_RETRIES):
+                self.assertEqual(first.get_recommendations(self.user.id, ["blog"]), fallback)
+            # A different worker sees the open breaker and skips the AI layer
+            second = RecommendationService()
+            self.assertEqual(second.get_recommendations(self.user.id, ["blog"]), fallback)
+            self.assertEqual(len(calls), MAX_RETRIES)
+            self.assertIn("ai_recommendations", second.get_health_status()["circuit_breakers"])
+
+            breaker = second._breakers["ai_recommendations"]
+            cache.set(breaker.open_until_key, time.time() - 1, None)
+            self.assertTrue(breaker.allow())
+            self.assertFalse(second._breakers["ai_recommendations"].allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state(), "closed")
+
+    def test_breakers_in_separate_processes_share_one_backend(self):
+        import shutil
+        import tempfile
+
+        from django.conf import settings
+        from django.core.cache.backends.filebased import FileBasedCache
+        from django.core.cache.backends.redis import RedisCache
+
+        from recommend.telemetry import CircuitBreaker
+
+        # Outside test runs the default cache is the Redis shared with Celery
+        self.assertIn(settings.CACHE_URL.split("://")[0], ("redis", "rediss"))
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, True)
+        backends = [
+            # Separate backend instances stand in for two worker processes
+            ("file", lambda: FileBasedCache(location, {})),
+            ("redis", lambda: RedisCache(settings.CACHE_URL, {"KEY_PREFIX": "breaker-test"})),
+        ]
+        for name, make_backend in backends:
+            with self.subTest(backend=name):
+                first, second = make_backend(), make_backend()
+                one = CircuitBreaker("ai", threshold=2, backend=first)
+                other = CircuitBreaker("ai", threshold=2, backend=second)
+                try:
+                    # Only this breaker's keys: the Redis database is Celery's too
+                    one.record_success()
+                except Exception:
+                    self.skipTest(f"No {name} cache reachable")
+                one.record_failure()
+                self.assertEqual(other.status()["failures"], 1)
+                other.record_failure()
+                self.assertEqual(one.state(), CircuitBreaker.OPEN)
+                self.assertFalse(one.allow())
+                one.record_success()
+                self.assertEqual(other.state(), CircuitBreaker.CLOSED)
+
+    def test_slow_layer_is_abandoned_and_counted(self):
+        import time
+        from unittest.mock import patch
+
+        from recommend.services import RecommendationService
+        from recommend.telemetry import LAYER_TIMEOUTS, layer_stats
+
+        def slow_ai(self, *args):
+            time.sleep(0.5)
+            return [("blog.post:99", 9.0)]
+
+        fallback = [("blog.post:1", 1.0)]
+        with patch.dict(LAYER_TIMEOUTS, {"ai_recommendations": 0.05,
+                                         "collaborative_fallback": None}), \
+                patch.object(RecommendationService, "_get_ai_recommendations", slow_ai), \
+                patch.object(RecommendationService, "_get_collaborative_recommendations",
+                             lambda self, *args: fallback):
+            service = RecommendationService()
+            started = time.time()
+            self.assertEqual(service.get_recommendations(self.user.id, ["blog"]), fallback)
+            self.assertLess(time.time() - started, 0.4)
+
+        stats = layer_stats()
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["fallback_rate"], 1.0)
+        self.assertEqual(stats["layers"]["ai_recommendations"]["counts"]["timeout"], 1)
+        self.assertEqual(stats["layers"]["collaborative_fallback"]["counts"]["hit"], 1)
+        self.assertEqual(stats["layers"]["collaborative_fallback"]["served"], 1)
+
+        self.user.is_staff = True
+        self.user.save()
+        client = Client()
+        client.force_login(self.user)
+        response = client.get("/recommend/stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["requests"], 1)
+
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command("recommendation_stats", "--reset", stdout=out)
+        self.assertIn("collaborative_fallback", out.getvalue())
+        self.assertEqual(layer_stats()["requests"], 0)
@@ -32,6 +32,13 @@ urlpatterns = [
         views.get_hybrid_recommendations,
         name="get_hybrid_recommendations",
     ),
+    path("related/", views.get_related_items, name="get_related_items"),
+    path(
+        "related/session/",
+        views.get_session_suggestions,
+        name="get_session_suggestions",
+    ),
     path("tag-options/", views.get_tag_options, name="get_tag_options"),
+    path("stats/", views.recommendation_stats, name="recommendation_stats"),
     path("track-interaction/", views.track_interaction, name="track_interaction"),
 ]
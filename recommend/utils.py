@@ -1,28 +1,100 @@
 """YouTube-like Recommendation Engine - Per-User Ranking System."""
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.utils import timezone
-from django.db.models import Q, Count, Avg, F
+from django.db.models import Q, Count, Avg, Max, Min
 from datetime import timedelta
 import random
 
-from recommend.models import Interaction, Recommendation, UserInterests
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from recommend.generations import replace_user_recommendations
+from recommend.models import Interaction, UserInterests
+
+# Profile stats are cached between requests; new interactions and interest
+# changes invalidate them (see signals)
+PROFILE_CACHE_TTL = getattr(settings, "RECOMMEND_PROFILE_CACHE_TTL", 600)
+PROFILE_WINDOW_DAYS = 30
+# Random ids drawn per wanted exploration item (ids have gaps)
+EXPLORATION_OVERSAMPLE = 4
 
 
 # ============================================================================
 # 1. USER PROFILE MANAGEMENT
 # ============================================================================
 
+def profile_cache_key(user_id):
+    return f"recommend:profile:{user_id}"
+
+
+def invalidate_user_profile(user_id):
+    """Forget a user's cached profile stats."""
+    cache.delete(profile_cache_key(user_id))
+
+
 class UserProfile:
-    """Manages per-user interest vectors and engagement metrics."""
+    """
+    Manages per-user interest vectors and engagement metrics.
+
+    Building the stats costs three queries (interests, one engagement
+    aggregate, active hours).  ``UserProfile.for_user`` reuses them from the
+    cache; within a request build the profile once and pass it along.
+    """
     
-    def __init__(self, user):
+    def __init__(self, user, stats=None):
         self.user = user
-        self.interests, _ = UserInterests.objects.get_or_create(user=user)
+        self.stats = stats if stats is not None else self._load_stats()
         self._init_vectors()
+
+    @classmethod
+    def for_user(cls, user):
+        """Profile from the cached stats, computed and cached on a miss."""
+        key = profile_cache_key(user.id)
+        stats = cache.get(key)
+        if stats is not None:
+            return cls(user, stats)
+        profile = cls(user)
+        cache.set(key, profile.stats, PROFILE_CACHE_TTL)
+        return profile
+
+    @property
+    def interests(self):
+        """The ``UserInterests`` row (queried on first access)."""
+        if not hasattr(self, '_interests'):
+            self._interests, _ = UserInterests.objects.get_or_create(user=self.user)
+        return self._interests
+
+    def _load_stats(self):
+        """Interest selections and 30-day engagement aggregates, as plain values."""
+        interests = self.interests
+        since = timezone.now() - timedelta(days=PROFILE_WINDOW_DAYS)
+        recent = Interaction.objects.filter(user=self.user, created_at__gte=since)
+        totals = recent.aggregate(
+            total=Count('id'),
+            skipped=Count('id', filter=Q(action='skip')),
+            avg_val=Avg('value'),
+        )
+        hours = recent.values('created_at__hour').annotate(count=Count('id')).order_by('-count')
+        return {
+            'game_categories': list(interests.game_categories or []),
+            'blog_tags': list(interests.blog_tags or []),
+            'community_tags': list(interests.community_tags or []),
+            'total': totals['total'],
+            'skipped': totals['skipped'],
+            'avg_val': totals['avg_val'],
+            'active_hours': [h['created_at__hour'] for h in hours[:3]],
+        }
     
     def _init_vectors(self):
         """Initialize interest vectors for all content types."""
+        self.game_categories = self.stats['game_categories']
+        self.blog_tags = self.stats['blog_tags']
+        self.community_tags = self.stats['community_tags']
         self.interest_vector = {
             'game': self._build_game_vector(),
             'blog': self._build_blog_vector(),
@@ -31,86 +103,110 @@ class UserProfile:
         self.skip_rate = self._calculate_skip_rate()
         self.avg_engagement_time = self._calculate_avg_engagement()
         self.active_hours = self._identify_active_hours()
+        self.recent_interactions = self.stats['total']
     
     def _build_game_vector(self):
         """Build interest vector for games from user selections."""
         vector = {}
-        for cat in self.interests.game_categories:
+        for cat in self.game_categories:
             vector[cat] = 1.0
         return vector or {'casual': 0.5}
     
     def _build_blog_vector(self):
         """Build interest vector for blog posts from tags."""
         vector = {}
-        for tag in self.interests.blog_tags:
+        for tag in self.blog_tags:
             vector[tag] = 1.0
         return vector or {'technology': 0.3, 'lifestyle': 0.2}
     
     def _build_community_vector(self):
         """Build interest vector for communities from tags."""
         vector = {}
-        for tag in self.interests.community_tags:
+        for tag in self.community_tags:
             vector[tag] = 1.0
         return vector or {'gaming': 0.3}
     
     def _calculate_skip_rate(self):
         """Calculate % of content user skipped in last 30 days."""
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        interactions = Interaction.objects.filter(
-            user=self.user,
-            created_at__gte=thirty_days_ago
-        )
-        total = interactions.count()
+        total = self.stats['total']
         if total == 0:
             return 0.1
-        skipped = interactions.filter(action='skip').count()
-        return skipped / total if total > 0 else 0.1
+        return self.stats['skipped'] / total
     
     def _calculate_avg_engagement(self):
         """Average engagement duration in seconds."""
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        avg = Interaction.objects.filter(
-            user=self.user,
-            created_at__gte=thirty_days_ago
-        ).aggregate(avg_val=Avg('value'))['avg_val']
-        return avg or 120.0
+        return self.stats['avg_val'] or 120.0
     
     def _identify_active_hours(self):
         """Identify when user is most active (0-23)."""
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        interactions = Interaction.objects.filter(
-            user=self.user,
-            created_at__gte=thirty_days_ago
-        ).values('created_at__hour').annotate(count=Count('id')).order_by('-count')
-        
-        if interactions:
-            return [h['created_at__hour'] for h in interactions[:3]]
-        return [18, 19, 20]
+        return self.stats['active_hours'] or [18, 19, 20]
 
 
 # ============================================================================
 # 2. CANDIDATE GENERATION
 # ============================================================================
 
+def _candidates(queryset, content_type, **flags):
+    """Candidate dicts for a queryset of posts (one query, no model instances)."""
+    ct_id = ContentType.objects.get_for_model(queryset.model).id
+    return [
+        dict(
+            content_type_id=ct_id,
+            object_id=pk,
+            type=content_type,
+            creator_id=author_id,
+            **flags,
+        )
+        for pk, author_id in queryset.values_list('id', 'author_id')
+    ]
+
+
+def _random_ids(queryset, limit):
+    """
+    Up to ``limit`` random primary keys without ``ORDER BY RANDOM()``.
+
+    Draws random ids between the smallest and largest key and fetches the
+    ones that exist by primary key; if gaps leave too few, the rest comes
+    from an index range scan starting at a random id.
+    """
+    bounds = queryset.aggregate(lo=Min('id'), hi=Max('id'))
+    lo, hi = bounds['lo'], bounds['hi']
+    if lo is None or limit <= 0:
+        return []
+    span = hi - lo + 1
+    draws = random.sample(range(lo, hi + 1), min(span, limit * EXPLORATION_OVERSAMPLE))
+    found = list(queryset.filter(id__in=draws).values_list('id', flat=True))
+    random.shuffle(found)
+    ids = found[:limit]
+    if len(ids) < limit and len(ids) < span:
+        pivot = random.randint(lo, hi)
+        rest = queryset.exclude(id__in=ids)
+        for window in (rest.filter(id__gte=pivot), rest.filter(id__lt=pivot)):
+            if len(ids) < limit:
+                ids.extend(window.order_by('id').values_list('id', flat=True)[: limit - len(ids)])
+    return ids
+
+
 class CandidateGenerator:
     """Generates candidate set for ranking."""
     
     @staticmethod
-    def generate_candidates(user, content_type='mixed', limit=200):
+    def generate_candidates(user, content_type='mixed', limit=200, profile=None):
         """
         Generate diversified candidate pool.
         Sources: interest-based, collaborative, subscriptions, exploration
         """
+        profile = profile or UserProfile.for_user(user)
         candidates = []
         
         if content_type in ('mixed', 'blog'):
-            candidates.extend(CandidateGenerator._interest_based_candidates(user, 'blog', 80))
-            candidates.extend(CandidateGenerator._collaborative_candidates(user, 'blog', 40))
+            candidates.extend(CandidateGenerator._interest_based_candidates(profile, 'blog', 80))
+            candidates.extend(CandidateGenerator._collaborative_candidates(profile, 'blog', 40))
             candidates.extend(CandidateGenerator._exploration_candidates(user, 'blog', 10))
         
         if content_type in ('mixed', 'community'):
-            candidates.extend(CandidateGenerator._interest_based_candidates(user, 'community', 80))
-            candidates.extend(CandidateGenerator._collaborative_candidates(user, 'community', 40))
+            candidates.extend(CandidateGenerator._interest_based_candidates(profile, 'community', 80))
+            candidates.extend(CandidateGenerator._collaborative_candidates(profile, 'community', 40))
             candidates.extend(CandidateGenerator._exploration_candidates(user, 'community', 10))
         
         # Deduplicate
@@ -125,127 +221,54 @@ class CandidateGenerator:
         return dedup[:limit]
     
     @staticmethod
-    def _interest_based_candidates(user, content_type, limit):
+    def _interest_based_candidates(profile, content_type, limit):
         """Fetch content matching user's interests."""
-        profile = UserProfile(user)
-        
         if content_type == 'blog':
-            interests = profile.interests.blog_tags
+            from blog.models import Post
+            interests = profile.blog_tags
             if not interests:
                 # Return recent posts if no interests
-                from blog.models import Post
-                posts = Post.objects.all().order_by('-created')[:limit]
-                candidates = []
-                for p in posts:
-                    ct = ContentType.objects.get_for_model(p)
-                    candidates.append({
-                        'content_type_id': ct.id,
-                        'object_id': p.id,
-                        'type': 'blog'
-                    })
-                return candidates
-            
-            from blog.models import Post
+                return _candidates(Post.objects.order_by('-created')[:limit], 'blog')
             posts = Post.objects.filter(
-                tags__icontains=interests[0] if interests else ''
-            ).order_by('-created')[:limit]
-            
-            candidates = []
-            for p in posts:
-                ct = ContentType.objects.get_for_model(p)
-                candidates.append({
-                    'content_type_id': ct.id,
-                    'object_id': p.id,
-                    'type': 'blog'
-                })
-            return candidates
+                tags__name__icontains=interests[0]
+            ).distinct().order_by('-created')[:limit]
+            return _candidates(posts, 'blog')
         
         elif content_type == 'community':
-            interests = profile.interests.community_tags
-            if not interests:
-                from communities.models import CommunityPost
-                posts = CommunityPost.objects.all().order_by('-created_at')[:limit]
-                candidates = []
-                for p in posts:
-                    ct = ContentType.objects.get_for_model(p)
-                    candidates.append({
-                        'content_type_id': ct.id,
-                        'object_id': p.id,
-                        'type': 'community'
-                    })
-                return candidates
-            
             from communities.models import CommunityPost
-            posts = CommunityPost.objects.all().order_by('-created_at')[:limit]
-            
-            candidates = []
-            for p in posts:
-                ct = ContentType.objects.get_for_model(p)
-                candidates.append({
-                    'content_type_id': ct.id,
-                    'object_id': p.id,
-                    'type': 'community'
-                })
-            return candidates
+            posts = CommunityPost.objects.order_by('-created_at')[:limit]
+            return _candidates(posts, 'community')
+        return []
     
     @staticmethod
-    def _collaborative_candidates(user, content_type, limit):
+    def _collaborative_candidates(profile, content_type, limit):
         """Find content watched by similar users."""
         # Simplified: get similar users based on interests
-        profile = UserProfile(user)
-        candidates = []
-        
-        if content_type == 'blog':
-            interests = profile.interests.blog_tags
-            if interests:
-                from blog.models import Post
-                posts = Post.objects.filter(
-                    tags__icontains=interests[0]
-                ).order_by('-created')[:limit]
-                
-                for p in posts:
-                    ct = ContentType.objects.get_for_model(p)
-                    candidates.append({
-                        'content_type_id': ct.id,
-                        'object_id': p.id,
-                        'type': 'blog',
-                        'collaborative': True
-                    })
-        
-        return candidates
+        if content_type == 'blog' and profile.blog_tags:
+            from blog.models import Post
+            posts = Post.objects.filter(
+                tags__name__icontains=profile.blog_tags[0]
+            ).distinct().order_by('-created')[:limit]
+            return _candidates(posts, 'blog', collaborative=True)
+        return []
     
     @staticmethod
     def _exploration_candidates(user, content_type, limit):
         """Exploration pool: random content for testing (5% of feed)."""
-        candidates = []
-        
         if content_type == 'blog':
             from blog.models import Post
-            all_posts = Post.objects.all().order_by('?')[:limit * 2]
-            
-            for p in all_posts[:limit]:
-                ct = ContentType.objects.get_for_model(p)
-                candidates.append({
-                    'content_type_id': ct.id,
-                    'object_id': p.id,
-                    'type': 'blog',
-                    'exploration': True
-                })
-        
+            model = Post
         elif content_type == 'community':
             from communities.models import CommunityPost
-            all_posts = CommunityPost.objects.all().order_by('?')[:limit * 2]
-            
-            for p in all_posts[:limit]:
-                ct = ContentType.objects.get_for_model(p)
-                candidates.append({
-                    'content_type_id': ct.id,
-                    'object_id': p.id,
-                    'type': 'community',
-                    'exploration': True
-                })
-        
-        return candidates
+            model = CommunityPost
+        else:
+            return []
+        ids = _random_ids(model.objects.all(), limit)
+        candidates = {
+            c['object_id']: c
+            for c in _candidates(model.objects.filter(id__in=ids), content_type, exploration=True)
+        }
+        return [candidates[pk] for pk in ids if pk in candidates]
 
 
 # ============================================================================
@@ -265,31 +288,52 @@ class ScoringEngine:
     }
     
     @staticmethod
-    def score_candidate(candidate, user):
+    def score_candidate(candidate, user, profile=None):
         """
         Compute personalized score for a candidate.
         score = weighted sum of signals
         """
-        profile = UserProfile(user)
-        
-        watch_time = ScoringEngine._predict_watch_time(candidate, profile)
-        retention = ScoringEngine._predict_retention(candidate, profile)
-        session_ext = ScoringEngine._predict_session_extension(candidate, profile)
-        interest_match = ScoringEngine._compute_interest_match(candidate, profile)
-        creator_affinity = ScoringEngine._compute_creator_affinity(candidate, user)
-        
-        score = (
-            watch_time * ScoringEngine.WEIGHTS['predicted_watch_time'] +
-            retention * ScoringEngine.WEIGHTS['predicted_retention'] +
-            session_ext * ScoringEngine.WEIGHTS['session_extension'] +
-            interest_match * ScoringEngine.WEIGHTS['user_interest_match'] +
-            creator_affinity * ScoringEngine.WEIGHTS['creator_affinity']
+        profile = profile or UserProfile.for_user(user)
+        return float(ScoringEngine.score_candidates([candidate], profile)[0])
+
+    @staticmethod
+    def score_candidates(candidates, profile):
+        """
+        Scores for a whole candidate list (float array, same order).
+
+        Profile signals are computed once; per-candidate signals are
+        assembled as arrays and combined in one weighted sum.
+        """
+        weights = ScoringEngine.WEIGHTS
+        exploration = np.fromiter(
+            (bool(c.get('exploration')) for c in candidates), dtype=bool, count=len(candidates)
+        )
+        match_by_type = {
+            content_type: ScoringEngine._compute_interest_match({'type': content_type}, profile)
+            for content_type in {c.get('type', 'unknown') for c in candidates}
+        }
+        interest_match = np.fromiter(
+            (match_by_type[c.get('type', 'unknown')] for c in candidates),
+            dtype=np.float64,
+            count=len(candidates),
+        )
+        session_ext = np.where(exploration, 0.7, 0.5)
+
+        scores = (
+            ScoringEngine._predict_watch_time(None, profile) * weights['predicted_watch_time'] +
+            ScoringEngine._predict_retention(None, profile) * weights['predicted_retention'] +
+            session_ext * weights['session_extension'] +
+            interest_match * weights['user_interest_match'] +
+            ScoringEngine._compute_creator_affinity(None, profile) * weights['creator_affinity']
         )
         
         # Apply suppression rules
-        score = ScoringEngine._apply_suppression(candidate, score)
-        
-        return max(0, score)
+        scores = np.fromiter(
+            (ScoringEngine._apply_suppression(c, s) for c, s in zip(candidates, scores)),
+            dtype=np.float64,
+            count=len(candidates),
+        )
+        return np.maximum(scores, 0.0)
     
     @staticmethod
     def _predict_watch_time(candidate, profile):
@@ -328,15 +372,10 @@ class ScoringEngine:
         return 0.5
     
     @staticmethod
-    def _compute_creator_affinity(candidate, user):
+    def _compute_creator_affinity(candidate, profile):
         """Compute affinity with creator (0-1)."""
-        # Simplified: count past interactions with this creator
-        interactions = Interaction.objects.filter(
-            user=user,
-            created_at__gte=timezone.now() - timedelta(days=30)
-        ).count()
-        
-        return min(1.0, interactions / 50.0)
+        # Simplified: count past interactions (from the profile's 30-day stats)
+        return min(1.0, profile.recent_interactions / 50.0)
     
     @staticmethod
     def _apply_suppression(candidate, score):
@@ -356,20 +395,21 @@ class Ranker:
     """Rank candidates with diversity and anti-fatigue rules."""
     
     @staticmethod
-    def rank(candidates, user, limit=24):
+    def rank(candidates, user, limit=24, profile=None):
         """
         Rank candidates with:
         - Scoring
         - Diversity rules
         - Anti-fatigue (no creator repetition)
         """
-        scored = []
-        for c in candidates:
-            score = ScoringEngine.score_candidate(c, user)
-            scored.append((c, score))
+        if not candidates:
+            return []
+        profile = profile or UserProfile.for_user(user)
+        scores = ScoringEngine.score_candidates(candidates, profile)
         
-        # Sort by score
-        scored.sort(key=lambda x: x[1], reverse=True)
+        # Sort by score (stable, so ties keep candidate order)
+        order = np.argsort(-scores, kind='stable')
+        scored = [(candidates[i], float(scores[i])) for i in order]
         
         # Apply diversity & anti-fatigue
         ranked = Ranker._apply_diversity_rules(scored, limit)
@@ -414,26 +454,29 @@ def compute_recommendations_for_user(user, content_type='mixed', limit=24):
     4. Store in DB
     5. Return
     """
+    # One profile per request, shared by generation and scoring
+    profile = UserProfile.for_user(user)
+
     # Generate candidates
-    candidates = CandidateGenerator.generate_candidates(user, content_type, limit=200)
+    candidates = CandidateGenerator.generate_candidates(
+        user, content_type, limit=200, profile=profile
+    )
     
     if not candidates:
         # No candidates: return empty (don't fabricate posts)
         return []
     
     # Rank candidates
-    ranked = Ranker.rank(candidates, user, limit)
-    
-    # Store in Recommendation model
-    Recommendation.objects.filter(user=user).delete()
+    ranked = Ranker.rank(candidates, user, limit, profile=profile)
     
-    for idx, candidate in enumerate(ranked):
-        Recommendation.objects.create(
-            user=user,
-            content_type_id=candidate['content_type_id'],
-            object_id=candidate['object_id'],
-            score=idx * -0.1 + 1.0,  # Descending scores
-        )
+    # Store in the current Recommendation generation
+    replace_user_recommendations(
+        user,
+        (
+            (candidate['content_type_id'], candidate['object_id'], idx * -0.1 + 1.0)
+            for idx, candidate in enumerate(ranked)  # Descending scores
+        ),
+    )
     
     return ranked
 
@@ -473,8 +516,7 @@ def record_interaction(user, content_obj, action='view', watch_time=None):
             defaults={'value': signal_strength}
         )
         
-        # Update user profile
-        profile = UserProfile(user)
+        # The cached profile is invalidated by the Interaction post_save signal
         
         # Trigger re-computation (can be async)
         # compute_recommendations_for_user(user)
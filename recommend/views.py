@@ -2,12 +2,15 @@ import json
 import hashlib
 
 from functools import wraps
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.http import JsonResponse
 from django.utils.decorators import decorator_from_middleware
 
+from recommend.hydration import (hydrate_recommendations,
+                                 recommendation_rows_to_items)
 from recommend.models import (BLOG_TAGS, COMMUNITY_TAGS, GAME_CATEGORIES,
                               Recommendation, UserInterests)
 
@@ -52,217 +55,66 @@ def smart_cache(cache_key_prefix, ttl=300, user_specific=True):
     return decorator
 
 
-def _parse_recommendation_key(rec_key):
-    parts = rec_key.split(":", 1)
-    if len(parts) != 2:
-        return None, None, None
-    app_model, object_id = parts
-    if "." not in app_model:
-        return None, None, None
-    return app_model.split(".", 1) + [object_id]
-
-
-def _serialize_recommendation_entry(rec_key, score):
-    app_label, model_name, object_id = _parse_recommendation_key(rec_key)
-    if not app_label:
-        return None
-    if app_label == "blog" and "post" in model_name:
-        try:
-            from blog.models import Post
-            from django.utils.html import strip_tags
-        except Exception:
-            return None
-        try:
-            obj = Post.objects.filter(id=int(object_id)).first()
-        except (TypeError, ValueError):
-            return None
-        if not obj:
-            return None
-        excerpt = strip_tags(obj.content)[:220] if hasattr(obj, "content") else ""
-        image = None
-        if hasattr(obj, "images"):
-            first = obj.images.all().first()
-            if first and hasattr(first, "image"):
-                image = first.image.url
-        return {
-            "type": "blog",
-            "id": obj.id,
-            "title": obj.title,
-            "excerpt": excerpt,
-            "image": image,
-            "score": float(score),
-        }
-    if app_label == "communities" and "post" in model_name:
-        try:
-            from communities.models import CommunityPost
-            from django.utils.html import strip_tags
-        except Exception:
-            return None
-        try:
-            obj = CommunityPost.objects.filter(id=int(object_id)).first()
-        except (TypeError, ValueError):
-            return None
-        if not obj:
-            return None
-        title = obj.title or (obj.content[:80] if obj.content else "Community Post")
-        excerpt = strip_tags(obj.content)[:220] if obj.content else ""
-        return {
-            "type": "community",
-            "id": obj.id,
-            "title": title,
-            "excerpt": excerpt,
-            "image": obj.image.url if obj.image else None,
-            "community_id": obj.community.id,
-            "community_name": obj.community.name,
-            "author_username": obj.author.username,
-            "score": float(score),
-        }
-    if app_label == "games" and "game" in model_name:
-        try:
-            from games.models import Game
-            import uuid
-        except Exception:
-            return None
-        game_id = object_id
-        try:
-            game_id = uuid.UUID(object_id)
-        except (ValueError, TypeError):
-            pass
-        obj = Game.objects.filter(id=game_id).first()
-        if not obj:
-            return None
-        return {
-            "type": "game",
-            "id": str(obj.id),
-            "title": obj.title,
-            "description": getattr(obj, "description", ""),
-            "thumbnail": obj.thumbnail.url if obj.thumbnail else None,
-            "score": float(score),
-        }
-    if app_label == "marketplace" and "project" in model_name:
-        try:
-            from marketplace.models import Project
-            import uuid
-        except Exception:
-            return None
-        project_id = object_id
-        try:
-            project_id = uuid.UUID(object_id)
-        except (ValueError, TypeError):
-            pass
-        proj = Project.objects.filter(id=project_id).first()
-        if not proj:
-            return None
-        return {
-            "type": "marketplace",
-            "id": str(proj.id),
-            "title": proj.title,
-            "short_description": getattr(proj, "short_description", ""),
-            "thumbnail": proj.thumbnail.url if proj.thumbnail else None,
-            "price": float(proj.price) if hasattr(proj, "price") else None,
-            "is_free": getattr(proj, "is_free", False),
-            "score": float(score),
-        }
-    return None
-
-
-def _hydrate_hybrid_recommendations(raw_recs):
-    if not raw_recs:
-        return []
-    results = []
-    for rec_key, score in raw_recs:
-        entry = _serialize_recommendation_entry(rec_key, score)
-        if entry:
-            results.append(entry)
-    return results
-
-
 def _run_hybrid_recommendation(user_id, allowed_content, topn=12, exclude_seen=True):
     try:
-        from recommend.ml.torch_recommender_hybrid import load_model_hybrid, recommend_for_user_hybrid
-    except Exception:
-        return []
-    model = load_model_hybrid()
-    if not model:
-        return []
-    try:
-        recommendations = recommend_for_user_hybrid(
-            user_id,
-            model=model,
-            topn=topn,
-            exclude_seen=exclude_seen,
-            diversity_penalty=0.15,
-            freshness_boost=True,
-            allowed_content=allowed_content,
-        )
+        from recommend.ml.serving import hybrid_cards
     except Exception:
         return []
-    return _hydrate_hybrid_recommendations(recommendations)
+    return hybrid_cards(user_id, allowed_content, topn=topn, exclude_seen=exclude_seen)
 
 
 @login_required
 def for_you_recommendations(request):
     """Get PyTorch hybrid recommendations for logged-in user."""
+    from recommend.ml.serving import (FOR_YOU_CACHE_TTL, FOR_YOU_CONTENT,
+                                      FOR_YOU_TOPN, for_you_cache_key)
+
     user = request.user
-    cache_key = f"for_you_pytorch:{user.id}"
+    cache_key = for_you_cache_key(user.id)
     
     # Check cache first
     data = cache.get(cache_key)
     if data is not None:
         return JsonResponse({"results": data})
     
-    results = _run_hybrid_recommendation(
-        user.id,
-        {"blog", "communities", "games", "marketplace"},
-        topn=24,
-    )
+    results = _run_hybrid_recommendation(user.id, FOR_YOU_CONTENT, topn=FOR_YOU_TOPN)
 
     # Fallback: if no recommendations, show recent posts
     if not results:
         try:
-            from blog.models import Post
+            from blog.models import Post, PostImage
             from communities.models import CommunityPost
-            from django.utils.html import strip_tags
-            
-            recent_posts = list(Post.objects.all().order_by('-created')[:12])
-            recent_community = list(CommunityPost.objects.all().order_by('-created_at')[:12])
-            
+            from django.db.models import Prefetch
+
+            from recommend.hydration import (serialize_blog_post,
+                                             serialize_community_post)
+
+            recent_posts = list(
+                Post.objects.all()
+                .order_by('-created')
+                .prefetch_related(Prefetch("images", queryset=PostImage.objects.order_by("pk")))[:12]
+            )
+            recent_community = list(
+                CommunityPost.objects.all()
+                .order_by('-created_at')
+                .select_related("community", "author")[:12]
+            )
+
             for post in recent_posts:
                 try:
-                    excerpt = strip_tags(post.content)[:220] if hasattr(post, "content") else ""
-                    img = None
-                    if hasattr(post, "images"):
-                        first = post.images.all().first()
-                        if first and hasattr(first, "image"):
-                            img = first.image.url
-                    results.append({
-                        "type": "blog",
-                        "id": post.id,
-                        "title": post.title,
-                        "excerpt": excerpt,
-                        "image": img,
-                        "score": 0.5,
-                    })
+                    results.append(serialize_blog_post(post, 0.5))
                 except Exception:
                     pass
-            
+
             for post in recent_community:
                 try:
-                    excerpt = strip_tags(post.content)[:220] if post.content else ""
-                    results.append({
-                        "type": "community",
-                        "id": post.id,
-                        "title": post.title or "Community Post",
-                        "excerpt": excerpt,
-                        "image": post.image.url if post.image else None,
-                        "score": 0.5,
-                    })
+                    results.append(serialize_community_post(post, 0.5))
                 except Exception:
                     pass
         except Exception as e:
             print(f"Error generating fallback: {e}")
 
-    cache.set(cache_key, results, 300)  # Cache for 5 minutes
+    cache.set(cache_key, results, FOR_YOU_CACHE_TTL)
     return JsonResponse({"results": results, "method": "pytorch_hybrid"})
 
 
@@ -680,107 +532,102 @@ def get_hybrid_recommendations(request):
         allowed_content = {"blog", "communities", "games", "marketplace"}
     
     try:
-        from recommend.ml.torch_recommender_hybrid import (
-            load_model_hybrid,
-            recommend_for_user_hybrid,
-        )
+        from recommend.ml.serving import get_serving_model
+        from recommend.ml.shadow import recommend_with_shadow
         
-        model = load_model_hybrid()
-        if not model:
-            # Fallback to basic recommendations if hybrid model unavailable
-            recs = Recommendation.objects.filter(user=user)[:topn]
-        else:
-            recs_raw = recommend_for_user_hybrid(
+        recs_raw = None
+        model = get_serving_model()
+        if model:
+            recs_raw = recommend_with_shadow(
                 user.id, 
                 model=model, 
                 topn=topn,
                 diversity_penalty=0.15,
                 freshness_boost=True,
-                allowed_content=allowed_content
+                allowed_content=allowed_content,
+                as_item_ids=True,
             )
-            # Convert raw recommendations to database lookups
-            recs = []
-            for item_key, score in recs_raw:
-                try:
-                    app_model, oid = item_key.split(":", 1)
-                    app_label, model_name = app_model.split(".", 1)
-                    ct = ContentType.objects.get(app_label=app_label, model=model_name)
-                    rec_obj = Recommendation(
-                        user=user,
-                        content_type=ct,
-                        object_id=int(oid),
-                        score=score
-                    )
-                    recs.append(rec_obj)
-                except Exception:
-                    pass
     except ImportError:
         # Fallback if hybrid model not available
-        recs = Recommendation.objects.filter(user=user)[:topn]
-    
-    results = []
-    for r in recs:
-        try:
-            ct = ContentType.objects.get_for_id(r.content_type_id)
-            app = ct.app_label
-            model = ct.model
-            
-            # Blog posts
-            if app == "blog" and model == "post":
-                try:
-                    from blog.models import Post
-                    obj = Post.objects.filter(id=r.object_id).first()
-                    if obj:
-                        from django.utils.html import strip_tags
-                        excerpt = strip_tags(obj.content)[:220] if hasattr(obj, "content") else ""
-                        img = None
-                        if hasattr(obj, "images"):
-                            first = obj.images.all().first()
-                            if first and hasattr(first, "image"):
-                                img = first.image.url
-                        results.append({
-                            "type": "blog",
-                            "id": obj.id,
-                            "title": obj.title,
-                            "excerpt": excerpt,
-                            "image": img,
-                            "score": r.score,
-                        })
-                        continue
-                except Exception:
-                    pass
-            
-            # Community posts
-            if app == "communities" and model == "communitypost":
-                try:
-                    from communities.models import CommunityPost
-                    obj = CommunityPost.objects.filter(id=r.object_id).first()
-                    if obj:
-                        title = getattr(obj, "title", getattr(obj, "content", "Community Post")[:80])
-                        excerpt = ""
-                        if hasattr(obj, "content"):
-                            from django.utils.html import strip_tags
-                            excerpt = strip_tags(obj.content)[:220]
-                        img = None
-                        if hasattr(obj, "image") and obj.image:
-                            img = obj.image.url
-                        results.append({
-                            "type": "community",
-                            "id": obj.id,
-                            "title": title,
-                            "excerpt": excerpt,
-                            "image": img,
-                            "score": r.score,
-                        })
-                        continue
-                except Exception:
-                    pass
-        except Exception:
-            pass
+        recs_raw = None
+
+    if recs_raw is None:
+        # Fallback to basic recommendations if hybrid model unavailable
+        recs_raw = recommendation_rows_to_items(
+            Recommendation.objects.current().filter(user=user)[:topn]
+        )
+
+    results = hydrate_recommendations(recs_raw)
     
     return JsonResponse({"results": results, "method": "hybrid"})
 
 
+def _related_options(request):
+    """``(k, weights)`` from ``?k=&co_weight=&content_weight=`` (weights None if not given)."""
+    try:
+        k = max(1, min(int(request.GET.get("k", 10)), 50))
+        co_weight = request.GET.get("co_weight")
+        content_weight = request.GET.get("content_weight")
+        weights = None
+        if co_weight is not None or content_weight is not None:
+            from recommend.ml.related import RELATED_WEIGHTS
+
+            weights = (
+                float(co_weight) if co_weight is not None else RELATED_WEIGHTS[0],
+                float(content_weight) if content_weight is not None else RELATED_WEIGHTS[1],
+            )
+    except (TypeError, ValueError):
+        raise ValueError("k, co_weight and content_weight must be numbers")
+    return k, weights
+
+
+def get_related_items(request):
+    """"More like this" rail for an item (``?item=app.model:id``), from the precomputed table."""
+    from recommend.ml.related import (
+        MAX_KEY_LENGTH,
+        load_related,
+        related_items,
+        remember_session_item,
+    )
+
+    item = request.GET.get("item", "")
+    if ":" not in item or len(item) > MAX_KEY_LENGTH:
+        return JsonResponse({"error": "item must be an app.model:id key"}, status=400)
+    try:
+        k, weights = _related_options(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # Only items the table knows go into the session; anything else is client noise
+    table = load_related()
+    if table is not None and table.row_for(item) >= 0:
+        remember_session_item(request.session, item)
+    results = hydrate_recommendations(related_items(item, k=k, weights=weights))
+    return JsonResponse({"item": item, "results": results, "method": "related"})
+
+
+def get_session_suggestions(request):
+    """Suggestions from the items viewed in this session (works for anonymous visitors)."""
+    from recommend.ml.related import SESSION_KEY, session_suggestions
+
+    try:
+        k, weights = _related_options(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    items = request.session.get(SESSION_KEY, [])
+    results = hydrate_recommendations(session_suggestions(items, k=k, weights=weights))
+    return JsonResponse({"results": results, "method": "session"})
+
+
+@staff_member_required
+def recommendation_stats(request):
+    """Layer latency histograms, hit/fallback counters and circuit breaker states."""
+    from recommend.services import get_recommendation_stats
+
+    return JsonResponse(get_recommendation_stats())
+
+
 @login_required
 def track_interaction(request):
     """Track user interactions for recommendation engine."""